@@ -10,11 +10,13 @@ Image File → Amazon Textract (OCR) → Gemini API (Structure) → DynamoDB
 import json
 import boto3
 import os
+import zstandard
 import google.generativeai as genai
 from datetime import datetime
 
 # Get configuration from environment variables
 AWS_REGION = os.environ.get('AWS_REGION', 'eu-north-1')
+TEXT_COMPRESSION_LEVEL = int(os.environ.get('TEXT_COMPRESSION_LEVEL', '10'))
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 
 if not GEMINI_API_KEY:
@@ -84,7 +86,9 @@ def lambda_handler(event, context):
                 'medications': medication_data.get('medications', []),
                 'diagnoses': medication_data.get('diagnoses', []),
                 'dates': medication_data.get('dates', []),
-                'extracted_text': extracted_text,
+                # Raw OCR text is large and rarely read: stored zstd-compressed (see read_extracted_text)
+                'extracted_text_zstd': compress_text(extracted_text),
+                'extracted_text_size': len(extracted_text.encode('utf-8')),
                 'image_url': f"s3://{bucket_name}/{file_key}",
                 'status': 'completed',
                 'created_at': datetime.now().isoformat()
@@ -115,6 +119,23 @@ def lambda_handler(event, context):
         }
 
 
+def compress_text(text):
+    """zstd-compress text for a DynamoDB binary attribute"""
+    return zstandard.ZstdCompressor(level=TEXT_COMPRESSION_LEVEL).compress(text.encode('utf-8'))
+
+
+def read_extracted_text(item):
+    """
+    Raw OCR text of a PatientHistory item, decompressed only when asked for
+    
+    Older items store it as plain text in 'extracted_text'
+    """
+    
+    if 'extracted_text_zstd' in item:
+        return zstandard.ZstdDecompressor().decompress(bytes(item['extracted_text_zstd'])).decode('utf-8')
+    return item.get('extracted_text')
+
+
 def extract_text_from_image(bucket_name, file_key):
     """
     Use Amazon Textract to extract text from image
@@ -11,11 +11,13 @@ import json
 import boto3
 import time
 import os
+import zstandard
 import google.generativeai as genai
 from datetime import datetime
 
 # Get configuration from environment variables
 AWS_REGION = os.environ.get('AWS_REGION', 'eu-north-1')
+TEXT_COMPRESSION_LEVEL = int(os.environ.get('TEXT_COMPRESSION_LEVEL', '10'))
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 
 if not GEMINI_API_KEY:
@@ -83,7 +85,9 @@ def lambda_handler(event, context):
                 'patient_id': patient_id,
                 'timestamp': timestamp,
                 'soap_note': soap_note,
-                'raw_transcript': transcript_text,
+                # Raw transcript is large and rarely read: stored zstd-compressed (see read_raw_transcript)
+                'raw_transcript_zstd': compress_text(transcript_text),
+                'raw_transcript_size': len(transcript_text.encode('utf-8')),
                 'audio_url': f"s3://{bucket_name}/{file_key}",
                 'status': 'completed',
                 'created_at': datetime.now().isoformat()
@@ -114,6 +118,23 @@ def lambda_handler(event, context):
         }
 
 
+def compress_text(text):
+    """zstd-compress text for a DynamoDB binary attribute"""
+    return zstandard.ZstdCompressor(level=TEXT_COMPRESSION_LEVEL).compress(text.encode('utf-8'))
+
+
+def read_raw_transcript(item):
+    """
+    Raw transcript of a PatientNotes item, decompressed only when asked for
+    
+    Older items store it as plain text in 'raw_transcript'
+    """
+    
+    if 'raw_transcript_zstd' in item:
+        return zstandard.ZstdDecompressor().decompress(bytes(item['raw_transcript_zstd'])).decode('utf-8')
+    return item.get('raw_transcript')
+
+
 def transcribe_audio(bucket_name, file_key):
     """
     Use Amazon Transcribe to convert audio to text
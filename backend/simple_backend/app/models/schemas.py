@@ -54,10 +54,13 @@ class PatientResponse(BaseModel):
     phone: str
     age: Optional[int]
     gender: Optional[str]
-    created_at: str
+    created_at: datetime
     status: str
-    last_visit: Optional[str] = None
+    last_visit: Optional[datetime] = None
     visit_count: int = 0
+    last_note_id: Optional[str] = None
+    last_complaint: Optional[str] = None
+    prescription_count: int = 0
 
 
 # ==================== QUEUE MODELS ====================
@@ -85,9 +88,9 @@ class QueueItemResponse(BaseModel):
     token_number: int
     priority: str
     status: QueueStatus
-    added_at: str
-    started_at: Optional[str] = None
-    completed_at: Optional[str] = None
+    added_at: datetime
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
 
 
 # ==================== NOTES MODELS ====================
@@ -107,7 +110,7 @@ class NoteResponse(BaseModel):
     """Response model for a patient note"""
     note_id: str
     patient_id: str
-    created_at: str
+    created_at: datetime
     soap_note: SOAPNote
     audio_file: Optional[str] = None
     transcript: Optional[str] = None
@@ -136,11 +139,46 @@ class PrescriptionResponse(BaseModel):
     """Response model for prescription upload"""
     history_id: str
     patient_id: str
-    created_at: str
+    created_at: datetime
     prescription_data: PrescriptionData
     image_file: str
 
 
+# ==================== DIRECT UPLOAD MODELS ====================
+
+class UploadFileType(str, Enum):
+    """Kinds of media that can be uploaded directly to storage"""
+    AUDIO = "audio"        # Consultation recording -> SOAP note
+    IMAGE = "image"        # Prescription photo -> history entry
+    DOCUMENT = "document"  # Scanned document -> batch for timeline
+
+
+class PresignedUploadRequest(BaseModel):
+    """Request model for issuing a presigned upload URL"""
+    patient_id: str
+    file_type: UploadFileType
+    file_extension: str = Field(..., min_length=1, max_length=10)
+    batch_id: Optional[str] = None  # Only used for file_type=document
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "patient_id": "PAT_12345678",
+                "file_type": "audio",
+                "file_extension": "m4a"
+            }
+        }
+
+
+# ==================== PROJECTIONS ====================
+
+class ProjectionView(str, Enum):
+    """How much of a note/document/history entry to return"""
+    SUMMARY = "summary"    # IDs, dates and one-line clinical context
+    CLINICAL = "clinical"  # Full clinical content without raw transcripts
+    FULL = "full"          # Everything stored, including transcripts
+
+
 # ==================== GENERIC RESPONSES ====================
 
 class SuccessResponse(BaseModel):
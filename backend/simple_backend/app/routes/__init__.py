@@ -1,4 +1,4 @@
 """
 Routes package
 """
-from . import patients, queue, uploads, notes, reports
+from . import patients, queue, queue_live, uploads, notes, reports, media
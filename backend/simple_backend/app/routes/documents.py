@@ -2,24 +2,29 @@
 Document scanning and timeline generation routes
 """
 
-from fastapi import APIRouter, File, UploadFile, HTTPException, BackgroundTasks
-from app.services.mongodb_storage import mongodb_storage
-from app.services.ai_service import extract_prescription
-from app.services.mongo_service import mongo_service
+from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, BackgroundTasks, Query
+from app.models.schemas import ProjectionView
+from app.services.storage_backend import get_storage, get_document_storage
+from app.services.storage_protocol import PatientStorage, DocumentStorage
+from app.services.blob_store import blob_store, get_content_type
+from app.services.ingestion_service import process_document, get_or_create_batch
+from app.services.thumbnail_service import media_url
+from app.services.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.services.projections import build_projection
 from app.services.timeline_service import generate_comprehensive_timeline
+from app.services.timestamps import utc_now
 import uuid
-import os
-from datetime import datetime
 from typing import Optional
 
 router = APIRouter(prefix="/documents", tags=["Document Scanning & Timeline"])
 
-UPLOADS_DIR = "/app/data/uploads"
-os.makedirs(UPLOADS_DIR, exist_ok=True)
-
 
 @router.post("/{patient_id}/start-batch", response_model=dict)
-async def start_document_batch(patient_id: str):
+async def start_document_batch(
+    patient_id: str,
+    storage: PatientStorage = Depends(get_storage),
+    document_storage: DocumentStorage = Depends(get_document_storage)
+):
     """
     Start a new document scanning batch for a patient
     
@@ -31,12 +36,12 @@ async def start_document_batch(patient_id: str):
     """
     
     # Verify patient exists
-    patient = await mongodb_storage.get_patient(patient_id)
+    patient = await storage.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     
     # Check if there's already an active batch
-    existing_batch = await mongo_service.get_active_batch(patient_id)
+    existing_batch = await document_storage.get_active_batch(patient_id)
     if existing_batch:
         return {
             "success": True,
@@ -53,11 +58,11 @@ async def start_document_batch(patient_id: str):
         "patient_name": patient['name'],
         "document_ids": [],
         "status": "pending",
-        "created_at": datetime.now().isoformat(),
+        "created_at": utc_now(),
         "completed_at": None
     }
     
-    await mongo_service.create_batch(batch_data)
+    await document_storage.create_batch(batch_data)
     
     print(f"📋 Started document batch: {batch_id} for {patient['name']}")
     
@@ -74,7 +79,9 @@ async def start_document_batch(patient_id: str):
 async def upload_document_to_batch(
     patient_id: str,
     file: UploadFile = File(...),
-    batch_id: Optional[str] = None
+    batch_id: Optional[str] = None,
+    storage: PatientStorage = Depends(get_storage),
+    document_storage: DocumentStorage = Depends(get_document_storage)
 ):
     """
     Upload a single document to patient's scanning batch
@@ -99,33 +106,13 @@ async def upload_document_to_batch(
     print(f"   Filename: {file.filename}")
     
     # Verify patient exists
-    patient = await mongodb_storage.get_patient(patient_id)
+    patient = await storage.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     
     # Get or create batch
-    if not batch_id:
-        print(f"⚠️ [UPLOAD] No batch_id provided, looking for active batch...")
-        # Try to get active batch
-        existing_batch = await mongo_service.get_active_batch(patient_id)
-        if existing_batch:
-            batch_id = existing_batch['batch_id']
-            print(f"✅ [UPLOAD] Found active batch: {batch_id}")
-        else:
-            # Create new batch
-            batch_id = f"BATCH_{uuid.uuid4().hex[:8].upper()}"
-            batch_data = {
-                "batch_id": batch_id,
-                "patient_id": patient_id,
-                "patient_name": patient['name'],
-                "document_ids": [],
-                "status": "pending",
-                "created_at": datetime.now().isoformat()
-            }
-            await mongo_service.create_batch(batch_data)
-            print(f"🆕 [UPLOAD] Created new batch: {batch_id}")
-    else:
-        print(f"✅ [UPLOAD] Using provided batch_id: {batch_id}")
+    batch_id = await get_or_create_batch(patient, batch_id)
+    print(f"✅ [UPLOAD] Using batch: {batch_id}")
     
     # Validate file type
     file_extension = file.filename.split('.')[-1].lower()
@@ -142,7 +129,6 @@ async def upload_document_to_batch(
         # Save image file
         document_id = f"DOC_{uuid.uuid4().hex[:8].upper()}"
         image_filename = f"{patient_id}_{document_id}.{file_extension}"
-        image_path = os.path.join(UPLOADS_DIR, image_filename)
         
         print("\n" + "🟢" * 40)
         print(f"📤 NEW DOCUMENT UPLOAD")
@@ -153,43 +139,16 @@ async def upload_document_to_batch(
         print(f"   Saved as: {image_filename}")
         print("🟢" * 40 + "\n")
         
-        with open(image_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        
-        print(f"✅ File saved to disk: {image_path}")
-        
-        # Create document record
-        document_data = {
-            "document_id": document_id,
-            "patient_id": patient_id,
-            "batch_id": batch_id,
-            "image_file": image_filename,
-            "image_path": image_path,
-            "status": "processing",
-            "uploaded_at": datetime.now().isoformat(),
-            "extracted_data": None
-        }
+        content = await file.read()
+        await blob_store.put(image_filename, content, get_content_type(image_filename))
         
-        await mongo_service.save_document(document_data)
-        await mongo_service.add_document_to_batch(batch_id, document_id)
+        print(f"✅ File saved to storage: {image_filename}")
         
-        # Extract prescription data (async in background)
-        try:
-            prescription_data = await extract_prescription(image_path)
-            await mongo_service.update_document_status(
-                document_id, 
-                "completed", 
-                prescription_data
-            )
-            print(f"✅ Document processed: {document_id}")
-        except Exception as e:
-            await mongo_service.update_document_status(document_id, "failed")
-            print(f"❌ Document processing failed: {e}")
-            prescription_data = {"error": str(e)}
+        # Create document record and extract prescription data
+        result = await process_document(patient_id, batch_id, document_id, image_filename)
         
         # Get updated batch info
-        batch = await mongo_service.get_batch(batch_id)
+        batch = await document_storage.get_batch(batch_id)
         
         return {
             "success": True,
@@ -197,7 +156,9 @@ async def upload_document_to_batch(
             "document_id": document_id,
             "batch_id": batch_id,
             "document_number": len(batch.get('document_ids', [])),
-            "extracted_data": prescription_data
+            "extracted_data": result['extracted_data'],
+            "thumbnail_url": result.get('thumbnail_url'),
+            "preview_url": result.get('preview_url')
         }
     
     except HTTPException:
@@ -208,7 +169,12 @@ async def upload_document_to_batch(
 
 
 @router.post("/{patient_id}/complete-batch", response_model=dict)
-async def complete_batch_and_generate_timeline(patient_id: str, batch_id: Optional[str] = None):
+async def complete_batch_and_generate_timeline(
+    patient_id: str,
+    batch_id: Optional[str] = None,
+    storage: PatientStorage = Depends(get_storage),
+    document_storage: DocumentStorage = Depends(get_document_storage)
+):
     """
     Complete document scanning and generate comprehensive timeline
     
@@ -228,24 +194,24 @@ async def complete_batch_and_generate_timeline(patient_id: str, batch_id: Option
     """
     
     # Verify patient exists
-    patient = await mongodb_storage.get_patient(patient_id)
+    patient = await storage.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     
     # Get batch
     if not batch_id:
-        batch = await mongo_service.get_active_batch(patient_id)
+        batch = await document_storage.get_active_batch(patient_id)
         if not batch:
             raise HTTPException(status_code=404, detail="No active document batch found")
         batch_id = batch['batch_id']
     else:
-        batch = await mongo_service.get_batch(batch_id)
+        batch = await document_storage.get_batch(batch_id)
         if not batch:
             raise HTTPException(status_code=404, detail=f"Batch {batch_id} not found")
     
     try:
         # Get all documents in batch
-        documents = await mongo_service.get_batch_documents(batch_id)
+        documents = await document_storage.get_batch_documents(batch_id)
         
         if not documents:
             raise HTTPException(status_code=400, detail="No documents in batch")
@@ -261,7 +227,7 @@ async def complete_batch_and_generate_timeline(patient_id: str, batch_id: Option
         print("🔵" * 40 + "\n")
         
         # Update batch status
-        await mongo_service.update_batch_status(batch_id, "processing")
+        await document_storage.update_batch_status(batch_id, "processing")
         
         # Generate comprehensive timeline
         timeline_data = await generate_comprehensive_timeline(documents, patient)
@@ -271,19 +237,19 @@ async def complete_batch_and_generate_timeline(patient_id: str, batch_id: Option
             "patient_id": patient_id,
             "patient_name": patient['name'],
             "batch_id": batch_id,
-            "generated_at": datetime.now().isoformat(),
+            "generated_at": utc_now(),
             "total_documents": len(documents),
             **timeline_data
         }
         
-        await mongo_service.save_timeline(timeline_record)
+        await document_storage.save_timeline(timeline_record)
         
         # Also save summary to JSON storage (for backwards compatibility)
         history_id = f"TIMELINE_{uuid.uuid4().hex[:8].upper()}"
         history_entry = {
             "history_id": history_id,
             "patient_id": patient_id,
-            "created_at": datetime.now().isoformat(),
+            "created_at": utc_now(),
             "batch_id": batch_id,
             "type": "comprehensive_timeline",
             "document_count": len(documents),
@@ -292,10 +258,10 @@ async def complete_batch_and_generate_timeline(patient_id: str, batch_id: Option
             "current_medications_count": len(timeline_data.get('current_medications', []))
         }
         
-        await mongodb_storage.add_history(patient_id, history_entry)
+        await storage.add_history(patient_id, history_entry)
         
         # Mark batch as completed
-        await mongo_service.update_batch_status(batch_id, "completed")
+        await document_storage.update_batch_status(batch_id, "completed")
         
         print(f"✅ Timeline generated and saved!")
         
@@ -317,12 +283,16 @@ async def complete_batch_and_generate_timeline(patient_id: str, batch_id: Option
         raise
     except Exception as e:
         print(f"❌ Timeline generation error: {e}")
-        await mongo_service.update_batch_status(batch_id, "failed")
+        await document_storage.update_batch_status(batch_id, "failed")
         raise HTTPException(status_code=500, detail=f"Failed to generate timeline: {str(e)}")
 
 
 @router.get("/{patient_id}/timeline", response_model=dict)
-async def get_patient_timeline(patient_id: str):
+async def get_patient_timeline(
+    patient_id: str,
+    storage: PatientStorage = Depends(get_storage),
+    document_storage: DocumentStorage = Depends(get_document_storage)
+):
     """
     Get patient's AI-generated medical timeline
     
@@ -330,11 +300,11 @@ async def get_patient_timeline(patient_id: str):
     - patient_id: Patient's unique identifier
     """
     
-    patient = await mongodb_storage.get_patient(patient_id)
+    patient = await storage.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     
-    timeline = await mongo_service.get_patient_timeline(patient_id)
+    timeline = await document_storage.get_patient_timeline(patient_id)
     
     if not timeline:
         return {
@@ -354,36 +324,122 @@ async def get_patient_timeline(patient_id: str):
     }
 
 
+@router.get("/timelines", response_model=dict)
+async def list_timelines(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    after: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    document_storage: DocumentStorage = Depends(get_document_storage)
+):
+    """
+    Get latest generated timelines across all patients (admin view), newest first
+    
+    **Query Parameters:**
+    - limit: Page size (default 50, max 200)
+    - after: Cursor returned as `next_cursor` by the previous page
+    """
+    
+    timelines, next_cursor = await document_storage.get_timelines_page(limit, after)
+    
+    return {
+        "success": True,
+        "count": len(timelines),
+        "timelines": timelines,
+        "next_cursor": next_cursor
+    }
+
+
 @router.get("/{patient_id}/documents", response_model=dict)
-async def get_patient_documents(patient_id: str):
+async def get_patient_documents(
+    patient_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    after: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    view: ProjectionView = Query(ProjectionView.SUMMARY, description="summary | clinical | full"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields, overrides view"),
+    storage: PatientStorage = Depends(get_storage),
+    document_storage: DocumentStorage = Depends(get_document_storage)
+):
     """
-    Get all scanned documents for a patient
+    Get scanned documents for a patient, newest first
+    
+    Each document includes `thumbnail_url` (~256px) and `preview_url` (~1024px)
+    for grid/preview rendering; `image_url` is the full-resolution original.
+    The full OCR extraction is only returned with `view=clinical`/`full` or
+    via GET /documents/{patient_id}/documents/{document_id}.
     
     **Path Parameters:**
     - patient_id: Patient's unique identifier
+    
+    **Query Parameters:**
+    - limit: Page size (default 50, max 200)
+    - after: Cursor returned as `next_cursor` by the previous page
+    - view: summary (default: doctor, date, diagnosis), clinical or full
+    - fields: Comma-separated fields, overrides view
     """
     
-    patient = await mongodb_storage.get_patient(patient_id)
+    projection = build_projection("documents", view, fields, required=("uploaded_at", "document_id"))
+    
+    patient = await storage.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     
-    documents = await mongo_service.get_patient_documents(patient_id)
+    documents, next_cursor = await document_storage.get_patient_documents_page(patient_id, limit, after, projection)
     
-    # Remove MongoDB _id fields
     for doc in documents:
-        doc.pop('_id', None)
+        # Documents uploaded before thumbnails existed only have the original
+        if doc.get('image_file') and not doc.get('image_url'):
+            doc['image_url'] = media_url(doc['image_file'])
     
     return {
         "success": True,
         "patient_id": patient_id,
         "patient_name": patient['name'],
         "document_count": len(documents),
-        "documents": documents
+        "documents": documents,
+        "next_cursor": next_cursor
+    }
+
+
+@router.get("/{patient_id}/documents/{document_id}", response_model=dict)
+async def get_patient_document(
+    patient_id: str,
+    document_id: str,
+    view: ProjectionView = Query(ProjectionView.FULL, description="summary | clinical | full"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields, overrides view"),
+    document_storage: DocumentStorage = Depends(get_document_storage)
+):
+    """
+    Get a single scanned document with its full extracted data
+    
+    **Path Parameters:**
+    - patient_id: Patient's unique identifier
+    - document_id: Document identifier
+    
+    **Query Parameters:**
+    - view: summary, clinical or full (default)
+    - fields: Comma-separated fields, overrides view
+    """
+    
+    projection = build_projection("documents", view, fields, required=("document_id", "patient_id"))
+    document = await document_storage.get_document(document_id, projection)
+    if not document or document.get('patient_id') != patient_id:
+        raise HTTPException(status_code=404, detail=f"Document {document_id} not found")
+    
+    if document.get('image_file') and not document.get('image_url'):
+        document['image_url'] = media_url(document['image_file'])
+    
+    return {
+        "success": True,
+        "patient_id": patient_id,
+        "document": document
     }
 
 
 @router.get("/{patient_id}/batches", response_model=dict)
-async def get_patient_batches(patient_id: str):
+async def get_patient_batches(
+    patient_id: str,
+    storage: PatientStorage = Depends(get_storage),
+    document_storage: DocumentStorage = Depends(get_document_storage)
+):
     """
     Get all document batches for a patient
     
@@ -391,18 +447,11 @@ async def get_patient_batches(patient_id: str):
     - patient_id: Patient's unique identifier
     """
     
-    patient = await mongodb_storage.get_patient(patient_id)
+    patient = await storage.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     
-    # Get all batches from MongoDB
-    all_batches = await mongo_service.db.batches.find(
-        {"patient_id": patient_id}
-    ).sort("created_at", -1).to_list(length=None)
-    
-    # Remove MongoDB _id fields
-    for batch in all_batches:
-        batch.pop('_id', None)
+    all_batches = await document_storage.get_patient_batches(patient_id)
     
     return {
         "success": True,
@@ -0,0 +1,127 @@
+"""
+FHIR Bulk Data Routes
+Asynchronous $export (kick-off, status polling, cancellation) per the
+HL7 FHIR Bulk Data Access spec
+"""
+
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, Query, Request
+from fastapi.responses import JSONResponse, Response
+from app.services.fhir_export import (
+    NDJSON_FORMATS, delete_export_files, export_manifest, new_export_job, operation_outcome, parse_since, run_export_job
+)
+from app.services.storage_backend import get_document_storage, get_storage
+from app.services.storage_protocol import DocumentStorage, PatientStorage
+from typing import Optional
+
+router = APIRouter(prefix="/fhir", tags=["FHIR"])
+
+FHIR_JSON = "application/fhir+json"
+
+
+def _outcome(status_code: int, message: str, severity: str = "error", code: str = "processing", headers=None) -> JSONResponse:
+    return JSONResponse(
+        operation_outcome(severity, code, message), status_code=status_code, media_type=FHIR_JSON, headers=headers
+    )
+
+
+@router.get("/$export")
+@router.get("/Patient/$export")
+async def bulk_export(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    output_format: Optional[str] = Query(None, alias="_outputFormat"),
+    since: Optional[str] = Query(None, alias="_since"),
+    types: Optional[str] = Query(None, alias="_type"),
+    prefer: Optional[str] = Header(None),
+    storage: PatientStorage = Depends(get_storage),
+    document_storage: DocumentStorage = Depends(get_document_storage)
+):
+    """
+    Kick off a bulk export of all patients (system and Patient level are the same here)
+
+    **Headers:**
+    - Prefer: respond-async (required)
+
+    **Query Parameters:**
+    - _outputFormat: application/fhir+ndjson (default)
+    - _since: Only resources updated after this instant
+    - _type: Comma-separated subset of Patient, Composition, MedicationRequest
+
+    **Returns:**
+    - 202 with the status URL in Content-Location
+    """
+
+    if "respond-async" not in (prefer or ""):
+        return _outcome(400, "Bulk export requires the header 'Prefer: respond-async'", code="invalid")
+    if output_format and output_format not in NDJSON_FORMATS:
+        return _outcome(400, f"Unsupported _outputFormat: {output_format} (use application/fhir+ndjson)", code="not-supported")
+
+    try:
+        since_value = parse_since(since) if since else None
+    except ValueError:
+        return _outcome(400, f"Invalid _since: {since} (expected a FHIR instant)", code="invalid")
+
+    try:
+        job = new_export_job([t.strip() for t in types.split(",") if t.strip()] if types else None, since_value, str(request.url))
+    except ValueError as e:
+        return _outcome(400, str(e), code="not-supported")
+
+    await document_storage.create_export_job(job)
+    background_tasks.add_task(run_export_job, job['job_id'], storage=storage, document_storage=document_storage)
+
+    print(f"🔥 FHIR export accepted: {job['job_id']} ({', '.join(job['types'])}, since {since_value or 'beginning'})")
+
+    status_url = str(request.url_for("bulk_export_status", job_id=job['job_id']))
+    return _outcome(202, f"Export accepted, poll {status_url}", severity="information", code="informational",
+                    headers={"Content-Location": status_url})
+
+
+@router.get("/$export-status/{job_id}")
+async def bulk_export_status(
+    job_id: str,
+    request: Request,
+    document_storage: DocumentStorage = Depends(get_document_storage)
+):
+    """
+    Poll a bulk export
+
+    **Returns:**
+    - 202 with X-Progress while running
+    - 200 with the manifest (output file URLs per resource type) when complete
+    - 500 OperationOutcome if the export failed, 404 if unknown or cancelled
+    """
+
+    job = await document_storage.get_export_job(job_id)
+    if not job or job['status'] == "cancelled":
+        return _outcome(404, f"Export {job_id} not found", code="not-found")
+
+    if job['status'] in ("accepted", "in-progress"):
+        return Response(status_code=202, headers={
+            "X-Progress": f"{job['status']}: {job.get('progress', 0)} records read",
+            "Retry-After": "5"
+        })
+    if job['status'] == "failed":
+        return _outcome(500, f"Export failed: {job.get('error')}", code="exception")
+
+    return JSONResponse(export_manifest(job, str(request.base_url)))
+
+
+@router.delete("/$export-status/{job_id}")
+async def cancel_bulk_export(
+    job_id: str,
+    document_storage: DocumentStorage = Depends(get_document_storage)
+):
+    """
+    Cancel a bulk export (a running job stops and removes its files)
+    """
+
+    job = await document_storage.get_export_job(job_id)
+    if not job or job['status'] == "cancelled":
+        return _outcome(404, f"Export {job_id} not found", code="not-found")
+
+    await document_storage.update_export_job(job_id, {"status": "cancelled"})
+    # A job that finished before the cancel landed left its files; one still running deletes its own
+    job = await document_storage.get_export_job(job_id)
+    await delete_export_files(job.get('output') or [])
+
+    return _outcome(202, f"Export {job_id} cancelled", severity="information", code="informational")
@@ -0,0 +1,151 @@
+"""
+Media routes: serving uploaded files and receiving direct uploads
+"""
+
+from fastapi import APIRouter, HTTPException, Request
+from typing import Optional
+from fastapi.responses import RedirectResponse, Response
+from app.services.blob_store import blob_store, LocalBlobStore
+from app.services.media_service import (
+    RangeFileResponse,
+    RangeNotSatisfiable,
+    parse_range_header,
+    etag_matches,
+    media_headers
+)
+import asyncio
+import hashlib
+import os
+import tempfile
+
+router = APIRouter(prefix="/media", tags=["Media"])
+
+MAX_UPLOAD_BYTES = 25 * 1024 * 1024  # 25MB, same limit as audio uploads
+
+# When set (e.g. "/protected-media/"), nginx serves the file via X-Accel-Redirect + sendfile
+ACCEL_REDIRECT_PREFIX = os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX')
+
+
+@router.api_route("/{key:path}", methods=["GET", "HEAD"])
+async def get_media(key: str, request: Request, expires: Optional[int] = None, signature: Optional[str] = None):
+    """
+    Serve uploaded media (audio_file, image_file) by storage key
+    
+    - Range requests (206) so audio players can seek
+    - Strong ETag from the SHA-256 content hash, If-None-Match -> 304
+    - Long-lived immutable cache headers (keys are never reused)
+    - Zero-copy sendfile when the server supports it
+    
+    With BLOB_STORE=s3 this redirects to a short-lived presigned S3 URL.
+    
+    **Path Parameters:**
+    - key: File name as stored in notes/history/documents
+    
+    **Query Parameters:**
+    - expires / signature: Required for bulk exports (`exports/...`), issued
+      with their download URLs
+    """
+    
+    if not isinstance(blob_store, LocalBlobStore):
+        if not await blob_store.exists(key):
+            raise HTTPException(status_code=404, detail="Media not found")
+        return RedirectResponse(blob_store.presign_download(key), status_code=307)
+    
+    try:
+        signed_only = blob_store.requires_signature(key)
+        if signed_only and not (expires is not None and signature and blob_store.verify("GET", key, expires, signature)):
+            raise HTTPException(status_code=403, detail="Invalid or expired download signature")
+        info = await blob_store.stat(key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not info:
+        raise HTTPException(status_code=404, detail="Media not found")
+    
+    headers = media_headers(info)
+    if signed_only:
+        headers["cache-control"] = "private, no-store"  # Access ends when the URL expires
+    
+    if etag_matches(request.headers.get("if-none-match"), info["etag"]):
+        return Response(status_code=304, headers=headers)
+    
+    if ACCEL_REDIRECT_PREFIX:
+        headers["x-accel-redirect"] = f"{ACCEL_REDIRECT_PREFIX.rstrip('/')}/{key}"
+        return Response(headers=headers, media_type=info["content_type"])
+    
+    # If-Range: only honour Range when the client's copy is still current
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range.strip() != headers["etag"]:
+        range_header = None
+    
+    size = info["size"]
+    try:
+        byte_range = parse_range_header(range_header, size)
+    except RangeNotSatisfiable:
+        headers["content-range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+    
+    path = blob_store.path_for(key)
+    
+    if byte_range is None:
+        return RangeFileResponse(path, 0, size - 1, headers=headers, media_type=info["content_type"])
+    
+    start, end = byte_range
+    headers["content-range"] = f"bytes {start}-{end}/{size}"
+    return RangeFileResponse(
+        path, start, end,
+        status_code=206,
+        headers=headers,
+        media_type=info["content_type"]
+    )
+
+
+@router.put("/{key:path}", response_model=dict)
+async def put_media(key: str, request: Request, expires: int, signature: str):
+    """
+    Receive a direct upload made with a presigned URL (local blob store only)
+
+    With BLOB_STORE=s3 clients upload to S3 and this route is not used.
+    The body is streamed to disk in chunks and moved into place atomically.
+
+    **Query Parameters:**
+    - expires / signature: Issued by `/upload/direct/presign`
+    """
+
+    if not isinstance(blob_store, LocalBlobStore):
+        raise HTTPException(status_code=404, detail="Direct uploads go to object storage")
+
+    if not blob_store.verify("PUT", key, expires, signature):
+        raise HTTPException(status_code=403, detail="Invalid or expired upload signature")
+
+    try:
+        path = blob_store.path_for(key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".upload_")
+    size = 0
+    sha = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail="File too large (max 25MB)")
+                sha.update(chunk)
+                await asyncio.to_thread(f.write, chunk)
+        await asyncio.to_thread(os.replace, tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    
+    # Content hash doubles as the ETag when the file is served
+    blob_store.remember_hash(key, sha.hexdigest())
+
+    print(f"📁 Direct upload stored: {key} ({size} bytes)")
+
+    return {
+        "success": True,
+        "file_key": key,
+        "size": size
+    }
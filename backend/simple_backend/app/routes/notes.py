@@ -2,42 +2,118 @@
 Notes and History routes
 """
 
-from fastapi import APIRouter, HTTPException
-from app.services.mongodb_storage import mongodb_storage
+from fastapi import APIRouter, Depends, HTTPException, Query
+from app.models.schemas import ProjectionView
+from app.services.storage_backend import get_storage
+from app.services.storage_protocol import PatientStorage
+from app.services.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.services.projections import build_projection
+from app.services.text_compression import texts_requested, merge_note_texts
+from app.services.timestamps import parse_timestamp
 from datetime import datetime
+from typing import Optional, Tuple
 
 router = APIRouter(tags=["Notes & History"])
 
 
+def _date_range(start: Optional[str], end: Optional[str]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """Parse start/end query parameters (ISO date or timestamp; no offset = clinic time)"""
+    try:
+        return parse_timestamp(start), parse_timestamp(end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start/end must be ISO dates or timestamps")
+
+
+@router.get("/notes", response_model=dict)
+async def get_notes(
+    start: Optional[str] = Query(None, description="Notes created at or after (ISO date/timestamp)"),
+    end: Optional[str] = Query(None, description="Notes created before (ISO date/timestamp)"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    after: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    view: ProjectionView = Query(ProjectionView.SUMMARY, description="summary | clinical | full"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields, overrides view"),
+    storage: PatientStorage = Depends(get_storage)
+):
+    """
+    Get notes of all patients in a date range, newest first
+    
+    Served by the (created_at, note_id) index, e.g. "all notes written
+    between 2024-03-01 and 2024-04-01".
+    
+    **Query Parameters:**
+    - start / end: Range [start, end); dates without an offset are clinic time
+    - limit: Page size (default 50, max 200)
+    - after: Cursor returned as `next_cursor` by the previous page
+    - view: summary (default), clinical or full
+    - fields: Comma-separated fields, overrides view
+    """
+    
+    start_at, end_at = _date_range(start, end)
+    projection = build_projection("notes", view, fields, required=("created_at", "note_id", "patient_id"))
+    notes, next_cursor = await storage.get_notes_page(limit, after, projection, start=start_at, end=end_at)
+    await _load_texts(storage, notes, projection)
+    
+    return {
+        "success": True,
+        "start": start_at,
+        "end": end_at,
+        "count": len(notes),
+        "notes": notes,
+        "next_cursor": next_cursor
+    }
+
+
 @router.get("/notes/{patient_id}", response_model=dict)
-async def get_patient_notes(patient_id: str):
+async def get_patient_notes(
+    patient_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    after: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    view: ProjectionView = Query(ProjectionView.CLINICAL, description="summary | clinical | full"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields, overrides view"),
+    start: Optional[str] = Query(None, description="Notes created at or after (ISO date/timestamp)"),
+    end: Optional[str] = Query(None, description="Notes created before (ISO date/timestamp)"),
+    storage: PatientStorage = Depends(get_storage)
+):
     """
-    Get all medical notes for a patient
+    Get medical notes for a patient, newest first
     
-    Returns all SOAP notes generated from audio recordings
+    Returns SOAP notes generated from audio recordings. Raw transcripts are
+    only included with `view=full` (or via GET /notes/{patient_id}/{note_id}).
     
     **Path Parameters:**
     - patient_id: Patient's unique identifier
+    
+    **Query Parameters:**
+    - limit: Page size (default 50, max 200)
+    - after: Cursor returned as `next_cursor` by the previous page
+    - view: summary (complaint + assessment), clinical (default, full SOAP note) or full
+    - fields: e.g. `note_id,created_at,soap_note.plan`
+    - start / end: Only notes created in [start, end); dates without an offset are clinic time
     """
     
+    start_at, end_at = _date_range(start, end)
+    projection = build_projection("notes", view, fields, required=("created_at", "note_id"))
+    
     # Verify patient exists
-    patient = await mongodb_storage.get_patient(patient_id)
+    patient = await storage.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     
-    notes = await mongodb_storage.get_patient_notes(patient_id)
+    notes, next_cursor = await storage.get_patient_notes_page(patient_id, limit, after, projection, start=start_at, end=end_at)
+    await _load_texts(storage, notes, projection)
     
     return {
         "success": True,
         "patient_id": patient_id,
         "patient_name": patient['name'],
         "count": len(notes),
-        "notes": notes
+        "notes": notes,
+        "next_cursor": next_cursor
     }
 
 
 @router.get("/notes/{patient_id}/latest", response_model=dict)
-async def get_latest_note(patient_id: str):
+async def get_latest_note(patient_id: str, storage: PatientStorage = Depends(get_storage)):
     """
     Get most recent note for a patient
     
@@ -47,21 +123,19 @@ async def get_latest_note(patient_id: str):
     - patient_id: Patient's unique identifier
     """
     
-    patient = await mongodb_storage.get_patient(patient_id)
+    patient = await storage.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     
-    notes = await mongodb_storage.get_patient_notes(patient_id)
+    latest_note = await _latest_note(storage, patient)
     
-    if not notes:
+    if not latest_note:
         return {
             "success": True,
             "message": "No notes found for this patient",
             "note": None
         }
     
-    latest_note = notes[-1]  # Last note in list
-    
     return {
         "success": True,
         "patient_id": patient_id,
@@ -70,34 +144,105 @@ async def get_latest_note(patient_id: str):
     }
 
 
+@router.get("/notes/{patient_id}/{note_id}", response_model=dict)
+async def get_note(
+    patient_id: str,
+    note_id: str,
+    view: ProjectionView = Query(ProjectionView.FULL, description="summary | clinical | full"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields, overrides view"),
+    storage: PatientStorage = Depends(get_storage)
+):
+    """
+    Get a single note, including its raw transcript
+    
+    **Path Parameters:**
+    - patient_id: Patient's unique identifier
+    - note_id: Note identifier
+    
+    **Query Parameters:**
+    - view: summary, clinical or full (default)
+    - fields: Comma-separated fields, overrides view
+    """
+    
+    projection = build_projection("notes", view, fields, required=("note_id",))
+    note = await storage.get_note(patient_id, note_id, projection)
+    if not note:
+        raise HTTPException(status_code=404, detail=f"Note {note_id} not found")
+    await _load_texts(storage, [note], projection)
+    
+    return {
+        "success": True,
+        "patient_id": patient_id,
+        "note": note
+    }
+
+
+async def _latest_note(storage: PatientStorage, patient: dict, projection: Optional[dict] = None) -> Optional[dict]:
+    """The patient's newest note: one read by last_note_id (or the first page of one, before it is set)"""
+    if patient.get('last_note_id'):
+        note = await storage.get_note(patient['patient_id'], patient['last_note_id'], projection)
+        if note:
+            return note
+    notes, _ = await storage.get_patient_notes_page(patient['patient_id'], limit=1, projection=projection)
+    return notes[0] if notes else None
+
+
+async def _load_texts(storage: PatientStorage, notes: list, projection: dict):
+    """Decompress transcripts only when the view/fields ask for them"""
+    fields = texts_requested(projection)
+    if fields and notes:
+        texts = await storage.get_note_texts([note['note_id'] for note in notes if 'note_id' in note])
+        merge_note_texts(notes, texts, fields)
+
+
 @router.get("/history/{patient_id}", response_model=dict)
-async def get_patient_history(patient_id: str):
+async def get_patient_history(
+    patient_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    after: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    view: ProjectionView = Query(ProjectionView.FULL, description="summary | clinical | full"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields, overrides view"),
+    start: Optional[str] = Query(None, description="Entries created at or after (ISO date/timestamp)"),
+    end: Optional[str] = Query(None, description="Entries created before (ISO date/timestamp)"),
+    storage: PatientStorage = Depends(get_storage)
+):
     """
-    Get all prescription history for a patient
+    Get prescription history for a patient, newest first
     
-    Returns all extracted prescription data from images
+    Returns extracted prescription data from images
     
     **Path Parameters:**
     - patient_id: Patient's unique identifier
+    
+    **Query Parameters:**
+    - limit: Page size (default 50, max 200)
+    - after: Cursor returned as `next_cursor` by the previous page
+    - view: summary (doctor, date, diagnosis), clinical or full (default)
+    - fields: Comma-separated fields, overrides view
+    - start / end: Only entries created in [start, end); dates without an offset are clinic time
     """
     
-    patient = await mongodb_storage.get_patient(patient_id)
+    start_at, end_at = _date_range(start, end)
+    projection = build_projection("history", view, fields, required=("created_at", "history_id"))
+    
+    patient = await storage.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     
-    history = await mongodb_storage.get_patient_history(patient_id)
+    history, next_cursor = await storage.get_patient_history_page(patient_id, limit, after, projection, start=start_at, end=end_at)
     
     return {
         "success": True,
         "patient_id": patient_id,
         "patient_name": patient['name'],
         "count": len(history),
-        "history": history
+        "history": history,
+        "next_cursor": next_cursor
     }
 
 
 @router.get("/history/{patient_id}/medications", response_model=dict)
-async def get_all_medications(patient_id: str):
+async def get_all_medications(patient_id: str, storage: PatientStorage = Depends(get_storage)):
     """
     Get comprehensive medication timeline for a patient
     
@@ -107,11 +252,13 @@ async def get_all_medications(patient_id: str):
     - patient_id: Patient's unique identifier
     """
     
-    patient = await mongodb_storage.get_patient(patient_id)
+    patient = await storage.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     
-    history = await mongodb_storage.get_patient_history(patient_id)
+    history = await storage.get_patient_history(
+        patient_id, {"_id": 0, "created_at": 1, "prescription_data": 1}
+    )
     
     # Extract all medications
     all_medications = []
@@ -137,7 +284,7 @@ async def get_all_medications(patient_id: str):
 
 
 @router.get("/summary/{patient_id}", response_model=dict)
-async def get_patient_summary(patient_id: str):
+async def get_patient_summary(patient_id: str, storage: PatientStorage = Depends(get_storage)):
     """
     Get complete patient summary
     
@@ -153,27 +300,29 @@ async def get_patient_summary(patient_id: str):
     - patient_id: Patient's unique identifier
     """
     
-    patient = await mongodb_storage.get_patient(patient_id)
+    patient = await storage.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     
-    notes = await mongodb_storage.get_patient_notes(patient_id)
-    history = await mongodb_storage.get_patient_history(patient_id)
-    
     # Get latest note
-    latest_note = notes[-1] if notes else None
+    latest_note = await _latest_note(storage, patient, build_projection("notes", ProjectionView.CLINICAL))
     
     # Get recent medications
     recent_meds = []
-    if history:
-        for entry in history[-3:]:  # Last 3 prescriptions
-            prescription = entry.get('prescription_data', {})
-            meds = prescription.get('medications', [])
-            recent_meds.extend([m.get('name') for m in meds if 'name' in m])
+    history, _ = await storage.get_patient_history_page(
+        patient_id, limit=3, projection={"_id": 0, "history_id": 1, "created_at": 1, "prescription_data": 1}
+    )
+    for entry in history:  # Last 3 prescriptions
+        prescription = entry.get('prescription_data', {})
+        meds = prescription.get('medications', [])
+        recent_meds.extend([m.get('name') for m in meds if 'name' in m])
     
     # Get chief complaints from notes
     chief_complaints = []
-    for note in notes[-5:]:  # Last 5 visits
+    notes, _ = await storage.get_patient_notes_page(
+        patient_id, limit=5, projection={"_id": 0, "note_id": 1, "created_at": 1, "soap_note.chief_complaint": 1}
+    )
+    for note in notes:  # Last 5 visits
         soap = note.get('soap_note', {})
         complaint = soap.get('chief_complaint')
         if complaint:
@@ -192,8 +341,8 @@ async def get_patient_summary(patient_id: str):
             "gender": patient.get('gender')
         },
         "statistics": {
-            "total_visits": len(notes),
-            "prescriptions_on_file": len(history),
+            "total_visits": patient.get('visit_count', 0),
+            "prescriptions_on_file": patient.get('prescription_count', 0),
             "member_since": patient['created_at']
         },
         "latest_visit": latest_note,
@@ -203,7 +352,7 @@ async def get_patient_summary(patient_id: str):
 
 
 @router.get("/timeline/{patient_id}", response_model=dict)
-async def get_medical_timeline(patient_id: str):
+async def get_medical_timeline(patient_id: str, storage: PatientStorage = Depends(get_storage)):
     """
     Get complete medical timeline for a patient
     
@@ -218,16 +367,16 @@ async def get_medical_timeline(patient_id: str):
     **Returns:**
     Timeline with entries sorted by date (newest first):
     - type: "note" or "prescription"
-    - date: ISO timestamp
+    - date: timestamp (UTC)
     - content: Full data object
     """
     
-    patient = await mongodb_storage.get_patient(patient_id)
+    patient = await storage.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     
-    notes = await mongodb_storage.get_patient_notes(patient_id)
-    history = await mongodb_storage.get_patient_history(patient_id)
+    notes = await storage.get_patient_notes(patient_id, build_projection("notes", ProjectionView.CLINICAL))
+    history = await storage.get_patient_history(patient_id)
     
     # Build timeline
     timeline = []
@@ -2,24 +2,28 @@
 Patient management routes
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from app.models.schemas import (
     PatientCreate, 
     PatientResponse, 
     SuccessResponse,
     QueueStatus
 )
-from app.services.mongodb_storage import mongodb_storage
+from app.services.storage_backend import get_storage
+from app.services.storage_protocol import PatientStorage
+from app.services.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.services.patient_import import import_patients, ImportFormatError, IMPORT_FORMATS, DEFAULT_CHUNK_SIZE
+from app.services.patient_search import DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT
+from app.services.timestamps import utc_now
 import uuid
-from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 router = APIRouter(prefix="/patients", tags=["Patients"])
 
 
 
 @router.get("/check-uhid/{uhid}", response_model=dict)
-async def check_uhid(uhid: str):
+async def check_uhid(uhid: str, storage: PatientStorage = Depends(get_storage)):
     """
     Check if a UHID (Unified Health ID) exists in the system
     
@@ -37,7 +41,7 @@ async def check_uhid(uhid: str):
     - patient: Patient data if found (null if not found)
     """
     
-    patient = await mongodb_storage.get_patient_by_uhid(uhid)
+    patient = await storage.get_patient_by_uhid(uhid)
     
     if patient:
         print(f"✅ UHID {uhid} found - Patient: {patient.get('name')}")
@@ -57,8 +61,73 @@ async def check_uhid(uhid: str):
         }
 
 
+@router.get("/search", response_model=dict)
+async def search_patients(
+    q: str = Query(..., min_length=2, description="Name, phone number (or its last digits) or UHID prefix"),
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT, description="Maximum results"),
+    storage: PatientStorage = Depends(get_storage)
+):
+    """
+    Find patients by name, phone or UHID
+    
+    **Query Parameters:**
+    - q: Search text. Names match by prefix ("ram ku" finds Ram Kumar), by
+      spelling variant or typo (Mohammad / Muhammad, Deepak / Dipak) and
+      across scripts (शर्मा finds Sharma). Digits match the end of the phone
+      number (last 4+ digits) or the start of a UHID.
+    - limit: Maximum results (default 20, max 100)
+    
+    **Returns:**
+    - patients: Best matches first, each with `match` (uhid / phone / name / fuzzy) and `score`
+    """
+    import time
+    start = time.time()
+    
+    patients = await storage.search_patients(q, limit)
+    
+    elapsed = (time.time() - start) * 1000
+    print(f"🔎 [API] GET /patients/search - {len(patients)} matches for '{q}' in {elapsed:.2f}ms")
+    
+    return {
+        "success": True,
+        "query": q,
+        "count": len(patients),
+        "patients": patients
+    }
+
+
+@router.post("/search/reindex", response_model=dict)
+async def reindex_patient_search(storage: PatientStorage = Depends(get_storage)):
+    """
+    Rebuild the patient search index from the patient records
+    
+    Only needed once for patients registered before search existed (or after
+    editing patients outside the API); every write keeps the index current.
+    """
+    indexed = await storage.rebuild_search_index()
+    return {
+        "success": True,
+        "indexed": indexed
+    }
+
+
+@router.post("/activity/rebuild", response_model=dict)
+async def rebuild_patient_activity(storage: PatientStorage = Depends(get_storage)):
+    """
+    Recount visit counts, latest note and prescription counts of every patient
+    
+    Only needed once for patients with notes from before these fields were
+    maintained; every note and history insert keeps them current.
+    """
+    rebuilt = await storage.rebuild_patient_activity()
+    return {
+        "success": True,
+        "rebuilt": rebuilt
+    }
+
+
 @router.post("", response_model=dict)
-async def register_patient(patient: PatientCreate):
+async def register_patient(patient: PatientCreate, storage: PatientStorage = Depends(get_storage)):
     """
     Register a new patient with UHID (Unified Health ID)
     
@@ -81,7 +150,7 @@ async def register_patient(patient: PatientCreate):
     """
     
     # Check if UHID already exists
-    existing_patient = await mongodb_storage.get_patient_by_uhid(patient.uhid)
+    existing_patient = await storage.get_patient_by_uhid(patient.uhid)
     if existing_patient:
         print(f"❌ UHID {patient.uhid} already registered - Patient: {existing_patient.get('name')}")
         raise HTTPException(
@@ -104,22 +173,21 @@ async def register_patient(patient: PatientCreate):
         "phone": patient.phone,
         "age": patient.age,
         "gender": patient.gender,
-        "created_at": datetime.now().isoformat(),
-        "last_visit": datetime.now().isoformat(),
-        "visit_count": 1,
+        "created_at": utc_now(),
+        "last_visit": None,
+        "visit_count": 0,
+        "prescription_count": 0,
         "status": "active"
     }
     
     # Save to storage
-    await mongodb_storage.create_patient(patient_id, patient_data)
+    await storage.create_patient(patient_id, patient_data)
     
     print(f"✅ Registered: {patient_id} - UHID: {patient.uhid} - {patient.name}")
     
     # NEW: Auto-add to queue
     queue_id = f"Q_{uuid.uuid4().hex[:8].upper()}"
-    queue = await mongodb_storage.get_queue()
-    active_queue = [q for q in queue if q['status'] != 'completed']
-    token_number = len(active_queue) + 1
+    token_number = await storage.next_token_number()
     
     queue_entry = {
         "queue_id": queue_id,
@@ -128,14 +196,14 @@ async def register_patient(patient: PatientCreate):
         "token_number": token_number,
         "priority": "normal",
         "status": QueueStatus.WAITING,
-        "added_at": datetime.now().isoformat(),
+        "added_at": utc_now(),
         "started_at": None,
         "completed_at": None,
         "nurse_completed_at": None,
         "timeline_ready_at": None
     }
     
-    await mongodb_storage.add_to_queue(queue_entry)
+    await storage.add_to_queue(queue_entry)
     
     print(f"✅ Added to queue: Token #{token_number} - {patient.name}")
     
@@ -148,20 +216,74 @@ async def register_patient(patient: PatientCreate):
     }
 
 
+@router.post("/import", response_model=dict)
+async def bulk_import_patients(
+    request: Request,
+    format: Optional[str] = Query(None, description="csv or ndjson (default: from Content-Type)"),
+    dry_run: bool = Query(False, description="Validate only, write nothing"),
+    chunk_size: int = Query(DEFAULT_CHUNK_SIZE, ge=1, le=5000, description="Rows per insert_many"),
+    storage: PatientStorage = Depends(get_storage)
+):
+    """
+    Bulk import existing patients (onboarding a PHC)
+    
+    Send the file as the raw request body; it is parsed as a stream.
+    - CSV: header row with `uhid,name,phone,age,gender`
+    - NDJSON: one PatientCreate JSON object per line
+    
+    Each row is validated like POST /patients. Invalid rows and already
+    registered UHIDs are reported per row and do not abort the import.
+    Imported patients are **not** added to the queue.
+    
+    **Query Parameters:**
+    - format: csv | ndjson (defaults from Content-Type: text/csv or application/x-ndjson)
+    - dry_run: Validate and check for existing UHIDs without writing
+    - chunk_size: Rows per insert_many (default 500)
+    
+    **Returns:**
+    - total_rows, imported, failed
+    - errors: [{row, uhid, errors}] (first 1000)
+    """
+    
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    if fmt not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {fmt}")
+    
+    try:
+        report = await import_patients(request.stream(), fmt, chunk_size=chunk_size, dry_run=dry_run, storage=storage)
+    except ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        "success": True,
+        "format": fmt,
+        **report
+    }
+
+
 @router.get("", response_model=dict)
-async def list_patients():
+async def list_patients(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    after: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    storage: PatientStorage = Depends(get_storage)
+):
     """
-    Get list of all registered patients
+    Get registered patients, newest first, one page at a time
+    
+    **Query Parameters:**
+    - limit: Page size (default 50, max 200)
+    - after: Cursor returned as `next_cursor` by the previous page
     
     **Returns:**
-    - count: Total number of patients
-    - patients: List of all patient records
+    - count: Number of patients in this page
+    - patients: Patient records
+    - next_cursor: Pass as `after` to get the next page (null on last page)
     """
     import time
     start = time.time()
     print(f"📋 [API] GET /patients - Request received")
     
-    patients = await mongodb_storage.get_all_patients()
+    patients, next_cursor = await storage.get_patients_page(limit, after)
     
     elapsed = (time.time() - start) * 1000
     print(f"📋 [API] GET /patients - Returning {len(patients)} patients in {elapsed:.2f}ms")
@@ -169,19 +291,20 @@ async def list_patients():
     return {
         "success": True,
         "count": len(patients),
-        "patients": list(patients.values())
+        "patients": patients,
+        "next_cursor": next_cursor
     }
 
 
 @router.get("/{patient_id}", response_model=dict)
-async def get_patient_details(patient_id: str):
+async def get_patient_details(patient_id: str, storage: PatientStorage = Depends(get_storage)):
     """
     Get detailed information about a specific patient
     
     Includes:
-    - Basic patient info
-    - All medical notes
-    - Prescription history
+    - Basic patient info (with visit and prescription counts)
+    - Latest 3 medical notes
+    - Latest 3 prescriptions
     - Current queue status
     
     **Path Parameters:**
@@ -189,31 +312,30 @@ async def get_patient_details(patient_id: str):
     """
     
     # Get patient
-    patient = await mongodb_storage.get_patient(patient_id)
+    patient = await storage.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     
-    # Get related data
-    notes = await mongodb_storage.get_patient_notes(patient_id)
-    history = await mongodb_storage.get_patient_history(patient_id)
+    # Newest first: one short indexed page each, counts come from the patient record
+    notes, _ = await storage.get_patient_notes_page(patient_id, limit=3)
+    history, _ = await storage.get_patient_history_page(patient_id, limit=3)
     
     # Check queue status
-    queue = await mongodb_storage.get_queue()
-    queue_entry = next((q for q in queue if q['patient_id'] == patient_id), None)
+    queue_entry = await storage.get_patient_queue_entry(patient_id)
     
     return {
         "success": True,
         "patient": patient,
-        "notes_count": len(notes),
-        "history_count": len(history),
-        "latest_notes": notes[-3:] if notes else [],  # Last 3 notes
-        "latest_history": history[-3:] if history else [],  # Last 3 prescriptions
+        "notes_count": patient.get('visit_count', 0),
+        "history_count": patient.get('prescription_count', 0),
+        "latest_notes": notes,  # Last 3 notes
+        "latest_history": history,  # Last 3 prescriptions
         "queue_status": queue_entry['status'] if queue_entry else None
     }
 
 
 @router.get("/{patient_id}/complete", response_model=dict)
-async def get_patient_complete_record(patient_id: str):
+async def get_patient_complete_record(patient_id: str, storage: PatientStorage = Depends(get_storage)):
     """
     Get COMPLETE patient record with all notes and history
     
@@ -224,13 +346,13 @@ async def get_patient_complete_record(patient_id: str):
     """
     
     # Get patient
-    patient = await mongodb_storage.get_patient(patient_id)
+    patient = await storage.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     
     # Get all data
-    notes = await mongodb_storage.get_patient_notes(patient_id)
-    history = await mongodb_storage.get_patient_history(patient_id)
+    notes = await storage.get_patient_notes(patient_id)
+    history = await storage.get_patient_history(patient_id)
     
     return {
         "success": True,
@@ -241,7 +363,7 @@ async def get_patient_complete_record(patient_id: str):
 
 
 @router.put("/{patient_id}", response_model=dict)
-async def update_patient(patient_id: str, updates: dict):
+async def update_patient(patient_id: str, updates: dict, storage: PatientStorage = Depends(get_storage)):
     """
     Update patient information
     
@@ -252,12 +374,12 @@ async def update_patient(patient_id: str, updates: dict):
     - Any patient fields to update (name, phone, age, gender)
     """
     
-    patient = await mongodb_storage.get_patient(patient_id)
+    patient = await storage.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     
     # Update patient
-    updated_patient = await mongodb_storage.update_patient(patient_id, updates)
+    updated_patient = await storage.update_patient(patient_id, updates)
     
     return {
         "success": True,
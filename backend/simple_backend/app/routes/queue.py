@@ -2,49 +2,79 @@
 Queue management routes
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from app.models.schemas import QueueEntry, QueueStatus
-from app.services.mongodb_storage import mongodb_storage
+from app.services.storage_backend import get_storage
+from app.services.storage_protocol import PatientStorage, DuplicateQueueEntry
+from app.services.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.services.timestamps import utc_now, clinic_today
 import uuid
-from datetime import datetime
+from datetime import timedelta
+from typing import Optional
 
 router = APIRouter(prefix="/queue", tags=["Queue Management"])
 
 
 @router.get("", response_model=dict)
-async def get_queue():
+async def get_queue(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    after: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    include_entries: bool = Query(True, description="Set false to return only stats"),
+    storage: PatientStorage = Depends(get_storage)
+):
     """
     Get current queue status
     
-    Shows all patients in queue with their status:
+    Shows patients in queue (arrival order, paginated) with their status:
     - waiting: Patient registered, nurse hasn't started
     - nurse_completed: Nurse finished, timeline generating
     - ready_for_doctor: Timeline ready, waiting for doctor
     - in_consultation: Currently with doctor
     - completed: Consultation finished
+    
+    **Query Parameters:**
+    - limit: Page size (default 50, max 200)
+    - after: Cursor returned as `next_cursor` by the previous page
+    - include_entries: false skips the list (same as GET /queue/stats)
     """
     
-    queue = await mongodb_storage.get_queue()
+    stats = await storage.get_queue_stats()
     
-    # Calculate statistics
-    stats = {
-        "waiting": len([q for q in queue if q['status'] == 'waiting']),
-        "nurse_completed": len([q for q in queue if q['status'] == 'nurse_completed']),
-        "ready_for_doctor": len([q for q in queue if q['status'] == 'ready_for_doctor']),
-        "in_consultation": len([q for q in queue if q['status'] == 'in_consultation']),
-        "completed": len([q for q in queue if q['status'] == 'completed']),
-        "total": len(queue)
-    }
+    if not include_entries:
+        return {
+            "success": True,
+            "stats": stats
+        }
+    
+    page, next_cursor = await storage.get_queue_page(limit, after)
     
     return {
         "success": True,
         "stats": stats,
-        "queue": queue
+        "queue": page,
+        "next_cursor": next_cursor
+    }
+
+
+@router.get("/stats", response_model=dict)
+async def get_queue_stats(storage: PatientStorage = Depends(get_storage)):
+    """
+    Get per-status queue counts without loading any entries
+    
+    Counts are aggregated in MongoDB ($group on status).
+    
+    **Returns:**
+    - Count per status, `active` (not completed/cancelled) and `total`
+    """
+    
+    return {
+        "success": True,
+        "stats": await storage.get_queue_stats()
     }
 
 
 @router.post("", response_model=dict)
-async def add_to_queue(entry: QueueEntry):
+async def add_to_queue(entry: QueueEntry, storage: PatientStorage = Depends(get_storage)):
     """
     Add patient to queue
     
@@ -57,7 +87,7 @@ async def add_to_queue(entry: QueueEntry):
     
     **Returns:**
     - queue_id: Unique queue entry identifier
-    - token_number: Queue position number
+    - token_number: Today's token number (unique per facility and day)
     """
     
     # Validate: must provide either patient_id or uhid
@@ -69,7 +99,7 @@ async def add_to_queue(entry: QueueEntry):
     
     # Lookup patient by uhid if provided
     if entry.uhid:
-        patient = await mongodb_storage.get_patient_by_uhid(entry.uhid)
+        patient = await storage.get_patient_by_uhid(entry.uhid)
         if not patient:
             raise HTTPException(
                 status_code=404, 
@@ -79,7 +109,7 @@ async def add_to_queue(entry: QueueEntry):
         print(f"✅ Found patient by UHID {entry.uhid}: {patient['name']}")
     else:
         # Use patient_id directly
-        patient = await mongodb_storage.get_patient(entry.patient_id)
+        patient = await storage.get_patient(entry.patient_id)
         if not patient:
             raise HTTPException(
                 status_code=404, 
@@ -87,15 +117,8 @@ async def add_to_queue(entry: QueueEntry):
             )
         patient_id = entry.patient_id
     
-    # Check if already in queue
-    queue = await mongodb_storage.get_queue()
-    existing = next((q for q in queue if q['patient_id'] == patient_id and q['status'] != 'completed'), None)
-    if existing:
-        raise HTTPException(status_code=400, detail=f"Patient already in queue with status: {existing['status']}")
-    
-    # Calculate token number (active entries only)
-    active_queue = [q for q in queue if q['status'] != 'completed']
-    token_number = len(active_queue) + 1
+    # Allocate token number (atomic per-day counter)
+    token_number = await storage.next_token_number()
     
     # Create queue entry
     queue_id = f"Q_{uuid.uuid4().hex[:8].upper()}"
@@ -106,12 +129,16 @@ async def add_to_queue(entry: QueueEntry):
         "token_number": token_number,
         "priority": entry.priority,
         "status": QueueStatus.WAITING,
-        "added_at": datetime.now().isoformat(),
+        "added_at": utc_now(),
         "started_at": None,
         "completed_at": None
     }
     
-    await mongodb_storage.add_to_queue(queue_entry)
+    # One active entry per patient is enforced by a partial unique index
+    try:
+        await storage.add_to_queue(queue_entry)
+    except DuplicateQueueEntry as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     print(f"✅ Added to queue: {patient['name']} - Token #{token_number}")
     
@@ -123,13 +150,13 @@ async def add_to_queue(entry: QueueEntry):
 
 
 @router.get("/waiting", response_model=dict)
-async def get_waiting_patients():
+async def get_waiting_patients(storage: PatientStorage = Depends(get_storage)):
     """
     Get all patients currently waiting
     
     Useful for displaying on waiting room screen
     """
-    waiting = await mongodb_storage.get_queue_by_status(QueueStatus.WAITING)
+    waiting = await storage.get_queue_by_status(QueueStatus.WAITING)
     
     return {
         "success": True,
@@ -139,13 +166,13 @@ async def get_waiting_patients():
 
 
 @router.get("/current", response_model=dict)
-async def get_current_patient():
+async def get_current_patient(storage: PatientStorage = Depends(get_storage)):
     """
     Get patient currently being treated
     
     Useful for doctor's dashboard
     """
-    in_consultation = await mongodb_storage.get_queue_by_status(QueueStatus.IN_CONSULTATION)
+    in_consultation = await storage.get_queue_by_status(QueueStatus.IN_CONSULTATION)
     
     if not in_consultation:
         return {
@@ -156,7 +183,7 @@ async def get_current_patient():
     
     # Should only be one in_consultation at a time
     current = in_consultation[0]
-    patient = await mongodb_storage.get_patient(current['patient_id'])
+    patient = await storage.get_patient(current['patient_id'])
     
     return {
         "success": True,
@@ -166,7 +193,7 @@ async def get_current_patient():
 
 
 @router.post("/{queue_id}/nurse-complete", response_model=dict)
-async def nurse_complete_patient(queue_id: str):
+async def nurse_complete_patient(queue_id: str, storage: PatientStorage = Depends(get_storage)):
     """
     Nurse marks patient as completed (timeline will be generated)
     
@@ -181,10 +208,10 @@ async def nurse_complete_patient(queue_id: str):
     'ready_for_doctor' when complete.
     """
     
-    updated = await mongodb_storage.update_queue_status(
+    updated = await storage.update_queue_status(
         queue_id,
         QueueStatus.NURSE_COMPLETED,
-        nurse_completed_at=datetime.now().isoformat()
+        nurse_completed_at=utc_now()
     )
     
     if not updated:
@@ -200,7 +227,7 @@ async def nurse_complete_patient(queue_id: str):
 
 
 @router.post("/{queue_id}/start", response_model=dict)
-async def start_consultation(queue_id: str):
+async def start_consultation(queue_id: str, storage: PatientStorage = Depends(get_storage)):
     """
     Mark consultation as started
     
@@ -211,7 +238,7 @@ async def start_consultation(queue_id: str):
     """
     
     # Check if another consultation is in progress
-    in_consultation = await mongodb_storage.get_queue_by_status(QueueStatus.IN_CONSULTATION)
+    in_consultation = await storage.get_queue_by_status(QueueStatus.IN_CONSULTATION)
     if in_consultation:
         raise HTTPException(
             status_code=400, 
@@ -219,10 +246,10 @@ async def start_consultation(queue_id: str):
         )
     
     # Update status
-    updated = await mongodb_storage.update_queue_status(
+    updated = await storage.update_queue_status(
         queue_id, 
         QueueStatus.IN_CONSULTATION,
-        started_at=datetime.now().isoformat()
+        started_at=utc_now()
     )
     
     if not updated:
@@ -238,7 +265,7 @@ async def start_consultation(queue_id: str):
 
 
 @router.post("/{queue_id}/complete", response_model=dict)
-async def complete_consultation(queue_id: str):
+async def complete_consultation(queue_id: str, storage: PatientStorage = Depends(get_storage)):
     """
     Mark consultation as completed
     
@@ -248,10 +275,10 @@ async def complete_consultation(queue_id: str):
     Changes status to 'completed'
     """
     
-    updated = await mongodb_storage.update_queue_status(
+    updated = await storage.update_queue_status(
         queue_id,
         QueueStatus.COMPLETED,
-        completed_at=datetime.now().isoformat()
+        completed_at=utc_now()
     )
     
     if not updated:
@@ -267,7 +294,7 @@ async def complete_consultation(queue_id: str):
 
 
 @router.post("/{queue_id}/cancel", response_model=dict)
-async def cancel_queue_entry(queue_id: str):
+async def cancel_queue_entry(queue_id: str, storage: PatientStorage = Depends(get_storage)):
     """
     Cancel/remove patient from queue
     
@@ -275,10 +302,10 @@ async def cancel_queue_entry(queue_id: str):
     - queue_id: Queue entry identifier
     """
     
-    updated = await mongodb_storage.update_queue_status(
+    updated = await storage.update_queue_status(
         queue_id,
         QueueStatus.CANCELLED,
-        cancelled_at=datetime.now().isoformat()
+        cancelled_at=utc_now()
     )
     
     if not updated:
@@ -292,24 +319,48 @@ async def cancel_queue_entry(queue_id: str):
 
 
 @router.delete("/cleanup", response_model=dict)
-async def cleanup_completed():
+async def cleanup_completed(storage: PatientStorage = Depends(get_storage)):
     """
-    Remove completed entries from queue
+    Move completed and cancelled entries to the queue archive
     
-    Useful for keeping queue display clean
+    Useful for keeping queue display clean. Finished entries of previous
+    days are archived automatically at day rollover; nothing is deleted.
     """
     
-    queue = await mongodb_storage.get_queue()
-    before_count = len(queue)
-    await mongodb_storage.clear_completed_queue()
-    queue = await mongodb_storage.get_queue()
-    after_count = len(queue)
-    
-    removed = before_count - after_count
+    archived = await storage.archive_finished_queue()
+    stats = await storage.get_queue_stats()
+    after_count = stats['total']
     
     return {
         "success": True,
-        "message": f"Removed {removed} completed entries",
+        "message": f"Archived {archived} finished entries",
+        "archived": archived,
         "remaining": after_count
     }
 
+
+@router.get("/archive/stats", response_model=dict)
+async def get_visit_stats(
+    days: int = Query(30, ge=1, le=365, description="Number of days to include"),
+    storage: PatientStorage = Depends(get_storage)
+):
+    """
+    Get finished visits per day from the queue archive
+    
+    **Query Parameters:**
+    - days: Number of days to include (default 30, max 365)
+    
+    **Returns:**
+    - Per-day (clinic-local) completed/cancelled counts, newest day first
+    """
+    
+    since = (clinic_today() - timedelta(days=days - 1)).isoformat()
+    visits = await storage.get_visit_stats(since)
+    
+    return {
+        "success": True,
+        "since": since,
+        "total_visits": sum(day['completed'] for day in visits),
+        "days": visits
+    }
+
@@ -0,0 +1,111 @@
+"""
+Live queue push (Server-Sent Events and WebSocket)
+
+Replaces polling of GET /queue, /queue/waiting and /queue/current: clients
+get one snapshot on connect, then compact deltas (see app.services.queue_events).
+"""
+
+import asyncio
+import json
+from typing import AsyncIterator, Dict, Optional
+
+from fastapi import APIRouter, Depends, Header, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from app.services.storage_backend import get_storage
+from app.services.storage_protocol import PatientStorage
+from app.services.queue_events import queue_events, sse_message, SubscriberLagged
+from app.services.timestamps import json_default
+
+router = APIRouter(prefix="/queue", tags=["Live Queue"])
+
+HEARTBEAT_SECONDS = 15
+
+
+async def _snapshot(storage: PatientStorage) -> Dict:
+    """Current hot queue + stats, tagged with the id of the last event it includes"""
+    last_event_id = queue_events.last_event_id
+    queue, stats = await asyncio.gather(storage.get_queue(), storage.get_queue_stats())
+    return {
+        "type": "snapshot",
+        "id": last_event_id,
+        "source": queue_events.source,
+        "stats": stats,
+        "queue": queue
+    }
+
+
+async def queue_event_stream(storage: PatientStorage, last_event_id: Optional[str] = None) -> AsyncIterator[Optional[Dict]]:
+    """
+    Snapshot (or replay of missed events), then live deltas
+
+    Yields None every HEARTBEAT_SECONDS without events so transports can
+    keep the connection alive.
+    """
+    subscription = queue_events.subscribe()
+    try:
+        # Subscribe before reading so nothing published meanwhile is lost
+        missed = queue_events.events_after(last_event_id)
+        if missed is None:
+            yield await _snapshot(storage)
+        else:
+            for event in missed:
+                yield event
+
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+
+            if isinstance(event, SubscriberLagged):
+                yield await _snapshot(storage)
+            else:
+                yield event
+    finally:
+        queue_events.unsubscribe(subscription)
+
+
+@router.get("/events")
+async def stream_queue_events(
+    last_event_id: Optional[str] = Query(None, description="Resume after this event id"),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+    storage: PatientStorage = Depends(get_storage)
+):
+    """
+    Live queue updates as Server-Sent Events
+
+    The first event is a `snapshot` (full hot queue + stats); after that only
+    deltas are sent: `added`, `status`, `removed`, `resync`.
+
+    **Query Parameters:**
+    - last_event_id: Resume after this event id (browsers send the
+      `Last-Event-ID` header automatically on reconnect)
+    """
+
+    async def body():
+        async for event in queue_event_stream(storage, last_event_id or last_event_id_header):
+            yield ": heartbeat\n\n" if event is None else sse_message(event)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.websocket("/ws")
+async def queue_websocket(websocket: WebSocket, resume: Optional[str] = None, storage: PatientStorage = Depends(get_storage)):
+    """
+    Live queue updates over WebSocket
+
+    Same messages as GET /queue/events, as JSON text frames. Reconnect with
+    `?resume=<last event id>` to receive only missed events.
+    """
+    await websocket.accept()
+    try:
+        async for event in queue_event_stream(storage, resume):
+            await websocket.send_text(json.dumps(event if event is not None else {"type": "heartbeat"}, default=json_default))
+    except WebSocketDisconnect:
+        pass
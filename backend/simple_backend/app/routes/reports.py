@@ -3,9 +3,14 @@ Patient Report Generation Routes
 Comprehensive medical reports for PDF generation
 """
 
-from fastapi import APIRouter, HTTPException, Query
-from app.services.mongodb_storage import mongodb_storage
-from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query
+from app.services.report_state import (
+    build_state, load_report_state, medication_name, replace_report_state, settle_report_state, state_drift, unix_time
+)
+from app.services.storage_backend import get_storage
+from app.services.storage_protocol import PatientStorage
+from app.services.timestamps import utc_now
+from datetime import datetime, timezone
 from typing import Optional, Dict, List
 import json
 
@@ -13,12 +18,24 @@ router = APIRouter(prefix="/report", tags=["Reports"])
 
 
 @router.get("", response_model=dict)
-async def generate_patient_report(uhid: str = Query(..., description="Patient's UHID")):
+async def generate_patient_report(
+    uhid: str = Query(..., description="Patient's UHID"),
+    verify: bool = Query(False, description="Recompute from all records and check the stored report state"),
+    storage: PatientStorage = Depends(get_storage)
+):
     """
     Generate comprehensive patient medical report for PDF generation
     
     **Query Parameters:**
     - uhid: Patient's Government Health ID (REQUIRED)
+    - verify: Recompute the report from every note, prescription and the queue
+      (the original path, with full timeline and raw data), compare the stored
+      report state against it and repair any drift
+    
+    By default the report is rendered from the patient's report state, one
+    read kept current by every note, prescription and queue update: the
+    timeline, visit dates and symptom trend hold the latest entries and
+    raw_data only the counts.
     
     **Returns:**
     Detailed patient analysis including:
@@ -35,7 +52,7 @@ async def generate_patient_report(uhid: str = Query(..., description="Patient's
     """
     
     # Step 1: Get patient by UHID
-    patient = await mongodb_storage.get_patient_by_uhid(uhid)
+    patient = await storage.get_patient_by_uhid(uhid)
     if not patient:
         raise HTTPException(
             status_code=404, 
@@ -45,19 +62,72 @@ async def generate_patient_report(uhid: str = Query(..., description="Patient's
     patient_id = patient['patient_id']
     print(f"📋 Generating comprehensive report for {patient['name']} (UHID: {uhid})")
     
-    # Step 2: Get all medical data
-    notes = await mongodb_storage.get_patient_notes(patient_id)
-    history = await mongodb_storage.get_patient_history(patient_id)
-    queue = await mongodb_storage.get_queue()
+    if verify:
+        return await _verified_report(storage, patient)
+    
+    # Step 2: One read of the precomputed state (built from the records the first time)
+    state = await load_report_state(storage, patient_id)
+    report = _report_from_state(patient, state)
+    
+    print(f"✅ Report generated from report state - {state['visits']} notes, {state['prescriptions']} prescriptions")
+    
+    return {
+        "success": True,
+        "uhid": uhid,
+        "patient_name": patient['name'],
+        "report": report
+    }
+
+
+async def _verified_report(storage: PatientStorage, patient: Dict) -> Dict:
+    """The original full recomputation, plus a check (and repair) of the stored report state"""
+    
+    patient_id = patient['patient_id']
+    
+    # Get all medical data (storage returns newest first; the analysis reads oldest first)
+    notes = await storage.get_patient_notes(patient_id)
+    history = await storage.get_patient_history(patient_id)
+    queue_entry = await storage.get_patient_queue_entry(patient_id)
+    
+    stored = await storage.get_report_state(patient_id)
+    rebuilt = build_state(patient_id, notes, history, queue_entry)
+    drift = state_drift(stored, rebuilt) if stored is not None else {}
+    if stored is None:
+        await storage.create_report_state(rebuilt)
+    elif drift:
+        await replace_report_state(storage, stored, rebuilt)
+    if stored is None or drift:
+        # Re-checked: a write may have landed after the records above were read
+        await settle_report_state(storage, patient_id)
+    
+    report = _recomputed_report(patient, list(reversed(notes)), history, queue_entry)
+    print(f"✅ Report generated successfully - {len(notes)} notes, {len(history)} prescriptions")
+    if drift:
+        print(f"⚠️ Report state drift repaired for {patient_id}: {', '.join(drift)}")
     
-    # Step 3: Calculate actual visit count (notes are the source of truth)
-    actual_visit_count = len(notes)
-    last_visit_date = notes[-1].get('created_at') if notes else patient.get('last_visit')
+    return {
+        "success": True,
+        "uhid": patient['uhid'],
+        "patient_name": patient['name'],
+        "report": report,
+        "verification": {
+            "state_found": stored is not None,
+            "matches": stored is not None and not drift,
+            "drift": drift,
+            "repaired": stored is None or bool(drift)
+        }
+    }
+
+
+def _recomputed_report(patient: Dict, notes: List[Dict], history: List[Dict], queue_entry: Optional[Dict]) -> Dict:
+    """Full report from all of a patient's records (notes oldest first)"""
     
-    # Step 4: Analyze and structure the report
-    report = {
-        "report_generated_at": datetime.now().isoformat(),
-        "report_id": f"REPORT_{patient_id}_{int(datetime.now().timestamp())}",
+    patient_id = patient['patient_id']
+    now = utc_now()
+    return {
+        "report_generated_at": now,
+        "report_id": f"REPORT_{patient_id}_{int(now.timestamp())}",
+        "source": "recomputed",
         
         # === PATIENT DEMOGRAPHICS ===
         "patient_info": {
@@ -69,8 +139,8 @@ async def generate_patient_report(uhid: str = Query(..., description="Patient's
             "gender": patient.get('gender', 'Not specified'),
             "registration_date": patient.get('created_at'),
             "status": patient.get('status', 'active'),
-            "total_visits": actual_visit_count,  # Use actual notes count
-            "last_visit": last_visit_date
+            "total_visits": len(notes),
+            "last_visit": notes[-1].get('created_at') if notes else patient.get('last_visit')
         },
         
         # === VISIT STATISTICS ===
@@ -89,7 +159,7 @@ async def generate_patient_report(uhid: str = Query(..., description="Patient's
         "health_patterns": _identify_health_patterns(notes),
         
         # === CURRENT STATUS ===
-        "current_status": _get_current_status(patient_id, queue, notes),
+        "current_status": _get_current_status(queue_entry, notes),
         
         # === RAW DATA (for detailed PDF sections) ===
         "raw_data": {
@@ -99,28 +169,149 @@ async def generate_patient_report(uhid: str = Query(..., description="Patient's
             "prescriptions_count": len(history)
         }
     }
+
+
+def _report_from_state(patient: Dict, state: Dict) -> Dict:
+    """Same report sections, rendered from the precomputed report state"""
     
-    print(f"✅ Report generated successfully - {len(notes)} notes, {len(history)} prescriptions")
+    patient_id = patient['patient_id']
+    now = utc_now()
+    visits = state.get('visits', 0)
+    recent = state.get('recent_visits') or []
+    last_visit = _from_unix(state.get('last_visit_time'))
+    return {
+        "report_generated_at": now,
+        "report_id": f"REPORT_{patient_id}_{int(now.timestamp())}",
+        "source": "report_state",
+        
+        "patient_info": {
+            "uhid": patient['uhid'],
+            "patient_id": patient['patient_id'],
+            "name": patient['name'],
+            "phone": patient.get('phone', 'Not provided'),
+            "age": patient.get('age', 'Not provided'),
+            "gender": patient.get('gender', 'Not specified'),
+            "registration_date": patient.get('created_at'),
+            "status": patient.get('status', 'active'),
+            "total_visits": visits,
+            "last_visit": last_visit or patient.get('last_visit')
+        },
+        
+        "statistics": _state_statistics(patient, state),
+        
+        # Latest REPORT_TIMELINE_SIZE consultations and prescriptions
+        "medical_timeline": [
+            {"date": _from_unix(event['timestamp']), **{key: value for key, value in event.items() if key not in ("id", "order")}}
+            for event in state.get('timeline') or []
+        ],
+        
+        "clinical_summary": _state_clinical_summary(state),
+        "medication_history": _state_medication_history(state),
+        "health_patterns": _state_health_patterns(state),
+        
+        "current_status": _get_current_status(state.get('queue'), [{"created_at": last_visit}] if last_visit else []),
+        
+        # Records themselves: ?verify=true
+        "raw_data": {
+            "notes_count": visits,
+            "prescriptions_count": state.get('prescriptions', 0),
+            "recent_visits": len(recent)
+        }
+    }
+
+
+def _from_unix(timestamp: Optional[int]) -> Optional[datetime]:
+    return datetime.fromtimestamp(timestamp, timezone.utc) if timestamp else None
+
+
+def _tallies(state: Dict, field: str) -> List[Dict]:
+    """A report state tally, most frequent first"""
+    return sorted((state.get(field) or {}).values(), key=lambda tally: (-tally['count'], tally['item']))
+
+
+def _top_tallies(state: Dict, field: str, top_n: int) -> List[Dict]:
+    return [{"item": tally['item'], "count": tally['count']} for tally in _tallies(state, field)[:top_n]]
+
+
+def _state_statistics(patient: Dict, state: Dict) -> Dict:
+    registration = patient.get('created_at')
+    days_registered = (utc_now() - registration).days if registration else 0
+    visits = state.get('visits', 0)
+    visit_frequency = visits / max(days_registered / 30, 1) if registration else 0  # Visits per month
     
     return {
-        "success": True,
-        "uhid": uhid,
-        "patient_name": patient['name'],
-        "report": report
+        "total_visits": visits,
+        "total_prescriptions": state.get('prescriptions', 0),
+        "days_as_patient": days_registered,
+        "average_visits_per_month": round(visit_frequency, 2),
+        "first_visit_date": _from_unix(state.get('first_visit_time')),
+        "most_recent_visit": _from_unix(state.get('last_visit_time')),
+        "visit_dates": [_from_unix(visit['timestamp']) for visit in reversed(state.get('recent_visits') or [])]
+    }
+
+
+def _state_clinical_summary(state: Dict) -> Dict:
+    if not state.get('visits'):
+        return _analyze_soap_notes([])
+    
+    latest = state.get('latest') or {}
+    return {
+        "total_consultations": state['visits'],
+        "common_complaints": _top_tallies(state, "complaints", 5),
+        "common_assessments": _top_tallies(state, "assessments", 5),
+        "treatment_approaches": _top_tallies(state, "plans", 3),
+        "medications_prescribed": _top_tallies(state, "soap_medications", 10),
+        "latest_complaint": latest.get('complaint') or "No recent visits",
+        "latest_assessment": latest.get('assessment') or "No recent assessment",
+        "language_breakdown": {tally['item']: tally['count'] for tally in _tallies(state, "languages")}
+    }
+
+
+def _state_medication_history(state: Dict) -> Dict:
+    if not state.get('prescriptions'):
+        return _analyze_medications([])
+    
+    medications = _tallies(state, "medications")
+    doctors = _tallies(state, "doctors")
+    return {
+        "total_prescriptions": state['prescriptions'],
+        "unique_medications": [tally['item'] for tally in medications],
+        "unique_medication_count": len(medications),
+        "most_prescribed": [{"medication": tally['item'], "times_prescribed": tally['count']}
+                           for tally in medications[:10]],
+        "prescribing_doctors": [tally['item'] for tally in doctors],
+        "doctor_visits": {tally['item']: tally['count'] for tally in doctors}
+    }
+
+
+def _state_health_patterns(state: Dict) -> Dict:
+    visits = state.get('visits', 0)
+    if visits < 2:
+        return _identify_health_patterns([])
+    
+    # Consecutive gaps always add up to the span between first and last visit
+    span = state['last_visit_time'] - state['first_visit_time']
+    avg_gap = span / 86400 / (visits - 1)
+    recent = list(reversed(state.get('recent_visits') or []))  # Oldest first, like the full recomputation
+    
+    return {
+        "visit_frequency_pattern": "Regular" if avg_gap < 60 else "Occasional",
+        "average_days_between_visits": round(avg_gap, 1),
+        "total_days_span": span // 86400,
+        "symptoms_over_time": [
+            {"date": _from_unix(visit['timestamp']), "complaint": visit['complaint'], "subjective": visit['subjective']}
+            for visit in recent
+        ],
+        "pattern_insights": _generate_pattern_insights(visits, [visit['complaint'] for visit in recent[-3:]], avg_gap)
     }
 
 
 def _calculate_statistics(patient: Dict, notes: List[Dict], history: List[Dict]) -> Dict:
     """Calculate visit and treatment statistics"""
     
-    # Parse dates
-    try:
-        registration = datetime.fromisoformat(patient.get('created_at', ''))
-        days_registered = (datetime.now() - registration).days
-        visit_frequency = len(notes) / max(days_registered / 30, 1)  # Visits per month
-    except:
-        days_registered = 0
-        visit_frequency = 0
+    registration = patient.get('created_at')
+    days_registered = (utc_now() - registration).days if registration else 0
+    visit_frequency = len(notes) / max(days_registered / 30, 1) if registration else 0  # Visits per month
     
     return {
         "total_visits": len(notes),
@@ -141,20 +332,10 @@ def _build_medical_timeline(notes: List[Dict], history: List[Dict]) -> List[Dict
     # Add SOAP notes
     for note in notes:
         soap = note.get('soap_note', {})
-        # Get timestamp or parse from created_at, fallback to 0
-        timestamp = note.get('timestamp')
-        if timestamp is None and note.get('created_at'):
-            try:
-                timestamp = int(datetime.fromisoformat(note.get('created_at')).timestamp())
-            except:
-                timestamp = 0
-        elif timestamp is None:
-            timestamp = 0
-            
         timeline.append({
             "type": "consultation",
             "date": note.get('created_at'),
-            "timestamp": timestamp,
+            "timestamp": _unix_time(note),
             "chief_complaint": soap.get('chief_complaint', 'Not documented'),
             "assessment": soap.get('assessment', 'Not documented'),
             "plan": soap.get('plan', 'Not documented'),
@@ -166,32 +347,27 @@ def _build_medical_timeline(notes: List[Dict], history: List[Dict]) -> List[Dict
     # Add prescription history
     for entry in history:
         prescription = entry.get('prescription_data', {})
-        # Get timestamp or parse from created_at, fallback to 0
-        timestamp = entry.get('timestamp')
-        if timestamp is None and entry.get('created_at'):
-            try:
-                timestamp = int(datetime.fromisoformat(entry.get('created_at')).timestamp())
-            except:
-                timestamp = 0
-        elif timestamp is None:
-            timestamp = 0
-            
         timeline.append({
             "type": "prescription",
             "date": entry.get('created_at'),
-            "timestamp": timestamp,
+            "timestamp": _unix_time(entry),
             "doctor": prescription.get('doctor_name', 'Unknown'),
             "diagnosis": prescription.get('diagnosis', 'Not specified'),
             "medications": prescription.get('medications', []),
             "image_url": entry.get('image_url')
         })
     
-    # Sort by timestamp (newest first) - all timestamps are now integers
+    # Sort by timestamp (newest first)
     timeline.sort(key=lambda x: x['timestamp'], reverse=True)
     
     return timeline
 
 
+def _unix_time(record: Dict) -> int:
+    """Unix time of a note/prescription (0 if it has no created_at)"""
+    return unix_time(record.get('created_at'))
+
+
 def _analyze_soap_notes(notes: List[Dict]) -> Dict:
     """Analyze SOAP notes for patterns and insights"""
     
@@ -222,7 +398,7 @@ def _analyze_soap_notes(notes: List[Dict]) -> Dict:
             plans.append(soap['plan'])
         
         if soap.get('medications'):
-            all_medications.extend(soap['medications'])
+            all_medications.extend(medication_name(m) for m in soap['medications'])
     
     # Find most common items
     from collections import Counter
@@ -286,15 +462,7 @@ def _identify_health_patterns(notes: List[Dict]) -> Dict:
         }
     
     # Analyze visit frequency
-    dates = []
-    for note in notes:
-        try:
-            date = datetime.fromisoformat(note.get('created_at', ''))
-            dates.append(date)
-        except:
-            pass
-    
-    dates.sort()
+    dates = sorted(note['created_at'] for note in notes if note.get('created_at'))
     
     # Calculate gaps between visits
     gaps = []
@@ -319,33 +487,25 @@ def _identify_health_patterns(notes: List[Dict]) -> Dict:
         "average_days_between_visits": round(avg_gap, 1),
         "total_days_span": (dates[-1] - dates[0]).days if len(dates) > 1 else 0,
         "symptoms_over_time": symptoms_trend[-5:],  # Last 5 visits
-        "pattern_insights": _generate_pattern_insights(notes, avg_gap)
+        "pattern_insights": _generate_pattern_insights(
+            len(notes), [note.get('soap_note', {}).get('chief_complaint', '') for note in notes[-3:]], avg_gap
+        )
     }
 
 
-def _get_current_status(patient_id: str, queue: List[Dict], notes: List[Dict]) -> Dict:
+def _get_current_status(queue_entry: Optional[Dict], notes: List[Dict]) -> Dict:
     """Get patient's current status in the system"""
     
-    # Check if in queue
-    queue_entry = next((q for q in queue if q['patient_id'] == patient_id), None)
-    
     # Get last visit
     last_visit = notes[-1] if notes else None
-    last_visit_date = None
-    if last_visit:
-        try:
-            last_visit_date = datetime.fromisoformat(last_visit.get('created_at', ''))
-            days_since = (datetime.now() - last_visit_date).days
-        except:
-            days_since = None
-    else:
-        days_since = None
+    last_visit_date = last_visit.get('created_at') if last_visit else None
+    days_since = (utc_now() - last_visit_date).days if last_visit_date else None
     
     return {
         "in_queue": queue_entry is not None,
         "queue_status": queue_entry.get('status') if queue_entry else None,
         "queue_token": queue_entry.get('token_number') if queue_entry else None,
-        "last_visit_date": last_visit_date.isoformat() if last_visit_date else None,
+        "last_visit_date": last_visit_date,
         "days_since_last_visit": days_since,
         "follow_up_due": days_since > 30 if days_since else False
     }
@@ -365,7 +525,7 @@ def _count_languages(notes: List[Dict]) -> Dict:
     return dict(Counter(languages))
 
 
-def _generate_pattern_insights(notes: List[Dict], avg_gap: float) -> str:
+def _generate_pattern_insights(visit_count: int, recent_complaints: List[str], avg_gap: float) -> str:
     """Generate natural language insights about health patterns"""
     
     insights = []
@@ -377,10 +537,9 @@ def _generate_pattern_insights(notes: List[Dict], avg_gap: float) -> str:
     else:
         insights.append("Occasional visits for acute conditions.")
     
-    if len(notes) >= 3:
-        # Check for recurring complaints
-        complaints = [note.get('soap_note', {}).get('chief_complaint', '') for note in notes[-3:]]
-        if len(set(complaints)) == 1:
+    if visit_count >= 3:
+        # Check for recurring complaints (last 3 visits)
+        if len(set(recent_complaints)) == 1:
             insights.append("Recurring complaint may indicate chronic condition requiring specialist referral.")
     
     return " ".join(insights)
@@ -2,22 +2,38 @@
 Upload and processing routes (Audio and Images)
 """
 
-from fastapi import APIRouter, File, UploadFile, HTTPException, BackgroundTasks
-from app.services.mongodb_storage import mongodb_storage
-from app.services.ai_service import transcribe_audio, generate_soap_note, extract_prescription
+from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, BackgroundTasks
+from app.models.schemas import PresignedUploadRequest, UploadFileType
+from app.services.storage_backend import get_storage, get_document_storage
+from app.services.storage_protocol import PatientStorage, DocumentStorage
+from app.services.ai_service import transcribe_audio, extract_prescription
+from app.services.blob_store import blob_store, get_content_type
+from app.services.ingestion_service import (
+    ProcessingError,
+    process_audio,
+    process_prescription_image,
+    process_document,
+    get_or_create_batch
+)
+from app.services.timestamps import utc_now
 import uuid
 import os
-from datetime import datetime
+from datetime import timedelta
 from typing import Optional
 
 router = APIRouter(prefix="/upload", tags=["Uploads & Processing"])
 
-UPLOADS_DIR = "/app/data/uploads"
-os.makedirs(UPLOADS_DIR, exist_ok=True)
+PRESIGNED_URL_EXPIRES_IN = 300  # seconds
+
+ALLOWED_EXTENSIONS = {
+    UploadFileType.AUDIO: ['mp3', 'm4a', 'wav', 'ogg', 'mp4'],
+    UploadFileType.IMAGE: ['jpg', 'jpeg', 'png'],
+    UploadFileType.DOCUMENT: ['jpg', 'jpeg', 'png', 'pdf']
+}
 
 
 @router.post("/audio/{patient_id}", response_model=dict)
-async def upload_audio(patient_id: str, file: UploadFile = File(...)):
+async def upload_audio(patient_id: str, file: UploadFile = File(...), storage: PatientStorage = Depends(get_storage)):
     """
     Upload audio recording and generate SOAP note
     
@@ -41,7 +57,7 @@ async def upload_audio(patient_id: str, file: UploadFile = File(...)):
     """
     
     # Verify patient exists
-    patient = await mongodb_storage.get_patient(patient_id)
+    patient = await storage.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     
@@ -62,47 +78,23 @@ async def upload_audio(patient_id: str, file: UploadFile = File(...)):
         # Save audio file
         file_extension = file.filename.split('.')[-1]
         audio_filename = f"{patient_id}_audio_{uuid.uuid4().hex[:8]}.{file_extension}"
-        audio_path = os.path.join(UPLOADS_DIR, audio_filename)
         
-        with open(audio_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        content = await file.read()
+        await blob_store.put(audio_filename, content, get_content_type(audio_filename))
         
         print(f"📁 Saved audio: {audio_filename}")
         
-        # Step 1: Transcribe audio
-        transcript = await transcribe_audio(audio_path)
-        
-        if transcript.startswith("[Transcription failed"):
-            raise HTTPException(status_code=500, detail="Transcription failed")
-        
-        # Step 2: Generate SOAP note
-        soap_note = await generate_soap_note(transcript)
-        
-        # Step 3: Save to notes
-        note_id = f"NOTE_{uuid.uuid4().hex[:8].upper()}"
-        note_data = {
-            "note_id": note_id,
-            "patient_id": patient_id,
-            "created_at": datetime.now().isoformat(),
-            "audio_file": audio_filename,
-            "transcript": transcript,
-            "soap_note": soap_note
-        }
-        
-        await mongodb_storage.add_note(patient_id, note_data)
-        
-        print(f"✅ SOAP note created: {note_id}")
+        # Transcribe, generate SOAP note and save to notes
+        result = await process_audio(patient_id, audio_filename)
         
         return {
             "success": True,
             "message": "Audio processed successfully",
-            "note_id": note_id,
-            "transcript": transcript,
-            "soap_note": soap_note,
-            "audio_file": audio_filename
+            **result
         }
     
+    except ProcessingError as e:
+        raise HTTPException(status_code=500, detail=str(e))
     except HTTPException:
         raise
     except Exception as e:
@@ -111,7 +103,11 @@ async def upload_audio(patient_id: str, file: UploadFile = File(...)):
 
 
 @router.post("/image/{patient_id}", response_model=dict)
-async def upload_prescription_image(patient_id: str, file: UploadFile = File(...)):
+async def upload_prescription_image(
+    patient_id: str,
+    file: UploadFile = File(...),
+    storage: PatientStorage = Depends(get_storage)
+):
     """
     Upload prescription image and extract details
     
@@ -134,7 +130,7 @@ async def upload_prescription_image(patient_id: str, file: UploadFile = File(...
     """
     
     # Verify patient exists
-    patient = await mongodb_storage.get_patient(patient_id)
+    patient = await storage.get_patient(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
     
@@ -155,38 +151,19 @@ async def upload_prescription_image(patient_id: str, file: UploadFile = File(...
         # Save image file
         file_extension = file.filename.split('.')[-1]
         image_filename = f"{patient_id}_prescription_{uuid.uuid4().hex[:8]}.{file_extension}"
-        image_path = os.path.join(UPLOADS_DIR, image_filename)
         
-        with open(image_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        content = await file.read()
+        await blob_store.put(image_filename, content, get_content_type(image_filename))
         
         print(f"📁 Saved image: {image_filename}")
         
-        # Extract prescription details
-        prescription_data = await extract_prescription(image_path)
-        
-        # Save to history
-        history_id = f"HIST_{uuid.uuid4().hex[:8].upper()}"
-        history_entry = {
-            "history_id": history_id,
-            "patient_id": patient_id,
-            "created_at": datetime.now().isoformat(),
-            "image_file": image_filename,
-            "prescription_data": prescription_data,
-            "type": "prescription"
-        }
-        
-        await mongodb_storage.add_history(patient_id, history_entry)
-        
-        print(f"✅ Prescription extracted: {history_id}")
+        # Extract prescription details and save to history
+        result = await process_prescription_image(patient_id, image_filename)
         
         return {
             "success": True,
             "message": "Prescription processed successfully",
-            "history_id": history_id,
-            "prescription_data": prescription_data,
-            "image_file": image_filename
+            **result
         }
     
     except HTTPException:
@@ -196,6 +173,199 @@ async def upload_prescription_image(patient_id: str, file: UploadFile = File(...
         raise HTTPException(status_code=500, detail=f"Failed to process image: {str(e)}")
 
 
+# ==================== DIRECT-TO-STORAGE UPLOADS ====================
+
+@router.post("/direct/presign", response_model=dict)
+async def create_presigned_upload(
+    request: PresignedUploadRequest,
+    storage: PatientStorage = Depends(get_storage),
+    document_storage: DocumentStorage = Depends(get_document_storage)
+):
+    """
+    Issue a presigned URL so the client uploads media straight to storage
+    
+    The API process never receives the file bytes. After the PUT succeeds,
+    call `POST /upload/direct/{upload_id}/complete` to start processing.
+    
+    **Request Body:**
+    - patient_id: Patient's unique identifier
+    - file_type: "audio", "image" (prescription) or "document" (batch scan)
+    - file_extension: e.g. m4a, jpg, pdf
+    - batch_id: Optional document batch (file_type=document only)
+    
+    **Returns:**
+    - upload_id: Use this for the completion callback
+    - upload_url / method / headers: How to upload the file
+    - file_key: Storage key of the uploaded file
+    - expires_in: Seconds until the URL expires
+    """
+    
+    patient = await storage.get_patient(request.patient_id)
+    if not patient:
+        raise HTTPException(status_code=404, detail=f"Patient {request.patient_id} not found")
+    
+    file_extension = request.file_extension.lower().lstrip('.')
+    allowed_extensions = ALLOWED_EXTENSIONS[request.file_type]
+    if file_extension not in allowed_extensions:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file type for {request.file_type.value}. Allowed: {', '.join(allowed_extensions)}"
+        )
+    
+    # Keys follow the same naming as multipart uploads
+    document_id = None
+    if request.file_type == UploadFileType.AUDIO:
+        file_key = f"{request.patient_id}_audio_{uuid.uuid4().hex[:8]}.{file_extension}"
+    elif request.file_type == UploadFileType.IMAGE:
+        file_key = f"{request.patient_id}_prescription_{uuid.uuid4().hex[:8]}.{file_extension}"
+    else:
+        document_id = f"DOC_{uuid.uuid4().hex[:8].upper()}"
+        file_key = f"{request.patient_id}_{document_id}.{file_extension}"
+    
+    content_type = get_content_type(file_key)
+    presigned = blob_store.presign_upload(file_key, content_type, PRESIGNED_URL_EXPIRES_IN)
+    
+    upload_id = f"UPL_{uuid.uuid4().hex[:12].upper()}"
+    now = utc_now()
+    await document_storage.create_upload_session({
+        "upload_id": upload_id,
+        "patient_id": request.patient_id,
+        "file_type": request.file_type.value,
+        "file_key": file_key,
+        "document_id": document_id,
+        "batch_id": request.batch_id,
+        "status": "pending",
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=PRESIGNED_URL_EXPIRES_IN),
+        "completed_at": None,
+        "result": None,
+        "error": None
+    })
+    
+    print(f"🔗 Presigned {request.file_type.value} upload: {file_key} ({upload_id})")
+    
+    return {
+        "success": True,
+        "upload_id": upload_id,
+        "upload_url": presigned["url"],
+        "method": presigned["method"],
+        "headers": presigned["headers"],
+        "file_key": file_key,
+        "storage": blob_store.name,
+        "expires_in": PRESIGNED_URL_EXPIRES_IN
+    }
+
+
+@router.post("/direct/{upload_id}/complete", response_model=dict)
+async def complete_presigned_upload(
+    upload_id: str,
+    background_tasks: BackgroundTasks,
+    document_storage: DocumentStorage = Depends(get_document_storage)
+):
+    """
+    Completion callback for a direct upload - enqueues processing
+    
+    Safe to call more than once: only the first call for an uploaded file
+    enqueues the job, later calls return the current session state.
+    
+    **Path Parameters:**
+    - upload_id: ID returned by `/upload/direct/presign`
+    
+    **Returns:**
+    - status: queued, processing, completed or failed
+    - duplicate: True if processing was already enqueued by an earlier call
+    """
+    
+    session = await document_storage.get_upload_session(upload_id)
+    if not session:
+        raise HTTPException(status_code=404, detail=f"Upload {upload_id} not found")
+    
+    if session['status'] != 'pending':
+        return _upload_session_response(session, duplicate=True)
+    
+    if not await blob_store.exists(session['file_key']):
+        if session['expires_at'] < utc_now():
+            raise HTTPException(status_code=410, detail="Upload URL expired before the file was uploaded")
+        raise HTTPException(status_code=409, detail="File has not been uploaded yet")
+    
+    claimed = await document_storage.claim_upload_session(upload_id)
+    if not claimed:
+        # Another callback won the race
+        session = await document_storage.get_upload_session(upload_id)
+        return _upload_session_response(session, duplicate=True)
+    
+    background_tasks.add_task(_run_upload_job, claimed)
+    
+    print(f"📥 Upload complete, processing enqueued: {claimed['file_key']}")
+    
+    return _upload_session_response(claimed, duplicate=False)
+
+
+@router.get("/direct/{upload_id}", response_model=dict)
+async def get_presigned_upload_status(
+    upload_id: str,
+    document_storage: DocumentStorage = Depends(get_document_storage)
+):
+    """
+    Get processing status of a direct upload
+    
+    **Path Parameters:**
+    - upload_id: ID returned by `/upload/direct/presign`
+    """
+    
+    session = await document_storage.get_upload_session(upload_id)
+    if not session:
+        raise HTTPException(status_code=404, detail=f"Upload {upload_id} not found")
+    
+    return _upload_session_response(session, duplicate=False)
+
+
+def _upload_session_response(session: dict, duplicate: bool) -> dict:
+    """Shape an upload session for API responses"""
+    return {
+        "success": True,
+        "upload_id": session['upload_id'],
+        "status": session['status'],
+        "duplicate": duplicate,
+        "file_type": session['file_type'],
+        "file_key": session['file_key'],
+        "result": session.get('result'),
+        "error": session.get('error')
+    }
+
+
+async def _run_upload_job(session: dict):
+    """Background job: run the ingestion pipeline for a completed direct upload"""
+    upload_id = session['upload_id']
+    patient_id = session['patient_id']
+    file_key = session['file_key']
+    
+    await get_document_storage().update_upload_session(upload_id, {"status": "processing"})
+    
+    try:
+        if session['file_type'] == UploadFileType.AUDIO.value:
+            result = await process_audio(patient_id, file_key)
+        elif session['file_type'] == UploadFileType.IMAGE.value:
+            result = await process_prescription_image(patient_id, file_key)
+        else:
+            patient = await get_storage().get_patient(patient_id)
+            batch_id = await get_or_create_batch(patient, session.get('batch_id'))
+            result = await process_document(patient_id, batch_id, session['document_id'], file_key)
+        
+        await get_document_storage().update_upload_session(upload_id, {
+            "status": "completed",
+            "result": result,
+            "processed_at": utc_now()
+        })
+    except Exception as e:
+        print(f"❌ Direct upload processing failed ({upload_id}): {e}")
+        await get_document_storage().update_upload_session(upload_id, {
+            "status": "failed",
+            "error": str(e),
+            "processed_at": utc_now()
+        })
+
+
 @router.post("/test-audio", response_model=dict)
 async def test_audio_transcription(file: UploadFile = File(...)):
     """
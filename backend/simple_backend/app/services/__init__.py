@@ -1,6 +1,5 @@
 """
 Services package
 """
-from .storage_service import storage
 from .mongodb_storage import mongodb_storage
 from .ai_service import transcribe_audio, generate_soap_note, extract_prescription
@@ -0,0 +1,354 @@
+"""
+Pluggable blob storage for uploaded media (audio, prescription images, documents)
+
+Backends:
+- local: files under UPLOADS_DIR, presigned URLs are HMAC-signed /media URLs
+- s3:    objects in BLOB_BUCKET, presigned URLs are native S3 URLs
+
+Select with BLOB_STORE=local|s3
+
+Keys under a signed-download prefix (bulk exports) are served by /media only
+with a valid presign_download() signature; other media keeps plain /media URLs.
+"""
+
+import abc
+import asyncio
+import hashlib
+import hmac
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncContextManager, AsyncIterator, Dict, Optional
+from urllib.parse import urlencode
+
+
+CONTENT_TYPES = {
+    'mp3': 'audio/mpeg',
+    'm4a': 'audio/mp4',
+    'mp4': 'audio/mp4',
+    'wav': 'audio/wav',
+    'ogg': 'audio/ogg',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'pdf': 'application/pdf',
+    'json': 'application/json',
+    'ndjson': 'application/fhir+ndjson',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+
+# Key prefixes /media serves only through signed download URLs
+_signed_download_prefixes = {"exports/"}
+
+
+def require_signed_downloads(prefix: str):
+    """Serve keys under `prefix` only with a valid, unexpired download signature"""
+    _signed_download_prefixes.add(prefix.strip('/') + '/')
+
+
+def get_content_type(key: str) -> str:
+    """Get MIME type based on the key's file extension"""
+    extension = key.rsplit('.', 1)[-1].lower() if '.' in key else ''
+    return CONTENT_TYPES.get(extension, 'application/octet-stream')
+
+
+class BlobStore(abc.ABC):
+    """Common interface for blob storage backends (a backend missing a method fails to instantiate)"""
+
+    name = "base"
+
+    @abc.abstractmethod
+    async def put(self, key: str, data: bytes, content_type: Optional[str] = None):
+        """Store bytes under key"""
+
+    async def put_file(self, key: str, path: str, content_type: Optional[str] = None):
+        """Store a local file under key (streamed where the backend allows it)"""
+        with open(path, "rb") as f:
+            data = await asyncio.to_thread(f.read)
+        await self.put(key, data, content_type)
+
+    @abc.abstractmethod
+    async def exists(self, key: str) -> bool:
+        """Check whether a blob exists"""
+
+    @abc.abstractmethod
+    async def delete(self, key: str):
+        """Delete a blob (no error if missing)"""
+
+    @abc.abstractmethod
+    def local_path(self, key: str) -> AsyncContextManager[str]:
+        """Async context manager yielding a local filesystem path holding the blob's bytes"""
+
+    @abc.abstractmethod
+    async def stat(self, key: str) -> Optional[Dict]:
+        """Return {size, etag, mtime, content_type} or None if missing"""
+
+    @abc.abstractmethod
+    def presign_upload(self, key: str, content_type: str, expires_in: int = 300) -> Dict:
+        """Return {url, method, headers} a client can use to upload directly"""
+
+    @abc.abstractmethod
+    def presign_download(self, key: str, expires_in: int = 3600) -> str:
+        """Return a URL a client can use to download directly"""
+
+
+class LocalBlobStore(BlobStore):
+    """Filesystem-backed blob store (single box / docker-compose deployments)"""
+
+    name = "local"
+
+    def __init__(self, root_dir: str, signing_secret: str, public_base_url: str = ""):
+        self.root_dir = root_dir
+        self.signing_secret = signing_secret.encode()
+        self.public_base_url = public_base_url.rstrip('/')
+        # (key, size, mtime_ns) -> sha256, so each file is hashed at most once
+        self._hash_cache = OrderedDict()
+        self._hash_cache_size = 4096
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def path_for(self, key: str) -> str:
+        """Resolve key to a path inside root_dir (rejects path traversal)"""
+        path = os.path.realpath(os.path.join(self.root_dir, key))
+        if not path.startswith(os.path.realpath(self.root_dir) + os.sep):
+            raise ValueError(f"Invalid blob key: {key}")
+        return path
+
+    async def put(self, key: str, data: bytes, content_type: Optional[str] = None):
+        path = self.path_for(key)
+        await asyncio.to_thread(self._write_atomic, path, data)
+        self.remember_hash(key, hashlib.sha256(data).hexdigest())
+
+    async def put_file(self, key: str, path: str, content_type: Optional[str] = None):
+        await asyncio.to_thread(self._copy_atomic, path, self.path_for(key))
+
+    def _copy_atomic(self, source: str, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".upload_")
+        os.close(fd)
+        try:
+            shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _write_atomic(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".upload_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    async def exists(self, key: str) -> bool:
+        return os.path.isfile(self.path_for(key))
+
+    async def delete(self, key: str):
+        try:
+            os.remove(self.path_for(key))
+        except FileNotFoundError:
+            pass
+
+    @asynccontextmanager
+    async def local_path(self, key: str) -> AsyncIterator[str]:
+        yield self.path_for(key)
+
+    async def stat(self, key: str) -> Optional[Dict]:
+        try:
+            st = os.stat(self.path_for(key))
+        except FileNotFoundError:
+            return None
+
+        cache_key = (key, st.st_size, st.st_mtime_ns)
+        digest = self._hash_cache.get(cache_key)
+        if digest is None:
+            digest = await asyncio.to_thread(self._hash_file, self.path_for(key))
+            self._cache_hash(cache_key, digest)
+        else:
+            self._hash_cache.move_to_end(cache_key)
+
+        return {
+            "size": st.st_size,
+            "etag": digest,
+            "mtime": st.st_mtime,
+            "content_type": get_content_type(key)
+        }
+
+    def remember_hash(self, key: str, digest: str):
+        """Record the content hash of a blob that was just written"""
+        try:
+            st = os.stat(self.path_for(key))
+        except FileNotFoundError:
+            return
+        self._cache_hash((key, st.st_size, st.st_mtime_ns), digest)
+
+    def _cache_hash(self, cache_key, digest: str):
+        self._hash_cache[cache_key] = digest
+        if len(self._hash_cache) > self._hash_cache_size:
+            self._hash_cache.popitem(last=False)
+
+    @staticmethod
+    def _hash_file(path: str) -> str:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    # ==================== SIGNED URLS ====================
+
+    def sign(self, method: str, key: str, expires: int) -> str:
+        """HMAC signature over method, key and expiry"""
+        message = f"{method.upper()}\n{key}\n{expires}".encode()
+        return hmac.new(self.signing_secret, message, hashlib.sha256).hexdigest()
+
+    def verify(self, method: str, key: str, expires: int, signature: str) -> bool:
+        """Check a signed URL has not expired or been tampered with"""
+        if expires < int(time.time()):
+            return False
+        return hmac.compare_digest(self.sign(method, key, expires), signature)
+
+    def requires_signature(self, key: str) -> bool:
+        """Is key (after resolving "..") under a signed-download prefix?"""
+        relative = os.path.relpath(self.path_for(key), os.path.realpath(self.root_dir)).replace(os.sep, '/')
+        return any(relative.startswith(prefix) for prefix in _signed_download_prefixes)
+
+    def presign_upload(self, key: str, content_type: str, expires_in: int = 300) -> Dict:
+        expires = int(time.time()) + expires_in
+        query = urlencode({"expires": expires, "signature": self.sign("PUT", key, expires)})
+        return {
+            "url": f"{self.public_base_url}/media/{key}?{query}",
+            "method": "PUT",
+            "headers": {"Content-Type": content_type}
+        }
+
+    def presign_download(self, key: str, expires_in: int = 3600) -> str:
+        expires = int(time.time()) + expires_in
+        query = urlencode({"expires": expires, "signature": self.sign("GET", key, expires)})
+        return f"{self.public_base_url}/media/{key}?{query}"
+
+
+class S3BlobStore(BlobStore):
+    """S3-backed blob store (same buckets the Lambda pipeline uses)"""
+
+    name = "s3"
+
+    def __init__(self, bucket: str, region: str):
+        import boto3  # Optional dependency, only needed for BLOB_STORE=s3
+
+        self.bucket = bucket
+        self.s3_client = boto3.client(
+            's3',
+            region_name=region,
+            config=boto3.session.Config(
+                signature_version='s3v4',
+                s3={'addressing_style': 'virtual'}
+            )
+        )
+
+    async def put(self, key: str, data: bytes, content_type: Optional[str] = None):
+        await asyncio.to_thread(
+            self.s3_client.put_object,
+            Bucket=self.bucket,
+            Key=key,
+            Body=data,
+            ContentType=content_type or get_content_type(key)
+        )
+
+    async def put_file(self, key: str, path: str, content_type: Optional[str] = None):
+        # upload_file switches to multipart for large files instead of reading them into memory
+        await asyncio.to_thread(
+            self.s3_client.upload_file,
+            path,
+            self.bucket,
+            key,
+            ExtraArgs={'ContentType': content_type or get_content_type(key)}
+        )
+
+    async def exists(self, key: str) -> bool:
+        try:
+            await asyncio.to_thread(self.s3_client.head_object, Bucket=self.bucket, Key=key)
+            return True
+        except self.s3_client.exceptions.ClientError:
+            return False
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self.s3_client.delete_object, Bucket=self.bucket, Key=key)
+
+    @asynccontextmanager
+    async def local_path(self, key: str) -> AsyncIterator[str]:
+        tmp_dir = tempfile.mkdtemp(prefix="blob_")
+        path = os.path.join(tmp_dir, os.path.basename(key))
+        try:
+            await asyncio.to_thread(self.s3_client.download_file, self.bucket, key, path)
+            yield path
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    async def stat(self, key: str) -> Optional[Dict]:
+        try:
+            head = await asyncio.to_thread(self.s3_client.head_object, Bucket=self.bucket, Key=key)
+        except self.s3_client.exceptions.ClientError:
+            return None
+        return {
+            "size": head['ContentLength'],
+            "etag": head['ETag'].strip('"'),
+            "mtime": head['LastModified'].timestamp(),
+            "content_type": head.get('ContentType') or get_content_type(key)
+        }
+
+    def presign_upload(self, key: str, content_type: str, expires_in: int = 300) -> Dict:
+        url = self.s3_client.generate_presigned_url(
+            'put_object',
+            Params={'Bucket': self.bucket, 'Key': key, 'ContentType': content_type},
+            ExpiresIn=expires_in,
+            HttpMethod='PUT'
+        )
+        return {
+            "url": url,
+            "method": "PUT",
+            "headers": {"Content-Type": content_type}
+        }
+
+    def presign_download(self, key: str, expires_in: int = 3600) -> str:
+        return self.s3_client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': key},
+            ExpiresIn=expires_in
+        )
+
+
+def create_blob_store() -> BlobStore:
+    """Build the blob store selected by BLOB_STORE"""
+    backend = os.environ.get('BLOB_STORE', 'local').lower()
+
+    if backend == 's3':
+        return S3BlobStore(
+            bucket=os.environ.get('BLOB_BUCKET', 'phc-media-uploads'),
+            region=os.environ.get('AWS_REGION', 'eu-north-1')
+        )
+
+    signing_secret = os.environ.get('BLOB_SIGNING_SECRET')
+    if not signing_secret:
+        # Per-process secret: fine for a single worker, set BLOB_SIGNING_SECRET for more
+        signing_secret = os.urandom(32).hex()
+
+    return LocalBlobStore(
+        root_dir=os.environ.get('UPLOADS_DIR', '/app/data/uploads'),
+        signing_secret=signing_secret,
+        public_base_url=os.environ.get('PUBLIC_BASE_URL', '')
+    )
+
+
+# Singleton instance
+blob_store = create_blob_store()
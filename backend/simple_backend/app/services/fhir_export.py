@@ -0,0 +1,370 @@
+"""
+FHIR Bulk Data export ($export)
+
+Maps patients, SOAP notes and prescriptions to FHIR R4 resources and
+writes them as NDJSON files (one resource per line) on the blob store:
+
+    <FHIR_EXPORT_PREFIX>/<job id>/<resource type>-<n>.ndjson
+
+- Patient:           one per patient (identifiers: patient_id, UHID)
+- Composition:       one per SOAP note, one section per SOAP part
+- MedicationRequest: one per medication on a prescription (history) or in
+                     a SOAP note; grouped by groupIdentifier
+
+Jobs run in the background and read the storage change feeds page by page,
+so memory stays flat however large the export. `_since` narrows the feeds
+to records updated after it. Clients poll the job status and get a
+manifest of file URLs (presigned on S3) when it completes.
+"""
+
+import asyncio
+import html
+import json
+import os
+import re
+import tempfile
+import uuid
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from app.services.blob_store import blob_store, require_signed_downloads
+from app.services.pagination import DEFAULT_CHANGES_PAGE_SIZE
+from app.services.storage_backend import get_storage, get_document_storage
+from app.services.timestamps import utc_now, to_iso
+
+
+FHIR_EXPORT_PREFIX = os.environ.get('FHIR_EXPORT_PREFIX', 'exports/fhir').strip('/')
+FHIR_EXPORT_LAG = int(os.environ.get('FHIR_EXPORT_LAG', '60'))
+FHIR_EXPORT_RESOURCES_PER_FILE = int(os.environ.get('FHIR_EXPORT_RESOURCES_PER_FILE', '100000'))
+FHIR_EXPORT_URL_EXPIRY = int(os.environ.get('FHIR_EXPORT_URL_EXPIRY', '3600'))
+FHIR_SYSTEM = os.environ.get('FHIR_IDENTIFIER_SYSTEM', 'urn:phc').rstrip(':/')
+FHIR_AUTHOR = os.environ.get('FHIR_AUTHOR', 'PHC AI Co-Pilot')
+
+# Output files hold PHI: /media serves them only via the manifest's signed URLs
+require_signed_downloads(FHIR_EXPORT_PREFIX)
+
+NDJSON_FORMATS = ("application/fhir+ndjson", "application/ndjson", "ndjson")
+
+
+class ExportCancelled(Exception):
+    """The job was cancelled (DELETE on its status URL) while running"""
+    pass
+
+
+# ==================== RESOURCES ====================
+
+def fhir_id(*parts) -> str:
+    """FHIR ids allow [A-Za-z0-9-.] up to 64 chars (PAT_0001 -> PAT-0001)"""
+    return re.sub(r'[^A-Za-z0-9\-.]', '-', '-'.join(str(part) for part in parts))[:64]
+
+
+def fhir_instant(value) -> Optional[str]:
+    """Stored timestamp -> FHIR instant (UTC, with offset)"""
+    try:
+        return to_iso(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_since(value: str) -> str:
+    """_since (FHIR instant) -> canonical timestamp text (raises ValueError)"""
+    # A "+" in the offset arrives as a space when the client did not URL-encode it
+    return to_iso(value.strip().replace(' ', '+'))
+
+
+def _identifier(kind: str, value) -> Dict:
+    return {"system": f"{FHIR_SYSTEM}:{kind}", "value": str(value)}
+
+
+def _meta(record: Dict) -> Dict:
+    updated = fhir_instant(record.get('updated_at') or record.get('created_at'))
+    return {"lastUpdated": updated} if updated else {}
+
+
+def _plain_text(value) -> str:
+    if isinstance(value, dict):
+        return "; ".join(f"{key}: {_plain_text(item)}" for key, item in value.items() if item not in (None, "", []))
+    if isinstance(value, list):
+        return "; ".join(_plain_text(item) for item in value)
+    return str(value)
+
+
+def _narrative(value) -> Dict:
+    return {"status": "generated", "div": f'<div xmlns="http://www.w3.org/1999/xhtml">{html.escape(_plain_text(value))}</div>'}
+
+
+def _gender(value) -> str:
+    gender = str(value or '').strip().lower()
+    return {"m": "male", "male": "male", "f": "female", "female": "female", "o": "other", "other": "other"}.get(gender, "unknown")
+
+
+def patient_resources(patient: Dict) -> List[Dict]:
+    patient_id = patient['patient_id']
+    resource = {
+        "resourceType": "Patient",
+        "id": fhir_id(patient_id),
+        "meta": _meta(patient),
+        "identifier": [_identifier("patient_id", patient_id)],
+        "active": patient.get('status', 'active') == 'active',
+        "gender": _gender(patient.get('gender'))
+    }
+    if patient.get('uhid'):
+        resource["identifier"].append(_identifier("uhid", patient['uhid']))
+    if patient.get('name'):
+        resource["name"] = [{"text": str(patient['name'])}]
+    if patient.get('phone'):
+        resource["telecom"] = [{"system": "phone", "value": str(patient['phone'])}]
+    return [resource]
+
+
+# SOAP part -> (section title, LOINC code)
+SOAP_SECTIONS = [
+    ("chief_complaint", "Chief complaint", "10154-3"),
+    ("subjective", "Subjective", "61150-9"),
+    ("objective", "Objective", "61149-1"),
+    ("assessment", "Assessment", "51848-0"),
+    ("plan", "Plan of care", "18776-5"),
+    ("medications", "Medications", "57828-6")
+]
+
+
+def composition_resources(note: Dict) -> List[Dict]:
+    soap = note.get('soap_note') or {}
+    sections = []
+    for field, title, code in SOAP_SECTIONS:
+        if soap.get(field) not in (None, "", [], {}):
+            sections.append({
+                "title": title,
+                "code": {"coding": [{"system": "http://loinc.org", "code": code, "display": title}]},
+                "text": _narrative(soap[field])
+            })
+    return [{
+        "resourceType": "Composition",
+        "id": fhir_id(note['note_id']),
+        "meta": _meta(note),
+        "identifier": _identifier("note_id", note['note_id']),
+        "status": "final",
+        "type": {"coding": [{"system": "http://loinc.org", "code": "11506-3", "display": "Progress note"}], "text": "SOAP note"},
+        "subject": {"reference": f"Patient/{fhir_id(note['patient_id'])}"},
+        "date": fhir_instant(note.get('created_at') or note.get('updated_at')),
+        "author": [{"display": FHIR_AUTHOR}],
+        "title": "SOAP note",
+        "section": sections
+    }]
+
+
+def _medication_request(record: Dict, kind: str, record_id: str, position: int, medication) -> Dict:
+    medication = medication if isinstance(medication, dict) else {"name": medication}
+    resource = {
+        "resourceType": "MedicationRequest",
+        "id": fhir_id(record_id, position),
+        "meta": _meta(record),
+        "identifier": [_identifier(f"{kind}_medication", f"{record_id}/{position}")],
+        "groupIdentifier": _identifier(kind, record_id),
+        "status": "unknown",
+        "intent": "order",
+        "medicationCodeableConcept": {"text": _plain_text(medication.get('name') or medication)},
+        "subject": {"reference": f"Patient/{fhir_id(record['patient_id'])}"},
+        "authoredOn": fhir_instant(record.get('created_at'))
+    }
+    dosage = ", ".join(str(medication[field]) for field in ("dosage", "frequency", "duration") if medication.get(field))
+    if dosage:
+        resource["dosageInstruction"] = [{"text": dosage}]
+    return resource
+
+
+def prescription_resources(entry: Dict) -> List[Dict]:
+    prescription = entry.get('prescription_data') or {}
+    medications = prescription.get('medications') or []
+    resources = []
+    for position, medication in enumerate(medications if isinstance(medications, list) else [medications]):
+        resource = _medication_request(entry, "history_id", entry['history_id'], position, medication)
+        if prescription.get('doctor_name'):
+            resource["requester"] = {"display": str(prescription['doctor_name'])}
+        if prescription.get('diagnosis'):
+            resource["reasonCode"] = [{"text": _plain_text(prescription['diagnosis'])}]
+        resources.append(resource)
+    return resources
+
+
+def note_medication_resources(note: Dict) -> List[Dict]:
+    medications = (note.get('soap_note') or {}).get('medications') or []
+    resources = []
+    for position, medication in enumerate(medications if isinstance(medications, list) else [medications]):
+        resource = _medication_request(note, "note_id", note['note_id'], position, medication)
+        resource["supportingInformation"] = [{"reference": f"Composition/{fhir_id(note['note_id'])}"}]
+        resources.append(resource)
+    return resources
+
+
+# resource type -> [(change feed, resources(record))]
+FHIR_RESOURCE_FEEDS = {
+    "Patient": [("patients", patient_resources)],
+    "Composition": [("notes", composition_resources)],
+    "MedicationRequest": [("history", prescription_resources), ("notes", note_medication_resources)]
+}
+
+
+# ==================== NDJSON FILES ====================
+
+class NdjsonPartWriter:
+    """Appends resources to a temp file and rolls part files onto the blob store"""
+
+    def __init__(self, blob, prefix: str, resource_type: str, resources_per_file: Optional[int] = None):
+        self.blob = blob
+        self.prefix = prefix
+        self.resource_type = resource_type
+        self.resources_per_file = resources_per_file or FHIR_EXPORT_RESOURCES_PER_FILE
+        self.files: List[Dict] = []
+        self._file = None
+        self._path: Optional[str] = None
+        self._count = 0
+
+    async def write(self, resources: List[Dict]):
+        while resources:
+            if self._file is None:
+                fd, self._path = tempfile.mkstemp(prefix="fhir_", suffix=".ndjson")
+                self._file = os.fdopen(fd, "w", encoding="utf-8")
+            room = self.resources_per_file - self._count
+            chunk, resources = resources[:room], resources[room:]
+            lines = "".join(json.dumps(resource, ensure_ascii=False, separators=(',', ':')) + "\n" for resource in chunk)
+            await asyncio.to_thread(self._file.write, lines)
+            self._count += len(chunk)
+            if self._count >= self.resources_per_file:
+                await self._finish_file()
+
+    async def _finish_file(self):
+        self._file.close()
+        key = f"{self.prefix}/{self.resource_type}-{len(self.files) + 1:03d}.ndjson"
+        try:
+            await self.blob.put_file(key, self._path, "application/fhir+ndjson")
+        finally:
+            os.remove(self._path)
+        self.files.append({"type": self.resource_type, "key": key, "count": self._count})
+        self._file, self._path, self._count = None, None, 0
+
+    async def close(self) -> List[Dict]:
+        """Upload the last file -> [{type, key, count}]"""
+        if self._file is not None and self._count:
+            await self._finish_file()
+        self.abort()
+        return self.files
+
+    def abort(self):
+        """Drop the unfinished file"""
+        if self._file is not None:
+            self._file.close()
+            os.remove(self._path)
+            self._file, self._path, self._count = None, None, 0
+
+
+# ==================== JOBS ====================
+
+def new_export_job(types: Optional[List[str]], since: Optional[str], request_url: str) -> Dict:
+    """Job record for a kick-off request (raises ValueError on unsupported types)"""
+    types = types or list(FHIR_RESOURCE_FEEDS)
+    unknown = [name for name in types if name not in FHIR_RESOURCE_FEEDS]
+    if unknown:
+        raise ValueError(f"Unsupported _type: {', '.join(unknown)} (supported: {', '.join(FHIR_RESOURCE_FEEDS)})")
+    # Resources changed in the last FHIR_EXPORT_LAG seconds are left for the next export
+    until = to_iso(utc_now() - timedelta(seconds=FHIR_EXPORT_LAG))
+    return {
+        "job_id": f"EXP_{uuid.uuid4().hex.upper()}",
+        "status": "accepted",
+        "request": request_url,
+        "types": types,
+        "since": since,
+        "until": until,
+        "transaction_time": until,
+        "created_at": utc_now(),
+        "progress": 0,
+        "output": [],
+        "error": None
+    }
+
+
+async def run_export_job(job_id: str, storage=None, document_storage=None, blob=None):
+    """Background job: write every requested resource type, then mark the job completed"""
+    storage = storage or get_storage()
+    document_storage = document_storage or get_document_storage()
+    blob = blob or blob_store
+
+    job = await document_storage.get_export_job(job_id)
+    if not job or job['status'] != "accepted":
+        return
+    await document_storage.update_export_job(job_id, {"status": "in-progress", "started_at": utc_now()})
+
+    output, progress = [], 0
+    try:
+        for resource_type in job['types']:
+            writer = NdjsonPartWriter(blob, f"{FHIR_EXPORT_PREFIX}/{job_id}", resource_type)
+            try:
+                for feed, to_resources in FHIR_RESOURCE_FEEDS[resource_type]:
+                    after = None
+                    while True:
+                        page, after = await storage.get_changes_page(
+                            feed, job['since'], job['until'], DEFAULT_CHANGES_PAGE_SIZE, after
+                        )
+                        await writer.write([resource for record in page for resource in to_resources(record)])
+                        progress += len(page)
+                        current = await document_storage.get_export_job(job_id)
+                        if current is None or current['status'] == "cancelled":
+                            raise ExportCancelled()
+                        await document_storage.update_export_job(job_id, {"progress": progress})
+                        if after is None:
+                            break
+                output.extend(await writer.close())
+            except BaseException:
+                writer.abort()
+                output.extend(writer.files)
+                raise
+
+        # Conditional: a cancel landing after the last check must not be overwritten
+        if not await document_storage.finish_export_job(job_id, {
+            "status": "completed",
+            "output": output,
+            "completed_at": utc_now()
+        }):
+            raise ExportCancelled()
+        print(f"🔥 FHIR export {job_id}: {sum(f['count'] for f in output):,} resources in {len(output)} file(s)")
+    except ExportCancelled:
+        await delete_export_files(output, blob)
+        print(f"🛑 FHIR export {job_id} cancelled")
+    except Exception as e:
+        print(f"❌ FHIR export failed ({job_id}): {e}")
+        await delete_export_files(output, blob)
+        await document_storage.finish_export_job(job_id, {
+            "status": "failed",
+            "error": str(e),
+            "completed_at": utc_now()
+        })
+
+
+async def delete_export_files(files: List[Dict], blob=None):
+    blob = blob or blob_store
+    for file in files:
+        await blob.delete(file['key'])
+
+
+def export_manifest(job: Dict, base_url: str) -> Dict:
+    """Bulk Data completion manifest with download URLs for the output files"""
+    def absolute(url: str) -> str:
+        return f"{base_url.rstrip('/')}{url}" if url.startswith('/') else url
+
+    return {
+        "transactionTime": job['transaction_time'],
+        "request": job['request'],
+        "requiresAccessToken": False,
+        "output": [
+            {"type": file['type'], "url": absolute(blob_store.presign_download(file['key'], FHIR_EXPORT_URL_EXPIRY)), "count": file['count']}
+            for file in job['output']
+        ],
+        "error": []
+    }
+
+
+def operation_outcome(severity: str, code: str, message: str) -> Dict:
+    return {
+        "resourceType": "OperationOutcome",
+        "issue": [{"severity": severity, "code": code, "diagnostics": message}]
+    }
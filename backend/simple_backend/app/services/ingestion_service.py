@@ -0,0 +1,157 @@
+"""
+Media ingestion pipeline shared by multipart uploads and direct-to-storage uploads
+
+Each function takes a blob key that already exists in the blob store and
+runs the AI processing + persistence step for it.
+"""
+
+import asyncio
+import uuid
+from typing import Dict, Optional
+
+from app.services.ai_service import transcribe_audio, generate_soap_note, extract_prescription
+from app.services.blob_store import blob_store
+from app.services.storage_backend import get_storage, get_document_storage
+from app.services.thumbnail_service import generate_thumbnails, media_url
+from app.services.timestamps import utc_now
+
+
+class ProcessingError(Exception):
+    """Raised when an uploaded file cannot be processed"""
+    pass
+
+
+async def process_audio(patient_id: str, audio_filename: str) -> Dict:
+    """Transcribe audio, generate a SOAP note and save it to the patient's notes"""
+    async with blob_store.local_path(audio_filename) as audio_path:
+        transcript = await transcribe_audio(audio_path)
+
+    if transcript.startswith("[Transcription failed"):
+        raise ProcessingError("Transcription failed")
+
+    soap_note = await generate_soap_note(transcript)
+
+    note_id = f"NOTE_{uuid.uuid4().hex[:8].upper()}"
+    note_data = {
+        "note_id": note_id,
+        "patient_id": patient_id,
+        "created_at": utc_now(),
+        "audio_file": audio_filename,
+        "transcript": transcript,
+        "soap_note": soap_note
+    }
+
+    await get_storage().add_note(patient_id, note_data)
+
+    print(f"✅ SOAP note created: {note_id}")
+
+    return {
+        "note_id": note_id,
+        "transcript": transcript,
+        "soap_note": soap_note,
+        "audio_file": audio_filename
+    }
+
+
+async def process_prescription_image(patient_id: str, image_filename: str) -> Dict:
+    """Extract prescription details and save them to the patient's history"""
+    async with blob_store.local_path(image_filename) as image_path:
+        prescription_data = await extract_prescription(image_path)
+
+    history_id = f"HIST_{uuid.uuid4().hex[:8].upper()}"
+    history_entry = {
+        "history_id": history_id,
+        "patient_id": patient_id,
+        "created_at": utc_now(),
+        "image_file": image_filename,
+        "prescription_data": prescription_data,
+        "type": "prescription"
+    }
+
+    await get_storage().add_history(patient_id, history_entry)
+
+    print(f"✅ Prescription extracted: {history_id}")
+
+    return {
+        "history_id": history_id,
+        "prescription_data": prescription_data,
+        "image_file": image_filename
+    }
+
+
+async def get_or_create_batch(patient: Dict, batch_id: Optional[str] = None) -> str:
+    """Return batch_id, falling back to the patient's active batch or a new one"""
+    if batch_id:
+        return batch_id
+
+    existing_batch = await get_document_storage().get_active_batch(patient['patient_id'])
+    if existing_batch:
+        return existing_batch['batch_id']
+
+    batch_id = f"BATCH_{uuid.uuid4().hex[:8].upper()}"
+    batch_data = {
+        "batch_id": batch_id,
+        "patient_id": patient['patient_id'],
+        "patient_name": patient['name'],
+        "document_ids": [],
+        "status": "pending",
+        "created_at": utc_now()
+    }
+    await get_document_storage().create_batch(batch_data)
+    print(f"🆕 Created new batch: {batch_id}")
+    return batch_id
+
+
+async def process_document(patient_id: str, batch_id: str, document_id: str, image_filename: str) -> Dict:
+    """Record a scanned document in its batch and extract its prescription data"""
+    document_data = {
+        "document_id": document_id,
+        "patient_id": patient_id,
+        "batch_id": batch_id,
+        "image_file": image_filename,
+        "image_url": media_url(image_filename),
+        "status": "processing",
+        "uploaded_at": utc_now(),
+        "extracted_data": None
+    }
+
+    await get_document_storage().save_document(document_data)
+    await get_document_storage().add_document_to_batch(batch_id, document_id)
+
+    # OCR and thumbnail rendering are independent - run them side by side
+    prescription_data, thumbnails = await asyncio.gather(
+        _extract_document(document_id, image_filename),
+        _generate_document_thumbnails(document_id, image_filename)
+    )
+
+    return {
+        "document_id": document_id,
+        "batch_id": batch_id,
+        "extracted_data": prescription_data,
+        **thumbnails
+    }
+
+
+async def _extract_document(document_id: str, image_filename: str) -> Dict:
+    try:
+        async with blob_store.local_path(image_filename) as image_path:
+            prescription_data = await extract_prescription(image_path)
+        await get_document_storage().update_document_status(document_id, "completed", prescription_data)
+        print(f"✅ Document processed: {document_id}")
+    except Exception as e:
+        await get_document_storage().update_document_status(document_id, "failed")
+        print(f"❌ Document processing failed: {e}")
+        prescription_data = {"error": str(e)}
+    return prescription_data
+
+
+async def _generate_document_thumbnails(document_id: str, image_filename: str) -> Dict:
+    # A missing thumbnail must never fail the upload - the dashboard falls back to image_url
+    try:
+        thumbnails = await generate_thumbnails(image_filename)
+    except Exception as e:
+        print(f"⚠️ Thumbnail generation failed for {document_id}: {e}")
+        return {}
+    if thumbnails:
+        await get_document_storage().update_document(document_id, thumbnails)
+    return thumbnails
@@ -0,0 +1,147 @@
+"""
+Media serving helpers: HTTP Range parsing, conditional requests and a
+file response that uses zero-copy sendfile when the ASGI server supports it
+"""
+
+from typing import Dict, Optional, Tuple
+
+import anyio
+from starlette.background import BackgroundTask
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+
+CHUNK_SIZE = 256 * 1024
+CACHE_CONTROL = "private, max-age=31536000, immutable"  # Blob keys are never reused
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a Range header cannot be served for the file size"""
+    pass
+
+
+def parse_range_header(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range `Range: bytes=...` header
+
+    Returns an inclusive (start, end) tuple, or None to serve the whole file
+    (no header, unsupported unit or multiple ranges).
+    Raises RangeNotSatisfiable if the range lies outside the file.
+    """
+    if not range_header:
+        return None
+
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+
+    start_str, _, end_str = ranges.strip().partition("-")
+    try:
+        if start_str == "":
+            # Suffix range: last N bytes
+            suffix = int(end_str)
+            if suffix <= 0:
+                raise RangeNotSatisfiable()
+            start, end = max(size - suffix, 0), size - 1
+        else:
+            start = int(start_str)
+            end = int(end_str) if end_str else size - 1
+    except ValueError:
+        return None
+
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+
+    return start, min(end, size - 1)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against a strong ETag"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or f'"{etag}"' in candidates or f'W/"{etag}"' in candidates
+
+
+def media_headers(info: Dict) -> Dict[str, str]:
+    """Validator and caching headers shared by 200/206/304 responses"""
+    return {
+        "etag": f'"{info["etag"]}"',
+        "accept-ranges": "bytes",
+        "cache-control": CACHE_CONTROL
+    }
+
+
+class RangeFileResponse(Response):
+    """
+    Stream a byte range of a file
+
+    Uses the ASGI `http.response.zerocopysend` extension (sendfile) when the
+    server offers it, otherwise reads the file in chunks on a worker thread.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        start: int,
+        end: int,
+        status_code: int = 200,
+        headers: Optional[Dict[str, str]] = None,
+        media_type: Optional[str] = None,
+        background: Optional[BackgroundTask] = None,
+    ):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = background
+        self.init_headers(headers)
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif "http.response.zerocopysend" in scope.get("extensions", {}):
+            await self._send_zerocopy(send)
+        else:
+            await self._send_chunks(send)
+
+        if self.background is not None:
+            await self.background()
+
+    async def _send_zerocopy(self, send: Send):
+        with open(self.path, "rb") as f:
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": f,
+                "offset": self.start,
+                "count": self.end - self.start + 1,
+                "more_body": False,
+            })
+
+    async def _send_chunks(self, send: Send):
+        remaining = self.end - self.start + 1
+        more_body = True
+        async with await anyio.open_file(self.path, mode="rb") as f:
+            await f.seek(self.start)
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                more_body = remaining > 0
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": more_body,
+                })
+        if more_body:
+            # Empty file, or the file shrank while streaming
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
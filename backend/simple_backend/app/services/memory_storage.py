@@ -0,0 +1,685 @@
+"""
+Async storage backend over the in-memory StorageService
+
+Implements PatientStorage and DocumentStorage on top of StorageService's
+indexed in-memory store:
+
+- STORAGE_BACKEND=json:    the journaled store in JSON_STORAGE_DIR (survives restarts)
+- STORAGE_BACKEND=memory:  nothing persisted (demos, tests)
+
+StorageService calls never await, so each method below runs atomically on
+the event loop (e.g. the one-active-entry check in add_to_queue).
+"""
+
+import asyncio
+import base64
+import uuid
+from itertools import islice
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.services.mongodb_storage import FACILITY_ID
+from app.services.pagination import page_items, changes_page_items, in_range, sort_key, DEFAULT_PAGE_SIZE, DEFAULT_CHANGES_PAGE_SIZE
+from app.services.patient_activity import note_activity, history_activity, rebuilt_activity
+from app.services.patient_search import (
+    SEARCH_CANDIDATES, SEARCH_FIELDS, DEFAULT_SEARCH_LIMIT, search_keys, query_plan, rank
+)
+from app.services.projections import apply_projection, set_path, get_path
+from app.services.queue_events import queue_events
+from app.services.report_state import apply_note, apply_history, apply_queue, clear_queue
+from app.services.stats_service import (
+    QUEUE_STATUSES, STATS_COUNTER_PREFIX, PATIENT_STATS_FIELDS, patient_stats_delta, queue_stats_delta,
+    combine_deltas, stats_to_counters, stats_from_counters, counters_drift
+)
+from app.services.storage_protocol import ACTIVE_QUEUE_STATUSES, FINISHED_QUEUE_STATUSES, CHANGE_FEEDS, DuplicateQueueEntry
+from app.services.storage_service import StorageService
+from app.services.text_compression import pack_note_texts, unpack_note_texts
+from app.services.timestamps import utc_now, parse_timestamp, clinic_date, clinic_today, clinic_day_start, upgrade_timestamps
+
+
+def _newest_first(items: List[Dict], sort_field: str, id_field: str) -> List[Dict]:
+    return sorted(items, key=lambda item: (sort_key(item.get(sort_field)), item.get(id_field) or ""), reverse=True)
+
+
+def _arrival_order(entries: List[Dict]) -> List[Dict]:
+    return sorted(entries, key=lambda entry: (sort_key(entry.get('added_at')), entry.get('queue_id') or ""))
+
+
+def _status_counts(entries: List[Dict]) -> Dict:
+    counts = {status: 0 for status in QUEUE_STATUSES}
+    for entry in entries:
+        counts[entry['status']] = counts.get(entry['status'], 0) + 1
+    counts["total"] = len(entries)
+    counts["active"] = counts["total"] - counts["completed"] - counts["cancelled"]
+    return counts
+
+
+def _per_patient_counts(by_patient: Dict[str, List[Dict]]) -> Dict:
+    return {
+        "total": sum(len(entries) for entries in by_patient.values()),
+        "patients": sum(1 for entries in by_patient.values() if entries)
+    }
+
+
+class MemoryStorage:
+    """PatientStorage + DocumentStorage backed by a StorageService"""
+
+    def __init__(self, store: Optional[StorageService] = None):
+        self.store = store if store is not None else StorageService(base_dir=None)
+        # Search index (not journaled: rebuilt from the patients on startup)
+        self._search_postings: Dict[str, Set[str]] = {}
+        self._search_keys: Dict[str, Set[str]] = {}
+        for patient in self.store.patients.values():
+            self._index_patient(patient)
+
+    async def connect(self):
+        print(f"✅ Memory Storage ready ({self.store.base_dir or 'not persisted'})")
+
+    async def disconnect(self):
+        await asyncio.to_thread(self.store.close)
+
+    # ==================== PATIENTS ====================
+
+    async def get_all_patients(self) -> Dict:
+        """Get all patients as dict, newest first"""
+        patients = _newest_first(list(self.store.get_all_patients().values()), "created_at", "patient_id")
+        return {p['patient_id']: p for p in patients}
+
+    async def get_patients_page(self, limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of patients, newest first (keyset on created_at, patient_id)"""
+        return page_items(list(self.store.get_all_patients().values()), "created_at", "patient_id", limit, after)
+
+    async def get_patient(self, patient_id: str) -> Optional[Dict]:
+        """Get single patient by ID"""
+        return self.store.get_patient(patient_id)
+
+    async def get_patient_by_uhid(self, uhid: str) -> Optional[Dict]:
+        """Get patient by UHID (index lookup)"""
+        return self.store.get_patient_by_uhid(uhid)
+
+    async def create_patient(self, patient_id: str, patient_data: Dict) -> Dict:
+        """Create new patient"""
+        patient_data['patient_id'] = patient_id
+        patient_data['created_at'] = patient_data.get('created_at', utc_now())
+        patient_data['updated_at'] = utc_now()
+        upgrade_timestamps(patient_data)
+        self.store.create_patient(patient_id, patient_data)
+        self._index_patient(patient_data)
+        self._bump_stats(patient_stats_delta(patient_data))
+        return patient_data
+
+    async def insert_patients(self, patients: List[Dict]) -> Dict[int, str]:
+        """Insert many patients; returns {index: error} for rejected rows"""
+        failures, deltas = {}, []
+        for index, patient in enumerate(patients):
+            upgrade_timestamps(patient)
+            if patient.get('uhid') and self.store.get_patient_by_uhid(patient['uhid']):
+                failures[index] = "uhid: UHID already registered"
+            elif self.store.get_patient(patient['patient_id']):
+                failures[index] = "patient_id already exists"
+            else:
+                self.store.create_patient(patient['patient_id'], patient)
+                self._index_patient(patient)
+                deltas.append(patient_stats_delta(patient))
+        self._bump_stats(combine_deltas(*deltas))
+        return failures
+
+    async def get_existing_uhids(self, uhids: List[str]) -> set:
+        """Which of these UHIDs are already registered"""
+        return {uhid for uhid in uhids if self.store.get_patient_by_uhid(uhid)}
+
+    async def update_patient(self, patient_id: str, updates: Dict) -> Optional[Dict]:
+        """Update patient data"""
+        updates['updated_at'] = utc_now()
+        patient = self.store.get_patient(patient_id)
+        if patient is None:
+            return None
+        before = {field: patient.get(field) for field in PATIENT_STATS_FIELDS}
+        for path, value in updates.items():
+            set_path(patient, path, value)
+        upgrade_timestamps(patient)
+        self.store.create_patient(patient_id, patient)
+        if any(field in updates for field in PATIENT_STATS_FIELDS):
+            self._bump_stats(combine_deltas(patient_stats_delta(before, -1), patient_stats_delta(patient)))
+        if any(field in updates for field in SEARCH_FIELDS):
+            self._index_patient(patient)
+        return patient
+
+    # ==================== PATIENT SEARCH ====================
+
+    def _index_patient(self, patient: Dict):
+        patient_id = patient['patient_id']
+        for key in self._search_keys.pop(patient_id, []):
+            self._search_postings[key].discard(patient_id)
+        keys = set(search_keys(patient))
+        for key in keys:
+            self._search_postings.setdefault(key, set()).add(patient_id)
+        self._search_keys[patient_id] = keys
+
+    async def search_patients(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> List[Dict]:
+        """Search patients by name (prefix, fuzzy, Hindi/English variants), phone suffix or UHID prefix"""
+        patient_ids: Set[str] = set()
+        for clause in query_plan(query):
+            # Walk the postings of the smallest group, check the others against each patient's keys
+            sizes = [sum(len(self._search_postings.get(key, ())) for key in group) for group in clause]
+            driver = sizes.index(min(sizes))
+            others = [set(group) for i, group in enumerate(clause) if i != driver]
+            matches = (
+                patient_id
+                for key in clause[driver]
+                for patient_id in self._search_postings.get(key, ())
+                if all(self._search_keys[patient_id] & group for group in others)
+            )
+            patient_ids.update(islice(matches, SEARCH_CANDIDATES))
+        candidates = [self.store.get_patient(patient_id) for patient_id in patient_ids]
+        return rank(query, [patient for patient in candidates if patient], limit)
+
+    async def rebuild_search_index(self) -> int:
+        """Rebuild the search index from the stored patients"""
+        self._search_postings, self._search_keys = {}, {}
+        for patient in self.store.patients.values():
+            self._index_patient(patient)
+        return len(self._search_keys)
+
+    # ==================== PATIENT ACTIVITY ====================
+
+    async def rebuild_patient_activity(self) -> int:
+        """Recount visit_count, last_* and prescription_count of every patient from notes and history"""
+        patients = list(self.store.patients.values())
+        for patient in patients:
+            notes = _newest_first(self.store.get_patient_notes(patient['patient_id']), "created_at", "note_id")
+            patient.update(rebuilt_activity(
+                notes[0] if notes else None, len(notes), len(self.store.get_patient_history(patient['patient_id']))
+            ))
+            self.store.create_patient(patient['patient_id'], patient)
+        return len(patients)
+
+    # ==================== QUEUE ====================
+
+    async def get_queue(self) -> List[Dict]:
+        """Get all queue entries (hot queue only)"""
+        return _arrival_order(self.store.get_queue())
+
+    async def get_queue_page(self, limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of the queue in arrival order (keyset on added_at, queue_id)"""
+        return page_items(self.store.get_queue(), "added_at", "queue_id", limit, after, descending=False)
+
+    async def add_to_queue(self, queue_entry: Dict) -> Dict:
+        """Add entry to queue (DuplicateQueueEntry if the patient already has an active one)"""
+        existing = await self.get_active_queue_entry(queue_entry['patient_id'])
+        if existing is not None:
+            raise DuplicateQueueEntry(existing)
+        upgrade_timestamps(queue_entry)
+        self.store.add_to_queue(queue_entry)
+        self._bump_stats(queue_stats_delta(None, queue_entry['status']))
+        self._update_report_state(queue_entry['patient_id'], apply_queue, queue_entry, True)
+        queue_events.entry_added(queue_entry)
+        return queue_entry
+
+    async def get_active_queue_entry(self, patient_id: str) -> Optional[Dict]:
+        """Get a patient's active queue entry, if any"""
+        for entry in self.store.get_patient_queue_entries(patient_id):
+            if entry['status'] in ACTIVE_QUEUE_STATUSES:
+                return entry
+        return None
+
+    async def update_queue_status(self, queue_id: str, status: str, **kwargs) -> Optional[Dict]:
+        """Update queue entry status"""
+        before = self.store.queue.get(queue_id)
+        old_status = before['status'] if before else None
+        upgrade_timestamps(kwargs)
+        result = self.store.update_queue_status(queue_id, status, **kwargs)
+        if result:
+            self._bump_stats(queue_stats_delta(old_status, status))
+            self._update_report_state(result['patient_id'], apply_queue, result)
+            queue_events.status_changed(result)
+        return result
+
+    async def get_queue_by_status(self, status: str) -> List[Dict]:
+        """Get queue entries by status (index lookup)"""
+        return _arrival_order(self.store.get_queue_by_status(status))
+
+    async def get_patient_queue_entry(self, patient_id: str) -> Optional[Dict]:
+        """Get a patient's most recent entry in the hot queue"""
+        entries = _arrival_order(self.store.get_patient_queue_entries(patient_id))
+        return entries[-1] if entries else None
+
+    async def archive_finished_queue(self, before: Optional[str] = None) -> int:
+        """Move completed/cancelled entries from the hot queue to the archive"""
+        before = parse_timestamp(before)
+        entries = [
+            entry
+            for status in FINISHED_QUEUE_STATUSES
+            for entry in self.store.get_queue_by_status(status)
+            if before is None or (entry.get('added_at') is not None and entry['added_at'] < before)
+        ]
+        queue_ids = [entry['queue_id'] for entry in entries]
+        self.store.archive_queue_entries(queue_ids, utc_now())
+        for patient_id in {entry['patient_id'] for entry in entries}:
+            self._update_report_state(patient_id, clear_queue, queue_ids)
+        self._bump_stats(combine_deltas(*(
+            {f"queue.{entry['status']}": -1, f"archive.{entry['status']}": 1} for entry in entries
+        )))
+        if queue_ids:
+            queue_events.entries_removed(queue_ids)
+        return len(queue_ids)
+
+    async def rollover_queue(self) -> int:
+        """Archive finished entries from previous days (keeps today's completed visible)"""
+        return await self.archive_finished_queue(before=clinic_day_start())
+
+    async def next_token_number(self, facility_id: str = FACILITY_ID, day: Optional[str] = None) -> int:
+        """Allocate the next token number for a facility and day"""
+        day = day or clinic_today().isoformat()
+        return self.store.increment_counter(f"token:{facility_id}:{day}")
+
+    async def get_queue_stats(self) -> Dict:
+        """Per-status queue counts (status index sizes)"""
+        counts = {status: 0 for status in QUEUE_STATUSES}
+        counts.update({status: count for status, count in self.store.get_queue_stats().items() if status != "total"})
+        counts["total"] = sum(counts.values())
+        counts["active"] = counts["total"] - counts["completed"] - counts["cancelled"]
+        return counts
+
+    async def get_visit_stats(self, since: Optional[str] = None) -> List[Dict]:
+        """Finished visits per clinic day from the archive (optionally since a YYYY-MM-DD day)"""
+        days: Dict[str, Dict] = {}
+        for entry in self.store.get_queue_archive():
+            visit_date = entry.get('visit_date') or clinic_date(entry.get('added_at')) or ""
+            if since and visit_date < since:
+                continue
+            day = days.setdefault(visit_date, {"date": visit_date, "completed": 0, "cancelled": 0, "total": 0})
+            if entry['status'] in ("completed", "cancelled"):
+                day[entry['status']] += 1
+            day["total"] += 1
+        return sorted(days.values(), key=lambda day: day["date"], reverse=True)
+
+    # ==================== STATS ====================
+    # Materialized counters live in the store as "stats:<field>" counters,
+    # journaled with the rest of the data.
+
+    def _bump_stats(self, delta: Dict[str, int]):
+        self.store.add_to_counters({STATS_COUNTER_PREFIX + field: change for field, change in delta.items()})
+
+    async def get_stats(self) -> Dict:
+        """Patient, queue, archive, notes and history counts (counters only)"""
+        counters = self.store.get_counters(STATS_COUNTER_PREFIX)
+        if not counters:
+            return (await self.reconcile_stats())["stats"]
+        return stats_from_counters({counter_id[len(STATS_COUNTER_PREFIX):]: value for counter_id, value in counters.items()})
+
+    async def reconcile_stats(self) -> Dict:
+        """Recount and overwrite the materialized counters"""
+        stored = {
+            counter_id[len(STATS_COUNTER_PREFIX):]: value
+            for counter_id, value in self.store.get_counters(STATS_COUNTER_PREFIX).items()
+        }
+        stats = await self.count_stats()
+        counters = stats_to_counters(stats)
+        self.store.reset_counters(STATS_COUNTER_PREFIX, {STATS_COUNTER_PREFIX + field: value for field, value in counters.items()})
+        return {
+            "stats": stats,
+            "drift": counters_drift(stored, counters) if stored else {},
+            "reconciled_at": utc_now()
+        }
+
+    async def count_stats(self) -> Dict:
+        """Recount everything from the store"""
+        patients = list(self.store.patients.values())
+        by_gender: Dict[str, int] = {}
+        for patient in patients:
+            gender = patient.get('gender') or "unknown"
+            by_gender[gender] = by_gender.get(gender, 0) + 1
+
+        return {
+            "patients": {
+                "total": len(patients),
+                "active": sum(1 for patient in patients if patient.get('status') == "active"),
+                "by_gender": by_gender
+            },
+            "queue": await self.get_queue_stats(),
+            "archive": _status_counts(list(self.store.queue_archive.values())),
+            "notes": _per_patient_counts(self.store.notes),
+            "history": _per_patient_counts(self.store.history)
+        }
+
+    # ==================== NOTES ====================
+
+    async def get_all_notes(self) -> Dict:
+        """Get all notes organized by patient_id"""
+        return self.store.get_all_notes()
+
+    async def get_patient_notes(self, patient_id: str, projection: Optional[Dict] = None) -> List[Dict]:
+        """Get all notes for a patient, newest first"""
+        notes = _newest_first(self.store.get_patient_notes(patient_id), "created_at", "note_id")
+        return [apply_projection(note, projection) for note in notes]
+
+    async def get_patient_notes_page(self, patient_id: str, limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None, projection: Optional[Dict] = None,
+                                     start=None, end=None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of a patient's notes, newest first (keyset on created_at, note_id; optionally start <= created_at < end)"""
+        notes = in_range(self.store.get_patient_notes(patient_id), "created_at", start, end)
+        notes, next_cursor = page_items(notes, "created_at", "note_id", limit, after)
+        return [apply_projection(note, projection) for note in notes], next_cursor
+
+    async def get_notes_page(self, limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None, projection: Optional[Dict] = None,
+                             start=None, end=None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of all patients' notes, newest first (keyset on created_at, note_id; optionally start <= created_at < end)"""
+        notes = [note for notes in self.store.get_all_notes().values() for note in notes]
+        notes, next_cursor = page_items(in_range(notes, "created_at", start, end), "created_at", "note_id", limit, after)
+        return [apply_projection(note, projection) for note in notes], next_cursor
+
+    async def get_note(self, patient_id: str, note_id: str, projection: Optional[Dict] = None) -> Optional[Dict]:
+        """Get a single note of a patient"""
+        for note in self.store.get_patient_notes(patient_id):
+            if note.get('note_id') == note_id:
+                return apply_projection(note, projection)
+        return None
+
+    async def add_note(self, patient_id: str, note: Dict) -> Dict:
+        """Add note for patient"""
+        note['patient_id'] = patient_id
+        note['created_at'] = note.get('created_at', utc_now())
+        note['updated_at'] = utc_now()
+        if 'note_id' not in note:
+            note['note_id'] = f"NOTE_{uuid.uuid4().hex[:8].upper()}"
+        upgrade_timestamps(note)
+        stored = dict(note)
+        self._put_texts(pack_note_texts(stored))
+        self.store.add_note(patient_id, stored)
+        self._record_activity(patient_id, note_activity, note)
+        self._update_report_state(patient_id, apply_note, note)
+        self._bump_stats({"notes.total": 1, "notes.patients": int(len(self.store.notes.get(patient_id, [])) == 1)})
+        return note
+
+    def _record_activity(self, patient_id: str, activity, *records):
+        """Apply note_activity / history_activity to the patient record"""
+        patient = self.store.get_patient(patient_id)
+        if patient is not None:
+            patient.update(activity(patient, *records))
+            self.store.create_patient(patient_id, patient)
+
+    def _put_texts(self, texts: Optional[Dict]):
+        # The journal is JSON: compressed bytes are kept base64-encoded
+        if texts:
+            texts['data'] = base64.b64encode(texts['data']).decode()
+            self.store.put_record("note_texts", texts['note_id'], texts)
+
+    async def get_note_texts(self, note_ids: List[str]) -> Dict[str, Dict[str, str]]:
+        """Decompressed text fields (transcript) of the given notes -> {note_id: {field: text}}"""
+        texts = {}
+        for note_id in note_ids:
+            record = self.store.get_record("note_texts", note_id)
+            if record:
+                texts[note_id] = unpack_note_texts({"data": base64.b64decode(record['data'])})
+        return texts
+
+    async def compress_note_texts(self, batch_size: int = 500) -> Dict:
+        """Move inline transcripts of older notes into note_texts (idempotent)"""
+        report = {"notes": 0, "raw_bytes": 0, "stored_bytes": 0}
+        for patient_id, notes in self.store.get_all_notes().items():
+            for note in notes:
+                if not isinstance(note.get('transcript'), str) or 'note_id' not in note:
+                    continue
+                texts = pack_note_texts(note)
+                report["notes"] += 1
+                report["raw_bytes"] += texts['raw_size']
+                report["stored_bytes"] += texts['stored_size']
+                self._put_texts(texts)
+                self.store.replace_note(patient_id, note)
+        return report
+
+    async def get_note_text_stats(self) -> Dict:
+        """Compressed text totals: {texts, raw_bytes, stored_bytes}"""
+        records = self.store.get_records("note_texts")
+        return {
+            "texts": len(records),
+            "raw_bytes": sum(record['raw_size'] for record in records),
+            "stored_bytes": sum(record['stored_size'] for record in records)
+        }
+
+    # ==================== HISTORY ====================
+
+    async def get_all_history(self) -> Dict:
+        """Get all history organized by patient_id"""
+        return self.store.get_all_history()
+
+    async def get_patient_history(self, patient_id: str, projection: Optional[Dict] = None) -> List[Dict]:
+        """Get all history for a patient, newest first"""
+        history = _newest_first(self.store.get_patient_history(patient_id), "created_at", "history_id")
+        return [apply_projection(entry, projection) for entry in history]
+
+    async def get_patient_history_page(self, patient_id: str, limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None, projection: Optional[Dict] = None,
+                                       start=None, end=None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of a patient's history, newest first (keyset on created_at, history_id; optionally start <= created_at < end)"""
+        history = in_range(self.store.get_patient_history(patient_id), "created_at", start, end)
+        history, next_cursor = page_items(history, "created_at", "history_id", limit, after)
+        return [apply_projection(entry, projection) for entry in history], next_cursor
+
+    async def add_history(self, patient_id: str, history_entry: Dict) -> Dict:
+        """Add history entry for patient"""
+        history_entry['patient_id'] = patient_id
+        history_entry['created_at'] = history_entry.get('created_at', utc_now())
+        history_entry['updated_at'] = utc_now()
+        if 'history_id' not in history_entry:
+            history_entry['history_id'] = f"HIST_{uuid.uuid4().hex[:8].upper()}"
+        upgrade_timestamps(history_entry)
+        self.store.add_history(patient_id, history_entry)
+        self._record_activity(patient_id, history_activity)
+        self._update_report_state(patient_id, apply_history, history_entry)
+        self._bump_stats({"history.total": 1, "history.patients": int(len(self.store.history.get(patient_id, [])) == 1)})
+        return history_entry
+
+    # ==================== REPORT STATE ====================
+
+    async def get_report_state(self, patient_id: str) -> Optional[Dict]:
+        """A patient's incrementally maintained report state (None until first built)"""
+        return self.store.get_record("report_state", patient_id)
+
+    async def create_report_state(self, state: Dict):
+        """Store a freshly built report state, unless another request created one meanwhile"""
+        if self.store.get_record("report_state", state['patient_id']) is None:
+            self.store.put_record("report_state", state['patient_id'], state)
+
+    async def replace_report_state(self, state: Dict, version: Optional[int]) -> bool:
+        """Replace the report state only while its version is still `version` -> replaced?"""
+        stored = self.store.get_record("report_state", state['patient_id'])
+        if stored is None or stored.get('version') != version:
+            return False
+        self.store.put_record("report_state", state['patient_id'], state)
+        return True
+
+    def _update_report_state(self, patient_id: str, apply, *args):
+        """Apply an incremental update to the patient's report state, if it has been built"""
+        state = self.store.get_record("report_state", patient_id)
+        if state is not None:
+            apply(state, *args)
+            self.store.put_record("report_state", patient_id, state)
+
+    # ==================== CHANGE FEEDS ====================
+
+    async def get_changes_page(self, collection: str, since: Optional[str] = None, until: Optional[str] = None, limit: int = DEFAULT_CHANGES_PAGE_SIZE, after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """One page of patients / notes / history / queue_archive changed in (since, until], oldest change first"""
+        change_field, id_field = CHANGE_FEEDS[collection]
+        if collection == "patients":
+            records = list(self.store.get_all_patients().values())
+        elif collection == "queue_archive":
+            records = self.store.get_queue_archive()
+        elif collection == "documents":
+            records = self.store.get_records("documents")
+        else:
+            grouped = self.store.get_all_notes() if collection == "notes" else self.store.get_all_history()
+            records = [record for entries in grouped.values() for record in entries]
+        return changes_page_items(records, change_field, id_field, since, until, limit, after)
+
+    # ==================== TIMESTAMP MIGRATION ====================
+
+    async def backfill_timestamps(self, batch_size: int = 500) -> Dict[str, int]:
+        """
+        Persist the upgraded timestamps of records loaded in legacy form
+
+        The store upgrades records as it loads them; compacting writes them
+        back in canonical form. Returns {collection: records upgraded}.
+        """
+        upgraded = dict(self.store.legacy_timestamps)
+        await asyncio.to_thread(self.store.compact)
+        self.store.legacy_timestamps = {}
+        return upgraded
+
+    # ==================== DOCUMENTS ====================
+
+    def _update_record(self, collection: str, key: str, updates: Dict, push: Optional[Dict] = None) -> Optional[Dict]:
+        record = self.store.get_record(collection, key)
+        if record is None:
+            return None
+        for path, value in updates.items():
+            set_path(record, path, value)
+        for path, item in (push or {}).items():
+            current, _ = get_path(record, path)
+            set_path(record, path, list(current or []) + [item])
+        upgrade_timestamps(record)
+        return self.store.put_record(collection, key, record)
+
+    async def save_document(self, document_data: Dict) -> str:
+        """Save a single document"""
+        document_data.setdefault('document_id', f"DOC_{uuid.uuid4().hex[:8].upper()}")
+        document_data['updated_at'] = utc_now()
+        upgrade_timestamps(document_data)
+        self.store.put_record("documents", document_data['document_id'], document_data)
+        return document_data['document_id']
+
+    async def get_document(self, document_id: str, projection: Optional[Dict] = None) -> Optional[Dict]:
+        """Get single document by ID"""
+        return apply_projection(self.store.get_record("documents", document_id), projection)
+
+    async def get_patient_documents(self, patient_id: str) -> List[Dict]:
+        """Get all documents for a patient, newest first"""
+        documents = [d for d in self.store.get_records("documents") if d.get('patient_id') == patient_id]
+        return _newest_first(documents, "uploaded_at", "document_id")
+
+    async def get_patient_documents_page(self, patient_id: str, limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None, projection: Optional[Dict] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of a patient's documents, newest first (keyset on uploaded_at, document_id)"""
+        documents = [d for d in self.store.get_records("documents") if d.get('patient_id') == patient_id]
+        documents, next_cursor = page_items(documents, "uploaded_at", "document_id", limit, after)
+        return [apply_projection(document, projection) for document in documents], next_cursor
+
+    async def get_batch_documents(self, batch_id: str) -> List[Dict]:
+        """Get all documents in a batch, oldest first"""
+        documents = [d for d in self.store.get_records("documents") if d.get('batch_id') == batch_id]
+        return sorted(documents, key=lambda d: sort_key(d.get('uploaded_at')))
+
+    async def update_document_status(self, document_id: str, status: str, extracted_data: Optional[Dict] = None):
+        """Update document processing status"""
+        update_data = {"status": status}
+        if extracted_data is not None:
+            update_data["extracted_data"] = extracted_data
+        await self.update_document(document_id, update_data)
+
+    async def update_document(self, document_id: str, updates: Dict):
+        """Set arbitrary fields on a document"""
+        self._update_record("documents", document_id, {**updates, "updated_at": utc_now()})
+
+    async def get_document_changes_page(self, since: Optional[str] = None, until: Optional[str] = None, limit: int = DEFAULT_CHANGES_PAGE_SIZE, after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """One page of documents changed in (since, until], oldest change first"""
+        return changes_page_items(self.store.get_records("documents"), "updated_at", "document_id", since, until, limit, after)
+
+    # ==================== BATCHES ====================
+
+    async def create_batch(self, batch_data: Dict) -> str:
+        """Create a new document batch"""
+        upgrade_timestamps(batch_data)
+        self.store.put_record("batches", batch_data['batch_id'], batch_data)
+        return batch_data['batch_id']
+
+    async def get_batch(self, batch_id: str) -> Optional[Dict]:
+        """Get batch by ID"""
+        return self.store.get_record("batches", batch_id)
+
+    async def get_patient_batches(self, patient_id: str) -> List[Dict]:
+        """Get all batches of a patient, newest first"""
+        batches = [b for b in self.store.get_records("batches") if b.get('patient_id') == patient_id]
+        return sorted(batches, key=lambda b: sort_key(b.get('created_at')), reverse=True)
+
+    async def add_document_to_batch(self, batch_id: str, document_id: str):
+        """Add document to existing batch"""
+        self._update_record("batches", batch_id, {}, push={"document_ids": document_id})
+
+    async def update_batch_status(self, batch_id: str, status: str):
+        """Update batch status"""
+        update_data = {"status": status}
+        if status == "completed":
+            update_data["completed_at"] = utc_now()
+        self._update_record("batches", batch_id, update_data)
+
+    async def get_active_batch(self, patient_id: str) -> Optional[Dict]:
+        """Get active (pending/processing) batch for patient"""
+        for batch in self.store.get_records("batches"):
+            if batch.get('patient_id') == patient_id and batch.get('status') in ("pending", "processing"):
+                return batch
+        return None
+
+    # ==================== UPLOAD SESSIONS ====================
+
+    async def create_upload_session(self, session_data: Dict) -> str:
+        """Create a direct-upload session"""
+        upgrade_timestamps(session_data)
+        self.store.put_record("upload_sessions", session_data['upload_id'], session_data)
+        return session_data['upload_id']
+
+    async def get_upload_session(self, upload_id: str) -> Optional[Dict]:
+        """Get upload session by ID"""
+        return self.store.get_record("upload_sessions", upload_id)
+
+    async def claim_upload_session(self, upload_id: str) -> Optional[Dict]:
+        """Atomically move a session from 'pending' to 'queued' (None if already claimed)"""
+        session = self.store.get_record("upload_sessions", upload_id)
+        if session is None or session.get('status') != "pending":
+            return None
+        updates = {"status": "queued", "completed_at": utc_now()}
+        return self._update_record("upload_sessions", upload_id, updates)
+
+    async def update_upload_session(self, upload_id: str, updates: Dict):
+        """Update upload session fields"""
+        self._update_record("upload_sessions", upload_id, updates)
+
+    # ==================== EXPORT JOBS ====================
+
+    async def create_export_job(self, job_data: Dict) -> str:
+        """Create a bulk export job"""
+        upgrade_timestamps(job_data)
+        self.store.put_record("export_jobs", job_data['job_id'], job_data)
+        return job_data['job_id']
+
+    async def get_export_job(self, job_id: str) -> Optional[Dict]:
+        """Get export job by ID"""
+        return self.store.get_record("export_jobs", job_id)
+
+    async def update_export_job(self, job_id: str, updates: Dict):
+        """Update export job fields"""
+        self._update_record("export_jobs", job_id, updates)
+
+    async def finish_export_job(self, job_id: str, updates: Dict) -> bool:
+        """Apply a running job's final update, unless it was cancelled meanwhile -> applied?"""
+        job = self.store.get_record("export_jobs", job_id)
+        if job is None or job.get('status') != "in-progress":
+            return False
+        self._update_record("export_jobs", job_id, updates)
+        return True
+
+    # ==================== TIMELINES ====================
+
+    async def save_timeline(self, timeline_data: Dict) -> str:
+        """Save generated timeline (replaces the patient's previous one)"""
+        upgrade_timestamps(timeline_data)
+        self.store.put_record("timelines", timeline_data['patient_id'], timeline_data)
+        return timeline_data['patient_id']
+
+    async def get_patient_timeline(self, patient_id: str) -> Optional[Dict]:
+        """Get latest timeline for patient"""
+        return self.store.get_record("timelines", patient_id)
+
+    async def get_all_timelines(self) -> List[Dict]:
+        """Get all timelines, newest first"""
+        return _newest_first(self.store.get_records("timelines"), "generated_at", "patient_id")
+
+    async def get_timelines_page(self, limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of timelines, newest first (keyset on generated_at, patient_id)"""
+        return page_items(self.store.get_records("timelines"), "generated_at", "patient_id", limit, after)
@@ -0,0 +1,259 @@
+"""
+Cursor-based keyset pagination for MongoDB collections
+
+Pages are ordered by (sort_field, id_field) and the cursor encodes the last
+item's pair, so fetching page N costs the same as page 1 when a matching
+compound index exists - no skip() scans. Timestamps travel in cursors as
+BSON dates ($date), so a cursor decodes to the aware datetime it came from.
+"""
+
+import base64
+from datetime import timezone
+from typing import Dict, List, Optional, Tuple
+
+from bson import json_util
+from bson.json_util import JSONOptions
+from pymongo import ASCENDING, DESCENDING
+
+from app.services.timestamps import parse_timestamp
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+_CURSOR_JSON_OPTIONS = JSONOptions(tz_aware=True, tzinfo=timezone.utc)
+
+
+class InvalidCursor(ValueError):
+    """Raised when an `after` cursor cannot be decoded"""
+    pass
+
+
+def encode_cursor(sort_value, id_value) -> str:
+    """Encode the (sort, id) pair of the last item on a page"""
+    raw = json_util.dumps([sort_value, id_value]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple:
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, id_value = json_util.loads(base64.urlsafe_b64decode(padded.encode()), json_options=_CURSOR_JSON_OPTIONS)
+        return sort_value, id_value
+    except Exception:
+        raise InvalidCursor(f"Invalid cursor: {cursor}")
+
+
+def sort_key(value) -> Tuple:
+    """Sort key for in-memory paging: missing values first, then by value"""
+    return (value is not None, value if value is not None else "")
+
+
+def keyset_filter(sort_field: str, id_field: str, after: Optional[str], descending: bool) -> Dict:
+    """Mongo filter selecting items strictly after the cursor position"""
+    if not after:
+        return {}
+    sort_value, id_value = decode_cursor(after)
+    op = "$lt" if descending else "$gt"
+    # null sorts lowest, but comparisons never cross types: match null / missing values explicitly
+    if sort_value is None:
+        after_null = {sort_field: None, id_field: {op: id_value}}
+        return after_null if descending else {"$or": [{sort_field: {"$ne": None}}, after_null]}
+    position = [
+        {sort_field: {op: sort_value}},
+        {sort_field: sort_value, id_field: {op: id_value}}
+    ]
+    return {"$or": (position + [{sort_field: None}]) if descending else position}
+
+
+async def fetch_page(
+    collection,
+    query: Dict,
+    sort_field: str,
+    id_field: str,
+    limit: int = DEFAULT_PAGE_SIZE,
+    after: Optional[str] = None,
+    descending: bool = True,
+    projection: Optional[Dict] = None
+) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Fetch one page of a collection
+
+    Returns (items, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    position = keyset_filter(sort_field, id_field, after, descending)
+    if position:
+        query = {"$and": [query, position]} if query else position
+
+    # An inclusion projection may leave out the keys the cursor is built from
+    projection = projection or {"_id": 0}
+    hidden = [
+        field for field in (sort_field, id_field)
+        if any(value for key, value in projection.items() if key != "_id") and not projection.get(field)
+    ]
+    if hidden:
+        projection = {**projection, **{field: 1 for field in hidden}}
+
+    direction = DESCENDING if descending else ASCENDING
+    cursor = collection.find(query, projection).sort(
+        [(sort_field, direction), (id_field, direction)]
+    ).limit(limit + 1)
+    items = await cursor.to_list(length=limit + 1)
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor(last.get(sort_field), last.get(id_field))
+
+    for item in items:
+        for field in hidden:
+            item.pop(field, None)
+    return items, next_cursor
+
+
+def page_items(
+    items: List[Dict],
+    sort_field: str,
+    id_field: str,
+    limit: int = DEFAULT_PAGE_SIZE,
+    after: Optional[str] = None,
+    descending: bool = True
+) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Same paging as fetch_page over an in-memory list (in-memory backends)
+
+    Cursors are interchangeable with fetch_page's.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    key = lambda item: (sort_key(item.get(sort_field)), item.get(id_field) or "")
+    ordered = sorted(items, key=key, reverse=descending)
+
+    if after:
+        sort_value, id_value = decode_cursor(after)
+        position = (sort_key(sort_value), id_value or "")
+        if descending:
+            ordered = [item for item in ordered if key(item) < position]
+        else:
+            ordered = [item for item in ordered if key(item) > position]
+
+    next_cursor = None
+    if len(ordered) > limit:
+        ordered = ordered[:limit]
+        last = ordered[-1]
+        next_cursor = encode_cursor(last.get(sort_field), last.get(id_field))
+    return ordered, next_cursor
+
+
+# ==================== CHANGE FEEDS ====================
+# Exports read "everything changed in (since, until]" oldest change first,
+# in larger pages than the API serves.
+
+DEFAULT_CHANGES_PAGE_SIZE = 1000
+MAX_CHANGES_PAGE_SIZE = 10000
+
+
+def changes_filter(change_field: str, since: Optional[str], until: Optional[str]) -> Dict:
+    """Mongo filter for records whose change timestamp is in (since, until]"""
+    window = {}
+    if since is not None:
+        window["$gt"] = parse_timestamp(since)
+    if until is not None:
+        window["$lte"] = parse_timestamp(until)
+    return {change_field: window} if window else {change_field: {"$exists": True}}
+
+
+async def fetch_changes_page(
+    collection,
+    change_field: str,
+    id_field: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    limit: int = DEFAULT_CHANGES_PAGE_SIZE,
+    after: Optional[str] = None
+) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Fetch one page of records changed in (since, until], oldest change first
+
+    Needs a compound (change_field, id_field) index. Returns (items, next_cursor).
+    """
+    limit = max(1, min(limit, MAX_CHANGES_PAGE_SIZE))
+    query = changes_filter(change_field, since, until)
+    position = keyset_filter(change_field, id_field, after, descending=False)
+    if position:
+        query = {"$and": [query, position]}
+
+    cursor = collection.find(query, {"_id": 0}).sort(
+        [(change_field, ASCENDING), (id_field, ASCENDING)]
+    ).limit(limit + 1)
+    items = await cursor.to_list(length=limit + 1)
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1].get(change_field), items[-1].get(id_field))
+    return items, next_cursor
+
+
+def changes_page_items(
+    items: List[Dict],
+    change_field: str,
+    id_field: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    limit: int = DEFAULT_CHANGES_PAGE_SIZE,
+    after: Optional[str] = None
+) -> Tuple[List[Dict], Optional[str]]:
+    """Same as fetch_changes_page over an in-memory list (in-memory backends)"""
+    limit = max(1, min(limit, MAX_CHANGES_PAGE_SIZE))
+    since, until = parse_timestamp(since), parse_timestamp(until)
+    key = lambda item: (item[change_field], item.get(id_field) or "")
+    position = None
+    if after:
+        sort_value, id_value = decode_cursor(after)
+        position = (sort_value, id_value or "")
+    ordered = sorted(
+        (
+            item for item in items
+            if item.get(change_field) is not None
+            and (since is None or item[change_field] > since)
+            and (until is None or item[change_field] <= until)
+            and (position is None or key(item) > position)
+        ),
+        key=key
+    )
+
+    next_cursor = None
+    if len(ordered) > limit:
+        ordered = ordered[:limit]
+        next_cursor = encode_cursor(ordered[-1].get(change_field), ordered[-1].get(id_field))
+    return ordered, next_cursor
+
+
+# ==================== DATE RANGES ====================
+# "Notes between X and Y": [start, end) on the sort timestamp, served by the
+# same compound (scope, timestamp, id) indexes as the pages themselves.
+
+def range_filter(field: str, start=None, end=None) -> Dict:
+    """Mongo filter for start <= field < end (either bound optional)"""
+    window = {}
+    if start is not None:
+        window["$gte"] = parse_timestamp(start)
+    if end is not None:
+        window["$lt"] = parse_timestamp(end)
+    return {field: window} if window else {}
+
+
+def in_range(items: List[Dict], field: str, start=None, end=None) -> List[Dict]:
+    """range_filter over an in-memory list (in-memory backends)"""
+    start, end = parse_timestamp(start), parse_timestamp(end)
+    if start is None and end is None:
+        return items
+    return [
+        item for item in items
+        if item.get(field) is not None
+        and (start is None or item[field] >= start)
+        and (end is None or item[field] < end)
+    ]
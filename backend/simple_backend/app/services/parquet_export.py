@@ -0,0 +1,409 @@
+"""
+Columnar (Parquet) export of clinical data for analytics
+
+Streams the storage change feeds into Parquet files on the blob store,
+partitioned by export date:
+
+    <PARQUET_EXPORT_PREFIX>/<dataset>/export_date=YYYY-MM-DD/part-<run_id>-<n>.parquet
+
+Datasets:
+- patients:            one row per patient
+- notes:               one row per SOAP note, SOAP sections as columns
+- history_medications: one row per medication on a prescription
+- documents:           one row per scanned document (OCR summary)
+- visits:              one row per archived queue entry, with wait/consultation minutes
+
+Timestamp columns are timestamp[ms, UTC].
+
+Runs are incremental: every dataset keeps a watermark (updated_at, or
+archived_at for visits) in <prefix>/_state.json, and the next run only reads
+records changed after it, up to PARQUET_EXPORT_LAG seconds ago so writes
+still in flight are not skipped. A record changed again later shows up in a
+later run too; consumers keep the latest row per id. Memory is bounded by
+PARQUET_ROW_GROUP_SIZE rows per dataset; files roll over every
+PARQUET_ROWS_PER_FILE rows. Each run writes a manifest to <prefix>/_runs/.
+The local /media route serves <prefix> only through signed download URLs.
+
+Needs pyarrow (optional dependency, only for this export).
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional
+
+from app.services.blob_store import blob_store as default_blob_store, require_signed_downloads
+from app.services.pagination import DEFAULT_CHANGES_PAGE_SIZE
+from app.services.storage_backend import get_storage, get_document_storage
+from app.services.timestamps import utc_now, parse_timestamp, to_iso, json_default
+
+
+PARQUET_EXPORT_ENABLED = os.environ.get('PARQUET_EXPORT_ENABLED', 'false').lower() == 'true'
+PARQUET_EXPORT_INTERVAL = int(os.environ.get('PARQUET_EXPORT_INTERVAL', '86400'))
+PARQUET_EXPORT_PREFIX = os.environ.get('PARQUET_EXPORT_PREFIX', 'exports/parquet').strip('/')
+PARQUET_EXPORT_LAG = int(os.environ.get('PARQUET_EXPORT_LAG', '60'))
+PARQUET_ROW_GROUP_SIZE = int(os.environ.get('PARQUET_ROW_GROUP_SIZE', '50000'))
+PARQUET_ROWS_PER_FILE = int(os.environ.get('PARQUET_ROWS_PER_FILE', '1000000'))
+PARQUET_COMPRESSION = os.environ.get('PARQUET_COMPRESSION', 'zstd')
+
+# Exported files hold PHI: never served by a plain /media URL
+require_signed_downloads(PARQUET_EXPORT_PREFIX)
+
+
+# ==================== ROWS ====================
+
+def _text(value) -> Optional[str]:
+    """Free-form fields (LLM output) as text: structured values become JSON"""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=json_default)
+    return str(value)
+
+
+def _int(value) -> Optional[int]:
+    try:
+        return int(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _timestamp(value) -> Optional[datetime]:
+    try:
+        return parse_timestamp(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _minutes_between(start, end) -> Optional[float]:
+    start, end = _timestamp(start), _timestamp(end)
+    if start is None or end is None:
+        return None
+    return round((end - start).total_seconds() / 60, 2)
+
+
+def patient_rows(patient: Dict) -> List[Dict]:
+    return [{
+        "patient_id": patient.get('patient_id'),
+        "uhid": patient.get('uhid'),
+        "name": _text(patient.get('name')),
+        "phone": _text(patient.get('phone')),
+        "age": _int(patient.get('age')),
+        "gender": _text(patient.get('gender')),
+        "status": _text(patient.get('status')),
+        "created_at": _timestamp(patient.get('created_at')),
+        "updated_at": _timestamp(patient.get('updated_at'))
+    }]
+
+
+def note_rows(note: Dict) -> List[Dict]:
+    soap = note.get('soap_note') or {}
+    medications = soap.get('medications') or []
+    return [{
+        "note_id": note.get('note_id'),
+        "patient_id": note.get('patient_id'),
+        "created_at": _timestamp(note.get('created_at')),
+        "updated_at": _timestamp(note.get('updated_at')),
+        "language": _text(soap.get('language')),
+        "chief_complaint": _text(soap.get('chief_complaint')),
+        "subjective": _text(soap.get('subjective')),
+        "objective": _text(soap.get('objective')),
+        "assessment": _text(soap.get('assessment')),
+        "plan": _text(soap.get('plan')),
+        "medications": [_text(medication) for medication in medications] if isinstance(medications, list) else [_text(medications)],
+        "audio_file": note.get('audio_file')
+    }]
+
+
+def history_medication_rows(entry: Dict) -> List[Dict]:
+    prescription = entry.get('prescription_data') or {}
+    medications = prescription.get('medications') or []
+    rows = []
+    for position, medication in enumerate(medications if isinstance(medications, list) else [medications]):
+        medication = medication if isinstance(medication, dict) else {"name": medication}
+        rows.append({
+            "history_id": entry.get('history_id'),
+            "patient_id": entry.get('patient_id'),
+            "position": position,
+            "created_at": _timestamp(entry.get('created_at')),
+            "updated_at": _timestamp(entry.get('updated_at')),
+            "prescription_date": _text(prescription.get('date')),
+            "doctor_name": _text(prescription.get('doctor_name')),
+            "diagnosis": _text(prescription.get('diagnosis')),
+            "name": _text(medication.get('name')),
+            "dosage": _text(medication.get('dosage')),
+            "frequency": _text(medication.get('frequency')),
+            "duration": _text(medication.get('duration'))
+        })
+    return rows
+
+
+def document_rows(document: Dict) -> List[Dict]:
+    extracted = document.get('extracted_data') or {}
+    medications = extracted.get('medications') if isinstance(extracted, dict) else None
+    return [{
+        "document_id": document.get('document_id'),
+        "patient_id": document.get('patient_id'),
+        "batch_id": document.get('batch_id'),
+        "status": document.get('status'),
+        "uploaded_at": _timestamp(document.get('uploaded_at')),
+        "updated_at": _timestamp(document.get('updated_at')),
+        "image_file": document.get('image_file'),
+        "doctor_name": _text(extracted.get('doctor_name')) if isinstance(extracted, dict) else None,
+        "diagnosis": _text(extracted.get('diagnosis')) if isinstance(extracted, dict) else None,
+        "medication_count": len(medications) if isinstance(medications, list) else 0
+    }]
+
+
+def visit_rows(entry: Dict) -> List[Dict]:
+    return [{
+        "queue_id": entry.get('queue_id'),
+        "patient_id": entry.get('patient_id'),
+        "token_number": _int(entry.get('token_number')),
+        "priority": _text(entry.get('priority')),
+        "status": entry.get('status'),
+        "added_at": _timestamp(entry.get('added_at')),
+        "nurse_completed_at": _timestamp(entry.get('nurse_completed_at')),
+        "started_at": _timestamp(entry.get('started_at')),
+        "completed_at": _timestamp(entry.get('completed_at')),
+        "cancelled_at": _timestamp(entry.get('cancelled_at')),
+        "archived_at": _timestamp(entry.get('archived_at')),
+        "wait_minutes": _minutes_between(entry.get('added_at'), entry.get('started_at')),
+        "consultation_minutes": _minutes_between(entry.get('started_at'), entry.get('completed_at'))
+    }]
+
+
+# dataset -> (change feed, rows(record), [(column, type)])
+EXPORT_DATASETS = {
+    "patients": ("patients", patient_rows, [
+        ("patient_id", "string"), ("uhid", "string"), ("name", "string"), ("phone", "string"), ("age", "int64"),
+        ("gender", "string"), ("status", "string"), ("created_at", "timestamp"), ("updated_at", "timestamp")
+    ]),
+    "notes": ("notes", note_rows, [
+        ("note_id", "string"), ("patient_id", "string"), ("created_at", "timestamp"), ("updated_at", "timestamp"),
+        ("language", "string"), ("chief_complaint", "string"), ("subjective", "string"), ("objective", "string"),
+        ("assessment", "string"), ("plan", "string"), ("medications", "list<string>"), ("audio_file", "string")
+    ]),
+    "history_medications": ("history", history_medication_rows, [
+        ("history_id", "string"), ("patient_id", "string"), ("position", "int64"), ("created_at", "timestamp"),
+        ("updated_at", "timestamp"), ("prescription_date", "string"), ("doctor_name", "string"), ("diagnosis", "string"),
+        ("name", "string"), ("dosage", "string"), ("frequency", "string"), ("duration", "string")
+    ]),
+    "documents": ("documents", document_rows, [
+        ("document_id", "string"), ("patient_id", "string"), ("batch_id", "string"), ("status", "string"),
+        ("uploaded_at", "timestamp"), ("updated_at", "timestamp"), ("image_file", "string"), ("doctor_name", "string"),
+        ("diagnosis", "string"), ("medication_count", "int64")
+    ]),
+    "visits": ("queue_archive", visit_rows, [
+        ("queue_id", "string"), ("patient_id", "string"), ("token_number", "int64"), ("priority", "string"),
+        ("status", "string"), ("added_at", "timestamp"), ("nurse_completed_at", "timestamp"), ("started_at", "timestamp"),
+        ("completed_at", "timestamp"), ("cancelled_at", "timestamp"), ("archived_at", "timestamp"),
+        ("wait_minutes", "float64"), ("consultation_minutes", "float64")
+    ])
+}
+
+
+# ==================== PARQUET FILES ====================
+
+class ParquetPartWriter:
+    """Buffers rows into row groups and rolls part files onto the blob store"""
+
+    def __init__(self, blob, prefix: str, run_id: str, columns: List, row_group_size: Optional[int] = None,
+                 rows_per_file: Optional[int] = None):
+        import pyarrow as pa  # Optional dependency, only needed for the Parquet export
+        import pyarrow.parquet as pq
+
+        types = {
+            "string": pa.string, "int64": pa.int64, "float64": pa.float64, "list<string>": lambda: pa.list_(pa.string()),
+            "timestamp": lambda: pa.timestamp("ms", tz="UTC")
+        }
+        self._pa, self._pq = pa, pq
+        self.schema = pa.schema([(name, types[kind]()) for name, kind in columns])
+        self.blob = blob
+        self.prefix = prefix
+        self.run_id = run_id
+        self.row_group_size = row_group_size or PARQUET_ROW_GROUP_SIZE
+        self.rows_per_file = rows_per_file or PARQUET_ROWS_PER_FILE
+        self.files: List[Dict] = []
+        self.rows = 0
+        self._buffer: List[Dict] = []
+        self._writer = None
+        self._path: Optional[str] = None
+        self._file_rows = 0
+
+    async def write(self, rows: List[Dict]):
+        self._buffer.extend(rows)
+        if len(self._buffer) >= self.row_group_size:
+            await self._flush()
+
+    async def _flush(self):
+        table = self._pa.Table.from_pylist(self._buffer, schema=self.schema)
+        self._buffer = []
+        if self._writer is None:
+            fd, self._path = tempfile.mkstemp(prefix="export_", suffix=".parquet")
+            os.close(fd)
+            self._writer = self._pq.ParquetWriter(self._path, self.schema, compression=PARQUET_COMPRESSION)
+        await asyncio.to_thread(self._writer.write_table, table)
+        self._file_rows += table.num_rows
+        self.rows += table.num_rows
+        if self._file_rows >= self.rows_per_file:
+            await self._finish_file()
+
+    async def _finish_file(self):
+        self._writer.close()
+        key = f"{self.prefix}/part-{self.run_id}-{len(self.files):05d}.parquet"
+        try:
+            await self.blob.put_file(key, self._path, "application/vnd.apache.parquet")
+        finally:
+            os.remove(self._path)
+        self.files.append({"key": key, "rows": self._file_rows})
+        self._writer, self._path, self._file_rows = None, None, 0
+
+    async def close(self) -> List[Dict]:
+        """Write what is buffered, upload the last file -> [{key, rows}]"""
+        if self._buffer:
+            await self._flush()
+        if self._writer is not None:
+            await self._finish_file()
+        return self.files
+
+    def abort(self):
+        """Drop the unfinished file (already uploaded parts stay)"""
+        if self._writer is not None:
+            self._writer.close()
+            os.remove(self._path)
+            self._writer, self._path = None, None
+
+
+# ==================== EXPORT RUNS ====================
+
+async def iter_changes(fetch, since: Optional[str], until: str, page_size: int = DEFAULT_CHANGES_PAGE_SIZE) -> AsyncIterator[Dict]:
+    """Walk a change feed page by page"""
+    after = None
+    while True:
+        page, after = await fetch(since, until, limit=page_size, after=after)
+        for record in page:
+            yield record
+        if after is None:
+            return
+
+
+async def load_state(blob, prefix: str = PARQUET_EXPORT_PREFIX) -> Dict:
+    """Watermarks of the previous runs ({} before the first run)"""
+    key = f"{prefix}/_state.json"
+    if not await blob.exists(key):
+        return {}
+    async with blob.local_path(key) as path:
+        with open(path) as f:
+            return json.load(f)
+
+
+async def _put_json(blob, key: str, data: Dict):
+    await blob.put(key, json.dumps(data, indent=2).encode(), "application/json")
+
+
+async def run_export(
+    datasets: Optional[List[str]] = None,
+    full: bool = False,
+    storage=None,
+    document_storage=None,
+    blob=None,
+    prefix: str = PARQUET_EXPORT_PREFIX,
+    now: Optional[datetime] = None
+) -> Dict:
+    """
+    Export every dataset changed since its watermark (everything if full)
+
+    Returns the run manifest: {run_id, until, datasets: {name: {since, rows, records, files}}}
+    """
+    storage = storage or get_storage()
+    document_storage = document_storage or get_document_storage()
+    blob = blob or default_blob_store
+    now = now or utc_now()
+    names = datasets or list(EXPORT_DATASETS)
+    unknown = [name for name in names if name not in EXPORT_DATASETS]
+    if unknown:
+        raise ValueError(f"Unknown dataset(s): {', '.join(unknown)} (use {', '.join(EXPORT_DATASETS)})")
+
+    state = await load_state(blob, prefix)
+    run_id = f"{now:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+    until = to_iso(now - timedelta(seconds=PARQUET_EXPORT_LAG))
+    manifest = {"run_id": run_id, "until": until, "full": full, "datasets": {}}
+
+    for name in names:
+        feed, to_rows, columns = EXPORT_DATASETS[name]
+        since = None if full else state.get(name, {}).get("watermark")
+        if since is not None and parse_timestamp(since) >= parse_timestamp(until):
+            continue
+        if feed == "documents":
+            fetch = document_storage.get_document_changes_page
+        else:
+            fetch = lambda since_, until_, limit, after, feed=feed: storage.get_changes_page(feed, since_, until_, limit, after)
+
+        writer = ParquetPartWriter(blob, f"{prefix}/{name}/export_date={until[:10]}", run_id, columns)
+        records = 0
+        try:
+            async for record in iter_changes(fetch, since, until):
+                await writer.write(to_rows(record))
+                records += 1
+            files = await writer.close()
+        except BaseException:
+            writer.abort()
+            raise
+
+        manifest["datasets"][name] = {"since": since, "records": records, "rows": writer.rows, "files": files}
+        # Saved per dataset: a failed run only repeats the datasets it did not finish
+        state[name] = {"watermark": until, "run_id": run_id}
+        await _put_json(blob, f"{prefix}/_state.json", state)
+        print(f"📦 Parquet export {name}: {records:,} records → {writer.rows:,} rows in {len(files)} file(s)")
+
+    await _put_json(blob, f"{prefix}/_runs/{run_id}.json", manifest)
+    return manifest
+
+
+class ParquetExportJob:
+    """Background task running the incremental export every PARQUET_EXPORT_INTERVAL seconds"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.last_run: Optional[Dict] = None
+
+    def start(self):
+        """Start the job (no-op if disabled or already running)"""
+        if PARQUET_EXPORT_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            print("📦 Parquet export job started")
+
+    async def stop(self):
+        """Cancel the job and wait for it to exit"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self, datasets: Optional[List[str]] = None, full: bool = False) -> Dict:
+        """Run one export now (runs never overlap)"""
+        async with self._lock:
+            self.last_run = await run_export(datasets, full)
+            return self.last_run
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Parquet export failed: {e}")
+            await asyncio.sleep(PARQUET_EXPORT_INTERVAL)
+
+
+# Singleton instance
+parquet_exporter = ParquetExportJob()
@@ -0,0 +1,60 @@
+"""
+Denormalized patient activity
+
+Every patient record carries a summary of its notes and prescriptions,
+updated atomically with each note / history insert:
+
+    visit_count         notes on file (one per consultation)
+    last_visit          created_at of the newest note
+    last_note_id        note_id of the newest note
+    last_complaint      soap_note.chief_complaint of the newest note
+    prescription_count  history entries on file
+
+The latest note, the summary and the report statistics read these instead
+of loading every note. A note older than last_visit (back-dated imports)
+only counts; it never replaces the latest note. rebuild_patient_activity()
+recomputes the fields for records written before they existed.
+"""
+
+from typing import Dict, Optional
+
+
+ACTIVITY_FIELDS = ("visit_count", "last_visit", "last_note_id", "last_complaint", "prescription_count")
+
+
+def latest_note_fields(note: Optional[Dict]) -> Dict:
+    """last_visit / last_note_id / last_complaint for this note as the newest"""
+    note = note or {}
+    return {
+        "last_visit": note.get('created_at'),
+        "last_note_id": note.get('note_id'),
+        "last_complaint": (note.get('soap_note') or {}).get('chief_complaint')
+    }
+
+
+def is_latest_note(patient: Dict, note: Dict) -> bool:
+    """Is `note` at least as new as the patient's current latest note?"""
+    last_visit = patient.get('last_visit')
+    return last_visit is None or note['created_at'] >= last_visit
+
+
+def note_activity(patient: Dict, note: Dict) -> Dict:
+    """Activity updates ($set) for one new note (backends that read-modify-write)"""
+    updates = {"visit_count": (patient.get('visit_count') or 0) + 1}
+    if is_latest_note(patient, note):
+        updates.update(latest_note_fields(note))
+    return updates
+
+
+def history_activity(patient: Dict) -> Dict:
+    """Activity updates ($set) for one new history entry"""
+    return {"prescription_count": (patient.get('prescription_count') or 0) + 1}
+
+
+def rebuilt_activity(latest_note: Optional[Dict], visit_count: int, prescription_count: int) -> Dict:
+    """All activity fields, recounted from a patient's notes and history"""
+    return {
+        "visit_count": visit_count,
+        "prescription_count": prescription_count,
+        **latest_note_fields(latest_note)
+    }
@@ -0,0 +1,218 @@
+"""
+In-process read-through cache for patient lookups
+
+Nearly every route starts with get_patient / get_patient_by_uhid, and one
+dashboard view triggers several identical lookups. Patients are cached
+(LRU + TTL) under two keys, ("id", patient_id) and ("uhid", uhid). Entries
+are deep copies in and out, so callers may mutate what they get.
+
+Writes through MongoDBStorage invalidate immediately. With several workers,
+set PATIENT_CACHE_CHANGE_STREAM=true (requires a replica set) so every
+worker also invalidates on other workers' writes; otherwise the TTL bounds
+how stale another worker's copy can be.
+"""
+
+import asyncio
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone
+from typing import Dict, Optional, Set, Tuple
+
+
+PATIENT_CACHE_SIZE = int(os.environ.get('PATIENT_CACHE_SIZE', '1000'))
+PATIENT_CACHE_TTL = float(os.environ.get('PATIENT_CACHE_TTL', '30'))
+PATIENT_CACHE_CHANGE_STREAM = os.environ.get('PATIENT_CACHE_CHANGE_STREAM', 'false').lower() == 'true'
+
+CacheKey = Tuple[str, str]
+
+
+class PatientCache:
+    """LRU + TTL cache of patient documents keyed by patient_id and uhid"""
+
+    def __init__(self, max_size: int = PATIENT_CACHE_SIZE, ttl: float = PATIENT_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[CacheKey, Tuple[Dict, float]]" = OrderedDict()
+        self._keys_by_patient: Dict[str, Set[CacheKey]] = {}  # patient_id -> its cache keys
+        self._lock = threading.Lock()
+        self._watch_task: Optional[asyncio.Task] = None
+        # Bumped on every invalidation; a read that started before a write must not re-cache the old copy
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.total_hit_age = 0.0
+        self.max_hit_age = 0.0
+        self.last_invalidation_lag_ms: Optional[float] = None
+
+    # ==================== LOOKUPS ====================
+
+    def get(self, kind: str, value: str) -> Optional[Dict]:
+        """Return a copy of the cached patient, or None on miss/expiry"""
+        key = (kind, value)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            patient, cached_at = entry
+            age = now - cached_at
+            if age > self.ttl:
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.total_hit_age += age
+            self.max_hit_age = max(self.max_hit_age, age)
+            return copy.deepcopy(patient)
+
+    def put(self, patient: Dict, generation: Optional[int] = None):
+        """
+        Cache a patient under both its patient_id and uhid
+
+        Pass the `generation` read before querying MongoDB; the put is skipped
+        if an invalidation happened in between.
+        """
+        now = time.monotonic()
+        snapshot = copy.deepcopy(patient)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            for key in self._keys_for(snapshot):
+                self._drop(key)
+                self._entries[key] = (snapshot, now)
+                self._keys_by_patient.setdefault(snapshot.get('patient_id'), set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key: CacheKey) -> bool:
+        """Remove one entry and its reverse mapping (lock held)"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        patient_id = entry[0].get('patient_id')
+        keys = self._keys_by_patient.get(patient_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_patient[patient_id]
+        return True
+
+    # ==================== INVALIDATION ====================
+
+    def invalidate(self, patient_id: Optional[str] = None, uhid: Optional[str] = None):
+        """Drop every cached copy of a patient (both keys, including an old uhid)"""
+        with self._lock:
+            keys = set()
+            if uhid:
+                keys.add(("uhid", uhid))
+            if patient_id:
+                keys.add(("id", patient_id))
+                keys.update(self._keys_by_patient.get(patient_id, ()))
+            self.generation += 1
+            for key in keys:
+                if self._drop(key):
+                    self.invalidations += 1
+
+    def clear(self):
+        """Drop everything (e.g. after a change stream gap)"""
+        with self._lock:
+            self.generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._keys_by_patient.clear()
+
+    @staticmethod
+    def _keys_for(patient: Dict):
+        if patient.get('patient_id'):
+            yield ("id", patient['patient_id'])
+        if patient.get('uhid'):
+            yield ("uhid", patient['uhid'])
+
+    # ==================== CHANGE STREAM ====================
+
+    def start_watching(self, collection):
+        """Invalidate on writes from any worker (no-op unless enabled)"""
+        if PATIENT_CACHE_CHANGE_STREAM and self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch(collection))
+
+    async def stop_watching(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    async def _watch(self, collection):
+        resume_token = None
+        while True:
+            try:
+                async with collection.watch(full_document='updateLookup', resume_after=resume_token) as stream:
+                    print("👀 Patient cache watching change stream")
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self._apply_change(change)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Changes may have been missed while disconnected
+                print(f"⚠️ Patient cache change stream error: {e}")
+                self.clear()
+                resume_token = None
+                await asyncio.sleep(5)
+
+    def _apply_change(self, change: Dict):
+        document = change.get('fullDocument') or {}
+        if document.get('patient_id'):
+            self.invalidate(document['patient_id'], document.get('uhid'))
+        else:
+            # Deletes (and updates of since-deleted documents) only carry _id
+            self.clear()
+
+        wall_time = change.get('wallTime')
+        if wall_time is not None:
+            lag = time.time() - wall_time.replace(tzinfo=timezone.utc).timestamp()
+            self.last_invalidation_lag_ms = round(max(lag, 0) * 1000, 3)
+
+    # ==================== STATS ====================
+
+    def stats(self) -> Dict:
+        """Hit rate and staleness metrics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            now = time.monotonic()
+            oldest = min((cached_at for _, cached_at in self._entries.values()), default=None)
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "avg_hit_age_ms": round(self.total_hit_age / self.hits * 1000, 3) if self.hits else 0.0,
+                "max_hit_age_ms": round(self.max_hit_age * 1000, 3),
+                "oldest_entry_age_ms": round((now - oldest) * 1000, 3) if oldest is not None else None,
+                "change_stream": self._watch_task is not None,
+                "last_invalidation_lag_ms": self.last_invalidation_lag_ms
+            }
+
+
+# Singleton instance
+patient_cache = PatientCache()
@@ -0,0 +1,244 @@
+"""
+Bulk patient import (CSV or NDJSON)
+
+Used by POST /patients/import and the import_patients.py CLI to onboard a
+PHC's existing register. Input is parsed as a stream, every row is validated
+against PatientCreate, and valid rows are written in chunks with unordered
+insert_many. Bad rows are reported individually and never abort the import.
+Imported patients are NOT added to the queue.
+"""
+
+import codecs
+import csv
+import json
+import uuid
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from app.models.schemas import PatientCreate
+from app.services.storage_backend import get_storage
+from app.services.timestamps import utc_now
+
+
+IMPORT_FORMATS = ["csv", "ndjson"]
+DEFAULT_CHUNK_SIZE = 500
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportFormatError(ValueError):
+    """Raised when the input cannot be parsed at all (e.g. missing CSV header)"""
+    pass
+
+
+# ==================== PARSING ====================
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a byte stream (UTF-8, optional BOM) into lines without buffering it whole"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_csv_records(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, object]]:
+    """
+    Yield (row_number, dict) per CSV record; row 1 is the first data row
+
+    Quoted fields may contain newlines: lines are joined until quotes balance.
+    """
+    header = None
+    row_number = 0
+    record = ""
+    async for line in lines:
+        record = f"{record}\n{line}" if record else line
+        if record.count('"') % 2:
+            continue  # Inside a quoted field
+        text, record = record, ""
+        if not text.strip():
+            continue
+
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip().lower() for name in values]
+            continue
+
+        row_number += 1
+        if len(values) > len(header):
+            yield row_number, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        values += [""] * (len(header) - len(values))  # Trailing optional columns may be omitted
+        yield row_number, {
+            name: (value.strip() or None) for name, value in zip(header, values) if name
+        }
+
+    if record.strip():
+        yield row_number + 1, "Unterminated quoted field"
+    if header is None:
+        raise ImportFormatError("CSV input has no header row")
+
+
+async def iter_ndjson_records(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, object]]:
+    """Yield (row_number, dict) per non-empty NDJSON line"""
+    row_number = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            value = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_number, f"Invalid JSON: {e.msg}"
+            continue
+        if not isinstance(value, dict):
+            yield row_number, "Expected a JSON object"
+            continue
+        yield row_number, value
+
+
+def iter_records(lines: AsyncIterator[str], fmt: str) -> AsyncIterator[Tuple[int, object]]:
+    if fmt == "csv":
+        return iter_csv_records(lines)
+    if fmt == "ndjson":
+        return iter_ndjson_records(lines)
+    raise ImportFormatError(f"Unsupported format: {fmt} (use one of {', '.join(IMPORT_FORMATS)})")
+
+
+# ==================== IMPORT ====================
+
+def _validation_messages(error: ValidationError) -> List[str]:
+    return [
+        f"{'.'.join(str(part) for part in item['loc']) or 'row'}: {item['msg']}"
+        for item in error.errors()
+    ]
+
+
+def _patient_document(patient: PatientCreate, imported_at: datetime) -> Dict:
+    """Same shape as POST /patients, minus the visit (import is not a visit)"""
+    return {
+        "patient_id": f"PAT_{uuid.uuid4().hex[:8].upper()}",
+        "uhid": patient.uhid,
+        "name": patient.name,
+        "phone": patient.phone,
+        "age": patient.age,
+        "gender": patient.gender,
+        "created_at": imported_at,
+        "updated_at": imported_at,
+        "last_visit": None,
+        "visit_count": 0,
+        "prescription_count": 0,
+        "status": "active",
+        "source": "import"
+    }
+
+
+class PatientImport:
+    """Validates and writes one import, collecting a per-row report"""
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE, dry_run: bool = False, storage=None):
+        self.storage = storage or get_storage()
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.total_rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors: List[Dict] = []
+        self._seen_uhids = set()
+        self._chunk: List[Tuple[int, Dict]] = []
+        self._imported_at = utc_now()
+
+    def _fail(self, row: int, messages: List[str], uhid: Optional[str] = None):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "uhid": uhid, "errors": messages})
+
+    async def add(self, row: int, record):
+        """Validate one parsed record and queue it for the next chunk"""
+        self.total_rows += 1
+        if isinstance(record, str):
+            self._fail(row, [record])
+            return
+
+        try:
+            patient = PatientCreate(**record)
+        except ValidationError as e:
+            self._fail(row, _validation_messages(e), record.get("uhid"))
+            return
+
+        if patient.uhid in self._seen_uhids:
+            self._fail(row, ["uhid: duplicate UHID earlier in this file"], patient.uhid)
+            return
+        self._seen_uhids.add(patient.uhid)
+
+        self._chunk.append((row, _patient_document(patient, self._imported_at)))
+        if len(self._chunk) >= self.chunk_size:
+            await self.flush()
+
+    async def flush(self):
+        """Write the pending chunk (unordered, so one bad row doesn't stop the rest)"""
+        if not self._chunk:
+            return
+        chunk, self._chunk = self._chunk, []
+
+        if self.dry_run:
+            existing = await self.storage.get_existing_uhids([doc['uhid'] for _, doc in chunk])
+            failures = {
+                index: "uhid: UHID already registered"
+                for index, (_, doc) in enumerate(chunk) if doc['uhid'] in existing
+            }
+        else:
+            failures = await self.storage.insert_patients([doc for _, doc in chunk])
+
+        for index, (row, doc) in enumerate(chunk):
+            if index in failures:
+                self._fail(row, [failures[index]], doc['uhid'])
+            else:
+                self.imported += 1
+
+    def report(self) -> Dict:
+        return {
+            "dry_run": self.dry_run,
+            "total_rows": self.total_rows,
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": sorted(self.errors, key=lambda error: error['row']),
+            "errors_truncated": self.failed > len(self.errors)
+        }
+
+
+async def import_patients(
+    chunks: AsyncIterator[bytes],
+    fmt: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    dry_run: bool = False,
+    storage=None
+) -> Dict:
+    """
+    Import patients from a CSV/NDJSON byte stream
+
+    Args:
+        chunks: Raw input bytes (request body stream or file reader)
+        fmt: "csv" (header row with uhid,name,phone,age,gender) or "ndjson"
+        chunk_size: Rows per insert_many
+        dry_run: Validate and check for existing UHIDs without writing
+        storage: PatientStorage to write to (default: the configured backend)
+
+    Returns:
+        Report with imported/failed counts and per-row errors
+    """
+    job = PatientImport(chunk_size=chunk_size, dry_run=dry_run, storage=storage)
+    async for row, record in iter_records(iter_lines(chunks), fmt):
+        await job.add(row, record)
+    await job.flush()
+
+    report = job.report()
+    print(f"📥 Patient import{' (dry run)' if dry_run else ''}: "
+          f"{report['imported']} imported, {report['failed']} failed of {report['total_rows']} rows")
+    return report
@@ -0,0 +1,263 @@
+"""
+Patient search keys (name prefix / fuzzy, phone suffix, UHID prefix)
+
+Every patient gets a list of search keys, stored next to it by each storage
+backend (MongoDB `patient_search` collection, SQLite `patient_search_keys`
+table, in-memory dict) and refreshed whenever the patient is written:
+
+- n:<prefix>   edge n-grams of each name token's phonetic form (prefix search)
+- f:<variant>  the phonetic token and every single-letter deletion of it
+               (fuzzy: two spellings within ~1-2 edits share a key)
+- p:<digits>   suffixes of the phone number (last 4..10 digits)
+- u:<prefix>   prefixes of the UHID
+
+Names are normalized before keys are built: Devanagari is transliterated to
+Latin, and common Hindi/English spelling variants collapse to one phonetic
+form (Sharma / शर्मा, Deepak / Dipak / दीपक, Priya / Pria / प्रिया), so
+every lookup is an exact match on an indexed key. A search reads at most
+SEARCH_CANDIDATES candidates and ranks them in Python.
+"""
+
+import os
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+
+SEARCH_CANDIDATES = int(os.environ.get('PATIENT_SEARCH_CANDIDATES', '200'))
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+# Patient fields the keys (and search results) are built from
+SEARCH_FIELDS = ("name", "phone", "uhid")
+SEARCH_RESULT_FIELDS = ("patient_id", "uhid", "name", "phone", "age", "gender", "created_at")
+
+MIN_PREFIX = 2
+MAX_PREFIX = 20
+MIN_FUZZY_TOKEN = 4
+MIN_PHONE_SUFFIX = 4
+PHONE_DIGITS = 10
+
+
+# ==================== TRANSLITERATION ====================
+
+_DEVANAGARI_VOWELS = {
+    "अ": "a", "आ": "aa", "इ": "i", "ई": "ii", "उ": "u", "ऊ": "uu", "ऋ": "ri",
+    "ए": "e", "ऐ": "ai", "ओ": "o", "औ": "au", "ऑ": "o"
+}
+_DEVANAGARI_MATRAS = {
+    "ा": "aa", "ि": "i", "ी": "ii", "ु": "u", "ू": "uu", "ृ": "ri",
+    "े": "e", "ै": "ai", "ो": "o", "ौ": "au", "ॉ": "o"
+}
+_DEVANAGARI_CONSONANTS = {
+    "क": "k", "ख": "kh", "ग": "g", "घ": "gh", "ङ": "n",
+    "च": "ch", "छ": "chh", "ज": "j", "झ": "jh", "ञ": "n",
+    "ट": "t", "ठ": "th", "ड": "d", "ढ": "dh", "ण": "n",
+    "त": "t", "थ": "th", "द": "d", "ध": "dh", "न": "n",
+    "प": "p", "फ": "ph", "ब": "b", "भ": "bh", "म": "m",
+    "य": "y", "र": "r", "ल": "l", "व": "v",
+    "श": "sh", "ष": "sh", "स": "s", "ह": "h",
+    "क़": "q", "ख़": "kh", "ग़": "g", "ज़": "z", "ड़": "r", "ढ़": "rh", "फ़": "f", "य़": "y"
+}
+_NUKTA_FORMS = {"क": "क़", "ख": "ख़", "ग": "ग़", "ज": "ज़", "ड": "ड़", "ढ": "ढ़", "फ": "फ़", "य": "य़"}
+_VIRAMA, _NUKTA = "्", "़"
+_NASALS = {"ं": "n", "ँ": "n", "ः": "h"}
+
+
+def transliterate(text: str) -> str:
+    """Devanagari -> Latin (Hindi pronunciation, word-final schwa dropped); other text unchanged"""
+    out: List[str] = []
+    pending_schwa = False
+    for char in text:
+        if char == _NUKTA:
+            if out and pending_schwa:
+                # Re-map the previous consonant to its nukta form (ज + ़ -> ज़)
+                for plain, nukta in _NUKTA_FORMS.items():
+                    if out[-1] == _DEVANAGARI_CONSONANTS[plain]:
+                        out[-1] = _DEVANAGARI_CONSONANTS[nukta]
+                        break
+            continue
+        if char in _DEVANAGARI_CONSONANTS:
+            if pending_schwa:
+                out.append("a")
+            out.append(_DEVANAGARI_CONSONANTS[char])
+            pending_schwa = True
+        elif char in _DEVANAGARI_MATRAS:
+            out.append(_DEVANAGARI_MATRAS[char])
+            pending_schwa = False
+        elif char == _VIRAMA:
+            pending_schwa = False
+        elif char in _DEVANAGARI_VOWELS:
+            if pending_schwa:
+                out.append("a")
+            out.append(_DEVANAGARI_VOWELS[char])
+            pending_schwa = False
+        elif char in _NASALS:
+            if pending_schwa:
+                out.append("a")
+            out.append(_NASALS[char])
+            pending_schwa = False
+        else:
+            # Word boundary: the final inherent vowel is silent (राम -> ram)
+            pending_schwa = False
+            out.append(char)
+    return "".join(out)
+
+
+# ==================== NORMALIZATION ====================
+
+# Applied in order; collapses Hindi/English spelling variants
+_PHONETIC_RULES = [
+    (re.compile(r"aa"), "a"), (re.compile(r"ee|ii"), "i"), (re.compile(r"oo|uu"), "u"),
+    (re.compile(r"ph"), "f"), (re.compile(r"w"), "v"), (re.compile(r"z"), "j"),
+    (re.compile(r"q|ck"), "k"), (re.compile(r"x"), "ks"),
+    (re.compile(r"(?<=[kgcjtdpbs])h"), ""),
+    (re.compile(r"y"), "i"),
+    (re.compile(r"(.)\1+"), r"\1"),
+]
+
+
+def name_tokens(name: Optional[str]) -> List[str]:
+    """Lower-case Latin tokens of a name (Devanagari transliterated, accents stripped)"""
+    text = unicodedata.normalize("NFKD", transliterate(unicodedata.normalize("NFC", name or "")))
+    text = "".join(char for char in text if not unicodedata.combining(char)).lower()
+    return [token for token in re.split(r"[^a-z0-9]+", text) if token]
+
+
+def phonetic(token: str) -> str:
+    """Phonetic form of one name token (Sharma, Sharmaa, शर्मा -> sarm)"""
+    for pattern, replacement in _PHONETIC_RULES:
+        token = pattern.sub(replacement, token)
+    if len(token) > 3 and token.endswith("a"):
+        token = token[:-1]
+    return token
+
+
+@lru_cache(maxsize=65536)
+def phonetic_tokens(name: Optional[str]) -> Tuple[str, ...]:
+    """Phonetic forms of a name's tokens (cached: ranking sees the same common names over and over)"""
+    return tuple(phonetic(token) for token in name_tokens(name))
+
+
+def phone_digits(phone: Optional[str]) -> str:
+    """Last PHONE_DIGITS digits of a phone number (drops +91, spaces, dashes)"""
+    return re.sub(r"\D", "", phone or "")[-PHONE_DIGITS:]
+
+
+def _fuzzy_variants(token: str) -> Set[str]:
+    if len(token) < MIN_FUZZY_TOKEN:
+        return {token}
+    return {token} | {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+# ==================== INDEX KEYS ====================
+
+def search_keys(patient: Dict) -> List[str]:
+    """All search keys of a patient"""
+    keys: Set[str] = set()
+    for token in set(phonetic_tokens(patient.get('name'))):
+        keys.update(f"n:{token[:length]}" for length in range(MIN_PREFIX, min(len(token), MAX_PREFIX) + 1))
+        keys.update(f"f:{variant}" for variant in _fuzzy_variants(token))
+
+    digits = phone_digits(patient.get('phone'))
+    keys.update(f"p:{digits[-length:]}" for length in range(MIN_PHONE_SUFFIX, len(digits) + 1))
+
+    uhid = (patient.get('uhid') or "").upper()
+    keys.update(f"u:{uhid[:length]}" for length in range(MIN_PREFIX, min(len(uhid), MAX_PREFIX) + 1))
+    return sorted(keys)
+
+
+def search_summary(patient: Dict) -> Dict:
+    """The patient fields returned by search"""
+    return {field: patient.get(field) for field in SEARCH_RESULT_FIELDS}
+
+
+def search_document(patient: Dict) -> Dict:
+    """MongoDB patient_search document: summary fields plus keys"""
+    return {**search_summary(patient), "keys": search_keys(patient)}
+
+
+# ==================== QUERIES ====================
+
+def query_plan(query: str) -> List[List[List[str]]]:
+    """
+    Translate a search string into key lookups
+
+    Returns clauses (OR) of groups (AND) of keys (OR): a patient matches when,
+    for some clause, it has at least one key of every group in it.
+    """
+    query = query.strip()
+    clauses: List[List[List[str]]] = []
+
+    uhid = query.upper().replace(" ", "")
+    if len(uhid) >= MIN_PREFIX:
+        clauses.append([[f"u:{uhid[:MAX_PREFIX]}"]])
+
+    digits = re.sub(r"[\s\-+()]", "", query)
+    if digits.isdigit() and len(digits) >= MIN_PHONE_SUFFIX:
+        clauses.append([[f"p:{digits[-PHONE_DIGITS:]}"]])
+
+    tokens = [phonetic(token) for token in name_tokens(query) if not token.isdigit()]
+    tokens = [token for token in tokens if len(token) >= MIN_PREFIX]
+    if tokens:
+        # Every token is the prefix of some name token ...
+        clauses.append([[f"n:{token[:MAX_PREFIX]}"] for token in tokens])
+        # ... or is within an edit or two of one
+        if any(len(token) >= MIN_FUZZY_TOKEN for token in tokens):
+            clauses.append([sorted(f"f:{variant}" for variant in _fuzzy_variants(token)) for token in tokens])
+    return clauses
+
+
+def driving_group(clause: List[List[str]]) -> int:
+    """Index of the group of a clause expected to match the fewest patients (longer keys are rarer)"""
+    lengths = [min(len(key) for key in group) for group in clause]
+    return lengths.index(max(lengths))
+
+
+@lru_cache(maxsize=65536)
+def _similarity(query_token: str, name_tokens_: Tuple[str, ...]) -> float:
+    best = 0.0
+    for token in name_tokens_:
+        if token == query_token:
+            return 1.0
+        if token.startswith(query_token):
+            best = max(best, 0.9)
+        else:
+            best = max(best, 0.7 * SequenceMatcher(None, query_token, token).ratio())
+    return best
+
+
+def rank(query: str, candidates: List[Dict], limit: int) -> List[Dict]:
+    """
+    Score and order candidate patients for a query
+
+    Each result gets `match` (uhid / phone / name / fuzzy) and `score` (0-100).
+    """
+    query = query.strip()
+    uhid = query.upper().replace(" ", "")
+    digits = re.sub(r"[\s\-+()]", "", query)
+    digits = digits[-PHONE_DIGITS:] if digits.isdigit() and len(digits) >= MIN_PHONE_SUFFIX else ""
+    tokens = [phonetic(token) for token in name_tokens(query) if not token.isdigit()]
+
+    results = []
+    for patient in candidates:
+        scores = []
+        patient_uhid = (patient.get('uhid') or "").upper()
+        if patient_uhid and len(uhid) >= MIN_PREFIX and patient_uhid.startswith(uhid):
+            scores.append((100 if patient_uhid == uhid else 90, "uhid"))
+        if digits and phone_digits(patient.get('phone')).endswith(digits):
+            scores.append((80, "phone"))
+        if tokens:
+            patient_tokens = phonetic_tokens(patient.get('name'))
+            similarity = sum(_similarity(token, patient_tokens) for token in tokens) / len(tokens)
+            # One letter off in a short name (Sharma / Varma) stays below the cut
+            if similarity >= 0.55:
+                scores.append((round(75 * similarity), "name" if similarity >= 0.9 else "fuzzy"))
+        if scores:
+            score, match = max(scores)
+            results.append({**search_summary(patient), "match": match, "score": score})
+
+    results.sort(key=lambda result: (-result["score"], result.get("name") or "", result["patient_id"]))
+    return results[:limit]
@@ -0,0 +1,153 @@
+"""
+Named projection profiles for heavy collections
+
+Lists and summaries should not drag raw transcripts or full OCR extractions
+over the wire. Routes pick a profile (`view`) or an explicit `fields` list
+and the projection is pushed down to MongoDB.
+
+- summary:  identifiers, dates and one-line clinical context
+- clinical: everything a doctor reads (SOAP note, extracted prescription),
+            without raw transcripts
+- full:     the complete stored document
+"""
+
+import copy
+import re
+from typing import Dict, Iterable, List, Optional
+
+from app.models.schemas import ProjectionView
+
+
+PROFILES = {
+    "notes": {
+        ProjectionView.SUMMARY: [
+            "note_id", "patient_id", "created_at", "audio_file",
+            "soap_note.chief_complaint", "soap_note.assessment", "soap_note.language"
+        ],
+        ProjectionView.CLINICAL: [
+            "note_id", "patient_id", "created_at", "updated_at", "audio_file", "soap_note"
+        ]
+    },
+    "documents": {
+        ProjectionView.SUMMARY: [
+            "document_id", "patient_id", "batch_id", "status", "uploaded_at",
+            "image_file", "image_url", "thumbnail_url", "preview_url",
+            "extracted_data.doctor_name", "extracted_data.date", "extracted_data.diagnosis"
+        ],
+        ProjectionView.CLINICAL: [
+            "document_id", "patient_id", "batch_id", "status", "uploaded_at",
+            "image_file", "image_url", "thumbnail_url", "preview_url", "extracted_data"
+        ]
+    },
+    "history": {
+        ProjectionView.SUMMARY: [
+            "history_id", "patient_id", "created_at", "type", "image_file", "batch_id",
+            "prescription_data.doctor_name", "prescription_data.date", "prescription_data.diagnosis",
+            "timeline_summary", "document_count"
+        ],
+        ProjectionView.CLINICAL: [
+            "history_id", "patient_id", "created_at", "type", "image_file", "batch_id",
+            "prescription_data", "timeline_summary", "document_count", "event_count",
+            "current_medications_count"
+        ]
+    }
+}
+
+FIELD_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$')
+
+
+class InvalidProjection(ValueError):
+    """Raised when a `fields` list contains an invalid field path"""
+    pass
+
+
+def _drop_nested(paths: Iterable[str]) -> List[str]:
+    """Remove paths already covered by a parent (Mongo rejects path collisions)"""
+    unique = sorted(set(paths))
+    kept = []
+    for path in unique:
+        if not any(path.startswith(parent + ".") for parent in kept):
+            kept.append(path)
+    return kept
+
+
+def build_projection(
+    collection: str,
+    view: Optional[ProjectionView] = None,
+    fields: Optional[str] = None,
+    required: Iterable[str] = ()
+) -> Dict:
+    """
+    Build a Mongo projection for a collection
+
+    Args:
+        collection: Key in PROFILES (notes, documents, history)
+        view: Named profile; None or FULL returns every field
+        fields: Comma-separated field paths, overrides `view`
+        required: Fields that must always be included (e.g. pagination keys)
+
+    Returns:
+        Projection dict (always excludes `_id`)
+    """
+    if fields:
+        paths = [f.strip() for f in fields.split(",") if f.strip()]
+        for path in paths:
+            if not FIELD_PATTERN.match(path):
+                raise InvalidProjection(f"Invalid field: {path}")
+    elif view and view != ProjectionView.FULL:
+        paths = PROFILES[collection][view]
+    else:
+        return {"_id": 0}
+
+    projection = {path: 1 for path in _drop_nested(list(paths) + list(required))}
+    projection["_id"] = 0
+    return projection
+
+
+# ==================== IN-PROCESS PROJECTION ====================
+# For backends without server-side projection (SQLite, in-memory)
+
+def get_path(document: Dict, path: str):
+    """Value at a dotted path, and whether it exists"""
+    for part in path.split("."):
+        if not isinstance(document, dict) or part not in document:
+            return None, False
+        document = document[part]
+    return document, True
+
+
+def set_path(document: Dict, path: str, value):
+    """$set semantics for dotted paths (creates intermediate dicts)"""
+    *parents, leaf = path.split(".")
+    for part in parents:
+        if not isinstance(document.get(part), dict):
+            document[part] = {}
+        document = document[part]
+    document[leaf] = value
+
+
+def apply_projection(document: Optional[Dict], projection: Optional[Dict]) -> Optional[Dict]:
+    """Apply a Mongo-style inclusion or exclusion projection to a document"""
+    if document is None or not projection:
+        return document
+    fields = {path: value for path, value in projection.items() if path != "_id"}
+    if not fields:
+        return document
+
+    if any(fields.values()):
+        projected = {}
+        for path in fields:
+            value, found = get_path(document, path)
+            if found:
+                set_path(projected, path, value)
+        return projected
+
+    projected = copy.deepcopy(document)
+    for path in fields:
+        *parents, leaf = path.split(".")
+        target = projected
+        for part in parents:
+            target = target.get(part) if isinstance(target, dict) else None
+        if isinstance(target, dict):
+            target.pop(leaf, None)
+    return projected
@@ -0,0 +1,210 @@
+"""
+Live queue events for the waiting-room screen, nurse app and doctor dashboard
+
+Instead of polling GET /queue, clients subscribe (SSE or WebSocket) and get a
+snapshot followed by compact delta events:
+
+- added:   a patient joined the queue
+- status:  an entry changed status
+- removed: an entry left the hot queue (archived)
+- resync:  reload the snapshot (change stream deletes, or a lagging client)
+
+Events come from an in-process bus fed by MongoDBStorage writes (standalone,
+single worker) or from a change stream on `queue` (QUEUE_EVENTS_SOURCE=
+change_stream, requires a replica set) so every worker sees every write.
+
+Every event carries an `id` ("<epoch>-<seq>"). Clients reconnect with the
+last id they saw and receive the missed events from a replay buffer, or a
+fresh snapshot if the id is too old or from another process.
+"""
+
+import asyncio
+import json
+import os
+import uuid
+from collections import deque
+from typing import Dict, List, Optional
+
+from app.services.timestamps import json_default
+
+
+QUEUE_EVENTS_SOURCE = os.environ.get('QUEUE_EVENTS_SOURCE', 'local')  # local | change_stream
+QUEUE_EVENTS_BUFFER = int(os.environ.get('QUEUE_EVENTS_BUFFER', '1000'))
+SUBSCRIBER_QUEUE_SIZE = 256
+
+# Fields sent with "added" events (everything a queue row needs to render)
+ADDED_FIELDS = ["queue_id", "patient_id", "patient_name", "token_number", "priority", "status", "added_at"]
+# Timestamp fields that may accompany a status change
+STATUS_FIELDS = ["started_at", "completed_at", "nurse_completed_at", "timeline_ready_at", "cancelled_at"]
+
+
+class SubscriberLagged(Exception):
+    """Raised to a subscriber that fell too far behind; it should resync from a snapshot"""
+    pass
+
+
+class QueueEventBus:
+    """Fan-out of queue deltas to live subscribers with a bounded replay buffer"""
+
+    def __init__(self, buffer_size: int = QUEUE_EVENTS_BUFFER):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.buffer: deque = deque(maxlen=buffer_size)
+        self.subscribers: List[asyncio.Queue] = []
+        self._watch_task: Optional[asyncio.Task] = None
+        self._change_stream_token = None
+
+    @property
+    def source(self) -> str:
+        return "change_stream" if self._watch_task is not None else "local"
+
+    @property
+    def last_event_id(self) -> str:
+        return f"{self.epoch}-{self.seq}"
+
+    # ==================== PUBLISHING ====================
+
+    def publish(self, event: Dict) -> Dict:
+        """Assign an id, buffer the event and deliver it to every subscriber"""
+        self.seq += 1
+        event = {"id": f"{self.epoch}-{self.seq}", **event}
+        self.buffer.append(event)
+
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow consumer: drop its backlog and tell it to resync
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(SubscriberLagged())
+        return event
+
+    def entry_added(self, entry: Dict):
+        """Storage hook: a queue entry was inserted (ignored when a change stream is the source)"""
+        if QUEUE_EVENTS_SOURCE != "change_stream":
+            self.publish(added_event(entry))
+
+    def status_changed(self, entry: Dict):
+        """Storage hook: a queue entry's status changed"""
+        if QUEUE_EVENTS_SOURCE != "change_stream":
+            self.publish(status_event(entry))
+
+    def entries_removed(self, queue_ids: List[str]):
+        """Storage hook: entries left the hot queue"""
+        if QUEUE_EVENTS_SOURCE != "change_stream":
+            for queue_id in queue_ids:
+                self.publish({"type": "removed", "queue_id": queue_id})
+
+    # ==================== SUBSCRIBING ====================
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self.subscribers:
+            self.subscribers.remove(queue)
+
+    def events_after(self, last_event_id: Optional[str]) -> Optional[List[Dict]]:
+        """
+        Buffered events after `last_event_id`
+
+        Returns None when the id cannot be resumed (other process, or older
+        than the replay buffer) - the client needs a snapshot instead.
+        """
+        if not last_event_id:
+            return None
+        try:
+            epoch, seq = last_event_id.rsplit("-", 1)
+            seq = int(seq)
+        except ValueError:
+            return None
+        if epoch != self.epoch or seq > self.seq:
+            return None
+
+        oldest = int(self.buffer[0]["id"].rsplit("-", 1)[1]) if self.buffer else self.seq + 1
+        if seq < oldest - 1:
+            return None
+        return [event for event in self.buffer if int(event["id"].rsplit("-", 1)[1]) > seq]
+
+    # ==================== CHANGE STREAM ====================
+
+    def start(self, collection):
+        """Watch the queue collection (only when QUEUE_EVENTS_SOURCE=change_stream)"""
+        if QUEUE_EVENTS_SOURCE == "change_stream" and self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch(collection))
+
+    async def stop(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    async def _watch(self, collection):
+        while True:
+            try:
+                async with collection.watch(
+                    full_document='updateLookup',
+                    resume_after=self._change_stream_token
+                ) as stream:
+                    print("📡 Queue events watching change stream")
+                    async for change in stream:
+                        self._change_stream_token = stream.resume_token
+                        event = change_to_event(change)
+                        if event is None:
+                            continue
+                        if event["type"] == "resync" and self.buffer and self.buffer[-1]["type"] == "resync":
+                            continue  # One resync per burst of deletes (archive runs in chunks)
+                        self.publish(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Queue change stream error: {e}")
+                await asyncio.sleep(2)
+
+
+def added_event(entry: Dict) -> Dict:
+    return {"type": "added", **{field: entry.get(field) for field in ADDED_FIELDS}}
+
+
+def status_event(entry: Dict) -> Dict:
+    event = {"type": "status", "queue_id": entry.get("queue_id"), "status": entry.get("status")}
+    event.update({field: entry[field] for field in STATUS_FIELDS if entry.get(field)})
+    return event
+
+
+def change_to_event(change: Dict) -> Optional[Dict]:
+    """Translate a MongoDB change stream document into a queue delta"""
+    operation = change.get("operationType")
+    document = change.get("fullDocument") or {}
+
+    if operation in ("insert", "replace") and document:
+        return added_event(document)
+    if operation == "update" and document:
+        updated = change.get("updateDescription", {}).get("updatedFields", {})
+        if "status" in updated or any(field in updated for field in STATUS_FIELDS):
+            return status_event(document)
+        return None
+    if operation == "delete":
+        # Deletes only carry _id, which clients never see - ask them to reload a snapshot
+        return {"type": "resync"}
+    return None
+
+
+def sse_message(event: Dict, event_type: Optional[str] = None) -> str:
+    """Format an event for text/event-stream"""
+    lines = []
+    if event.get("id"):
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event_type or event.get('type', 'message')}")
+    lines.append(f"data: {json.dumps(event, default=json_default)}")
+    return "\n".join(lines) + "\n\n"
+
+
+# Singleton instance
+queue_events = QueueEventBus()
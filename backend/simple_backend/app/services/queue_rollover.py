@@ -0,0 +1,77 @@
+"""
+Daily queue rollover
+
+Keeps the hot `queue` collection down to the current day's working set:
+on startup and shortly after every clinic midnight, finished entries from
+previous days are moved to `queue_archive`.
+"""
+
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from app.services.storage_backend import get_storage
+from app.services.timestamps import CLINIC_TZ, utc_now
+
+
+QUEUE_ROLLOVER_ENABLED = os.environ.get('QUEUE_ROLLOVER_ENABLED', 'true').lower() == 'true'
+# Seconds after midnight to run, so late consultations can still be closed
+QUEUE_ROLLOVER_DELAY = int(os.environ.get('QUEUE_ROLLOVER_DELAY', '300'))
+
+
+def seconds_until_next_rollover(now: Optional[datetime] = None) -> float:
+    """Seconds from `now` until the next clinic midnight + QUEUE_ROLLOVER_DELAY"""
+    now = now or datetime.now(CLINIC_TZ)
+    next_run = datetime.combine(now.date(), datetime.min.time(), tzinfo=now.tzinfo) + timedelta(seconds=QUEUE_ROLLOVER_DELAY)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+class QueueRolloverJob:
+    """Background task archiving yesterday's finished queue entries"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.last_run_at: Optional[datetime] = None
+        self.last_archived = 0
+
+    def start(self):
+        """Start the job (no-op if disabled or already running)"""
+        if QUEUE_ROLLOVER_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            print("🗓️ Queue rollover job started")
+
+    async def stop(self):
+        """Cancel the job and wait for it to exit"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> int:
+        """Archive finished entries from previous days now"""
+        archived = await get_storage().rollover_queue()
+        self.last_run_at = utc_now()
+        self.last_archived = archived
+        print(f"🗄️ Queue rollover: archived {archived} finished entries")
+        return archived
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Never let a failed run stop tomorrow's rollover
+                print(f"⚠️ Queue rollover failed: {e}")
+            await asyncio.sleep(seconds_until_next_rollover())
+
+
+# Singleton instance
+queue_rollover = QueueRolloverJob()
@@ -0,0 +1,299 @@
+"""
+Incrementally maintained patient report state
+
+GET /report used to load every note, prescription and the queue entry of a
+patient and recompute all statistics per request. Each patient now has one
+`report_state` record that note inserts, history inserts and queue
+transitions update in place, so a report is two reads (patient + state):
+
+    {
+        patient_id, visits, prescriptions,
+        first_visit_time, last_visit_time,                  # Unix seconds
+        latest: {timestamp, note_id, complaint, assessment},
+        complaints / assessments / plans / soap_medications / languages /
+        medications / doctors: {key: {"item": text, "count": n}},
+        recent_visits: newest REPORT_RECENT_VISITS {timestamp, id, complaint, subjective},
+        timeline: newest REPORT_TIMELINE_SIZE consultation / prescription events,
+                                                            # both sorted by "order" (timestamp:id)
+        queue: {queue_id, status, token_number} of the patient's hot queue entry,
+        version                                             # +1 on every update
+    }
+
+Updates are MongoDB update documents ($inc, $min, $max, $set, $push with
+$each/$sort/$slice); SQLite and the JSON store apply the same documents with
+apply_update(), so all backends hold identical state. Tallies are keyed by
+a hash of the text (free text may contain "." or "$"). Times are Unix
+seconds so the state is plain JSON everywhere.
+
+Writes only update existing states: a patient's state is built from their
+records (build_state) the first time a report needs it and inserted only if
+no other request created it meanwhile. A write landing between reading the
+records and storing the state would be lost (or counted twice), so the
+stored counts are then re-checked against the records and the state is
+rebuilt if they differ - replaced only while its version is still the one
+that was read, so no concurrent update is overwritten.
+`GET /report?verify=true` recomputes it from scratch and reports any drift.
+"""
+
+import copy
+import hashlib
+import os
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from app.services.pagination import sort_key
+from app.services.projections import get_path, set_path
+from app.services.timestamps import parse_timestamp
+
+
+REPORT_TIMELINE_SIZE = int(os.environ.get('REPORT_TIMELINE_SIZE', '20'))
+REPORT_RECENT_VISITS = 5
+
+# Tallied text fields, rendered as "top N" lists
+TALLY_FIELDS = ("complaints", "assessments", "plans", "soap_medications", "languages", "medications", "doctors")
+
+# Fields the report needs from each note (loaded only to build a state)
+REPORT_NOTE_PROJECTION = {"_id": 0, "note_id": 1, "created_at": 1, "soap_note": 1}
+
+# One sort key: (timestamp, id) as text, so every MongoDB implementation orders alike
+_NEWEST_FIRST = {"order": -1}
+
+# Rebuilds of a state that concurrent writes keep invalidating before giving up (verify repairs it later)
+REPORT_STATE_ATTEMPTS = 3
+
+
+def unix_time(value) -> int:
+    """Unix seconds of a timestamp (0 if missing or unparseable)"""
+    try:
+        parsed = parse_timestamp(value)
+    except (TypeError, ValueError):
+        return 0
+    return int(parsed.timestamp()) if parsed else 0
+
+
+def tally_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def medication_name(medication) -> str:
+    return medication.get('name', str(medication)) if isinstance(medication, dict) else str(medication)
+
+
+def _tally(update: Dict, field: str, items: Iterable):
+    for item, count in Counter(str(item) for item in items if item).items():
+        key = tally_key(item)
+        update["$inc"][f"{field}.{key}.count"] = count
+        update["$set"][f"{field}.{key}.item"] = item
+
+
+def _push_newest(update: Dict, field: str, item: Dict, size: int):
+    item["order"] = f"{item['timestamp']:012d}:{item['id'] or ''}"
+    update["$push"][field] = {"$each": [item], "$sort": dict(_NEWEST_FIRST), "$slice": size}
+
+
+def _finish(update: Dict) -> Dict:
+    """Drop empty operators (MongoDB rejects them) and bump the state's version"""
+    update = {operator: fields for operator, fields in update.items() if fields}
+    update.setdefault("$inc", {})["version"] = 1
+    return update
+
+
+# ==================== UPDATES ====================
+
+def note_update(note: Dict) -> Dict:
+    """Counts, tallies, visit range, recent visits and timeline for one new note"""
+    timestamp = unix_time(note.get('created_at'))
+    soap = note.get('soap_note') or {}
+    update = {"$inc": {"visits": 1}, "$set": {}, "$min": {"first_visit_time": timestamp},
+              "$max": {"last_visit_time": timestamp}, "$push": {}}
+    _tally(update, "complaints", [soap.get('chief_complaint')])
+    _tally(update, "assessments", [soap.get('assessment')])
+    _tally(update, "plans", [soap.get('plan')])
+    _tally(update, "soap_medications", [medication_name(m) for m in soap.get('medications') or []])
+    _tally(update, "languages", [soap.get('language', 'unknown')])
+    _push_newest(update, "recent_visits", {
+        "timestamp": timestamp,
+        "id": note.get('note_id'),
+        "complaint": soap.get('chief_complaint', 'Not documented'),
+        "subjective": (soap.get('subjective') or '')[:100]
+    }, REPORT_RECENT_VISITS)
+    _push_newest(update, "timeline", {
+        "type": "consultation",
+        "timestamp": timestamp,
+        "id": note.get('note_id'),
+        "chief_complaint": soap.get('chief_complaint', 'Not documented'),
+        "assessment": soap.get('assessment', 'Not documented'),
+        "plan": soap.get('plan', 'Not documented'),
+        "medications": soap.get('medications', []),
+        "language": soap.get('language', 'unknown')
+    }, REPORT_TIMELINE_SIZE)
+    return _finish(update)
+
+
+def latest_note_update(note: Dict) -> Dict:
+    """Make this note the latest one (apply only where latest_note_filter matches)"""
+    soap = note.get('soap_note') or {}
+    return _finish({"$set": {"latest": {
+        "timestamp": unix_time(note.get('created_at')),
+        "note_id": note.get('note_id'),
+        "complaint": soap.get('chief_complaint'),
+        "assessment": soap.get('assessment')
+    }}})
+
+
+def latest_note_filter(note: Dict) -> Dict:
+    """MongoDB condition: the state's latest note is not newer than this one"""
+    timestamp = unix_time(note.get('created_at'))
+    return {"$or": [
+        {"latest.timestamp": None},
+        {"latest.timestamp": {"$lt": timestamp}},
+        {"latest.timestamp": timestamp, "latest.note_id": {"$lte": note.get('note_id')}}
+    ]}
+
+
+def history_update(entry: Dict) -> Dict:
+    """Counts, medication / doctor tallies and timeline for one new history entry"""
+    prescription = entry.get('prescription_data') or {}
+    medications = prescription.get('medications') or []
+    doctor = prescription.get('doctor_name')
+    update = {"$inc": {"prescriptions": 1}, "$set": {}, "$push": {}}
+    _tally(update, "medications", [medication_name(m) for m in medications if m])
+    _tally(update, "doctors", [doctor] if doctor and doctor != 'Unknown' else [])
+    _push_newest(update, "timeline", {
+        "type": "prescription",
+        "timestamp": unix_time(entry.get('created_at')),
+        "id": entry.get('history_id'),
+        "doctor": prescription.get('doctor_name', 'Unknown'),
+        "diagnosis": prescription.get('diagnosis', 'Not specified'),
+        "medications": medications,
+        "image_url": entry.get('image_url')
+    }, REPORT_TIMELINE_SIZE)
+    return _finish(update)
+
+
+def queue_update(entry: Dict) -> Dict:
+    """The patient's current queue entry (on add; on status change only for that entry)"""
+    return _finish({"$set": {"queue": {
+        "queue_id": entry.get('queue_id'),
+        "status": entry.get('status'),
+        "token_number": entry.get('token_number')
+    }}})
+
+
+# Archived entries leave the hot queue
+QUEUE_CLEARED = _finish({"$set": {"queue": None}})
+
+
+# ==================== IN-PROCESS STATES ====================
+
+def apply_update(document: Dict, update: Dict) -> Dict:
+    """Apply a MongoDB update document (the subset used above) to a state in place"""
+    for path, value in update.get("$set", {}).items():
+        set_path(document, path, copy.deepcopy(value))
+    for path, value in update.get("$inc", {}).items():
+        current, _ = get_path(document, path)
+        set_path(document, path, (current or 0) + value)
+    for path, value in update.get("$min", {}).items():
+        current, found = get_path(document, path)
+        if not found or value < current:
+            set_path(document, path, value)
+    for path, value in update.get("$max", {}).items():
+        current, found = get_path(document, path)
+        if not found or value > current:
+            set_path(document, path, value)
+    for path, spec in update.get("$push", {}).items():
+        current, _ = get_path(document, path)
+        items = list(current or []) + copy.deepcopy(spec["$each"])
+        for field, direction in reversed(list(spec.get("$sort", {}).items())):
+            items.sort(key=lambda item: sort_key(item.get(field)), reverse=direction < 0)
+        if "$slice" in spec:
+            items = items[:spec["$slice"]]
+        set_path(document, path, items)
+    return document
+
+
+def empty_state(patient_id: str) -> Dict:
+    return {"patient_id": patient_id, "visits": 0, "prescriptions": 0}
+
+
+def apply_note(state: Dict, note: Dict):
+    apply_update(state, note_update(note))
+    latest = state.get('latest') or {}
+    timestamp = unix_time(note.get('created_at'))
+    if not latest or (latest['timestamp'], latest['note_id'] or "") <= (timestamp, note.get('note_id') or ""):
+        apply_update(state, latest_note_update(note))
+
+
+def apply_history(state: Dict, entry: Dict):
+    apply_update(state, history_update(entry))
+
+
+def apply_queue(state: Dict, entry: Dict, added: bool = False):
+    if added or (state.get('queue') or {}).get('queue_id') == entry.get('queue_id'):
+        apply_update(state, queue_update(entry))
+
+
+def clear_queue(state: Dict, queue_ids: Iterable[str]):
+    if (state.get('queue') or {}).get('queue_id') in set(queue_ids):
+        apply_update(state, QUEUE_CLEARED)
+
+
+def build_state(patient_id: str, notes: List[Dict], history: List[Dict], queue_entry: Optional[Dict]) -> Dict:
+    """A patient's state computed from all their records"""
+    state = empty_state(patient_id)
+    for note in notes:
+        apply_note(state, note)
+    for entry in history:
+        apply_history(state, entry)
+    if queue_entry:
+        apply_queue(state, queue_entry, added=True)
+    return state
+
+
+def state_drift(stored: Dict, rebuilt: Dict) -> Dict:
+    """{field: {"stored": ..., "rebuilt": ...}} for every top-level field that differs"""
+    fields = (set(stored) | set(rebuilt)) - {"_id", "patient_id", "version"}
+    return {
+        field: {"stored": stored.get(field), "rebuilt": rebuilt.get(field)}
+        for field in sorted(fields)
+        if stored.get(field) != rebuilt.get(field)
+    }
+
+
+# ==================== LOADING ====================
+
+async def _state_from_records(storage, patient_id: str) -> Dict:
+    notes = await storage.get_patient_notes(patient_id, REPORT_NOTE_PROJECTION)
+    history = await storage.get_patient_history(patient_id)
+    queue_entry = await storage.get_patient_queue_entry(patient_id)
+    return build_state(patient_id, notes, history, queue_entry)
+
+
+async def replace_report_state(storage, stored: Dict, rebuilt: Dict) -> bool:
+    """Replace the stored state with a rebuilt one unless an update changed it since it was read"""
+    rebuilt['version'] = (stored.get('version') or 0) + 1
+    return await storage.replace_report_state(rebuilt, stored.get('version'))
+
+
+async def settle_report_state(storage, patient_id: str) -> Optional[Dict]:
+    """Re-read a just-written state until its counts agree with the records, rebuilding it if not"""
+    state = await storage.get_report_state(patient_id)
+    for _ in range(REPORT_STATE_ATTEMPTS):
+        rebuilt = await _state_from_records(storage, patient_id)
+        if state is None:
+            await storage.create_report_state(rebuilt)
+        elif (state['visits'], state['prescriptions']) == (rebuilt['visits'], rebuilt['prescriptions']):
+            return state
+        else:
+            await replace_report_state(storage, state, rebuilt)
+        state = await storage.get_report_state(patient_id)
+    return state
+
+
+async def load_report_state(storage, patient_id: str) -> Dict:
+    """The patient's report state, built from their records if it does not exist yet"""
+    state = await storage.get_report_state(patient_id)
+    if state is not None:
+        return state
+    await storage.create_report_state(await _state_from_records(storage, patient_id))
+    return await settle_report_state(storage, patient_id)
@@ -0,0 +1,1210 @@
+"""
+SQLite Storage Service for single-box (offline) PHC deployments
+
+Implements the same interface as MongoDBStorage (patients, queue, notes,
+history) plus the document/batch/timeline/upload-session methods of
+MongoService, on one SQLite database in WAL mode:
+
+- every record is stored as JSON in a `data` column, with the fields that are
+  queried or sorted on extracted into indexed columns
+- writes go through one connection under a lock, each in its own transaction
+- reads use one connection per worker thread, so readers never block on
+  (or block) the writer
+- timestamps are stored in the canonical text form of timestamps.py (UTC,
+  fixed width, so text order is time order) and read back as datetimes
+
+All sqlite3 calls run in worker threads (asyncio.to_thread), keeping the
+event loop free.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.services.mongodb_storage import ARCHIVE_CHUNK_SIZE, FACILITY_ID
+from app.services.pagination import (
+    encode_cursor, decode_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, DEFAULT_CHANGES_PAGE_SIZE, MAX_CHANGES_PAGE_SIZE
+)
+from app.services.patient_activity import note_activity, history_activity, rebuilt_activity
+from app.services.patient_search import (
+    SEARCH_CANDIDATES, SEARCH_FIELDS, DEFAULT_SEARCH_LIMIT, search_keys, query_plan, driving_group, rank
+)
+from app.services.projections import apply_projection, get_path, set_path
+from app.services.queue_events import queue_events
+from app.services.report_state import apply_note, apply_history, apply_queue, clear_queue
+from app.services.stats_service import (
+    STATS_COUNTER_PREFIX, PATIENT_STATS_FIELDS, finish_status_counts, patient_stats_delta, queue_stats_delta,
+    combine_deltas, stats_to_counters, stats_from_counters, counters_drift
+)
+from app.services.storage_protocol import ACTIVE_QUEUE_STATUSES, FINISHED_QUEUE_STATUSES, CHANGE_FEEDS, DuplicateQueueEntry
+from app.services.text_compression import pack_note_texts, unpack_note_texts
+from app.services.timestamps import (
+    utc_now, to_iso, json_default, clinic_today, clinic_day_start, upgrade_timestamps, decode_timestamps
+)
+
+
+SQLITE_PATH = os.environ.get('SQLITE_PATH', '/app/data/phc.db')
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+_ACTIVE_IN = ", ".join(f"'{status}'" for status in ACTIVE_QUEUE_STATUSES)
+_STATS_LIKE = STATS_COUNTER_PREFIX + "%"
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS patients (
+    patient_id TEXT PRIMARY KEY,
+    uhid TEXT UNIQUE,
+    status TEXT,
+    gender TEXT,
+    created_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS patients_created ON patients (created_at DESC, patient_id DESC);
+CREATE INDEX IF NOT EXISTS patients_changes ON patients (json_extract(data, '$.updated_at'), patient_id);
+
+-- Patient search keys (see patient_search.py)
+CREATE TABLE IF NOT EXISTS patient_search_keys (
+    key TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    PRIMARY KEY (key, patient_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS patient_search_keys_patient ON patient_search_keys (patient_id);
+
+CREATE TABLE IF NOT EXISTS queue (
+    queue_id TEXT PRIMARY KEY,
+    patient_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    added_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS queue_patient ON queue (patient_id, added_at DESC);
+CREATE INDEX IF NOT EXISTS queue_status ON queue (status);
+CREATE INDEX IF NOT EXISTS queue_added ON queue (added_at, queue_id);
+-- At most one active entry per patient, enforced by the database
+CREATE UNIQUE INDEX IF NOT EXISTS queue_patient_active_unique ON queue (patient_id)
+    WHERE status IN ({_ACTIVE_IN});
+
+CREATE TABLE IF NOT EXISTS queue_archive (
+    queue_id TEXT PRIMARY KEY,
+    patient_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    added_at TEXT,
+    archived_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS queue_archive_patient ON queue_archive (patient_id, added_at DESC);
+CREATE INDEX IF NOT EXISTS queue_archive_added ON queue_archive (added_at, status);
+CREATE INDEX IF NOT EXISTS queue_archive_changes ON queue_archive (archived_at, queue_id);
+
+CREATE TABLE IF NOT EXISTS notes (
+    note_id TEXT PRIMARY KEY,
+    patient_id TEXT NOT NULL,
+    created_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notes_patient ON notes (patient_id, created_at DESC, note_id DESC);
+CREATE INDEX IF NOT EXISTS notes_created ON notes (created_at DESC, note_id DESC);
+CREATE INDEX IF NOT EXISTS notes_changes ON notes (json_extract(data, '$.updated_at'), note_id);
+
+-- Compressed transcripts (zstd BLOB), read only on request
+CREATE TABLE IF NOT EXISTS note_texts (
+    note_id TEXT PRIMARY KEY,
+    patient_id TEXT,
+    codec TEXT,
+    raw_size INTEGER,
+    stored_size INTEGER,
+    data BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS history (
+    history_id TEXT PRIMARY KEY,
+    patient_id TEXT NOT NULL,
+    created_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_patient ON history (patient_id, created_at DESC, history_id DESC);
+CREATE INDEX IF NOT EXISTS history_changes ON history (json_extract(data, '$.updated_at'), history_id);
+
+CREATE TABLE IF NOT EXISTS documents (
+    document_id TEXT PRIMARY KEY,
+    patient_id TEXT,
+    batch_id TEXT,
+    status TEXT,
+    uploaded_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_patient ON documents (patient_id, uploaded_at DESC, document_id DESC);
+CREATE INDEX IF NOT EXISTS documents_batch ON documents (batch_id, uploaded_at);
+CREATE INDEX IF NOT EXISTS documents_changes ON documents (json_extract(data, '$.updated_at'), document_id);
+
+CREATE TABLE IF NOT EXISTS batches (
+    batch_id TEXT PRIMARY KEY,
+    patient_id TEXT,
+    status TEXT,
+    created_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS batches_patient_status ON batches (patient_id, status);
+CREATE INDEX IF NOT EXISTS batches_patient_created ON batches (patient_id, created_at DESC);
+
+-- Only the latest timeline per patient is kept
+CREATE TABLE IF NOT EXISTS timelines (
+    patient_id TEXT PRIMARY KEY,
+    generated_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timelines_generated ON timelines (generated_at DESC, patient_id DESC);
+
+-- Incrementally maintained report state, one per patient (see report_state.py)
+CREATE TABLE IF NOT EXISTS report_state (
+    patient_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    upload_id TEXT PRIMARY KEY,
+    patient_id TEXT,
+    status TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS upload_sessions_patient ON upload_sessions (patient_id);
+
+CREATE TABLE IF NOT EXISTS export_jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS counters (
+    counter_id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+"""
+
+# Indexed columns per table (the rest of a record only lives in `data`)
+COLUMNS = {
+    "patients": ["patient_id", "uhid", "status", "gender", "created_at"],
+    "queue": ["queue_id", "patient_id", "status", "added_at"],
+    "queue_archive": ["queue_id", "patient_id", "status", "added_at", "archived_at"],
+    "notes": ["note_id", "patient_id", "created_at"],
+    "history": ["history_id", "patient_id", "created_at"],
+    "documents": ["document_id", "patient_id", "batch_id", "status", "uploaded_at"],
+    "batches": ["batch_id", "patient_id", "status", "created_at"],
+    "timelines": ["patient_id", "generated_at"],
+    "report_state": ["patient_id"],
+    "upload_sessions": ["upload_id", "patient_id", "status"],
+    "export_jobs": ["job_id", "status"]
+}
+
+# Change feed timestamp per table: a column, or the JSON field behind an expression index
+CHANGE_COLUMNS = {
+    "patients": "json_extract(data, '$.updated_at')",
+    "notes": "json_extract(data, '$.updated_at')",
+    "history": "json_extract(data, '$.updated_at')",
+    "documents": "json_extract(data, '$.updated_at')",
+    "queue_archive": "archived_at"
+}
+
+
+# ==================== DOCUMENT HELPERS ====================
+
+def _sql_value(value):
+    """Datetime query parameters and indexed column values -> canonical text"""
+    return to_iso(value) if isinstance(value, datetime) else value
+
+
+def _dumps(document: Dict) -> str:
+    return json.dumps(document, default=json_default, ensure_ascii=False)
+
+
+def _loads(data: str) -> Dict:
+    document = json.loads(data)
+    decode_timestamps(document)
+    return document
+
+
+def _range(column: str, start, end) -> Tuple[str, List]:
+    """SQL condition (and params) for start <= column < end, either bound optional"""
+    conditions, params = [], []
+    if start is not None:
+        conditions.append(f"{column} >= ?")
+        params.append(to_iso(start))
+    if end is not None:
+        conditions.append(f"{column} < ?")
+        params.append(to_iso(end))
+    return " AND ".join(conditions), params
+
+
+def _group_by_patient(documents: List[Dict]) -> Dict[str, List[Dict]]:
+    grouped = {}
+    for document in documents:
+        grouped.setdefault(document['patient_id'], []).append(document)
+    return grouped
+
+
+class SQLiteStorage:
+    """SQLite (WAL) storage service with the MongoDBStorage interface"""
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self._writer: Optional[sqlite3.Connection] = None
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+
+    async def connect(self):
+        """Open the database, enable WAL and create tables/indexes"""
+        if self._writer is None:
+            await asyncio.to_thread(self._open)
+            print(f"✅ SQLite Storage connected ({self.path})")
+
+    async def disconnect(self):
+        """Close the writer and every reader connection"""
+        if self._writer is not None:
+            with self._readers_lock:
+                for connection in self._readers:
+                    connection.close()
+                self._readers = []
+            self._local = threading.local()
+            self._writer.close()
+            self._writer = None
+            print("🔌 SQLite Storage disconnected")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self.path,
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+            isolation_level=None,  # Transactions are explicit (BEGIN IMMEDIATE)
+            check_same_thread=False
+        )
+        connection.row_factory = sqlite3.Row
+        connection.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        return connection
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        writer = self._connection()
+        writer.execute("PRAGMA journal_mode = WAL")
+        # Durable at checkpoints; WAL keeps committed transactions safe on crash
+        writer.execute("PRAGMA synchronous = NORMAL")
+        writer.executescript(SCHEMA)
+        self._writer = writer
+
+    # ==================== LOW-LEVEL ACCESS ====================
+
+    def _reader(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._connection()
+            connection.execute("PRAGMA query_only = ON")
+            self._local.connection = connection
+            with self._readers_lock:
+                self._readers.append(connection)
+        return connection
+
+    async def _read(self, sql: str, params: Sequence = ()) -> List[sqlite3.Row]:
+        return await asyncio.to_thread(lambda: self._reader().execute(sql, params).fetchall())
+
+    async def _read_one(self, sql: str, params: Sequence = ()) -> Optional[sqlite3.Row]:
+        return await asyncio.to_thread(lambda: self._reader().execute(sql, params).fetchone())
+
+    async def _find(self, sql: str, params: Sequence = (), projection: Optional[Dict] = None) -> List[Dict]:
+        """Rows selected as `data` → projected documents"""
+        rows = await self._read(sql, params)
+        return [apply_projection(_loads(row["data"]), projection) for row in rows]
+
+    async def _find_one(self, sql: str, params: Sequence = (), projection: Optional[Dict] = None) -> Optional[Dict]:
+        row = await self._read_one(sql, params)
+        return apply_projection(_loads(row["data"]), projection) if row else None
+
+    async def _write(self, work: Callable[[sqlite3.Connection], object]):
+        """Run `work(connection)` in one write transaction (rolled back on error)"""
+        def run():
+            with self._write_lock:
+                self._writer.execute("BEGIN IMMEDIATE")
+                try:
+                    result = work(self._writer)
+                except BaseException:
+                    self._writer.execute("ROLLBACK")
+                    raise
+                self._writer.execute("COMMIT")
+                return result
+        return await asyncio.to_thread(run)
+
+    @staticmethod
+    def _row_values(table: str, document: Dict) -> List:
+        upgrade_timestamps(document)
+        return [_sql_value(document.get(column)) for column in COLUMNS[table]] + [_dumps(document)]
+
+    @staticmethod
+    def _insert(connection: sqlite3.Connection, table: str, document: Dict, verb: str = "INSERT"):
+        columns = COLUMNS[table] + ["data"]
+        connection.execute(
+            f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            SQLiteStorage._row_values(table, document)
+        )
+
+    @staticmethod
+    def _update(connection: sqlite3.Connection, table: str, key: str, value: str, updates: Dict,
+                push: Optional[Dict] = None, where: str = "") -> Optional[Dict]:
+        """Read-modify-write one record ($set / $push semantics); returns the updated record"""
+        row = connection.execute(f"SELECT data FROM {table} WHERE {key} = ? {where}", (value,)).fetchone()
+        if row is None:
+            return None
+        document = _loads(row["data"])
+        for path, field_value in updates.items():
+            set_path(document, path, field_value)
+        for path, item in (push or {}).items():
+            current, _ = get_path(document, path)
+            set_path(document, path, (current or []) + [item])
+
+        assignments = ", ".join(f"{column} = ?" for column in COLUMNS[table])
+        connection.execute(
+            f"UPDATE {table} SET {assignments}, data = ? WHERE {key} = ?",
+            SQLiteStorage._row_values(table, document) + [value]
+        )
+        return document
+
+    @staticmethod
+    def _bump_stats(connection: sqlite3.Connection, delta: Dict[str, int]):
+        """Apply a stats counter delta inside the caller's write transaction"""
+        connection.executemany(
+            "INSERT INTO counters (counter_id, seq) VALUES (?, ?) "
+            "ON CONFLICT (counter_id) DO UPDATE SET seq = seq + excluded.seq",
+            [(STATS_COUNTER_PREFIX + field, change) for field, change in delta.items()]
+        )
+
+    async def _fetch_page(
+        self,
+        table: str,
+        where: str,
+        params: Sequence,
+        sort_field: str,
+        id_field: str,
+        limit: int = DEFAULT_PAGE_SIZE,
+        after: Optional[str] = None,
+        descending: bool = True,
+        projection: Optional[Dict] = None
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """Keyset pagination with the same cursors as app.services.pagination.fetch_page"""
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        conditions = [where] if where else []
+        params = list(params)
+        if after:
+            sort_value, id_value = decode_cursor(after)
+            op = "<" if descending else ">"
+            # NULL sorts lowest (as in MongoDB): after every value when descending, before them ascending
+            if sort_value is None:
+                position = f"{sort_field} IS NULL AND {id_field} {op} ?"
+                conditions.append(f"({position})" if descending else f"({sort_field} IS NOT NULL OR ({position}))")
+                params += [id_value]
+            else:
+                position = f"{sort_field} {op} ? OR ({sort_field} = ? AND {id_field} {op} ?)"
+                conditions.append(f"({position} OR {sort_field} IS NULL)" if descending else f"({position})")
+                params += [_sql_value(sort_value), _sql_value(sort_value), id_value]
+
+        direction = "DESC" if descending else "ASC"
+        sql = (
+            f"SELECT data FROM {table}"
+            f"{' WHERE ' + ' AND '.join(conditions) if conditions else ''}"
+            f" ORDER BY {sort_field} {direction}, {id_field} {direction} LIMIT ?"
+        )
+        documents = await self._find(sql, params + [limit + 1])
+
+        next_cursor = None
+        if len(documents) > limit:
+            documents = documents[:limit]
+            last = documents[-1]
+            next_cursor = encode_cursor(last.get(sort_field), last.get(id_field))
+        return [apply_projection(document, projection) for document in documents], next_cursor
+
+    async def _changes_page(
+        self,
+        table: str,
+        since: Optional[str],
+        until: Optional[str],
+        limit: int,
+        after: Optional[str]
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """Change feed page with the same cursors as app.services.pagination.fetch_changes_page"""
+        change_field, id_field = CHANGE_FEEDS[table]
+        column = CHANGE_COLUMNS[table]
+        limit = max(1, min(limit, MAX_CHANGES_PAGE_SIZE))
+        conditions, params = [f"{column} IS NOT NULL"], []
+        if since is not None:
+            conditions.append(f"{column} > ?")
+            params.append(to_iso(since))
+        if until is not None:
+            conditions.append(f"{column} <= ?")
+            params.append(to_iso(until))
+        if after:
+            sort_value, id_value = decode_cursor(after)
+            conditions.append(f"({column} > ? OR ({column} = ? AND {id_field} > ?))")
+            params += [_sql_value(sort_value), _sql_value(sort_value), id_value]
+
+        documents = await self._find(
+            f"SELECT data FROM {table} WHERE {' AND '.join(conditions)} ORDER BY {column}, {id_field} LIMIT ?",
+            params + [limit + 1]
+        )
+        next_cursor = None
+        if len(documents) > limit:
+            documents = documents[:limit]
+            next_cursor = encode_cursor(documents[-1].get(change_field), documents[-1].get(id_field))
+        return documents, next_cursor
+
+    # ==================== PATIENTS ====================
+
+    async def get_all_patients(self) -> Dict:
+        """Get all patients as dict (for compatibility with JSON storage)"""
+        patients = await self._find("SELECT data FROM patients ORDER BY created_at DESC, patient_id DESC")
+        return {p['patient_id']: p for p in patients}
+
+    async def get_patients_page(self, limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of patients, newest first (keyset on created_at, patient_id)"""
+        return await self._fetch_page("patients", "", (), "created_at", "patient_id", limit, after)
+
+    async def get_patient(self, patient_id: str) -> Optional[Dict]:
+        """Get single patient by ID"""
+        return await self._find_one("SELECT data FROM patients WHERE patient_id = ?", (patient_id,))
+
+    async def get_patient_by_uhid(self, uhid: str) -> Optional[Dict]:
+        """Get patient by UHID"""
+        return await self._find_one("SELECT data FROM patients WHERE uhid = ?", (uhid,))
+
+    async def create_patient(self, patient_id: str, patient_data: Dict) -> Dict:
+        """Create new patient"""
+        patient_data['patient_id'] = patient_id
+        patient_data['created_at'] = patient_data.get('created_at', utc_now())
+        patient_data['updated_at'] = utc_now()
+
+        def work(connection):
+            self._insert(connection, "patients", patient_data)
+            self._index_patient(connection, patient_data)
+            self._bump_stats(connection, patient_stats_delta(patient_data))
+        await self._write(work)
+        return patient_data
+
+    async def insert_patients(self, patients: List[Dict]) -> Dict[int, str]:
+        """
+        Insert many patients in one transaction
+
+        Returns:
+            {index in `patients`: error message} for rows that were rejected
+            (e.g. UHID already registered); all other rows are inserted
+        """
+        def work(connection):
+            failures = {}
+            inserted = []
+            for index, patient in enumerate(patients):
+                try:
+                    self._insert(connection, "patients", patient)
+                    self._index_patient(connection, patient)
+                    inserted.append(patient)
+                except sqlite3.IntegrityError as e:
+                    if "uhid" in str(e):
+                        failures[index] = "uhid: UHID already registered"
+                    else:
+                        failures[index] = str(e)
+            self._bump_stats(connection, combine_deltas(*(patient_stats_delta(patient) for patient in inserted)))
+            return failures
+        return await self._write(work)
+
+    async def get_existing_uhids(self, uhids: List[str]) -> set:
+        """Which of these UHIDs are already registered (indexed lookups)"""
+        existing = set()
+        for start in range(0, len(uhids), 500):  # Stay below SQLite's bound-parameter limit
+            chunk = uhids[start:start + 500]
+            rows = await self._read(
+                f"SELECT uhid FROM patients WHERE uhid IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            existing.update(row["uhid"] for row in rows)
+        return existing
+
+    async def update_patient(self, patient_id: str, updates: Dict) -> Optional[Dict]:
+        """Update patient data"""
+        updates['updated_at'] = utc_now()
+
+        def work(connection):
+            before = None
+            if any(field in updates for field in PATIENT_STATS_FIELDS):
+                before = connection.execute(
+                    "SELECT status, gender FROM patients WHERE patient_id = ?", (patient_id,)
+                ).fetchone()
+            result = self._update(connection, "patients", "patient_id", patient_id, updates)
+            if result is not None and before is not None:
+                self._bump_stats(connection, combine_deltas(patient_stats_delta(dict(before), -1), patient_stats_delta(result)))
+            if result is not None and any(field in updates for field in SEARCH_FIELDS):
+                self._index_patient(connection, result)
+            return result
+        return await self._write(work)
+
+    # ==================== PATIENT SEARCH ====================
+
+    @staticmethod
+    def _index_patient(connection: sqlite3.Connection, patient: Dict):
+        """Replace a patient's search keys (inside the caller's write transaction)"""
+        connection.execute("DELETE FROM patient_search_keys WHERE patient_id = ?", (patient['patient_id'],))
+        connection.executemany(
+            "INSERT INTO patient_search_keys (key, patient_id) VALUES (?, ?)",
+            [(key, patient['patient_id']) for key in search_keys(patient)]
+        )
+
+    async def search_patients(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> List[Dict]:
+        """
+        Search patients by name (prefix, fuzzy, Hindi/English variants), phone suffix or UHID prefix
+
+        Each clause of the query plan scans the postings of its most selective
+        group and checks the other groups with primary-key probes (EXISTS), so
+        it stops after SEARCH_CANDIDATES matches instead of materializing every
+        posting list; candidates are ranked in Python.
+        """
+        patient_ids = set()
+        for clause in query_plan(query):
+            driver = driving_group(clause)
+            others = [group for i, group in enumerate(clause) if i != driver]
+            sql = f"SELECT DISTINCT k.patient_id FROM patient_search_keys k WHERE k.key IN ({', '.join('?' * len(clause[driver]))})"
+            for group in others:
+                sql += (
+                    " AND EXISTS (SELECT 1 FROM patient_search_keys o"
+                    f" WHERE o.key IN ({', '.join('?' * len(group))}) AND o.patient_id = k.patient_id)"
+                )
+            params = clause[driver] + [key for group in others for key in group]
+            rows = await self._read(f"{sql} LIMIT ?", params + [SEARCH_CANDIDATES])
+            patient_ids.update(row["patient_id"] for row in rows)
+
+        candidates = []
+        if patient_ids:
+            ids = sorted(patient_ids)
+            candidates = await self._find(f"SELECT data FROM patients WHERE patient_id IN ({', '.join('?' * len(ids))})", ids)
+        return rank(query, candidates, limit)
+
+    async def rebuild_search_index(self) -> int:
+        """Rebuild patient_search_keys from the patients table"""
+        def work(connection):
+            connection.execute("DELETE FROM patient_search_keys")
+            indexed = 0
+            for row in connection.execute("SELECT data FROM patients").fetchall():
+                self._index_patient(connection, _loads(row["data"]))
+                indexed += 1
+            return indexed
+        return await self._write(work)
+
+    # ==================== PATIENT ACTIVITY ====================
+
+    async def rebuild_patient_activity(self) -> int:
+        """Recount visit_count, last_* and prescription_count of every patient from notes and history"""
+        def work(connection):
+            visits, prescriptions = (
+                {row["patient_id"]: row["count"] for row in connection.execute(
+                    f"SELECT patient_id, COUNT(*) AS count FROM {table} GROUP BY patient_id"
+                )}
+                for table in ("notes", "history")
+            )
+            rows = connection.execute("SELECT patient_id FROM patients").fetchall()
+            for row in rows:
+                patient_id = row["patient_id"]
+                latest = connection.execute(
+                    "SELECT data FROM notes WHERE patient_id = ? ORDER BY created_at DESC, note_id DESC LIMIT 1", (patient_id,)
+                ).fetchone()
+                self._update(connection, "patients", "patient_id", patient_id, rebuilt_activity(
+                    _loads(latest["data"]) if latest else None, visits.get(patient_id, 0), prescriptions.get(patient_id, 0)
+                ))
+            return len(rows)
+        return await self._write(work)
+
+    # ==================== QUEUE ====================
+    # Same hot queue / queue_archive split as MongoDBStorage.
+
+    async def get_queue(self) -> List[Dict]:
+        """Get all queue entries (hot queue only)"""
+        return await self._find("SELECT data FROM queue ORDER BY added_at ASC, queue_id ASC")
+
+    async def get_queue_page(self, limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of the queue in arrival order (keyset on added_at, queue_id)"""
+        return await self._fetch_page("queue", "", (), "added_at", "queue_id", limit, after, descending=False)
+
+    async def add_to_queue(self, queue_entry: Dict) -> Dict:
+        """
+        Add entry to queue
+
+        Raises DuplicateQueueEntry if the patient already has an active entry
+        (queue_patient_active_unique index).
+        """
+        def work(connection):
+            self._insert(connection, "queue", queue_entry)
+            self._bump_stats(connection, queue_stats_delta(None, queue_entry['status']))
+            self._update_report_state(connection, queue_entry['patient_id'], apply_queue, queue_entry, True)
+
+        try:
+            await self._write(work)
+        except sqlite3.IntegrityError as e:
+            if "queue.patient_id" not in str(e):
+                raise
+            raise DuplicateQueueEntry(await self.get_active_queue_entry(queue_entry['patient_id']))
+        queue_events.entry_added(queue_entry)
+        return queue_entry
+
+    async def get_active_queue_entry(self, patient_id: str) -> Optional[Dict]:
+        """Get a patient's active queue entry, if any"""
+        return await self._find_one(
+            f"SELECT data FROM queue WHERE patient_id = ? AND status IN ({_ACTIVE_IN})", (patient_id,)
+        )
+
+    async def update_queue_status(self, queue_id: str, status: str, **kwargs) -> Optional[Dict]:
+        """Update queue entry status"""
+        updates = {"status": status}
+        updates.update(kwargs)
+
+        def work(connection):
+            before = connection.execute("SELECT status FROM queue WHERE queue_id = ?", (queue_id,)).fetchone()
+            result = self._update(connection, "queue", "queue_id", queue_id, updates)
+            if result is not None:
+                self._bump_stats(connection, queue_stats_delta(before["status"], status))
+                self._update_report_state(connection, result['patient_id'], apply_queue, result)
+            return result
+
+        result = await self._write(work)
+        if result:
+            queue_events.status_changed(result)
+        return result
+
+    async def get_queue_by_status(self, status: str) -> List[Dict]:
+        """Get queue entries by status"""
+        return await self._find("SELECT data FROM queue WHERE status = ? ORDER BY added_at ASC, queue_id ASC", (status,))
+
+    async def get_patient_queue_entry(self, patient_id: str) -> Optional[Dict]:
+        """Get a patient's most recent entry in the hot queue (indexed lookup)"""
+        return await self._find_one(
+            "SELECT data FROM queue WHERE patient_id = ? ORDER BY added_at DESC LIMIT 1", (patient_id,)
+        )
+
+    async def archive_finished_queue(self, before: Optional[str] = None) -> int:
+        """
+        Move completed/cancelled entries from the hot queue to queue_archive
+
+        Each chunk is copied and deleted in one transaction.
+        """
+        finished = ", ".join(f"'{status}'" for status in FINISHED_QUEUE_STATUSES)
+        where = f"status IN ({finished})" + (" AND added_at < ?" if before else "")
+        params = [to_iso(before)] if before else []
+        archived_at = utc_now()
+
+        def work(connection):
+            rows = connection.execute(
+                f"SELECT data FROM queue WHERE {where} LIMIT ?", params + [ARCHIVE_CHUNK_SIZE]
+            ).fetchall()
+            queue_ids, patient_ids, deltas = [], set(), []
+            for row in rows:
+                entry = {**_loads(row["data"]), "archived_at": archived_at}
+                self._insert(connection, "queue_archive", entry, verb="INSERT OR REPLACE")
+                queue_ids.append(entry['queue_id'])
+                patient_ids.add(entry['patient_id'])
+                deltas.append({f"queue.{entry['status']}": -1, f"archive.{entry['status']}": 1})
+            connection.executemany("DELETE FROM queue WHERE queue_id = ?", [(queue_id,) for queue_id in queue_ids])
+            for patient_id in patient_ids:
+                self._update_report_state(connection, patient_id, clear_queue, queue_ids)
+            self._bump_stats(connection, combine_deltas(*deltas))
+            return queue_ids
+
+        archived = 0
+        while True:
+            queue_ids = await self._write(work)
+            if not queue_ids:
+                break
+            archived += len(queue_ids)
+            queue_events.entries_removed(queue_ids)
+        return archived
+
+    async def rollover_queue(self) -> int:
+        """Archive finished entries from previous days (keeps today's completed visible)"""
+        return await self.archive_finished_queue(before=clinic_day_start())
+
+    async def next_token_number(self, facility_id: str = FACILITY_ID, day: Optional[str] = None) -> int:
+        """Allocate the next token number for a facility and day (atomic upsert)"""
+        day = day or clinic_today().isoformat()
+        counter_id = f"token:{facility_id}:{day}"
+
+        def work(connection):
+            return connection.execute(
+                "INSERT INTO counters (counter_id, seq) VALUES (?, 1) "
+                "ON CONFLICT (counter_id) DO UPDATE SET seq = seq + 1 RETURNING seq",
+                (counter_id,)
+            ).fetchone()["seq"]
+        return await self._write(work)
+
+    @staticmethod
+    def _status_counts(rows) -> Dict:
+        return finish_status_counts({row["status"]: row["count"] for row in rows if row["status"] is not None})
+
+    async def get_queue_stats(self) -> Dict:
+        """Per-status queue counts (one GROUP BY, no entries loaded)"""
+        return self._status_counts(await self._read("SELECT status, COUNT(*) AS count FROM queue GROUP BY status"))
+
+    async def get_visit_stats(self, since: Optional[str] = None) -> List[Dict]:
+        """Finished visits per clinic day from the archive (optionally since a YYYY-MM-DD day)"""
+        # Entries archived before visit_date existed fall back to their added_at text
+        rows = await self._read(
+            "SELECT COALESCE(json_extract(data, '$.visit_date'), substr(added_at, 1, 10)) AS date, "
+            "SUM(status = 'completed') AS completed, SUM(status = 'cancelled') AS cancelled, COUNT(*) AS total "
+            f"FROM queue_archive {'WHERE date >= ?' if since else ''} "
+            "GROUP BY date ORDER BY date DESC",
+            [since] if since else []
+        )
+        return [dict(row) for row in rows]
+
+    # ==================== STATS ====================
+    # Materialized counters ("stats:<field>" rows in `counters`) are updated
+    # in the same transaction as each write, so they only drift if the
+    # database is edited by hand; reconcile_stats() recounts them.
+
+    async def get_stats(self) -> Dict:
+        """Patient, queue, archive, notes and history counts (counter rows only)"""
+        rows = await self._read("SELECT counter_id, seq FROM counters WHERE counter_id LIKE ?", (_STATS_LIKE,))
+        if not rows:
+            return (await self.reconcile_stats())["stats"]
+        return stats_from_counters({row["counter_id"][len(STATS_COUNTER_PREFIX):]: row["seq"] for row in rows})
+
+    @staticmethod
+    def _count_stats(connection: sqlite3.Connection) -> Dict:
+        """Recount everything from the tables"""
+        genders = connection.execute(
+            "SELECT COALESCE(gender, 'unknown') AS gender, COUNT(*) AS count, "
+            "SUM(status = 'active') AS active FROM patients GROUP BY gender"
+        ).fetchall()
+        stats = {"patients": {
+            "total": sum(row["count"] for row in genders),
+            "active": sum(row["active"] or 0 for row in genders),
+            "by_gender": {row["gender"]: row["count"] for row in genders}
+        }}
+        for section, table in (("queue", "queue"), ("archive", "queue_archive")):
+            stats[section] = SQLiteStorage._status_counts(connection.execute(
+                f"SELECT status, COUNT(*) AS count FROM {table} GROUP BY status"
+            ).fetchall())
+        for table in ("notes", "history"):
+            row = connection.execute(
+                f"SELECT COUNT(*) AS total, COUNT(DISTINCT patient_id) AS patients FROM {table}"
+            ).fetchone()
+            stats[table] = {"total": row["total"], "patients": row["patients"]}
+        return stats
+
+    async def reconcile_stats(self) -> Dict:
+        """
+        Recount and overwrite the materialized counters (one write transaction)
+
+        Returns:
+            {"stats": recounted stats, "drift": {counter: actual - stored}, "reconciled_at": datetime}
+        """
+        def work(connection):
+            stored = {
+                row["counter_id"][len(STATS_COUNTER_PREFIX):]: row["seq"]
+                for row in connection.execute("SELECT counter_id, seq FROM counters WHERE counter_id LIKE ?", (_STATS_LIKE,))
+            }
+            stats = self._count_stats(connection)
+            counters = stats_to_counters(stats)
+            connection.execute("DELETE FROM counters WHERE counter_id LIKE ?", (_STATS_LIKE,))
+            self._bump_stats(connection, counters)
+            return {
+                "stats": stats,
+                "drift": counters_drift(stored, counters) if stored else {},
+                "reconciled_at": utc_now()
+            }
+        return await self._write(work)
+
+    # ==================== NOTES ====================
+
+    async def get_all_notes(self) -> Dict:
+        """Get all notes organized by patient_id (for compatibility)"""
+        return _group_by_patient(await self._find("SELECT data FROM notes"))
+
+    async def get_patient_notes(self, patient_id: str, projection: Optional[Dict] = None) -> List[Dict]:
+        """Get all notes for a patient"""
+        return await self._find(
+            "SELECT data FROM notes WHERE patient_id = ? ORDER BY created_at DESC, note_id DESC",
+            (patient_id,), projection
+        )
+
+    async def get_patient_notes_page(self, patient_id: str, limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None, projection: Optional[Dict] = None,
+                                     start=None, end=None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of a patient's notes, newest first (keyset on created_at, note_id; optionally start <= created_at < end)"""
+        where, params = _range("created_at", start, end)
+        return await self._fetch_page(
+            "notes", "patient_id = ?" + (f" AND {where}" if where else ""), [patient_id] + params,
+            "created_at", "note_id", limit, after, projection=projection
+        )
+
+    async def get_notes_page(self, limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None, projection: Optional[Dict] = None,
+                             start=None, end=None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of all patients' notes, newest first (keyset on created_at, note_id; optionally start <= created_at < end)"""
+        where, params = _range("created_at", start, end)
+        return await self._fetch_page("notes", where, params, "created_at", "note_id", limit, after, projection=projection)
+
+    async def get_note(self, patient_id: str, note_id: str, projection: Optional[Dict] = None) -> Optional[Dict]:
+        """Get a single note of a patient"""
+        return await self._find_one(
+            "SELECT data FROM notes WHERE note_id = ? AND patient_id = ?", (note_id, patient_id), projection
+        )
+
+    async def add_note(self, patient_id: str, note: Dict) -> Dict:
+        """Add note for patient"""
+        note['patient_id'] = patient_id
+        note['created_at'] = note.get('created_at', utc_now())
+        note['updated_at'] = utc_now()
+        if 'note_id' not in note:
+            note['note_id'] = f"NOTE_{uuid.uuid4().hex[:8].upper()}"
+        upgrade_timestamps(note)
+
+        stored = dict(note)
+        texts = pack_note_texts(stored)
+
+        def work(connection):
+            if texts:
+                self._insert_texts(connection, texts)
+            self._insert_entry(connection, "notes", stored)
+            self._record_activity(connection, patient_id, note_activity, note)
+            self._update_report_state(connection, patient_id, apply_note, note)
+        await self._write(work)
+        return note
+
+    @staticmethod
+    def _insert_texts(connection: sqlite3.Connection, texts: Dict):
+        connection.execute(
+            "INSERT OR REPLACE INTO note_texts (note_id, patient_id, codec, raw_size, stored_size, data) VALUES (?, ?, ?, ?, ?, ?)",
+            tuple(texts[column] for column in ("note_id", "patient_id", "codec", "raw_size", "stored_size", "data"))
+        )
+
+    async def get_note_texts(self, note_ids: List[str]) -> Dict[str, Dict[str, str]]:
+        """Decompressed text fields (transcript) of the given notes -> {note_id: {field: text}}"""
+        note_ids = list(note_ids)
+        texts = {}
+        for start in range(0, len(note_ids), 500):
+            chunk = note_ids[start:start + 500]
+            rows = await self._read(
+                f"SELECT note_id, data FROM note_texts WHERE note_id IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            texts.update((row["note_id"], unpack_note_texts(row)) for row in rows)
+        return texts
+
+    async def compress_note_texts(self, batch_size: int = 500) -> Dict:
+        """Move inline transcripts of older notes into note_texts (idempotent)"""
+        report = {"notes": 0, "raw_bytes": 0, "stored_bytes": 0}
+        last_rowid = 0
+
+        def work(connection):
+            rows = connection.execute(
+                "SELECT rowid, data FROM notes WHERE rowid > ? AND json_type(data, '$.transcript') = 'text' "
+                "ORDER BY rowid LIMIT ?",
+                (last_rowid, batch_size)
+            ).fetchall()
+            for row in rows:
+                note = _loads(row["data"])
+                texts = pack_note_texts(note)
+                self._insert_texts(connection, texts)
+                connection.execute(
+                    "UPDATE notes SET data = ? WHERE note_id = ?", (_dumps(note), note['note_id'])
+                )
+                report["notes"] += 1
+                report["raw_bytes"] += texts['raw_size']
+                report["stored_bytes"] += texts['stored_size']
+            return rows[-1]["rowid"] if rows else None
+
+        while True:
+            last_rowid = await self._write(work)
+            if last_rowid is None:
+                return report
+
+    async def get_note_text_stats(self) -> Dict:
+        """Compressed text totals: {texts, raw_bytes, stored_bytes}"""
+        row = await self._read_one(
+            "SELECT COUNT(*) AS texts, COALESCE(SUM(raw_size), 0) AS raw_bytes, "
+            "COALESCE(SUM(stored_size), 0) AS stored_bytes FROM note_texts"
+        )
+        return dict(row)
+
+    @staticmethod
+    def _insert_entry(connection: sqlite3.Connection, table: str, entry: Dict):
+        """Insert a note/history entry and count it (and its patient, if it is their first)"""
+        SQLiteStorage._insert(connection, table, entry)
+        first = connection.execute(
+            f"SELECT COUNT(*) AS count FROM (SELECT 1 FROM {table} WHERE patient_id = ? LIMIT 2)",
+            (entry['patient_id'],)
+        ).fetchone()["count"] == 1
+        SQLiteStorage._bump_stats(connection, combine_deltas({f"{table}.total": 1, f"{table}.patients": int(first)}))
+
+    @staticmethod
+    def _record_activity(connection: sqlite3.Connection, patient_id: str, activity: Callable, *records: Dict):
+        """Apply note_activity / history_activity to the patient (inside the caller's write transaction)"""
+        row = connection.execute("SELECT data FROM patients WHERE patient_id = ?", (patient_id,)).fetchone()
+        if row is not None:
+            SQLiteStorage._update(connection, "patients", "patient_id", patient_id, activity(_loads(row["data"]), *records))
+
+    # ==================== HISTORY ====================
+
+    async def get_all_history(self) -> Dict:
+        """Get all history organized by patient_id (for compatibility)"""
+        return _group_by_patient(await self._find("SELECT data FROM history"))
+
+    async def get_patient_history(self, patient_id: str, projection: Optional[Dict] = None) -> List[Dict]:
+        """Get all history for a patient"""
+        return await self._find(
+            "SELECT data FROM history WHERE patient_id = ? ORDER BY created_at DESC, history_id DESC",
+            (patient_id,), projection
+        )
+
+    async def get_patient_history_page(self, patient_id: str, limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None, projection: Optional[Dict] = None,
+                                       start=None, end=None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of a patient's history, newest first (keyset on created_at, history_id; optionally start <= created_at < end)"""
+        where, params = _range("created_at", start, end)
+        return await self._fetch_page(
+            "history", "patient_id = ?" + (f" AND {where}" if where else ""), [patient_id] + params,
+            "created_at", "history_id", limit, after, projection=projection
+        )
+
+    async def add_history(self, patient_id: str, history_entry: Dict) -> Dict:
+        """Add history entry for patient"""
+        history_entry['patient_id'] = patient_id
+        history_entry['created_at'] = history_entry.get('created_at', utc_now())
+        history_entry['updated_at'] = utc_now()
+        if 'history_id' not in history_entry:
+            history_entry['history_id'] = f"HIST_{uuid.uuid4().hex[:8].upper()}"
+
+        def work(connection):
+            self._insert_entry(connection, "history", history_entry)
+            self._record_activity(connection, patient_id, history_activity)
+            self._update_report_state(connection, patient_id, apply_history, history_entry)
+        await self._write(work)
+        return history_entry
+
+    # ==================== REPORT STATE ====================
+
+    async def get_report_state(self, patient_id: str) -> Optional[Dict]:
+        """A patient's incrementally maintained report state (None until first built)"""
+        return await self._find_one("SELECT data FROM report_state WHERE patient_id = ?", (patient_id,))
+
+    async def create_report_state(self, state: Dict):
+        """Store a freshly built report state, unless another request created one meanwhile"""
+        await self._write(lambda connection: self._insert(connection, "report_state", state, verb="INSERT OR IGNORE"))
+
+    async def replace_report_state(self, state: Dict, version: Optional[int]) -> bool:
+        """Replace the report state only while its version is still `version` -> replaced?"""
+        return await self._write(lambda connection: connection.execute(
+            "UPDATE report_state SET data = ? WHERE patient_id = ? AND json_extract(data, '$.version') IS ?",
+            (_dumps(state), state['patient_id'], version)
+        ).rowcount == 1)
+
+    @staticmethod
+    def _update_report_state(connection: sqlite3.Connection, patient_id: str, apply: Callable, *args):
+        """Apply an incremental update to the patient's report state, if it has been built (caller's transaction)"""
+        row = connection.execute("SELECT data FROM report_state WHERE patient_id = ?", (patient_id,)).fetchone()
+        if row is not None:
+            state = _loads(row["data"])
+            apply(state, *args)
+            connection.execute("UPDATE report_state SET data = ? WHERE patient_id = ?", (_dumps(state), patient_id))
+
+    # ==================== CHANGE FEEDS ====================
+
+    async def get_changes_page(self, collection: str, since: Optional[str] = None, until: Optional[str] = None, limit: int = DEFAULT_CHANGES_PAGE_SIZE, after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """One page of patients / notes / history / queue_archive changed in (since, until], oldest change first"""
+        return await self._changes_page(collection, since, until, limit, after)
+
+    # ==================== TIMESTAMP MIGRATION ====================
+    # Reads already decode legacy text; the backfill rewrites it (and the
+    # indexed columns) in canonical form, so text order is time order again.
+
+    async def backfill_timestamps(self, batch_size: int = 500) -> Dict[str, int]:
+        """Rewrite records still holding legacy timestamp text (idempotent) -> {table: records upgraded}"""
+        return {table: await self._backfill_table(table, batch_size) for table in COLUMNS}
+
+    async def _backfill_table(self, table: str, batch_size: int) -> int:
+        report = {"upgraded": 0}
+        last_rowid = 0
+        assignments = ", ".join(f"{column} = ?" for column in COLUMNS[table])
+
+        def work(connection):
+            rows = connection.execute(
+                f"SELECT rowid, data FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?", (last_rowid, batch_size)
+            ).fetchall()
+            for row in rows:
+                document = json.loads(row["data"])
+                if decode_timestamps(document):
+                    connection.execute(
+                        f"UPDATE {table} SET {assignments}, data = ? WHERE rowid = ?",
+                        self._row_values(table, document) + [row["rowid"]]
+                    )
+                    report["upgraded"] += 1
+            return rows[-1]["rowid"] if rows else None
+
+        while True:
+            last_rowid = await self._write(work)
+            if last_rowid is None:
+                return report["upgraded"]
+
+    # ==================== DOCUMENTS ====================
+    # Same methods as MongoService, so one SQLite file holds everything.
+
+    async def save_document(self, document_data: Dict) -> str:
+        """Save a single document"""
+        document_data.setdefault('document_id', f"DOC_{uuid.uuid4().hex[:8].upper()}")
+        document_data['updated_at'] = utc_now()
+        await self._write(lambda connection: self._insert(connection, "documents", document_data))
+        return document_data['document_id']
+
+    async def get_document(self, document_id: str, projection: Optional[Dict] = None) -> Optional[Dict]:
+        """Get single document by ID"""
+        return await self._find_one("SELECT data FROM documents WHERE document_id = ?", (document_id,), projection)
+
+    async def get_patient_documents(self, patient_id: str) -> List[Dict]:
+        """Get all documents for a patient"""
+        return await self._find(
+            "SELECT data FROM documents WHERE patient_id = ? ORDER BY uploaded_at DESC, document_id DESC",
+            (patient_id,)
+        )
+
+    async def get_patient_documents_page(self, patient_id: str, limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None, projection: Optional[Dict] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of a patient's documents, newest first (keyset on uploaded_at, document_id)"""
+        return await self._fetch_page(
+            "documents", "patient_id = ?", (patient_id,), "uploaded_at", "document_id", limit, after, projection=projection
+        )
+
+    async def get_batch_documents(self, batch_id: str) -> List[Dict]:
+        """Get all documents in a batch"""
+        return await self._find("SELECT data FROM documents WHERE batch_id = ? ORDER BY uploaded_at ASC", (batch_id,))
+
+    async def update_document_status(self, document_id: str, status: str, extracted_data: Optional[Dict] = None):
+        """Update document processing status"""
+        update_data = {"status": status}
+        if extracted_data is not None:
+            update_data["extracted_data"] = extracted_data
+        await self.update_document(document_id, update_data)
+
+    async def update_document(self, document_id: str, updates: Dict):
+        """Set arbitrary fields on a document (e.g. thumbnail keys/URLs)"""
+        updates = {**updates, "updated_at": utc_now()}
+        await self._write(
+            lambda connection: self._update(connection, "documents", "document_id", document_id, updates)
+        )
+
+    async def get_document_changes_page(self, since: Optional[str] = None, until: Optional[str] = None, limit: int = DEFAULT_CHANGES_PAGE_SIZE, after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """One page of documents changed in (since, until], oldest change first"""
+        return await self._changes_page("documents", since, until, limit, after)
+
+    # ==================== BATCHES ====================
+
+    async def create_batch(self, batch_data: Dict) -> str:
+        """Create a new document batch"""
+        await self._write(lambda connection: self._insert(connection, "batches", batch_data))
+        return batch_data['batch_id']
+
+    async def get_batch(self, batch_id: str) -> Optional[Dict]:
+        """Get batch by ID"""
+        return await self._find_one("SELECT data FROM batches WHERE batch_id = ?", (batch_id,))
+
+    async def get_patient_batches(self, patient_id: str) -> List[Dict]:
+        """Get all batches of a patient, newest first"""
+        return await self._find(
+            "SELECT data FROM batches WHERE patient_id = ? ORDER BY created_at DESC", (patient_id,)
+        )
+
+    async def add_document_to_batch(self, batch_id: str, document_id: str):
+        """Add document to existing batch"""
+        await self._write(
+            lambda connection: self._update(
+                connection, "batches", "batch_id", batch_id, {}, push={"document_ids": document_id}
+            )
+        )
+
+    async def update_batch_status(self, batch_id: str, status: str):
+        """Update batch status"""
+        update_data = {"status": status}
+        if status == "completed":
+            update_data["completed_at"] = utc_now()
+        await self._write(
+            lambda connection: self._update(connection, "batches", "batch_id", batch_id, update_data)
+        )
+
+    async def get_active_batch(self, patient_id: str) -> Optional[Dict]:
+        """Get active (pending/processing) batch for patient"""
+        return await self._find_one(
+            "SELECT data FROM batches WHERE patient_id = ? AND status IN ('pending', 'processing')",
+            (patient_id,)
+        )
+
+    # ==================== UPLOAD SESSIONS ====================
+
+    async def create_upload_session(self, session_data: Dict) -> str:
+        """Create a direct-upload session (issued with a presigned URL)"""
+        await self._write(lambda connection: self._insert(connection, "upload_sessions", session_data))
+        return session_data['upload_id']
+
+    async def get_upload_session(self, upload_id: str) -> Optional[Dict]:
+        """Get upload session by ID"""
+        return await self._find_one("SELECT data FROM upload_sessions WHERE upload_id = ?", (upload_id,))
+
+    async def claim_upload_session(self, upload_id: str) -> Optional[Dict]:
+        """Atomically move a session from 'pending' to 'queued' (None if already claimed)"""
+        updates = {"status": "queued", "completed_at": utc_now()}
+        return await self._write(
+            lambda connection: self._update(
+                connection, "upload_sessions", "upload_id", upload_id, updates, where="AND status = 'pending'"
+            )
+        )
+
+    async def update_upload_session(self, upload_id: str, updates: Dict):
+        """Update upload session fields"""
+        await self._write(
+            lambda connection: self._update(connection, "upload_sessions", "upload_id", upload_id, updates)
+        )
+
+    # ==================== EXPORT JOBS ====================
+
+    async def create_export_job(self, job_data: Dict) -> str:
+        """Create a bulk export job"""
+        await self._write(lambda connection: self._insert(connection, "export_jobs", job_data))
+        return job_data['job_id']
+
+    async def get_export_job(self, job_id: str) -> Optional[Dict]:
+        """Get export job by ID"""
+        return await self._find_one("SELECT data FROM export_jobs WHERE job_id = ?", (job_id,))
+
+    async def update_export_job(self, job_id: str, updates: Dict):
+        """Update export job fields"""
+        await self._write(lambda connection: self._update(connection, "export_jobs", "job_id", job_id, updates))
+
+    async def finish_export_job(self, job_id: str, updates: Dict) -> bool:
+        """Apply a running job's final update, unless it was cancelled meanwhile -> applied?"""
+        return await self._write(
+            lambda connection: self._update(
+                connection, "export_jobs", "job_id", job_id, updates, where="AND status = 'in-progress'"
+            )
+        ) is not None
+
+    # ==================== TIMELINES ====================
+
+    async def save_timeline(self, timeline_data: Dict) -> str:
+        """Save generated timeline (replaces the patient's previous one)"""
+        await self._write(
+            lambda connection: self._insert(connection, "timelines", timeline_data, verb="INSERT OR REPLACE")
+        )
+        return timeline_data['patient_id']
+
+    async def get_patient_timeline(self, patient_id: str) -> Optional[Dict]:
+        """Get latest timeline for patient"""
+        return await self._find_one("SELECT data FROM timelines WHERE patient_id = ?", (patient_id,))
+
+    async def get_all_timelines(self) -> List[Dict]:
+        """Get all timelines (for admin view)"""
+        return await self._find("SELECT data FROM timelines ORDER BY generated_at DESC, patient_id DESC")
+
+    async def get_timelines_page(self, limit: int = DEFAULT_PAGE_SIZE, after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of timelines, newest first (keyset on generated_at, patient_id)"""
+        return await self._fetch_page("timelines", "", (), "generated_at", "patient_id", limit, after)
+
+
+# Singleton instance
+sqlite_storage = SQLiteStorage()
@@ -0,0 +1,71 @@
+"""
+Stats counter reconciliation
+
+`/` and `/stats` read materialized counters that every write path updates
+with a delta. A write that fails between the data change and the counter
+update (or an edit made outside the API) leaves the counters off; this job
+recounts them from the collections on startup and every
+STATS_RECONCILE_INTERVAL seconds and logs any drift it corrects.
+"""
+
+import asyncio
+import os
+from datetime import datetime
+from typing import Dict, Optional
+
+from app.services.storage_backend import get_storage
+from app.services.timestamps import utc_now
+
+
+STATS_RECONCILE_ENABLED = os.environ.get('STATS_RECONCILE_ENABLED', 'true').lower() == 'true'
+STATS_RECONCILE_INTERVAL = int(os.environ.get('STATS_RECONCILE_INTERVAL', '3600'))
+
+
+class StatsReconcileJob:
+    """Background task recounting the stats counters"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.last_run_at: Optional[datetime] = None
+        self.last_drift: Dict[str, int] = {}
+
+    def start(self):
+        """Start the job (no-op if disabled or already running)"""
+        if STATS_RECONCILE_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            print("🧮 Stats reconciliation job started")
+
+    async def stop(self):
+        """Cancel the job and wait for it to exit"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> Dict:
+        """Recount the stats counters now"""
+        result = await get_storage().reconcile_stats()
+        self.last_run_at = utc_now()
+        self.last_drift = result["drift"]
+        if result["drift"]:
+            print(f"⚠️ Stats counters drifted, corrected: {result['drift']}")
+        else:
+            print("🧮 Stats counters reconciled (no drift)")
+        return result
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Stats reconciliation failed: {e}")
+            await asyncio.sleep(STATS_RECONCILE_INTERVAL)
+
+
+# Singleton instance
+stats_reconciler = StatsReconcileJob()
@@ -0,0 +1,223 @@
+"""
+Server-side statistics via MongoDB aggregation
+
+Counts are computed with $group/$facet inside MongoDB so callers never load
+whole collections into Python just to count them.
+
+`/` and `/stats` do not aggregate at all: they read the materialized
+counters below, which every write path updates with a small delta and the
+stats reconciliation job recomputes from the collections.
+"""
+
+from typing import Dict, List, Optional
+
+from app.models.schemas import QueueStatus
+from app.services.projections import set_path
+
+
+QUEUE_STATUSES = [status.value for status in QueueStatus]
+
+# Counters record id (MongoDB `counters` collection); SQLite and the
+# in-memory store keep one counter per field, prefixed with "stats:"
+STATS_COUNTER_ID = "stats"
+STATS_COUNTER_PREFIX = "stats:"
+# Patient fields the counters depend on (updates touching them adjust the counters)
+PATIENT_STATS_FIELDS = ("gender", "status")
+
+
+def finish_status_counts(counts: Dict) -> Dict:
+    """Zero-fill every QueueStatus and add the "total" and "active" counts"""
+    counts = {**{status: 0 for status in QUEUE_STATUSES}, **counts}
+    counts.pop("total", None)
+    counts.pop("active", None)
+    counts["total"] = sum(counts.values())
+    counts["active"] = counts["total"] - counts[QueueStatus.COMPLETED.value] - counts[QueueStatus.CANCELLED.value]
+    return counts
+
+
+async def queue_status_counts(collection, match: Optional[Dict] = None) -> Dict:
+    """
+    Count queue entries per status in one $group
+
+    Returns:
+        {<status>: count for every QueueStatus, "active": not completed/cancelled, "total": all}
+    """
+    pipeline = [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+    if match:
+        pipeline.insert(0, {"$match": match})
+
+    counts = {}
+    async for row in collection.aggregate(pipeline):
+        if row["_id"] is not None:
+            counts[row["_id"]] = row["count"]
+    return finish_status_counts(counts)
+
+
+async def patient_counts(collection) -> Dict:
+    """Total, active and per-gender patient counts in one $facet"""
+    pipeline = [{"$facet": {
+        "total": [{"$count": "count"}],
+        "active": [{"$match": {"status": "active"}}, {"$count": "count"}],
+        "by_gender": [{"$group": {"_id": {"$ifNull": ["$gender", "unknown"]}, "count": {"$sum": 1}}}]
+    }}]
+    result = await collection.aggregate(pipeline).to_list(length=1)
+    facets = result[0] if result else {}
+
+    return {
+        "total": _facet_count(facets.get("total")),
+        "active": _facet_count(facets.get("active")),
+        "by_gender": {row["_id"]: row["count"] for row in facets.get("by_gender", [])}
+    }
+
+
+async def per_patient_counts(collection) -> Dict:
+    """Total entries and number of distinct patients (notes, history)"""
+    pipeline = [
+        {"$group": {"_id": "$patient_id", "count": {"$sum": 1}}},
+        {"$group": {"_id": None, "total": {"$sum": "$count"}, "patients": {"$sum": 1}}}
+    ]
+    result = await collection.aggregate(pipeline).to_list(length=1)
+    if not result:
+        return {"total": 0, "patients": 0}
+    return {"total": result[0]["total"], "patients": result[0]["patients"]}
+
+
+async def daily_visit_counts(collection, since: Optional[str] = None) -> List[Dict]:
+    """
+    Finished visits per clinic day (queue archive), newest day first
+
+    Entries carry `visit_date`, the clinic-local day they were added; records
+    archived before that field existed fall back to the date part of their
+    added_at string.
+
+    Returns:
+        [{"date": "YYYY-MM-DD", "completed": n, "cancelled": n, "total": n}, ...]
+    """
+    pipeline = [
+        {"$group": {
+            "_id": {"date": {"$ifNull": ["$visit_date", {"$substr": ["$added_at", 0, 10]}]}, "status": "$status"},
+            "count": {"$sum": 1}
+        }},
+        {"$group": {
+            "_id": "$_id.date",
+            "statuses": {"$push": {"k": "$_id.status", "v": "$count"}},
+            "total": {"$sum": "$count"}
+        }},
+        {"$sort": {"_id": -1}}
+    ]
+    if since:
+        pipeline.insert(0, {"$match": {"$or": [
+            {"visit_date": {"$gte": since}},
+            {"visit_date": {"$exists": False}, "added_at": {"$gte": since}}
+        ]}})
+
+    days = []
+    async for row in collection.aggregate(pipeline):
+        counts = {item["k"]: item["v"] for item in row["statuses"]}
+        days.append({
+            "date": row["_id"],
+            "completed": counts.get(QueueStatus.COMPLETED.value, 0),
+            "cancelled": counts.get(QueueStatus.CANCELLED.value, 0),
+            "total": row["total"]
+        })
+    return days
+
+
+def _facet_count(rows) -> int:
+    return rows[0]["count"] if rows else 0
+
+
+# ==================== MATERIALIZED COUNTERS ====================
+# Counters are flat {"patients.total": n, "queue.waiting": n, ...} dicts;
+# writes apply deltas in the same shape ($inc in MongoDB).
+
+def patient_stats_delta(patient: Dict, sign: int = 1) -> Dict[str, int]:
+    """Counter changes for adding (sign=1) or removing (sign=-1) a patient"""
+    delta = {
+        "patients.total": sign,
+        f"patients.by_gender.{patient.get('gender') or 'unknown'}": sign
+    }
+    if patient.get('status') == "active":
+        delta["patients.active"] = sign
+    return delta
+
+
+def queue_stats_delta(old_status: Optional[str], new_status: Optional[str], section: str = "queue") -> Dict[str, int]:
+    """Counter changes for a queue entry moving between statuses (None = absent)"""
+    if old_status == new_status:
+        return {}
+    delta = {}
+    if old_status is not None:
+        delta[f"{section}.{old_status}"] = -1
+    if new_status is not None:
+        delta[f"{section}.{new_status}"] = 1
+    return delta
+
+
+def combine_deltas(*deltas: Dict[str, int]) -> Dict[str, int]:
+    """Sum counter deltas, dropping fields that cancel out"""
+    combined: Dict[str, int] = {}
+    for delta in deltas:
+        for field, change in delta.items():
+            combined[field] = combined.get(field, 0) + change
+    return {field: change for field, change in combined.items() if change}
+
+
+def stats_to_counters(stats: Dict) -> Dict[str, int]:
+    """Flatten a get_stats() result into counters (derived totals left out)"""
+    counters = {
+        "patients.total": stats["patients"]["total"],
+        "patients.active": stats["patients"]["active"]
+    }
+    for gender, count in stats["patients"]["by_gender"].items():
+        counters[f"patients.by_gender.{gender}"] = count
+    for section in ("queue", "archive"):
+        for status, count in stats[section].items():
+            if status not in ("total", "active"):
+                counters[f"{section}.{status}"] = count
+    for section in ("notes", "history"):
+        counters[f"{section}.total"] = stats[section]["total"]
+        counters[f"{section}.patients"] = stats[section]["patients"]
+    return counters
+
+
+def stats_from_counters(counters: Dict[str, int]) -> Dict:
+    """Build the get_stats() result from flat counters"""
+    nested: Dict = {}
+    for field, value in counters.items():
+        set_path(nested, field, value)
+
+    patients = nested.get("patients", {})
+    notes, history = nested.get("notes", {}), nested.get("history", {})
+    return {
+        "patients": {
+            "total": patients.get("total", 0),
+            "active": patients.get("active", 0),
+            "by_gender": {gender: count for gender, count in patients.get("by_gender", {}).items() if count}
+        },
+        "queue": finish_status_counts({s: n for s, n in nested.get("queue", {}).items() if n}),
+        "archive": finish_status_counts({s: n for s, n in nested.get("archive", {}).items() if n}),
+        "notes": {"total": notes.get("total", 0), "patients": notes.get("patients", 0)},
+        "history": {"total": history.get("total", 0), "patients": history.get("patients", 0)}
+    }
+
+
+def flatten_counters(document: Dict, prefix: str = "") -> Dict[str, int]:
+    """Nested counters record (MongoDB) -> flat counters; non-numeric fields are skipped"""
+    counters = {}
+    for key, value in document.items():
+        if isinstance(value, dict):
+            counters.update(flatten_counters(value, f"{prefix}{key}."))
+        elif isinstance(value, int) and not isinstance(value, bool):
+            counters[f"{prefix}{key}"] = value
+    return counters
+
+
+def counters_drift(stored: Dict[str, int], actual: Dict[str, int]) -> Dict[str, int]:
+    """Fields where the stored counters disagree with a recount ({field: actual - stored})"""
+    fields = set(stored) | set(actual)
+    return {
+        field: actual.get(field, 0) - stored.get(field, 0)
+        for field in sorted(fields)
+        if actual.get(field, 0) != stored.get(field, 0)
+    }
@@ -0,0 +1,104 @@
+"""
+Storage backend selection and FastAPI dependencies
+
+Routes take their storage through `Depends(get_storage)` /
+`Depends(get_document_storage)` instead of importing a backend singleton.
+Background code (ingestion, rollover, live queue) calls the same functions.
+
+STORAGE_BACKEND:
+- mongodb (default): MongoDBStorage + MongoService
+- sqlite:            SQLiteStorage for everything (SQLITE_PATH)
+- json:              journaled in-memory store in JSON_STORAGE_DIR
+- memory:            in-memory store, nothing persisted
+
+Tests can swap backends with `storage_backend.use(...)` or FastAPI's
+`app.dependency_overrides`.
+"""
+
+import os
+from typing import Optional
+
+from app.services.storage_protocol import PatientStorage, DocumentStorage
+
+
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongodb').lower()
+STORAGE_BACKENDS = ["mongodb", "sqlite", "json", "memory"]
+JSON_STORAGE_DIR = os.environ.get('JSON_STORAGE_DIR', '/app/data')
+
+
+def create_backend(name: str):
+    """Build (PatientStorage, DocumentStorage) for a backend name"""
+    if name == "mongodb":
+        from app.services.mongodb_storage import mongodb_storage
+        from app.services.mongo_service import mongo_service
+        return mongodb_storage, mongo_service
+    if name == "sqlite":
+        from app.services.sqlite_storage import sqlite_storage
+        return sqlite_storage, sqlite_storage
+    if name == "json":
+        from app.services.memory_storage import MemoryStorage
+        from app.services.storage_service import StorageService
+        backend = MemoryStorage(StorageService(base_dir=JSON_STORAGE_DIR))
+        return backend, backend
+    if name == "memory":
+        from app.services.memory_storage import MemoryStorage
+        backend = MemoryStorage()
+        return backend, backend
+    raise ValueError(f"Unknown STORAGE_BACKEND: {name} (use one of {', '.join(STORAGE_BACKENDS)})")
+
+
+class StorageBackend:
+    """Holds the configured backend for the process"""
+
+    def __init__(self, name: str = STORAGE_BACKEND):
+        self.name = name
+        self._storage: Optional[PatientStorage] = None
+        self._document_storage: Optional[DocumentStorage] = None
+
+    def _ensure(self):
+        if self._storage is None:
+            self._storage, self._document_storage = create_backend(self.name)
+
+    @property
+    def storage(self) -> PatientStorage:
+        self._ensure()
+        return self._storage
+
+    @property
+    def document_storage(self) -> DocumentStorage:
+        self._ensure()
+        return self._document_storage
+
+    def use(self, storage: PatientStorage, document_storage: Optional[DocumentStorage] = None, name: str = "custom"):
+        """Install specific backend instances (tests, scripts)"""
+        self.name = name
+        self._storage = storage
+        self._document_storage = document_storage if document_storage is not None else storage
+
+    async def connect(self):
+        self._ensure()
+        await self._storage.connect()
+        if self._document_storage is not self._storage:
+            await self._document_storage.connect()
+        print(f"✅ Storage backend: {self.name}")
+
+    async def disconnect(self):
+        if self._storage is None:
+            return
+        if self._document_storage is not self._storage:
+            await self._document_storage.disconnect()
+        await self._storage.disconnect()
+
+
+# Singleton instance
+storage_backend = StorageBackend()
+
+
+def get_storage() -> PatientStorage:
+    """FastAPI dependency: patients, queue, notes, history"""
+    return storage_backend.storage
+
+
+def get_document_storage() -> DocumentStorage:
+    """FastAPI dependency: documents, batches, upload sessions, timelines"""
+    return storage_backend.document_storage
@@ -0,0 +1,170 @@
+"""
+Storage contracts shared by every backend
+
+Routes depend on these protocols (via app.services.storage_backend), never
+on a concrete backend. Implementations:
+
+- MongoDBStorage / MongoService  (STORAGE_BACKEND=mongodb, default)
+- SQLiteStorage                  (STORAGE_BACKEND=sqlite)
+- MemoryStorage                  (STORAGE_BACKEND=json or memory)
+
+Ordering rules every backend follows (checked by test_storage_conformance.py):
+
+- patients: newest first (created_at, patient_id)
+- queue: arrival order (added_at, queue_id)
+- notes / history: newest first (created_at, note_id / history_id)
+- documents: newest first (uploaded_at, document_id); batch documents oldest first
+- change feeds: oldest change first (CHANGE_FEEDS field, id)
+- note reads leave out transcripts (kept compressed, loaded via get_note_texts)
+- records are returned without Mongo's `_id`
+- timestamps are returned as aware UTC datetimes (millisecond precision) and
+  accepted as datetimes or ISO strings; date ranges are [start, end)
+- every note / history insert updates the patient's activity fields
+  (patient_activity.py) in the same operation, and note / history / queue
+  writes update a built report state (report_state.py)
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional, Protocol, Tuple, runtime_checkable
+
+
+# Queue statuses that count as "in the queue" (one entry per patient)
+ACTIVE_QUEUE_STATUSES = ["waiting", "nurse_completed", "ready_for_doctor", "in_consultation"]
+# Finished entries leave the hot queue for queue_archive at day rollover
+FINISHED_QUEUE_STATUSES = ["completed", "cancelled"]
+
+# Change feeds for exports: collection -> (change timestamp, id field).
+# Every write stamps the timestamp, so (since, until] windows are complete.
+CHANGE_FEEDS = {
+    "patients": ("updated_at", "patient_id"),
+    "notes": ("updated_at", "note_id"),
+    "history": ("updated_at", "history_id"),
+    "queue_archive": ("archived_at", "queue_id"),
+    "documents": ("updated_at", "document_id"),
+}
+
+
+class DuplicateQueueEntry(Exception):
+    """Raised when a patient already has an active queue entry"""
+
+    def __init__(self, existing: Optional[Dict]):
+        self.existing = existing
+        status = existing['status'] if existing else "active"
+        super().__init__(f"Patient already in queue with status: {status}")
+
+
+@runtime_checkable
+class PatientStorage(Protocol):
+    """Patients, queue, notes, history and stats"""
+
+    async def connect(self): ...
+    async def disconnect(self): ...
+
+    # Patients
+    async def get_all_patients(self) -> Dict: ...
+    async def get_patients_page(self, limit: int = ..., after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]: ...
+    async def get_patient(self, patient_id: str) -> Optional[Dict]: ...
+    async def get_patient_by_uhid(self, uhid: str) -> Optional[Dict]: ...
+    async def create_patient(self, patient_id: str, patient_data: Dict) -> Dict: ...
+    async def insert_patients(self, patients: List[Dict]) -> Dict[int, str]: ...
+    async def get_existing_uhids(self, uhids: List[str]) -> set: ...
+    async def update_patient(self, patient_id: str, updates: Dict) -> Optional[Dict]: ...
+    async def search_patients(self, query: str, limit: int = ...) -> List[Dict]: ...
+    async def rebuild_search_index(self) -> int: ...
+    async def rebuild_patient_activity(self) -> int: ...
+
+    # Queue
+    async def get_queue(self) -> List[Dict]: ...
+    async def get_queue_page(self, limit: int = ..., after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]: ...
+    async def add_to_queue(self, queue_entry: Dict) -> Dict: ...
+    async def get_active_queue_entry(self, patient_id: str) -> Optional[Dict]: ...
+    async def update_queue_status(self, queue_id: str, status: str, **kwargs) -> Optional[Dict]: ...
+    async def get_queue_by_status(self, status: str) -> List[Dict]: ...
+    async def get_patient_queue_entry(self, patient_id: str) -> Optional[Dict]: ...
+    async def archive_finished_queue(self, before: Optional[str] = None) -> int: ...
+    async def rollover_queue(self) -> int: ...
+    async def next_token_number(self, facility_id: str = ..., day: Optional[str] = None) -> int: ...
+    async def get_queue_stats(self) -> Dict: ...
+    async def get_visit_stats(self, since: Optional[str] = None) -> List[Dict]: ...
+
+    # Stats
+    async def get_stats(self) -> Dict: ...
+    async def reconcile_stats(self) -> Dict: ...
+
+    # Notes
+    async def get_all_notes(self) -> Dict: ...
+    async def get_patient_notes(self, patient_id: str, projection: Optional[Dict] = None) -> List[Dict]: ...
+    async def get_patient_notes_page(self, patient_id: str, limit: int = ..., after: Optional[str] = None, projection: Optional[Dict] = None,
+                                     start: Optional[datetime] = None, end: Optional[datetime] = None) -> Tuple[List[Dict], Optional[str]]: ...
+    async def get_notes_page(self, limit: int = ..., after: Optional[str] = None, projection: Optional[Dict] = None,
+                             start: Optional[datetime] = None, end: Optional[datetime] = None) -> Tuple[List[Dict], Optional[str]]: ...
+    async def get_note(self, patient_id: str, note_id: str, projection: Optional[Dict] = None) -> Optional[Dict]: ...
+    async def add_note(self, patient_id: str, note: Dict) -> Dict: ...
+    async def get_note_texts(self, note_ids: List[str]) -> Dict[str, Dict[str, str]]: ...
+    async def compress_note_texts(self, batch_size: int = ...) -> Dict: ...
+    async def get_note_text_stats(self) -> Dict: ...
+
+    # History
+    async def get_all_history(self) -> Dict: ...
+    async def get_patient_history(self, patient_id: str, projection: Optional[Dict] = None) -> List[Dict]: ...
+    async def get_patient_history_page(self, patient_id: str, limit: int = ..., after: Optional[str] = None, projection: Optional[Dict] = None,
+                                       start: Optional[datetime] = None, end: Optional[datetime] = None) -> Tuple[List[Dict], Optional[str]]: ...
+    async def add_history(self, patient_id: str, history_entry: Dict) -> Dict: ...
+
+    # Report state (report_state.py), updated by note / history / queue writes once built
+    async def get_report_state(self, patient_id: str) -> Optional[Dict]: ...
+    async def create_report_state(self, state: Dict): ...
+    async def replace_report_state(self, state: Dict, version: Optional[int]) -> bool: ...
+
+    # Change feeds (patients, notes, history, queue_archive)
+    async def get_changes_page(self, collection: str, since: Optional[str] = None, until: Optional[str] = None, limit: int = ..., after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]: ...
+
+    # Schema upgrade: legacy string timestamps -> dates ({collection: records upgraded})
+    async def backfill_timestamps(self, batch_size: int = ...) -> Dict[str, int]: ...
+
+
+@runtime_checkable
+class DocumentStorage(Protocol):
+    """Documents, batches, direct-upload sessions, bulk export jobs and timelines"""
+
+    async def connect(self): ...
+    async def disconnect(self): ...
+
+    # Documents
+    async def save_document(self, document_data: Dict) -> str: ...
+    async def get_document(self, document_id: str, projection: Optional[Dict] = None) -> Optional[Dict]: ...
+    async def get_patient_documents(self, patient_id: str) -> List[Dict]: ...
+    async def get_patient_documents_page(self, patient_id: str, limit: int = ..., after: Optional[str] = None, projection: Optional[Dict] = None) -> Tuple[List[Dict], Optional[str]]: ...
+    async def get_batch_documents(self, batch_id: str) -> List[Dict]: ...
+    async def update_document_status(self, document_id: str, status: str, extracted_data: Optional[Dict] = None): ...
+    async def update_document(self, document_id: str, updates: Dict): ...
+    async def get_document_changes_page(self, since: Optional[str] = None, until: Optional[str] = None, limit: int = ..., after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]: ...
+
+    # Batches
+    async def create_batch(self, batch_data: Dict) -> str: ...
+    async def get_batch(self, batch_id: str) -> Optional[Dict]: ...
+    async def get_patient_batches(self, patient_id: str) -> List[Dict]: ...
+    async def add_document_to_batch(self, batch_id: str, document_id: str): ...
+    async def update_batch_status(self, batch_id: str, status: str): ...
+    async def get_active_batch(self, patient_id: str) -> Optional[Dict]: ...
+
+    # Upload sessions
+    async def create_upload_session(self, session_data: Dict) -> str: ...
+    async def get_upload_session(self, upload_id: str) -> Optional[Dict]: ...
+    async def claim_upload_session(self, upload_id: str) -> Optional[Dict]: ...
+    async def update_upload_session(self, upload_id: str, updates: Dict): ...
+
+    # Bulk export jobs
+    async def create_export_job(self, job_data: Dict) -> str: ...
+    async def get_export_job(self, job_id: str) -> Optional[Dict]: ...
+    async def update_export_job(self, job_id: str, updates: Dict): ...
+    async def finish_export_job(self, job_id: str, updates: Dict) -> bool: ...
+
+    # Timelines
+    async def save_timeline(self, timeline_data: Dict) -> str: ...
+    async def get_patient_timeline(self, patient_id: str) -> Optional[Dict]: ...
+    async def get_all_timelines(self) -> List[Dict]: ...
+    async def get_timelines_page(self, limit: int = ..., after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]: ...
+
+    # Schema upgrade: legacy string timestamps -> dates ({collection: records upgraded})
+    async def backfill_timestamps(self, batch_size: int = ...) -> Dict[str, int]: ...
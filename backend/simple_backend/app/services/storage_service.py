@@ -1,162 +1,516 @@
 """
-Service layer for storage operations (JSON file-based database)
+Service layer for storage operations (file-backed in-memory store)
+
+All data lives in memory with secondary indexes (uhid → patient, queue
+status → entries, patient → queue entries), so reads never touch disk.
+Durability comes from two files in `base_dir`:
+
+- journal.jsonl:  one JSON line per write, appended (and fsynced) before the
+                  write is applied - O(1) per write
+- snapshot.json:  the full state plus the sequence number of the last
+                  journal record it contains, replaced atomically
+                  (temp file + fsync + os.replace) on compaction
+
+Compaction runs on a background thread once `compact_every` records are
+journaled: it copies the containers under the lock (pointers only - stored
+documents are replaced, never mutated), serializes without holding it, then
+swaps in a journal holding just the records written meanwhile. Documents are
+deep-copied on the way in and out, so neither callers updating what they read
+nor later changes to what they wrote can reach a stored document.
+
+On startup the snapshot is loaded and newer journal records are replayed;
+a torn last line from a crash mid-append is discarded. Records already in
+the snapshot are skipped, so a crash between snapshot replacement and
+journal truncation is harmless. The legacy patients/queue/notes/history
+JSON files are imported once if no snapshot exists yet.
+
+Timestamps are held as datetimes and written in the canonical text form of
+timestamps.py; records still in the older naive-string form are upgraded as
+they are loaded (and counted in `legacy_timestamps` until the next compaction
+rewrites them).
+
+With base_dir=None nothing is persisted (pure in-memory store, used by
+STORAGE_BACKEND=memory and tests).
 """
 
+import copy
 import json
 import os
+import threading
 from typing import Dict, List, Optional
-from datetime import datetime
+
+from app.services.timestamps import json_default, parse_timestamp, upgrade_timestamps, decode_timestamps
+
+
+STORAGE_COMPACT_EVERY = int(os.environ.get('STORAGE_COMPACT_EVERY', '1000'))
+STORAGE_FSYNC = os.environ.get('STORAGE_FSYNC', 'true').lower() == 'true'
 
 
 class StorageService:
-    """Handles all file-based data storage"""
-    
-    def __init__(self, base_dir: str = "/app/data"):
+    """In-memory indexed store with an append-only journal"""
+
+    def __init__(self, base_dir: Optional[str] = "/app/data", compact_every: int = STORAGE_COMPACT_EVERY, fsync: bool = STORAGE_FSYNC):
         self.base_dir = base_dir
         self.patients_file = f"{base_dir}/patients.json"
         self.queue_file = f"{base_dir}/queue.json"
         self.notes_file = f"{base_dir}/notes.json"
         self.history_file = f"{base_dir}/history.json"
+        self.snapshot_file = f"{base_dir}/snapshot.json"
+        self.journal_file = f"{base_dir}/journal.jsonl"
         self.uploads_dir = f"{base_dir}/uploads"
-        
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self._lock = threading.RLock()
+
+        # Primary data
+        self.patients: Dict[str, Dict] = {}
+        self.queue: Dict[str, Dict] = {}  # queue_id -> entry, in arrival order
+        self.notes: Dict[str, List[Dict]] = {}
+        self.history: Dict[str, List[Dict]] = {}
+        self.queue_archive: Dict[str, Dict] = {}
+        self.counters: Dict[str, int] = {}
+        # Other keyed collections (documents, batches, timelines, upload_sessions, export_jobs)
+        self.records: Dict[str, Dict[str, Dict]] = {}
+
+        # Secondary indexes
+        self.uhid_index: Dict[str, str] = {}
+        self.queue_status_index: Dict[str, Dict[str, None]] = {}  # status -> ordered set of queue_ids
+        self.queue_patient_index: Dict[str, List[str]] = {}
+
+        # Records loaded with legacy timestamps, per collection (see backfill_timestamps)
+        self.legacy_timestamps: Dict[str, int] = {}
+
+        self.seq = 0
+        self.journal_entries = 0
+        self._journal = None
+        self._compact_lock = threading.Lock()
+        self._compaction: Optional[threading.Thread] = None
+        self._compacting_lines: Optional[List[str]] = None  # Journaled while a snapshot is written
+
         # Initialize storage
         self._init_storage()
-    
+
     def _init_storage(self):
-        """Create directories and files if they don't exist"""
+        """Create directories, load the snapshot and replay the journal"""
+        if self.base_dir is None:
+            return
         os.makedirs(self.base_dir, exist_ok=True)
         os.makedirs(self.uploads_dir, exist_ok=True)
-        
-        for file_path in [self.patients_file, self.notes_file, self.history_file]:
-            if not os.path.exists(file_path):
-                with open(file_path, 'w') as f:
-                    json.dump({}, f)
-        
-        # Queue is a list, not dict
-        if not os.path.exists(self.queue_file):
-            with open(self.queue_file, 'w') as f:
-                json.dump([], f)
-    
+
+        if os.path.exists(self.snapshot_file):
+            self._load_state(self.load_json(self.snapshot_file))
+        else:
+            self._load_legacy_files()
+
+        self._replay_journal()
+        self._journal = open(self.journal_file, "a", encoding="utf-8")
+
     def load_json(self, file_path: str):
         """Load JSON file"""
         with open(file_path, 'r') as f:
             return json.load(f)
-    
+
     def save_json(self, file_path: str, data):
-        """Save JSON file"""
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=2)
-    
+        """Atomically replace a JSON file (readers and crashes see old or new, never half)"""
+        self._replace_file(file_path, lambda f: json.dump(data, f, default=json_default))
+
+    def _replace_file(self, file_path: str, write):
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, 'w', encoding="utf-8") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+        self._fsync_dir()
+
+    def _fsync_dir(self):
+        if hasattr(os, "O_DIRECTORY"):
+            fd = os.open(self.base_dir, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    # ==================== STATE ====================
+
+    def _load_state(self, state: Dict):
+        self._decode_state(state)
+        self.seq = state.get("seq", 0)
+        for patient_id, patient in state.get("patients", {}).items():
+            patient.setdefault('patient_id', patient_id)
+            self._put_patient(patient)
+        for entry in state.get("queue", []):
+            self._put_queue_entry(entry)
+        self.notes = state.get("notes", {})
+        self.history = state.get("history", {})
+        self.queue_archive = {entry['queue_id']: entry for entry in state.get("queue_archive", [])}
+        self.counters = state.get("counters", {})
+        self.records = state.get("records", {})
+
+    def _decode_state(self, state: Dict):
+        """Parse a loaded state's timestamps in place, counting legacy records"""
+        collections = {
+            "patients": list(state.get("patients", {}).values()),
+            "queue": state.get("queue", []),
+            "queue_archive": state.get("queue_archive", []),
+            "notes": [note for notes in state.get("notes", {}).values() for note in notes],
+            "history": [entry for entries in state.get("history", {}).values() for entry in entries]
+        }
+        for collection, records in state.get("records", {}).items():
+            collections[collection] = list(records.values())
+        for collection, documents in collections.items():
+            legacy = sum(1 for document in documents if decode_timestamps(document))
+            if legacy:
+                self.legacy_timestamps[collection] = legacy
+
+    def _load_legacy_files(self):
+        """Import the pre-journal JSON files (one file per collection)"""
+        legacy = {}
+        for key, path in [("patients", self.patients_file), ("queue", self.queue_file),
+                          ("notes", self.notes_file), ("history", self.history_file)]:
+            if os.path.exists(path):
+                legacy[key] = self.load_json(path)
+        if legacy:
+            self._load_state(legacy)
+            print(f"📦 Imported legacy JSON storage ({len(self.patients)} patients)")
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_file):
+            return
+
+        good_offset = 0
+        with open(self.journal_file, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # Torn write from a crash; everything after it is discarded
+                if not line.endswith(b"\n"):
+                    break
+                good_offset += len(line)
+                self.journal_entries += 1
+                if record["seq"] > self.seq:
+                    self._apply(record)
+                    self.seq = record["seq"]
+
+        if good_offset < os.path.getsize(self.journal_file):
+            print("⚠️ Discarding incomplete journal record")
+            with open(self.journal_file, "r+b") as f:
+                f.truncate(good_offset)
+
+    def _apply(self, record: Dict):
+        """Apply one journal record to the in-memory state"""
+        op = record["op"]
+        upgrade_timestamps(record.get("doc"))
+        if op == "patient":
+            self._put_patient(record["doc"])
+        elif op == "queue":
+            self._put_queue_entry(record["doc"])
+        elif op == "queue_remove":
+            for queue_id in record["queue_ids"]:
+                self._remove_queue_entry(queue_id)
+        elif op == "note":
+            self.notes.setdefault(record["patient_id"], []).append(record["doc"])
+        elif op == "note_replace":
+            notes = self.notes.get(record["patient_id"], [])
+            for position, note in enumerate(notes):
+                if note.get("note_id") == record["doc"].get("note_id"):
+                    notes[position] = record["doc"]
+        elif op == "history":
+            self.history.setdefault(record["patient_id"], []).append(record["doc"])
+        elif op == "queue_archive":
+            for queue_id in record["queue_ids"]:
+                entry = self.queue.get(queue_id)
+                if entry is not None:
+                    self._remove_queue_entry(queue_id)
+                    self.queue_archive[queue_id] = {**entry, "archived_at": parse_timestamp(record["archived_at"])}
+        elif op == "counter":
+            self.counters[record["counter_id"]] = record["value"]
+        elif op == "counters":
+            prefix = record.get("reset_prefix")
+            if prefix:
+                self.counters = {c: value for c, value in self.counters.items() if not c.startswith(prefix)}
+            self.counters.update(record["values"])
+        elif op == "record":
+            self.records.setdefault(record["collection"], {})[record["key"]] = record["doc"]
+        elif op == "record_remove":
+            self.records.get(record["collection"], {}).pop(record["key"], None)
+
+    def _write(self, record: Dict):
+        """Journal a record (write-ahead), apply it, and compact when due"""
+        with self._lock:
+            self.seq += 1
+            record["seq"] = self.seq
+            if self._journal is None:
+                self._apply(record)  # In-memory only
+                return
+            line = json.dumps(record, default=json_default) + "\n"
+            self._journal.write(line)
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._apply(record)
+            if self._compacting_lines is not None:
+                self._compacting_lines.append(line)
+
+            self.journal_entries += 1
+            if self.journal_entries >= self.compact_every and self._compaction is None:
+                self._compaction = threading.Thread(target=self._compact_in_background, name="journal-compaction", daemon=True)
+                self._compaction.start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"⚠️ Journal compaction failed: {e}")  # Journal stays complete; retried on the next write
+        finally:
+            with self._lock:
+                self._compaction = None
+
+    def compact(self):
+        """Write a snapshot of the current state and start a journal with only newer records"""
+        with self._compact_lock:
+            with self._lock:
+                if self._journal is None:
+                    return
+                state = {
+                    "seq": self.seq,
+                    "patients": dict(self.patients),
+                    "queue": list(self.queue.values()),
+                    "notes": {patient_id: list(notes) for patient_id, notes in self.notes.items()},
+                    "history": {patient_id: list(entries) for patient_id, entries in self.history.items()},
+                    "queue_archive": list(self.queue_archive.values()),
+                    "counters": dict(self.counters),
+                    "records": {collection: dict(records) for collection, records in self.records.items()}
+                }
+                self._compacting_lines = []
+            try:
+                self.save_json(self.snapshot_file, state)
+            except Exception:
+                with self._lock:
+                    self._compacting_lines = None
+                raise
+
+            with self._lock:
+                # Records up to state["seq"] are in the snapshot. The new journal is
+                # swapped in atomically; a crash before that leaves records replay skips
+                lines, self._compacting_lines = self._compacting_lines, None
+                self._journal.close()
+                self._replace_file(self.journal_file, lambda f: f.writelines(lines))
+                self._journal = open(self.journal_file, "a", encoding="utf-8")
+                self.journal_entries = len(lines)
+
+    def wait_for_compaction(self):
+        """Block until a running background compaction has finished"""
+        with self._lock:
+            compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
+
+    def close(self):
+        """Wait for a running compaction, compact and close the journal"""
+        self.wait_for_compaction()
+        self.compact()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    # ==================== INDEX MAINTENANCE ====================
+
+    def _put_patient(self, patient: Dict):
+        patient_id = patient['patient_id']
+        previous = self.patients.get(patient_id)
+        if previous and previous.get('uhid') and previous.get('uhid') != patient.get('uhid'):
+            self.uhid_index.pop(previous['uhid'], None)
+        self.patients[patient_id] = patient
+        if patient.get('uhid'):
+            self.uhid_index[patient['uhid']] = patient_id
+
+    def _put_queue_entry(self, entry: Dict):
+        queue_id = entry['queue_id']
+        previous = self.queue.get(queue_id)
+        if previous is not None:
+            self.queue_status_index.get(previous['status'], {}).pop(queue_id, None)
+        else:
+            self.queue_patient_index.setdefault(entry['patient_id'], []).append(queue_id)
+        self.queue[queue_id] = entry
+        self.queue_status_index.setdefault(entry['status'], {})[queue_id] = None
+
+    def _remove_queue_entry(self, queue_id: str):
+        entry = self.queue.pop(queue_id, None)
+        if entry is None:
+            return
+        self.queue_status_index.get(entry['status'], {}).pop(queue_id, None)
+        patient_entries = self.queue_patient_index.get(entry['patient_id'], [])
+        if queue_id in patient_entries:
+            patient_entries.remove(queue_id)
+
     # ==================== PATIENTS ====================
-    
+
     def get_all_patients(self) -> Dict:
         """Get all patients"""
-        return self.load_json(self.patients_file)
-    
+        with self._lock:
+            return {patient_id: copy.deepcopy(patient) for patient_id, patient in self.patients.items()}
+
     def get_patient(self, patient_id: str) -> Optional[Dict]:
         """Get single patient by ID"""
-        patients = self.get_all_patients()
-        return patients.get(patient_id)
-    
+        patient = self.patients.get(patient_id)
+        return copy.deepcopy(patient) if patient else None
+
     def get_patient_by_uhid(self, uhid: str) -> Optional[Dict]:
-        """Get patient by UHID (Government Health ID)"""
-        patients = self.get_all_patients()
-        for patient_id, patient_data in patients.items():
-            if patient_data.get('uhid') == uhid:
-                return patient_data
-        return None
-    
+        """Get patient by UHID (Government Health ID) - index lookup"""
+        patient_id = self.uhid_index.get(uhid)
+        return self.get_patient(patient_id) if patient_id else None
+
     def create_patient(self, patient_id: str, patient_data: Dict) -> Dict:
         """Create new patient"""
-        patients = self.get_all_patients()
-        patients[patient_id] = patient_data
-        self.save_json(self.patients_file, patients)
-        return patient_data
-    
+        patient_data['patient_id'] = patient_id
+        self._write({"op": "patient", "doc": copy.deepcopy(patient_data)})
+        return copy.deepcopy(patient_data)
+
     def update_patient(self, patient_id: str, updates: Dict) -> Optional[Dict]:
         """Update patient data"""
-        patients = self.get_all_patients()
-        if patient_id not in patients:
-            return None
-        patients[patient_id].update(updates)
-        self.save_json(self.patients_file, patients)
-        return patients[patient_id]
-    
+        with self._lock:
+            if patient_id not in self.patients:
+                return None
+            patient = copy.deepcopy({**self.patients[patient_id], **updates})
+            self._write({"op": "patient", "doc": patient})
+            return copy.deepcopy(patient)
+
     # ==================== QUEUE ====================
-    
+
     def get_queue(self) -> List[Dict]:
         """Get all queue entries"""
-        return self.load_json(self.queue_file)
-    
+        with self._lock:
+            return [copy.deepcopy(entry) for entry in self.queue.values()]
+
     def add_to_queue(self, queue_entry: Dict) -> Dict:
         """Add entry to queue"""
-        queue = self.get_queue()
-        queue.append(queue_entry)
-        self.save_json(self.queue_file, queue)
-        return queue_entry
-    
+        self._write({"op": "queue", "doc": copy.deepcopy(queue_entry)})
+        return copy.deepcopy(queue_entry)
+
     def update_queue_status(self, queue_id: str, status: str, **kwargs) -> Optional[Dict]:
         """Update queue entry status"""
-        queue = self.get_queue()
-        for entry in queue:
-            if entry['queue_id'] == queue_id:
-                entry['status'] = status
-                entry.update(kwargs)
-                self.save_json(self.queue_file, queue)
-                return entry
-        return None
-    
+        with self._lock:
+            if queue_id not in self.queue:
+                return None
+            entry = copy.deepcopy({**self.queue[queue_id], "status": status, **kwargs})
+            self._write({"op": "queue", "doc": entry})
+            return copy.deepcopy(entry)
+
     def get_queue_by_status(self, status: str) -> List[Dict]:
-        """Get queue entries by status"""
-        queue = self.get_queue()
-        return [q for q in queue if q['status'] == status]
-    
+        """Get queue entries by status - index lookup"""
+        with self._lock:
+            return [copy.deepcopy(self.queue[queue_id]) for queue_id in self.queue_status_index.get(status, {})]
+
+    def get_patient_queue_entries(self, patient_id: str) -> List[Dict]:
+        """Get a patient's queue entries in arrival order - index lookup"""
+        with self._lock:
+            return [copy.deepcopy(self.queue[queue_id]) for queue_id in self.queue_patient_index.get(patient_id, [])]
+
+    def get_queue_stats(self) -> Dict:
+        """Entries per status (index sizes, no scan)"""
+        with self._lock:
+            counts = {status: len(queue_ids) for status, queue_ids in self.queue_status_index.items()}
+        counts["total"] = len(self.queue)
+        return counts
+
     def clear_completed_queue(self):
         """Remove completed entries from queue"""
-        queue = self.get_queue()
-        active_queue = [q for q in queue if q['status'] != 'completed']
-        self.save_json(self.queue_file, active_queue)
-    
+        with self._lock:
+            completed = list(self.queue_status_index.get('completed', {}))
+            if completed:
+                self._write({"op": "queue_remove", "queue_ids": completed})
+
+    def archive_queue_entries(self, queue_ids: List[str], archived_at):
+        """Move entries from the queue to the queue archive"""
+        if queue_ids:
+            self._write({"op": "queue_archive", "queue_ids": list(queue_ids), "archived_at": archived_at})
+
+    def get_queue_archive(self) -> List[Dict]:
+        """Get all archived queue entries"""
+        with self._lock:
+            return [copy.deepcopy(entry) for entry in self.queue_archive.values()]
+
+    def increment_counter(self, counter_id: str) -> int:
+        """Atomically increment a named counter and return the new value"""
+        with self._lock:
+            value = self.counters.get(counter_id, 0) + 1
+            self._write({"op": "counter", "counter_id": counter_id, "value": value})
+            return value
+
+    def add_to_counters(self, deltas: Dict[str, int]):
+        """Apply several counter deltas as one journal record"""
+        if deltas:
+            with self._lock:
+                values = {counter_id: self.counters.get(counter_id, 0) + delta for counter_id, delta in deltas.items()}
+                self._write({"op": "counters", "values": values})
+
+    def reset_counters(self, prefix: str, values: Dict[str, int]):
+        """Replace every counter starting with `prefix` by `values`"""
+        self._write({"op": "counters", "values": dict(values), "reset_prefix": prefix})
+
+    def get_counters(self, prefix: str) -> Dict[str, int]:
+        """All counters whose id starts with `prefix`"""
+        with self._lock:
+            return {counter_id: value for counter_id, value in self.counters.items() if counter_id.startswith(prefix)}
+
     # ==================== NOTES ====================
-    
+
     def get_all_notes(self) -> Dict:
         """Get all notes (organized by patient_id)"""
-        return self.load_json(self.notes_file)
-    
+        with self._lock:
+            return {patient_id: [copy.deepcopy(note) for note in notes] for patient_id, notes in self.notes.items()}
+
     def get_patient_notes(self, patient_id: str) -> List[Dict]:
         """Get all notes for a patient"""
-        notes = self.get_all_notes()
-        return notes.get(patient_id, [])
-    
+        with self._lock:
+            return [copy.deepcopy(note) for note in self.notes.get(patient_id, [])]
+
     def add_note(self, patient_id: str, note: Dict) -> Dict:
         """Add note for patient"""
-        notes = self.get_all_notes()
-        if patient_id not in notes:
-            notes[patient_id] = []
-        notes[patient_id].append(note)
-        self.save_json(self.notes_file, notes)
-        return note
-    
+        self._write({"op": "note", "patient_id": patient_id, "doc": copy.deepcopy(note)})
+        return copy.deepcopy(note)
+
+    def replace_note(self, patient_id: str, note: Dict):
+        """Replace a stored note (matched by note_id)"""
+        self._write({"op": "note_replace", "patient_id": patient_id, "doc": copy.deepcopy(note)})
+
     # ==================== HISTORY ====================
-    
+
     def get_all_history(self) -> Dict:
         """Get all history (organized by patient_id)"""
-        return self.load_json(self.history_file)
-    
+        with self._lock:
+            return {patient_id: [copy.deepcopy(entry) for entry in entries] for patient_id, entries in self.history.items()}
+
     def get_patient_history(self, patient_id: str) -> List[Dict]:
         """Get all history for a patient"""
-        history = self.get_all_history()
-        return history.get(patient_id, [])
-    
+        with self._lock:
+            return [copy.deepcopy(entry) for entry in self.history.get(patient_id, [])]
+
     def add_history(self, patient_id: str, history_entry: Dict) -> Dict:
         """Add history entry for patient"""
-        history = self.get_all_history()
-        if patient_id not in history:
-            history[patient_id] = []
-        history[patient_id].append(history_entry)
-        self.save_json(self.history_file, history)
-        return history_entry
+        self._write({"op": "history", "patient_id": patient_id, "doc": copy.deepcopy(history_entry)})
+        return copy.deepcopy(history_entry)
+
+    # ==================== RECORDS ====================
+    # Keyed collections without dedicated indexes (documents, batches, ...)
+
+    def put_record(self, collection: str, key: str, doc: Dict) -> Dict:
+        """Insert or replace a record"""
+        self._write({"op": "record", "collection": collection, "key": key, "doc": copy.deepcopy(doc)})
+        return copy.deepcopy(doc)
+
+    def get_record(self, collection: str, key: str) -> Optional[Dict]:
+        record = self.records.get(collection, {}).get(key)
+        return copy.deepcopy(record) if record else None
 
+    def get_records(self, collection: str) -> List[Dict]:
+        with self._lock:
+            return [copy.deepcopy(record) for record in self.records.get(collection, {}).values()]
 
-# Singleton instance
-storage = StorageService()
+    def remove_record(self, collection: str, key: str):
+        with self._lock:
+            if key in self.records.get(collection, {}):
+                self._write({"op": "record_remove", "collection": collection, "key": key})
@@ -0,0 +1,89 @@
+"""
+Compressed side storage for large, rarely read note text
+
+Raw transcripts are by far the biggest part of a note, yet only the single
+note view (or view=full) ever shows them. They are kept out of the note
+record in a `note_texts` side record instead:
+
+    {note_id, patient_id, codec: "zstd", raw_size, stored_size, data}
+
+`data` is the zstd-compressed JSON of the note's text fields. Note lists,
+summaries and the notes working set never carry the text; it is
+decompressed only when a read explicitly asks for it. The note keeps
+`text_sizes` ({field: bytes}) so clients know what can be loaded.
+"""
+
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import zstandard
+
+
+TEXT_COMPRESSION_LEVEL = int(os.environ.get('TEXT_COMPRESSION_LEVEL', '10'))
+TEXT_CODEC = "zstd"
+
+# Note fields moved to note_texts
+COMPRESSED_NOTE_FIELDS = ("transcript",)
+
+# zstd contexts are not thread-safe; SQLite/Mongo work runs in worker threads
+_contexts = threading.local()
+
+
+def compress_text(data: bytes) -> bytes:
+    if not hasattr(_contexts, "compressor"):
+        _contexts.compressor = zstandard.ZstdCompressor(level=TEXT_COMPRESSION_LEVEL)
+    return _contexts.compressor.compress(data)
+
+
+def decompress_text(data: bytes) -> bytes:
+    if not hasattr(_contexts, "decompressor"):
+        _contexts.decompressor = zstandard.ZstdDecompressor()
+    return _contexts.decompressor.decompress(data)
+
+
+def pack_note_texts(note: Dict) -> Optional[Dict]:
+    """
+    Move a note's text fields into a compressed side record
+
+    Pops the fields from `note` (and sets `text_sizes`); returns the
+    note_texts record, or None if the note has no text to move.
+    """
+    texts = {field: note.pop(field) for field in COMPRESSED_NOTE_FIELDS if isinstance(note.get(field), str)}
+    if not texts:
+        return None
+    note['text_sizes'] = {field: len(text.encode()) for field, text in texts.items()}
+    raw = json.dumps(texts, ensure_ascii=False).encode()
+    data = compress_text(raw)
+    return {
+        "note_id": note['note_id'],
+        "patient_id": note['patient_id'],
+        "codec": TEXT_CODEC,
+        "raw_size": len(raw),
+        "stored_size": len(data),
+        "data": data
+    }
+
+
+def unpack_note_texts(record: Dict) -> Dict[str, str]:
+    """note_texts record -> {field: text}"""
+    return json.loads(decompress_text(bytes(record['data'])))
+
+
+def texts_requested(projection: Optional[Dict]) -> List[str]:
+    """Text fields a notes projection asks for (full view: all of them)"""
+    fields = {path: value for path, value in (projection or {}).items() if path != "_id"}
+    if not fields:
+        return list(COMPRESSED_NOTE_FIELDS) if projection else []
+    if any(fields.values()):
+        return [field for field in COMPRESSED_NOTE_FIELDS if fields.get(field)]
+    return [field for field in COMPRESSED_NOTE_FIELDS if field not in fields]
+
+
+def merge_note_texts(notes: Iterable[Dict], texts: Dict[str, Dict[str, str]], fields: List[str]):
+    """Put loaded texts back into notes (inline text in older notes wins)"""
+    for note in notes:
+        for field, text in texts.get(note.get('note_id'), {}).items():
+            if field in fields and field not in note:
+                note[field] = text
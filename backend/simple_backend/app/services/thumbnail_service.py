@@ -0,0 +1,113 @@
+"""
+Thumbnail and preview generation for scanned documents
+
+Resizing runs in a process pool so large phone photos never block the
+event loop. Derivatives are stored next to the original in the blob store.
+"""
+
+import asyncio
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+from PIL import Image, ImageOps
+
+from app.services.blob_store import blob_store, get_content_type
+
+
+# name -> (max edge in px, quality)
+DERIVATIVES = {
+    "thumbnail": (256, 60),
+    "preview": (1024, 75)
+}
+THUMBNAIL_EXTENSIONS = ['jpg', 'jpeg', 'png', 'webp']
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', '2'))
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def media_url(key: str) -> str:
+    """API URL that serves a blob (see GET /media/{key})"""
+    return f"/media/{key}"
+
+
+def render_derivatives(image_path: str) -> Dict[str, tuple]:
+    """
+    Render all derivatives for one image (runs in a worker process)
+
+    Returns {name: (extension, bytes)}. WebP is preferred, JPEG is the
+    fallback when Pillow was built without WebP support.
+    """
+    with Image.open(image_path) as image:
+        image.draft("RGB", (max(size for size, _ in DERIVATIVES.values()),) * 2)  # Fast JPEG downscale on decode
+        image = ImageOps.exif_transpose(image)  # Phone photos carry rotation in EXIF
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        rendered = {}
+        for name, (max_edge, quality) in DERIVATIVES.items():
+            derivative = image.copy()
+            derivative.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+            buffer = io.BytesIO()
+            try:
+                derivative.save(buffer, format="WEBP", quality=quality, method=4)
+                extension = "webp"
+            except (KeyError, OSError):
+                buffer = io.BytesIO()
+                derivative.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+                extension = "jpg"
+
+            rendered[name] = (extension, buffer.getvalue())
+
+        return rendered
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    return _executor
+
+
+def shutdown_executor():
+    """Stop worker processes (called on app shutdown)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def generate_thumbnails(image_filename: str) -> Dict:
+    """
+    Create thumbnail + preview for an uploaded image and store them
+
+    Args:
+        image_filename: Blob key of the original image
+
+    Returns:
+        Fields to merge into the document record, e.g. thumbnail_file,
+        thumbnail_url, preview_file, preview_url. Empty for non-images (PDF).
+    """
+    extension = image_filename.rsplit('.', 1)[-1].lower()
+    if extension not in THUMBNAIL_EXTENSIONS:
+        return {}
+
+    loop = asyncio.get_running_loop()
+    async with blob_store.local_path(image_filename) as image_path:
+        rendered = await loop.run_in_executor(_get_executor(), render_derivatives, image_path)
+
+    stem = image_filename.rsplit('.', 1)[0]
+    fields = {}
+    for name, (derivative_extension, derivative_bytes) in rendered.items():
+        key = f"{stem}_{name}.{derivative_extension}"
+        await blob_store.put(key, derivative_bytes, get_content_type(key))
+        fields[f"{name}_file"] = key
+        fields[f"{name}_url"] = media_url(key)
+        fields[f"{name}_bytes"] = len(derivative_bytes)
+
+    print(f"🖼️ Thumbnails generated for {image_filename}: "
+          + ", ".join(f"{name} {len(b) // 1024}KB" for name, (_, b) in rendered.items()))
+
+    return fields
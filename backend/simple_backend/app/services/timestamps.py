@@ -0,0 +1,144 @@
+"""
+Typed timestamps: timezone-aware UTC datetimes in every collection
+
+Every stored timestamp (created_at, updated_at, added_at, ...) is a
+timezone-aware UTC datetime with millisecond precision - the precision of a
+BSON date, so a value reads back identically from every backend:
+
+- MongoDB stores native BSON dates (the shared client is tz_aware)
+- SQLite and the JSON store keep the canonical text form
+  "2024-01-01T03:30:00.000+00:00" (fixed width, so text order is time
+  order) and hand back datetimes
+
+Older records hold naive ISO strings written with datetime.now(), i.e. the
+clinic's wall-clock time. They are read as CLINIC_TIMEZONE, upgraded when
+read (MongoDB writes the upgrade back) and in bulk by migrate_timestamps.py.
+Calendar days (visit stats, token numbers) are clinic-local days.
+"""
+
+import os
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Optional
+from zoneinfo import ZoneInfo
+
+
+# IANA zone of the clinic (e.g. Asia/Kolkata); defaults to the server's zone
+CLINIC_TIMEZONE = os.environ.get('CLINIC_TIMEZONE', '')
+CLINIC_TZ = ZoneInfo(CLINIC_TIMEZONE) if CLINIC_TIMEZONE else datetime.now().astimezone().tzinfo
+
+# Top-level timestamp fields, whatever the collection
+TIMESTAMP_FIELDS = (
+    "created_at", "updated_at",
+    "added_at", "nurse_completed_at", "started_at", "completed_at", "cancelled_at", "timeline_ready_at", "archived_at",
+    "uploaded_at", "processed_at", "generated_at", "expires_at", "reconciled_at", "last_visit"
+)
+
+_ZERO = timedelta(0)
+
+
+def _canonical(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=CLINIC_TZ)
+    value = value.astimezone(timezone.utc)
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+
+def _is_canonical(value) -> bool:
+    return (
+        isinstance(value, datetime) and value.tzinfo is not None
+        and value.utcoffset() == _ZERO and value.microsecond % 1000 == 0
+    )
+
+
+def utc_now() -> datetime:
+    """Current time as stored: aware UTC, millisecond precision"""
+    return _canonical(datetime.now(timezone.utc))
+
+
+def parse_timestamp(value) -> Optional[datetime]:
+    """
+    ISO string, datetime or date -> aware UTC datetime (None/"" -> None)
+
+    Naive values are clinic wall-clock time. Raises ValueError for anything else.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return _canonical(value)
+    if isinstance(value, date):
+        return _canonical(datetime.combine(value, time.min))
+    if isinstance(value, str):
+        return _canonical(datetime.fromisoformat(value.strip()))
+    raise ValueError(f"Not a timestamp: {value!r}")
+
+
+def to_iso(value) -> Optional[str]:
+    """Canonical text form (UTC, milliseconds) of a timestamp"""
+    parsed = parse_timestamp(value)
+    return parsed.isoformat(timespec="milliseconds") if parsed else None
+
+
+def json_default(value):
+    """json.dumps default: timestamps in canonical text form, anything else as str"""
+    if isinstance(value, datetime):
+        return to_iso(value)
+    return str(value)
+
+
+def clinic_date(value) -> Optional[str]:
+    """Clinic-local calendar day ("YYYY-MM-DD") of a timestamp"""
+    parsed = parse_timestamp(value)
+    return parsed.astimezone(CLINIC_TZ).date().isoformat() if parsed else None
+
+
+def clinic_today() -> date:
+    return datetime.now(CLINIC_TZ).date()
+
+
+def clinic_day_start(day: Optional[date] = None) -> datetime:
+    """Local midnight starting a clinic day (today by default), as stored"""
+    return parse_timestamp(datetime.combine(day or clinic_today(), time.min))
+
+
+# ==================== SCHEMA UPGRADE ====================
+
+def upgrade_timestamps(document: Optional[Dict]) -> Dict:
+    """
+    Convert a record's (or an update's) timestamp fields in place
+
+    Legacy strings, naive and non-UTC datetimes become aware UTC datetimes;
+    queue entries also get `visit_date`, the clinic day of added_at. Values
+    that do not parse are left alone.
+
+    Returns:
+        {field: new value} for every field that changed (what a migration writes back)
+    """
+    changed = {}
+    if not document:
+        return changed
+    for field in TIMESTAMP_FIELDS:
+        value = document.get(field)
+        if value is None or _is_canonical(value):
+            continue
+        try:
+            document[field] = changed[field] = parse_timestamp(value)
+        except (TypeError, ValueError):
+            continue
+    if isinstance(document.get('added_at'), datetime) and 'visit_date' not in document:
+        document['visit_date'] = changed['visit_date'] = clinic_date(document['added_at'])
+    return changed
+
+
+def decode_timestamps(document: Optional[Dict]) -> bool:
+    """
+    Text backends: parse stored timestamps back into datetimes in place
+
+    Returns True if the stored form was legacy (not canonical text), i.e.
+    the record should be rewritten by the backfill.
+    """
+    original = {field: document.get(field) for field in TIMESTAMP_FIELDS} if document else {}
+    changed = upgrade_timestamps(document)
+    return any(
+        field not in original or not isinstance(original[field], str) or to_iso(value) != original[field]
+        for field, value in changed.items()
+    )
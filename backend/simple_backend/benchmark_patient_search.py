@@ -0,0 +1,115 @@
+"""
+Benchmark: patient search latency at scale
+
+Registers N synthetic patients (Hindi names in Latin and Devanagari,
+phones, UHIDs) through insert_patients, then times search_patients for
+name prefixes, misspellings, cross-script names, phone suffixes and UHID
+prefixes. Reports median / p95 / max milliseconds per query kind.
+
+Usage:
+    python benchmark_patient_search.py                              # sqlite, 100,000 patients
+    python benchmark_patient_search.py --backends sqlite,memory -p 1000000
+    python benchmark_patient_search.py --backends mongodb --mock    # in-process mongomock-motor
+
+mongodb uses MONGODB_URL (a scratch database, dropped afterwards).
+"""
+
+import argparse
+import asyncio
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from benchmark_storage import open_backend, close_backend
+from app.services.storage_backend import STORAGE_BACKENDS
+
+
+FIRST_NAMES = [
+    "Ram", "Shyam", "Sita", "Geeta", "Deepak", "Priya", "Pooja", "Rahul", "Anil", "Sunita",
+    "Mohammad", "Irfan", "Ayesha", "Vikram", "Lakshmi", "Suresh", "Kavita", "Manoj", "Neha", "Arjun",
+    "राम", "सीता", "दीपक", "प्रिया", "पूजा", "राहुल", "सुनीता", "मोहम्मद", "लक्ष्मी", "मनोज"
+]
+LAST_NAMES = [
+    "Sharma", "Verma", "Gupta", "Singh", "Kumar", "Yadav", "Khan", "Patel", "Mishra", "Chauhan",
+    "Reddy", "Nair", "Das", "Joshi", "Pandey", "Tiwari", "Ansari", "Meena", "Rawat", "Thakur",
+    "शर्मा", "वर्मा", "गुप्ता", "सिंह", "कुमार", "यादव", "खान", "पटेल", "मिश्रा", "जोशी"
+]
+STATES = ["MH", "DL", "UP", "RJ", "KA", "TN", "BR", "MP"]
+
+QUERIES = {
+    "name prefix": ["ram sh", "deep", "priya gu", "moh kh", "sunita y", "vik"],
+    "misspelled": ["Sharmaa", "Dipak", "Muhammad", "Pooja Guptha", "Lakshmee", "Sureshh"],
+    "devanagari": ["शर्मा", "दीपक वर्मा", "प्रिया", "मोहम्मद खान", "राहुल", "गुप्ता"],
+    "phone suffix": ["43210", "0042", "98765", "1234", "55501", "7777"],
+    "uhid prefix": ["MH0001", "DL00042", "UP1", "KA0000", "RJ00123", "TN0"],
+}
+
+
+def synthetic_patient(i: int, rng: random.Random) -> dict:
+    return {
+        "patient_id": f"PAT_{i:08X}",
+        "uhid": f"{STATES[i % len(STATES)]}{i:07d}",
+        "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        "phone": f"9{rng.randrange(10 ** 9):09d}",
+        "age": rng.randrange(1, 90),
+        "gender": "female" if i % 2 else "male",
+        "status": "active",
+        "created_at": f"2024-01-01T08:{i // 60 % 60:02d}:{i % 60:02d}"
+    }
+
+
+async def run_search(storage, patients: int, rounds: int) -> dict:
+    rng = random.Random(42)
+    start = time.perf_counter()
+    chunk = 5000
+    for offset in range(0, patients, chunk):
+        await storage.insert_patients([synthetic_patient(i, rng) for i in range(offset, min(offset + chunk, patients))])
+    print(f"   📥 {patients:,} patients indexed in {time.perf_counter() - start:.1f}s")
+
+    results = {}
+    for kind, queries in QUERIES.items():
+        timings = []
+        for _ in range(rounds):
+            for query in queries:
+                started = time.perf_counter()
+                await storage.search_patients(query)
+                timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        results[kind] = (statistics.median(timings), timings[int(len(timings) * 0.95) - 1], timings[-1])
+    return results
+
+
+async def run_benchmark(backends: list, patients: int, rounds: int, mock: bool):
+    print(f"🚀 Patient search benchmark ({patients:,} patients, backends: {', '.join(backends)})")
+    for name in backends:
+        workdir = tempfile.mkdtemp(prefix="phc_bench_")
+        try:
+            storage = await open_backend(name, workdir, mock)
+            results = await run_search(storage, patients, rounds)
+            await close_backend(name, storage, mock)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        print(f"\n📊 {name} (ms per search, lower is better):")
+        print("-" * 56)
+        print(f"   {'query':<16}{'median':>12}{'p95':>12}{'max':>12}")
+        for kind, (median, p95, worst) in results.items():
+            print(f"   {kind:<16}{median:>12.2f}{p95:>12.2f}{worst:>12.2f}")
+        print("-" * 56)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="sqlite", help="Comma-separated backends to run")
+    parser.add_argument("-p", "--patients", type=int, default=100000, help="Number of patients to register")
+    parser.add_argument("-r", "--rounds", type=int, default=5, help="Times each query is repeated")
+    parser.add_argument("--mock", action="store_true", help="Use mongomock-motor instead of MONGODB_URL")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.backends.split(",") if name.strip()]
+    unknown = [name for name in names if name not in STORAGE_BACKENDS]
+    if unknown:
+        parser.error(f"unknown backend(s): {', '.join(unknown)}")
+    asyncio.run(run_benchmark(names, args.patients, args.rounds, args.mock))
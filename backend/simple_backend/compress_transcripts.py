@@ -0,0 +1,79 @@
+"""
+Transcript Compression: move inline note transcripts into zstd-compressed note_texts
+New notes are stored compressed already; this backfills notes written before,
+then reports the storage and working-set savings. Safe to re-run.
+
+Usage:
+    python compress_transcripts.py
+    python compress_transcripts.py --batch-size 200
+    python compress_transcripts.py --report-only
+
+Uses STORAGE_BACKEND like the API.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+os.environ.setdefault('GEMINI_API_KEY', 'not-needed-for-compression')
+os.environ.setdefault('GROQ_API_KEY', 'not-needed-for-compression')
+
+from app.services.storage_backend import storage_backend
+
+
+def _mb(size: int) -> str:
+    return f"{size / (1024 * 1024):8.2f} MB"
+
+
+async def collection_sizes(storage) -> dict:
+    """MongoDB only: in-memory (uncompressed) data size of notes vs note_texts"""
+    sizes = {}
+    for name in ("notes", "note_texts"):
+        try:
+            stats = await storage.db.command("collStats", name)
+        except Exception:
+            return {}
+        sizes[name] = (stats.get("count", 0), stats.get("size", 0), stats.get("avgObjSize", 0))
+    return sizes
+
+
+async def main(args):
+    print(f"🚀 Compressing note transcripts ({storage_backend.name} storage)...")
+
+    await storage_backend.connect()
+    storage = storage_backend.storage
+    try:
+        start = time.perf_counter()
+        moved = {"notes": 0, "raw_bytes": 0, "stored_bytes": 0}
+        if not args.report_only:
+            moved = await storage.compress_note_texts(batch_size=args.batch_size)
+        elapsed = time.perf_counter() - start
+        totals = await storage.get_note_text_stats()
+        sizes = await collection_sizes(storage) if storage_backend.name == "mongodb" else {}
+    finally:
+        await storage_backend.disconnect()
+
+    print("\n📊 Compression Summary:")
+    print("-" * 60)
+    if not args.report_only:
+        print(f"   Moved now:        {moved['notes']:8d} notes  {_mb(moved['raw_bytes'])} → {_mb(moved['stored_bytes'])}")
+        print(f"   Time:             {elapsed:8.1f}s")
+    print(f"   Compressed texts: {totals['texts']:8d}")
+    print(f"   Raw text:         {_mb(totals['raw_bytes'])}  (no longer in note records, lists or cache)")
+    print(f"   Stored:           {_mb(totals['stored_bytes'])}  (note_texts, read only on request)")
+    if totals['stored_bytes']:
+        print(f"   Ratio:            {totals['raw_bytes'] / totals['stored_bytes']:8.1f}x")
+    for name, (count, size, average) in sizes.items():
+        print(f"   {name + ':':<18}{count:8d} docs   {_mb(size)}  avg {average / 1024:.1f} KB")
+    print("-" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500, help="Notes per write batch")
+    parser.add_argument("--report-only", action="store_true", help="Only print the savings report")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,62 @@
+"""
+Parquet Export: clinical data → Parquet files on the blob store
+Exports records changed since the last run (watermarks in <prefix>/_state.json)
+
+Usage:
+    python export_parquet.py                          # incremental, all datasets
+    python export_parquet.py --full                   # ignore watermarks, export everything
+    python export_parquet.py --datasets notes,visits
+
+Uses STORAGE_BACKEND and BLOB_STORE like the API. Needs pyarrow.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+os.environ.setdefault('GEMINI_API_KEY', 'not-needed-for-export')
+os.environ.setdefault('GROQ_API_KEY', 'not-needed-for-export')
+
+from app.services.storage_backend import storage_backend
+from app.services.parquet_export import run_export, EXPORT_DATASETS, PARQUET_EXPORT_PREFIX
+
+
+async def main(args):
+    datasets = [name.strip() for name in args.datasets.split(",") if name.strip()] if args.datasets else None
+
+    print(f"🚀 Starting Parquet export{' (full)' if args.full else ''}...")
+    print(f"📂 Destination: {PARQUET_EXPORT_PREFIX}/ ({os.environ.get('BLOB_STORE', 'local')} blob store)")
+
+    await storage_backend.connect()
+    try:
+        start = time.perf_counter()
+        manifest = await run_export(datasets, full=args.full)
+        elapsed = time.perf_counter() - start
+    finally:
+        await storage_backend.disconnect()
+
+    print(f"\n📊 Export Summary (run {manifest['run_id']}, changes up to {manifest['until']}):")
+    print("-" * 60)
+    for name, result in manifest["datasets"].items():
+        print(f"   {name:<22}{result['records']:>9} records{result['rows']:>10} rows{len(result['files']):>5} files")
+    skipped = [name for name in (datasets or EXPORT_DATASETS) if name not in manifest["datasets"]]
+    if skipped:
+        print(f"   Up to date: {', '.join(skipped)}")
+    print(f"   Time: {elapsed:.1f}s")
+    print("-" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--full", action="store_true", help="Ignore watermarks and export every record")
+    parser.add_argument("--datasets", help=f"Comma-separated subset of: {', '.join(EXPORT_DATASETS)}")
+    args = parser.parse_args()
+
+    unknown = [name for name in (args.datasets or "").split(",") if name.strip() and name.strip() not in EXPORT_DATASETS]
+    if unknown:
+        parser.error(f"unknown dataset(s): {', '.join(unknown)}")
+    asyncio.run(main(args))
@@ -0,0 +1,81 @@
+"""
+Bulk Patient Import: CSV / NDJSON → MongoDB
+Registers existing patients without adding them to the queue (same rules as POST /patients/import)
+
+Usage:
+    python import_patients.py patients.csv
+    python import_patients.py patients.ndjson --dry-run
+    python import_patients.py export.txt --format csv --chunk-size 1000 --errors errors.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+os.environ.setdefault('GEMINI_API_KEY', 'not-needed-for-import')
+os.environ.setdefault('GROQ_API_KEY', 'not-needed-for-import')
+
+from app.services.mongodb_storage import mongodb_storage
+from app.services.patient_import import import_patients, DEFAULT_CHUNK_SIZE, IMPORT_FORMATS
+
+
+READ_SIZE = 256 * 1024
+
+
+async def read_file(path: str):
+    """Stream a file in blocks so large registers never sit in memory whole"""
+    with open(path, "rb") as f:
+        while True:
+            block = await asyncio.to_thread(f.read, READ_SIZE)
+            if not block:
+                break
+            yield block
+
+
+async def run_import(args):
+    fmt = args.format or ("csv" if args.file.lower().endswith(".csv") else "ndjson")
+
+    print("🚀 Starting patient import...")
+    print(f"📂 File: {args.file} ({fmt})")
+
+    await mongodb_storage.connect()
+    try:
+        start = time.perf_counter()
+        report = await import_patients(read_file(args.file), fmt, chunk_size=args.chunk_size, dry_run=args.dry_run)
+        elapsed = time.perf_counter() - start
+    finally:
+        await mongodb_storage.disconnect()
+
+    print("\n📊 Import Summary:")
+    print("-" * 60)
+    print(f"   Rows:      {report['total_rows']:6d}")
+    print(f"   Imported:  {report['imported']:6d}{'  (dry run - nothing written)' if args.dry_run else ''}")
+    print(f"   Failed:    {report['failed']:6d}")
+    print(f"   Time:      {elapsed:6.1f}s ({report['total_rows'] / max(elapsed, 1e-9):.0f} rows/s)")
+    print("-" * 60)
+
+    for error in report['errors'][:20]:
+        print(f"   ❌ Row {error['row']} ({error['uhid'] or '-'}): {'; '.join(error['errors'])}")
+    if report['failed'] > 20:
+        print(f"   ... {report['failed'] - 20} more")
+
+    if args.errors:
+        with open(args.errors, "w") as f:
+            json.dump(report['errors'], f, indent=2)
+        print(f"📝 Row errors written to {args.errors}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", help="CSV (uhid,name,phone,age,gender header) or NDJSON file")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, help="Defaults from the file extension")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per insert_many")
+    parser.add_argument("--dry-run", action="store_true", help="Validate only, write nothing")
+    parser.add_argument("--errors", help="Write the per-row error report to this JSON file")
+
+    asyncio.run(run_import(parser.parse_args()))
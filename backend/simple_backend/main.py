@@ -4,13 +4,21 @@ Version: 3.0.0
 Features: Queue Management, Groq Whisper, Gemini Vision, Organized Architecture
 """
 
-from fastapi import FastAPI
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes import patients, queue, uploads, notes, documents, reports
-from app.services.storage_service import storage
-from app.services.mongo_service import mongo_service
-from app.services.mongodb_storage import mongodb_storage
+from fastapi.responses import JSONResponse
+from typing import Optional
+from app.routes import patients, queue, queue_live, uploads, notes, documents, reports, media, fhir
+from app.services.database import database
+from app.services.storage_backend import storage_backend, get_storage
+from app.services.pagination import InvalidCursor
+from app.services.projections import InvalidProjection
+from app.services.patient_cache import patient_cache
+from app.services.queue_events import queue_events
+from app.services.queue_rollover import queue_rollover
+from app.services.stats_reconciler import stats_reconciler
+from app.services.parquet_export import parquet_exporter
+from app.services.thumbnail_service import shutdown_executor
 import os
 from dotenv import load_dotenv
 
@@ -64,40 +72,52 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(InvalidCursor)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursor):
+    """Malformed `after` pagination cursor"""
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+
+@app.exception_handler(InvalidProjection)
+async def invalid_projection_handler(request: Request, exc: InvalidProjection):
+    """Malformed `fields` projection list"""
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+
 # ==================== INCLUDE ROUTERS ====================
 
 app.include_router(patients.router)
 app.include_router(queue.router)
+app.include_router(queue_live.router)
 app.include_router(uploads.router)
 app.include_router(notes.router)
 app.include_router(documents.router)
 app.include_router(reports.router)
+app.include_router(media.router)
+app.include_router(fhir.router)
 
 
 # ==================== ROOT ENDPOINT ====================
 
 @app.get("/", tags=["System"])
-def root():
+async def root():
     """
     API Information & Real-time Statistics
     
     Shows current system status and usage metrics
     """
     
-    # Get real-time stats
-    patients_data = storage.get_all_patients()
-    queue_data = storage.get_queue()
-    notes_data = storage.get_all_notes()
+    # Materialized counters: one read, however large the collections get
+    stats = await get_storage().get_stats()
+    queue_counts = stats['queue']
     
     queue_stats = {
-        "waiting": len([q for q in queue_data if q['status'] == 'waiting']),
-        "in_progress": len([q for q in queue_data if q['status'] == 'in_progress']),
-        "completed_today": len([q for q in queue_data if q['status'] == 'completed']),
-        "total": len(queue_data)
+        "waiting": queue_counts['waiting'],
+        "in_progress": queue_counts['in_consultation'],
+        "completed_today": queue_counts['completed'],
+        "total": queue_counts['total']
     }
     
-    total_notes = sum(len(notes) for notes in notes_data.values())
-    
     return {
         "service": "PHC AI Co-Pilot Backend",
         "version": "3.0.0",
@@ -120,10 +140,10 @@ def root():
             "history": "/history"
         },
         "statistics": {
-            "total_patients": len(patients_data),
+            "total_patients": stats['patients']['total'],
             "queue": queue_stats,
-            "total_notes": total_notes,
-            "storage": "JSON (File-based)"
+            "total_notes": stats['notes']['total'],
+            "storage": storage_backend.name
         },
         "integrations": {
             "transcription": "Groq Whisper (whisper-large-v3-turbo)",
@@ -143,49 +163,99 @@ def health_check():
 
 
 @app.get("/stats", tags=["System"])
-def detailed_stats():
+async def detailed_stats():
     """
     Detailed system statistics
     
-    For admin dashboard or monitoring
+    For admin dashboard or monitoring. Counts come from materialized
+    counters kept up to date by every write (O(1) read); the reconciliation
+    job recounts them periodically (POST /stats/reconcile to force it).
     """
     
-    patients_data = storage.get_all_patients()
-    queue_data = storage.get_queue()
-    notes_data = storage.get_all_notes()
-    history_data = storage.get_all_history()
-    
-    # Calculate detailed stats
-    active_patients = [p for p in patients_data.values() if p['status'] == 'active']
-    
-    patients_by_gender = {}
-    for p in patients_data.values():
-        gender = p.get('gender', 'unknown')
-        patients_by_gender[gender] = patients_by_gender.get(gender, 0) + 1
+    stats = await get_storage().get_stats()
+    queue_counts = stats['queue']
     
     return {
-        "patients": {
-            "total": len(patients_data),
-            "active": len(active_patients),
-            "by_gender": patients_by_gender
-        },
+        "patients": stats['patients'],
         "queue": {
-            "current_size": len([q for q in queue_data if q['status'] != 'completed']),
-            "waiting": len([q for q in queue_data if q['status'] == 'waiting']),
-            "in_progress": len([q for q in queue_data if q['status'] == 'in_progress']),
-            "completed": len([q for q in queue_data if q['status'] == 'completed'])
+            "current_size": queue_counts['total'] - queue_counts['completed'],
+            "waiting": queue_counts['waiting'],
+            "in_progress": queue_counts['in_consultation'],
+            "completed": queue_counts['completed'],
+            "by_status": queue_counts
         },
+        "archive": stats['archive'],
         "notes": {
-            "total": sum(len(notes) for notes in notes_data.values()),
-            "patients_with_notes": len(notes_data)
+            "total": stats['notes']['total'],
+            "patients_with_notes": stats['notes']['patients']
         },
         "history": {
-            "total_prescriptions": sum(len(h) for h in history_data.values()),
-            "patients_with_history": len(history_data)
+            "total_prescriptions": stats['history']['total'],
+            "patients_with_history": stats['history']['patients']
+        },
+        "counters": {
+            "last_reconciled_at": stats_reconciler.last_run_at,
+            "last_drift": stats_reconciler.last_drift
         }
     }
 
 
+@app.post("/stats/reconcile", tags=["System"])
+async def reconcile_stats():
+    """
+    Recount the materialized stats counters now
+    
+    Returns the recounted stats and the drift that was corrected
+    ({counter: actual - stored}).
+    """
+    result = await stats_reconciler.run_once()
+    return {"success": True, **result}
+
+
+@app.post("/exports/parquet", tags=["System"])
+async def export_parquet(datasets: Optional[str] = None, full: bool = False):
+    """
+    Export changed records to Parquet on the blob store now
+    
+    **Query Parameters:**
+    - datasets: Comma-separated subset (patients, notes, history_medications, documents, visits)
+    - full: Ignore the watermarks and export everything
+    
+    **Returns:**
+    - The run manifest (rows and files per dataset)
+    """
+    names = [name.strip() for name in datasets.split(",") if name.strip()] if datasets else None
+    try:
+        manifest = await parquet_exporter.run_once(names, full)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Parquet export needs pyarrow (pip install pyarrow)")
+    return {"success": True, **manifest}
+
+
+@app.get("/stats/database", tags=["System"])
+def database_stats():
+    """
+    MongoDB connection pool statistics
+    
+    Shows pool configuration, checked-out connections, checkout wait
+    times and background index creation status
+    """
+    return database.pool_stats()
+
+
+@app.get("/stats/cache", tags=["System"])
+def cache_stats():
+    """
+    Patient cache statistics
+    
+    Hit rate, evictions/invalidations and staleness (age of entries served
+    from cache, change stream invalidation lag)
+    """
+    return patient_cache.stats()
+
+
 # ==================== STARTUP/SHUTDOWN EVENTS ====================
 
 @app.on_event("startup")
@@ -196,16 +266,22 @@ async def startup_event():
     print("="*60)
     print("✅ Storage initialized")
     print("✅ AI services configured (Groq + Gemini)")
-    print("🔄 Connecting to MongoDB...")
-    await mongo_service.connect()
-    await mongodb_storage.connect()  # NEW: Connect MongoDB storage
+    print(f"🔄 Connecting to {storage_backend.name} storage...")
+    await storage_backend.connect()
+    queue_rollover.start()
+    stats_reconciler.start()
+    parquet_exporter.start()
+    if storage_backend.name == "mongodb":
+        queue_events.start(storage_backend.storage.db.queue)
     print("✅ Routes loaded:")
     print("   - /patients  (Patient Management)")
-    print("   - /queue     (Queue Management)")
+    print("   - /queue     (Queue Management, live: /queue/events, /queue/ws)")
     print("   - /upload    (Audio & Image Processing)")
     print("   - /notes     (Medical Notes)")
     print("   - /history   (Prescription History)")
     print("   - /documents (Multi-Document Timeline)")
+    print("   - /media     (Direct Uploads & Media)")
+    print("   - /fhir      (FHIR Bulk Data $export)")
     print("="*60)
     print("📚 API Documentation: http://localhost:8000/docs")
     print("="*60 + "\n")
@@ -215,8 +291,12 @@ async def startup_event():
 async def shutdown_event():
     """Cleanup on shutdown"""
     print("\n🛑 PHC AI Co-Pilot Backend shutting down...")
-    await mongo_service.disconnect()
-    await mongodb_storage.disconnect()  # NEW: Disconnect MongoDB storage
+    await queue_rollover.stop()
+    await stats_reconciler.stop()
+    await parquet_exporter.stop()
+    await queue_events.stop()
+    await storage_backend.disconnect()
+    shutdown_executor()
 
 
 if __name__ == "__main__":
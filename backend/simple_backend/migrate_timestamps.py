@@ -0,0 +1,56 @@
+"""
+Timestamp Migration: rewrite legacy string timestamps as typed dates
+Records written before typed timestamps hold naive ISO strings (clinic wall-clock
+time). Reads already upgrade them on the fly; this rewrites them in bulk so
+date-range queries, sorts and indexes see one type. Safe to re-run.
+
+Usage:
+    python migrate_timestamps.py
+    python migrate_timestamps.py --batch-size 200
+
+Uses STORAGE_BACKEND like the API. Set CLINIC_TIMEZONE (e.g. Asia/Kolkata)
+if the server does not run in the clinic's time zone.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+os.environ.setdefault('GEMINI_API_KEY', 'not-needed-for-migration')
+os.environ.setdefault('GROQ_API_KEY', 'not-needed-for-migration')
+
+from app.services.storage_backend import storage_backend
+from app.services.timestamps import CLINIC_TZ
+
+
+async def main(args):
+    print(f"🚀 Migrating timestamps ({storage_backend.name} storage, clinic time zone {CLINIC_TZ})...")
+
+    await storage_backend.connect()
+    try:
+        start = time.perf_counter()
+        counts = await storage_backend.storage.backfill_timestamps(batch_size=args.batch_size)
+        document_storage = storage_backend.document_storage
+        if document_storage is not storage_backend.storage:
+            counts.update(await document_storage.backfill_timestamps(batch_size=args.batch_size))
+        elapsed = time.perf_counter() - start
+    finally:
+        await storage_backend.disconnect()
+
+    print("\n📊 Migration Summary:")
+    print("-" * 60)
+    for name, count in counts.items():
+        print(f"   {name + ':':<18}{count:8d} records rewritten")
+    print(f"   {'Total:':<18}{sum(counts.values()):8d}")
+    print(f"   {'Time:':<18}{elapsed:8.1f}s")
+    print("-" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500, help="Records per write batch")
+    asyncio.run(main(parser.parse_args()))
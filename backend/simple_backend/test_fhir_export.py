@@ -0,0 +1,221 @@
+"""
+Tests for the FHIR Bulk Data $export (app/services/fhir_export.py, app/routes/fhir.py)
+
+Runs offline: the in-memory backend, a local blob store in a temp dir and
+the FHIR and media routers on a bare FastAPI app (background jobs run inside
+the kick-off request under TestClient).
+"""
+
+import asyncio
+import json
+import os
+from urllib.parse import urlparse
+
+os.environ.setdefault('GEMINI_API_KEY', 'test_key')
+os.environ.setdefault('GROQ_API_KEY', 'test_key')
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routes import fhir, media
+from app.services import fhir_export
+from app.services.blob_store import LocalBlobStore
+from app.services.fhir_export import composition_resources, fhir_id, parse_since, patient_resources, prescription_resources
+from app.services.memory_storage import MemoryStorage
+from app.services.storage_backend import get_document_storage, get_storage, storage_backend
+
+ASYNC = {"Prefer": "respond-async", "Accept": "application/fhir+json"}
+
+
+# ==================== RESOURCES ====================
+
+def test_resource_mapping():
+    [patient] = patient_resources({"patient_id": "PAT_0001", "uhid": "MH0001", "name": "सीता देवी", "gender": "F",
+                                   "phone": "9876543210", "updated_at": "2024-01-01T09:00:00"})
+    assert patient["id"] == "PAT-0001"
+    assert patient["gender"] == "female"
+    assert [i["value"] for i in patient["identifier"]] == ["PAT_0001", "MH0001"]
+    assert patient["meta"]["lastUpdated"].startswith("2024-01-01T09:00:00")
+    assert patient["meta"]["lastUpdated"] != "2024-01-01T09:00:00"  # carries an offset
+
+    [composition] = composition_resources({"note_id": "NOTE_1", "patient_id": "PAT_0001", "created_at": "2024-01-01T09:00:00",
+                                           "soap_note": {"subjective": "Fever <3 days>", "plan": {"rest": "2 days"}, "objective": ""}})
+    assert composition["subject"] == {"reference": "Patient/PAT-0001"}
+    assert [s["title"] for s in composition["section"]] == ["Subjective", "Plan of care"]
+    assert "Fever &lt;3 days&gt;" in composition["section"][0]["text"]["div"]
+    assert "rest: 2 days" in composition["section"][1]["text"]["div"]
+
+    requests = prescription_resources({"history_id": "HIST_1", "patient_id": "PAT_0001", "prescription_data": {
+        "doctor_name": "Dr. Rao", "medications": [{"name": "Amoxicillin", "dosage": "250mg", "frequency": "TDS"}, "ORS"]
+    }})
+    assert [r["id"] for r in requests] == ["HIST-1-0", "HIST-1-1"]
+    assert requests[0]["dosageInstruction"] == [{"text": "250mg, TDS"}]
+    assert requests[1]["medicationCodeableConcept"] == {"text": "ORS"}
+    assert requests[0]["groupIdentifier"] == requests[1]["groupIdentifier"]
+    assert requests[0]["requester"] == {"display": "Dr. Rao"}
+
+    assert fhir_id("x" * 80) == "x" * 64
+    assert parse_since("2024-01-01T09:00:00+05:30") == "2024-01-01T03:30:00.000+00:00"
+    assert parse_since("2024-01-01T09:00:00 05:30") == "2024-01-01T03:30:00.000+00:00"
+    with pytest.raises(ValueError):
+        parse_since("yesterday")
+
+
+# ==================== BULK EXPORT ====================
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    storage = MemoryStorage()
+    asyncio.run(storage.connect())
+    previous = (storage_backend.name, storage_backend._storage, storage_backend._document_storage)
+    storage_backend.use(storage, name="memory")
+    blob = LocalBlobStore(str(tmp_path / "blobs"), "secret")
+    monkeypatch.setattr(fhir_export, "blob_store", blob)
+    monkeypatch.setattr(media, "blob_store", blob)
+    monkeypatch.setattr(fhir_export, "FHIR_EXPORT_LAG", 0)
+
+    app = FastAPI()
+    app.include_router(fhir.router)
+    app.include_router(media.router)
+    with TestClient(app) as test_client:
+        yield test_client, storage, blob
+    storage_backend.name, storage_backend._storage, storage_backend._document_storage = previous
+
+
+async def _seed(storage):
+    for i in range(3):
+        await storage.create_patient(f"PAT_{i}", {"uhid": f"UHID{i}", "name": f"Patient {i}", "gender": "male", "status": "active"})
+    await storage.add_note("PAT_1", {"note_id": "NOTE_1", "soap_note": {"subjective": "Cough", "medications": ["Syrup"]}})
+    await storage.add_history("PAT_2", {"history_id": "HIST_1", "prescription_data": {"medications": [{"name": "Amoxicillin"}]}})
+
+
+def _kick_off(client, query: str = "", headers=ASYNC):
+    response = client.get(f"/fhir/$export{query}", headers=headers)
+    assert response.status_code == 202, response.text
+    return response.headers["Content-Location"]
+
+
+def _read_output(blob, manifest):
+    resources = {}
+    for output in manifest["output"]:
+        key = urlparse(output["url"]).path.removeprefix("/media/")
+        with open(blob.path_for(key), encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        assert len(lines) == output["count"]
+        resources.setdefault(output["type"], []).extend(lines)
+    return resources
+
+
+def test_bulk_export_and_since(client):
+    client, storage, blob = client
+    asyncio.run(_seed(storage))
+
+    status_url = _kick_off(client)
+    response = client.get(status_url)
+    assert response.status_code == 200
+    manifest = response.json()
+    assert manifest["requiresAccessToken"] is False
+    assert manifest["request"].endswith("/fhir/$export")
+    assert all(output["url"].startswith("http") for output in manifest["output"])
+
+    resources = _read_output(blob, manifest)
+    assert sorted(p["id"] for p in resources["Patient"]) == ["PAT-0", "PAT-1", "PAT-2"]
+    assert [c["id"] for c in resources["Composition"]] == ["NOTE-1"]
+    assert sorted(r["medicationCodeableConcept"]["text"] for r in resources["MedicationRequest"]) == ["Amoxicillin", "Syrup"]
+
+    # _since = the previous transactionTime: only what changed afterwards
+    asyncio.run(asyncio.sleep(0.01))
+    asyncio.run(storage.update_patient("PAT_2", {"name": "Renamed"}))
+    since = manifest["transactionTime"].replace("+", "%2B")
+    manifest = client.get(_kick_off(client, f"?_since={since}&_type=Patient,Composition")).json()
+    resources = _read_output(blob, manifest)
+    assert [p["name"] for p in resources["Patient"]] == [[{"text": "Renamed"}]]
+    assert "Composition" not in resources
+
+
+def test_bulk_export_files_need_a_signed_url(client):
+    client, storage, blob = client
+    asyncio.run(_seed(storage))
+    manifest = client.get(_kick_off(client, "?_type=Patient")).json()
+    url = urlparse(manifest["output"][0]["url"])
+    key = url.path.removeprefix("/media/")
+
+    response = client.get(f"{url.path}?{url.query}")
+    assert response.status_code == 200 and response.headers["cache-control"] == "private, no-store"
+    assert len(response.text.splitlines()) == 3
+
+    assert client.get(url.path).status_code == 403
+    assert client.get(f"{url.path}?{url.query.replace('signature=', 'signature=0')}").status_code == 403
+    expired = urlparse(blob.presign_download(key, expires_in=-1))
+    assert client.get(f"{expired.path}?{expired.query}").status_code == 403
+    assert client.get(f"/media/audio/../{key}").status_code in (403, 404)
+    assert client.get(f"/media/audio%2F..%2F{key}").status_code == 403
+
+    asyncio.run(blob.put("audio/visit.mp3", b"ID3"))
+    assert client.get("/media/audio/visit.mp3").status_code == 200
+
+
+def test_bulk_export_rejects_bad_requests(client):
+    client, _, _ = client
+    assert client.get("/fhir/$export").status_code == 400
+    assert client.get("/fhir/$export?_type=Observation", headers=ASYNC).json()["issue"][0]["code"] == "not-supported"
+    assert client.get("/fhir/$export?_outputFormat=text/csv", headers=ASYNC).status_code == 400
+    assert client.get("/fhir/$export?_since=yesterday", headers=ASYNC).status_code == 400
+    assert client.get("/fhir/$export-status/EXP_MISSING").status_code == 404
+
+
+def test_bulk_export_status_and_cancel(client):
+    client, storage, blob = client
+    asyncio.run(_seed(storage))
+
+    job = fhir_export.new_export_job(["Patient"], None, "http://testserver/fhir/$export")
+    asyncio.run(storage.create_export_job(job))
+    response = client.get(f"/fhir/$export-status/{job['job_id']}")
+    assert response.status_code == 202
+    assert response.headers["X-Progress"].startswith("accepted")
+
+    asyncio.run(fhir_export.run_export_job(job["job_id"]))
+    manifest = client.get(f"/fhir/$export-status/{job['job_id']}").json()
+    [output] = manifest["output"]
+    key = urlparse(output["url"]).path.removeprefix("/media/")
+    assert asyncio.run(blob.exists(key))
+
+    assert client.delete(f"/fhir/$export-status/{job['job_id']}").status_code == 202
+    assert not asyncio.run(blob.exists(key))
+    assert client.get(f"/fhir/$export-status/{job['job_id']}").status_code == 404
+
+
+def test_cancel_after_the_last_check_removes_the_files(client):
+    client, storage, blob = client
+    asyncio.run(_seed(storage))
+    job = fhir_export.new_export_job(["Patient"], None, "http://testserver/fhir/$export")
+    asyncio.run(storage.create_export_job(job))
+
+    # The DELETE lands after the job's last cancellation check, before it completes
+    update_export_job = storage.update_export_job
+    async def update_then_cancel(job_id, updates):
+        await update_export_job(job_id, updates)
+        if "progress" in updates:
+            await update_export_job(job_id, {"status": "cancelled"})
+    storage.update_export_job = update_then_cancel
+
+    asyncio.run(fhir_export.run_export_job(job["job_id"]))
+    assert asyncio.run(storage.get_export_job(job["job_id"]))["status"] == "cancelled"
+    assert not os.listdir(blob.path_for(f"{fhir_export.FHIR_EXPORT_PREFIX}/{job['job_id']}"))
+
+
+def test_background_job_uses_the_injected_storage(client):
+    _, _, blob = client
+    injected = MemoryStorage()
+    asyncio.run(injected.connect())
+    asyncio.run(_seed(injected))
+
+    app = FastAPI()
+    app.include_router(fhir.router)
+    app.dependency_overrides[get_storage] = lambda: injected
+    app.dependency_overrides[get_document_storage] = lambda: injected
+    with TestClient(app) as test_client:
+        status_url = _kick_off(test_client, "?_type=Patient")
+        resources = _read_output(blob, test_client.get(status_url).json())
+    assert sorted(p["id"] for p in resources["Patient"]) == ["PAT-0", "PAT-1", "PAT-2"]
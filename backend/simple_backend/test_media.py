@@ -0,0 +1,125 @@
+"""
+Tests for media serving (app/services/media_service.py, app/routes/media.py)
+
+Range parsing and ETag matching are checked directly; the routes run on a
+bare FastAPI app over a local blob store in a temp dir.
+"""
+
+import asyncio
+import hashlib
+import os
+from urllib.parse import urlparse
+
+os.environ.setdefault('GEMINI_API_KEY', 'test_key')
+os.environ.setdefault('GROQ_API_KEY', 'test_key')
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routes import media
+from app.services.blob_store import BlobStore, LocalBlobStore
+from app.services.media_service import RangeNotSatisfiable, etag_matches, parse_range_header
+
+
+# ==================== RANGE / ETAG ====================
+
+def test_parse_range_header():
+    assert parse_range_header(None, 100) is None
+    assert parse_range_header("bytes=0-9", 100) == (0, 9)
+    assert parse_range_header("bytes=90-", 100) == (90, 99)        # Open-ended
+    assert parse_range_header("bytes=-10", 100) == (90, 99)        # Suffix
+    assert parse_range_header("bytes=-500", 100) == (0, 99)        # Suffix longer than the file
+    assert parse_range_header("bytes=50-500", 100) == (50, 99)     # End clamped to the file
+    assert parse_range_header("bytes=0-1,5-6", 100) is None        # Multi-range: whole file
+    assert parse_range_header("items=0-9", 100) is None            # Unknown unit
+    assert parse_range_header("bytes=abc-", 100) is None           # Malformed: ignored
+
+    for header in ("bytes=100-", "bytes=10-5", "bytes=-0"):
+        with pytest.raises(RangeNotSatisfiable):
+            parse_range_header(header, 100)
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header("bytes=0-", 0)
+
+
+def test_etag_matches():
+    assert etag_matches('"abc"', "abc")
+    assert etag_matches('W/"abc"', "abc")
+    assert etag_matches('"xyz", "abc"', "abc")
+    assert etag_matches("*", "abc")
+    assert not etag_matches('"xyz"', "abc")
+    assert not etag_matches(None, "abc")
+
+
+def test_incomplete_blob_store_fails_at_instantiation():
+    class PutOnlyBlobStore(BlobStore):
+        async def put(self, key, data, content_type=None):
+            pass
+
+    with pytest.raises(TypeError, match="local_path"):
+        PutOnlyBlobStore()
+
+
+# ==================== ROUTES ====================
+
+DATA = bytes(range(256)) * 4
+ETAG = f'"{hashlib.sha256(DATA).hexdigest()}"'
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    blob = LocalBlobStore(str(tmp_path / "blobs"), "secret")
+    monkeypatch.setattr(media, "blob_store", blob)
+    asyncio.run(blob.put("audio/visit.mp3", DATA))
+    app = FastAPI()
+    app.include_router(media.router)
+    return TestClient(app), blob
+
+
+def test_full_and_partial_responses(client):
+    client, _ = client
+    response = client.get("/media/audio/visit.mp3")
+    assert response.status_code == 200 and response.content == DATA
+    assert response.headers["etag"] == ETAG and response.headers["accept-ranges"] == "bytes"
+    assert response.headers["content-type"] == "audio/mpeg"
+
+    response = client.get("/media/audio/visit.mp3", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206 and response.content == DATA[10:20]
+    assert response.headers["content-range"] == f"bytes 10-19/{len(DATA)}"
+
+    response = client.get("/media/audio/visit.mp3", headers={"Range": "bytes=-4"})
+    assert response.status_code == 206 and response.content == DATA[-4:]
+
+    response = client.get("/media/audio/visit.mp3", headers={"Range": "bytes=0-1,4-5"})
+    assert response.status_code == 200 and response.content == DATA
+
+    response = client.get("/media/audio/visit.mp3", headers={"Range": f"bytes={len(DATA)}-"})
+    assert response.status_code == 416 and response.headers["content-range"] == f"bytes */{len(DATA)}"
+
+    assert client.get("/media/audio/missing.mp3").status_code == 404
+    assert client.get("/media/../secret").status_code in (400, 404)
+
+
+def test_conditional_requests(client):
+    client, _ = client
+    response = client.get("/media/audio/visit.mp3", headers={"If-None-Match": ETAG})
+    assert response.status_code == 304 and response.content == b"" and response.headers["etag"] == ETAG
+    assert client.get("/media/audio/visit.mp3", headers={"If-None-Match": '"stale"'}).status_code == 200
+
+    # If-Range: the range only applies while the client's copy is current
+    response = client.get("/media/audio/visit.mp3", headers={"Range": "bytes=0-9", "If-Range": ETAG})
+    assert response.status_code == 206 and response.content == DATA[:10]
+    response = client.get("/media/audio/visit.mp3", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200 and response.content == DATA
+
+
+def test_signed_direct_upload(client):
+    client, blob = client
+    url = urlparse(blob.presign_upload("audio/direct.mp3", "audio/mpeg")["url"])
+
+    response = client.put(f"{url.path}?{url.query}", content=DATA)
+    assert response.status_code == 200 and response.json()["size"] == len(DATA)
+    assert client.get("/media/audio/direct.mp3").headers["etag"] == ETAG
+
+    assert client.put(f"{url.path}?{url.query.replace('signature=', 'signature=0')}", content=b"x").status_code == 403
+    assert client.get("/media/audio/direct.mp3").content == DATA
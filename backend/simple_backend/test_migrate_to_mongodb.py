@@ -0,0 +1,177 @@
+"""
+Tests for the streaming JSON → MongoDB migration (migrate_to_mongodb.py)
+
+Runs against in-process MongoDB (mongomock-motor).
+"""
+
+import asyncio
+import json
+import os
+
+os.environ.setdefault('GEMINI_API_KEY', 'test_key')
+os.environ.setdefault('GROQ_API_KEY', 'test_key')
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import migrate_to_mongodb
+from app.services.database import CODEC_OPTIONS, database
+from app.services.patient_cache import patient_cache
+from migrate_to_mongodb import JsonEntryReader, migrate_data
+
+
+def _write_legacy_files(data_dir, patients: int = 25):
+    data_dir.mkdir(exist_ok=True)
+    (data_dir / "patients.json").write_text(json.dumps({
+        f"PAT_{i:04d}": {"uhid": f"UHID{i:06d}", "name": f"रोगी {i}" if i % 2 else f"Patient {i}",
+                         "phone": "9876543210", "age": 30, "gender": "female", "status": "active"}
+        for i in range(patients)
+    }, ensure_ascii=False, indent=2))
+    (data_dir / "queue.json").write_text(json.dumps([
+        {"queue_id": f"Q_{i:04d}", "patient_id": f"PAT_{i:04d}", "token_number": i + 1,
+         "status": "waiting", "added_at": f"2024-01-01T09:{i:02d}:00"}
+        for i in range(5)
+    ]))
+    (data_dir / "notes.json").write_text(json.dumps({
+        f"PAT_{i:04d}": [{"soap_note": {"subjective": "fever"}}, {"note_id": f"NOTE_{i:04d}", "soap_note": {}}]
+        for i in range(10)
+    }))
+    # history.json is missing on purpose
+
+
+@pytest.fixture
+def mongo():
+    """Point the shared connection at a fresh in-process MongoDB"""
+    database.client = AsyncMongoMockClient(**CODEC_OPTIONS)
+    database.db = database.client.phc
+    patient_cache.clear()
+    yield
+    patient_cache.clear()
+
+
+def _counts(mongo_db) -> dict:
+    async def count():
+        return {name: await mongo_db[name].count_documents({}) for name in ("patients", "queue", "notes", "history")}
+    return asyncio.run(count())
+
+
+def _migrate(data_dir, **options):
+    # migrate_data disconnects the shared client at the end; keep a handle for the assertions
+    client = database.client
+    reports = asyncio.run(migrate_data(data_dir, **options))
+    database.client, database.db = client, client.phc
+    return reports
+
+
+# ==================== READER ====================
+
+def test_reader_streams_entries_across_small_reads(tmp_path):
+    path = tmp_path / "data.json"
+    data = {"a": {"name": "राम", "n": 12345}, "b": [1, 2.5, {"x": "y"}], "c": 1234567890, "d": "ends"}
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=2))
+
+    assert list(JsonEntryReader(path, read_size=3)) == list(data.items())
+
+    array = tmp_path / "array.json"
+    array.write_text(" [ {\"q\": 1} , 22 , \"x\" ] ")
+    assert list(JsonEntryReader(array, read_size=2)) == [(0, {"q": 1}), (1, 22), (2, "x")]
+
+    empty = tmp_path / "empty.json"
+    empty.write_text("{ }")
+    assert list(JsonEntryReader(empty)) == []
+
+
+def test_reader_resumes_from_offset(tmp_path):
+    path = tmp_path / "data.json"
+    data = {f"K{i}": {"value": "é" * i} for i in range(20)}
+    path.write_text(json.dumps(data, ensure_ascii=False))
+
+    reader = JsonEntryReader(path, read_size=16)
+    entries = iter(reader)
+    first = [next(entries) for _ in range(7)]
+    offset = reader.offset
+
+    rest = list(JsonEntryReader(path, start=offset, read_size=16))
+    assert first + rest == list(data.items())
+    assert list(JsonEntryReader(path, start=path.stat().st_size - 1)) == []
+
+
+def test_reader_rejects_invalid_json(tmp_path):
+    path = tmp_path / "broken.json"
+    path.write_text('{"a": {"b": 1}, "c": {"d": ')
+    with pytest.raises(ValueError):
+        list(JsonEntryReader(path, read_size=4))
+
+
+# ==================== MIGRATION ====================
+
+def test_migration_is_idempotent(tmp_path, mongo):
+    data_dir = tmp_path / "data"
+    _write_legacy_files(data_dir)
+    mongo_db = database.db
+
+    reports = _migrate(data_dir, chunk_size=7)
+    assert _counts(mongo_db) == {"patients": 25, "queue": 5, "notes": 20, "history": 0}
+    assert [report["documents"] for report in reports] == [25, 5, 20, 0]
+    assert reports[3]["skipped"]
+
+    note_ids = asyncio.run(mongo_db.notes.distinct("note_id"))
+    assert len(note_ids) == 20 and "NOTE_0003" in note_ids
+
+    # Completed files are skipped; a fresh run upserts the same documents again
+    _migrate(data_dir, chunk_size=7)
+    reports = _migrate(data_dir, chunk_size=7, fresh=True)
+    assert _counts(mongo_db) == {"patients": 25, "queue": 5, "notes": 20, "history": 0}
+    assert sorted(asyncio.run(mongo_db.notes.distinct("note_id"))) == sorted(note_ids)
+
+    # Derived data is rebuilt after the copy
+    assert asyncio.run(mongo_db.patient_search.count_documents({})) == 25
+    counters = asyncio.run(mongo_db.counters.find_one({"_id": "stats"}))
+    assert counters["patients"]["total"] == 25
+
+
+def test_migration_resumes_after_failure(tmp_path, mongo, monkeypatch):
+    data_dir = tmp_path / "data"
+    _write_legacy_files(data_dir, patients=40)
+    mongo_db = database.db
+
+    original = migrate_to_mongodb.write_chunk
+    calls = {"n": 0}
+
+    async def failing_write_chunk(collection, id_field, documents):
+        calls["n"] += 1
+        if calls["n"] == 3:
+            raise ConnectionError("connection lost")
+        return await original(collection, id_field, documents)
+
+    monkeypatch.setattr(migrate_to_mongodb, "write_chunk", failing_write_chunk)
+    with pytest.raises(ConnectionError):
+        _migrate(data_dir, chunk_size=10)
+    database.client, database.db = mongo_db.client, mongo_db
+    assert _counts(mongo_db)["patients"] == 20
+
+    checkpoint = json.loads((data_dir / ".migration_checkpoint.json").read_text())
+    assert checkpoint["patients.json"]["entries"] == 20
+    assert not checkpoint["patients.json"]["done"]
+
+    monkeypatch.setattr(migrate_to_mongodb, "write_chunk", original)
+    reports = _migrate(data_dir, chunk_size=10)
+    assert reports[0]["documents"] == 40
+    assert reports[0]["upserted"] == 40
+    assert _counts(mongo_db) == {"patients": 40, "queue": 5, "notes": 20, "history": 0}
+
+
+def test_migration_reports_conflicting_documents(tmp_path, mongo):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "patients.json").write_text(json.dumps({
+        "PAT_A": {"uhid": "SAME", "name": "A"},
+        "PAT_B": {"uhid": "SAME", "name": "B"},
+        "PAT_C": {"uhid": "OTHER", "name": "C"},
+    }))
+    asyncio.run(database.db.patients.create_index("uhid", unique=True))
+
+    reports = _migrate(data_dir)
+    assert reports[0]["documents"] == 3
+    assert [error["id"] for error in reports[0]["errors"]] == ["PAT_B"]
+    assert _counts(database.db)["patients"] == 2
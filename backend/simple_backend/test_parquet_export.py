@@ -0,0 +1,160 @@
+"""
+Tests for the incremental Parquet export (app/services/parquet_export.py)
+
+Row flattening runs everywhere; the end-to-end runs need pyarrow and use
+the in-memory backend with a local blob store in a temp dir.
+"""
+
+import asyncio
+import json
+import os
+
+os.environ.setdefault('GEMINI_API_KEY', 'test_key')
+os.environ.setdefault('GROQ_API_KEY', 'test_key')
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routes import media
+from app.services import parquet_export
+from app.services.blob_store import LocalBlobStore
+from app.services.memory_storage import MemoryStorage
+from app.services.parquet_export import (
+    EXPORT_DATASETS, note_rows, history_medication_rows, visit_rows, run_export
+)
+
+
+# ==================== ROWS ====================
+
+def test_rows_match_dataset_columns():
+    note = {"note_id": "NOTE_1", "patient_id": "PAT_1", "soap_note": {
+        "chief_complaint": "Fever", "objective": {"temp": "101F"}, "medications": ["Paracetamol 500mg", {"name": "ORS"}]
+    }}
+    [row] = note_rows(note)
+    assert row["chief_complaint"] == "Fever"
+    assert json.loads(row["objective"]) == {"temp": "101F"}
+    assert row["medications"] == ["Paracetamol 500mg", '{"name": "ORS"}']
+    assert row["subjective"] is None
+
+    entry = {"history_id": "HIST_1", "patient_id": "PAT_1", "prescription_data": {
+        "doctor_name": "Dr. Rao", "medications": [{"name": "Amoxicillin", "dosage": "250mg"}, "Cetirizine"]
+    }}
+    rows = history_medication_rows(entry)
+    assert [(r["position"], r["name"], r["dosage"]) for r in rows] == [(0, "Amoxicillin", "250mg"), (1, "Cetirizine", None)]
+    assert history_medication_rows({"history_id": "HIST_2", "prescription_data": {}}) == []
+
+    [visit] = visit_rows({"queue_id": "Q_1", "token_number": "7", "added_at": "2024-01-01T09:00:00",
+                          "started_at": "2024-01-01T09:12:30", "completed_at": "2024-01-01T09:20:30"})
+    assert (visit["token_number"], visit["wait_minutes"], visit["consultation_minutes"]) == (7, 12.5, 8.0)
+    assert visit_rows({"queue_id": "Q_2"})[0]["wait_minutes"] is None
+
+    samples = {"patients": {}, "notes": note, "history_medications": entry, "documents": {}, "visits": {}}
+    for name, (_, to_rows, columns) in EXPORT_DATASETS.items():
+        assert list(to_rows(samples[name])[0]) == [column for column, _ in columns]
+
+
+# ==================== EXPORT RUNS ====================
+
+async def _seed(storage):
+    for i in range(3):
+        await storage.create_patient(f"PAT_{i}", {
+            "uhid": f"UHID{i}", "name": f"Patient {i}", "phone": "9876543210", "age": f"4{i}", "status": "active"
+        })
+    await storage.add_note("PAT_1", {"note_id": "NOTE_1", "soap_note": {"chief_complaint": "Cough", "medications": ["Syrup"]}})
+    await storage.add_history("PAT_1", {"history_id": "HIST_1", "prescription_data": {
+        "medications": [{"name": "Amoxicillin"}, {"name": "Paracetamol"}]
+    }})
+    await storage.save_document({"document_id": "DOC_1", "patient_id": "PAT_1", "status": "completed",
+                                 "uploaded_at": "2024-01-01T09:00:00", "extracted_data": {"medications": [{}, {}]}})
+    await storage.add_to_queue({"queue_id": "Q_1", "patient_id": "PAT_1", "token_number": 1, "status": "waiting",
+                                "priority": "normal", "added_at": "2024-01-01T09:00:00"})
+    await storage.update_queue_status("Q_1", "completed")
+    await storage.archive_finished_queue()
+
+
+def _read(blob, files):
+    import pyarrow.parquet as pq
+    tables = [pq.read_table(blob.path_for(f["key"])) for f in files]
+    return [row for table in tables for row in table.to_pylist()]
+
+
+def test_export_is_incremental(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(parquet_export, "PARQUET_EXPORT_LAG", 0)
+
+    async def main():
+        storage = MemoryStorage()
+        await storage.connect()
+        blob = LocalBlobStore(str(tmp_path / "blobs"), "secret")
+        options = dict(storage=storage, document_storage=storage, blob=blob, prefix="exports/parquet")
+        await _seed(storage)
+
+        first = await run_export(**options)
+        counts = {name: result["rows"] for name, result in first["datasets"].items()}
+        assert counts == {"patients": 3, "notes": 1, "history_medications": 2, "documents": 1, "visits": 1}
+        [patients_file] = first["datasets"]["patients"]["files"]
+        assert patients_file["key"].startswith(f"exports/parquet/patients/export_date={first['until'][:10]}/part-")
+        patients = _read(blob, [patients_file])
+        assert sorted((p["patient_id"], p["age"]) for p in patients) == [("PAT_0", 40), ("PAT_1", 41), ("PAT_2", 42)]
+        assert _read(blob, first["datasets"]["notes"]["files"])[0]["medications"] == ["Syrup"]
+        assert _read(blob, first["datasets"]["documents"]["files"])[0]["medication_count"] == 2
+
+        state = json.loads(open(blob.path_for("exports/parquet/_state.json")).read())
+        assert state["notes"]["watermark"] == first["until"]
+        assert await blob.exists(f"exports/parquet/_runs/{first['run_id']}.json")
+
+        # Only what changed since the watermarks
+        await asyncio.sleep(0.01)
+        await storage.update_patient("PAT_2", {"name": "Renamed"})
+        second = await run_export(**options)
+        assert {name: result["rows"] for name, result in second["datasets"].items()} == {
+            "patients": 1, "notes": 0, "history_medications": 0, "documents": 0, "visits": 0
+        }
+        assert second["datasets"]["notes"]["files"] == []
+        assert [p["name"] for p in _read(blob, second["datasets"]["patients"]["files"])] == ["Renamed"]
+
+        # full ignores the watermarks
+        full = await run_export(full=True, datasets=["patients"], **options)
+        assert full["datasets"]["patients"]["rows"] == 3
+        await storage.disconnect()
+    asyncio.run(main())
+
+
+def test_export_rolls_files_and_rejects_unknown_datasets(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(parquet_export, "PARQUET_EXPORT_LAG", 0)
+    monkeypatch.setattr(parquet_export, "PARQUET_ROW_GROUP_SIZE", 4)
+    monkeypatch.setattr(parquet_export, "PARQUET_ROWS_PER_FILE", 8)
+
+    async def main():
+        storage = MemoryStorage()
+        await storage.connect()
+        blob = LocalBlobStore(str(tmp_path / "blobs"), "secret")
+        await storage.insert_patients([
+            {"patient_id": f"PAT_{i:02d}", "uhid": f"U{i}", "name": f"P {i}", "updated_at": "2024-01-01T09:00:00"}
+            for i in range(20)
+        ])
+
+        manifest = await run_export(["patients"], storage=storage, document_storage=storage, blob=blob)
+        files = manifest["datasets"]["patients"]["files"]
+        assert [f["rows"] for f in files] == [8, 8, 4]
+        assert sorted(p["patient_id"] for p in _read(blob, files)) == [f"PAT_{i:02d}" for i in range(20)]
+
+        with pytest.raises(ValueError):
+            await run_export(["prescriptions"], storage=storage, document_storage=storage, blob=blob)
+        await storage.disconnect()
+    asyncio.run(main())
+
+
+def test_exported_files_need_a_signed_url(tmp_path, monkeypatch):
+    blob = LocalBlobStore(str(tmp_path / "blobs"), "secret")
+    monkeypatch.setattr(media, "blob_store", blob)
+    key = f"{parquet_export.PARQUET_EXPORT_PREFIX}/patients/export_date=2024-01-01/part-RUN-00000.parquet"
+    asyncio.run(blob.put(key, b"PAR1"))
+
+    app = FastAPI()
+    app.include_router(media.router)
+    client = TestClient(app)
+    assert client.get(f"/media/{key}").status_code == 403
+    assert client.get(blob.presign_download(key, expires_in=60)).content == b"PAR1"
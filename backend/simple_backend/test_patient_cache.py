@@ -0,0 +1,99 @@
+"""
+Tests for the patient read-through cache (app/services/patient_cache.py)
+
+The clock is patched so TTL expiry is deterministic.
+"""
+
+import os
+
+os.environ.setdefault('GEMINI_API_KEY', 'test_key')
+os.environ.setdefault('GROQ_API_KEY', 'test_key')
+
+import pytest
+
+from app.services import patient_cache as patient_cache_module
+from app.services.patient_cache import PatientCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(patient_cache_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def _patient(i: int, **fields) -> dict:
+    return {"patient_id": f"PAT_{i}", "uhid": f"U{i}", "name": f"Patient {i}", "tags": ["diabetic"], **fields}
+
+
+def test_lookups_by_id_and_uhid_return_private_copies(clock):
+    cache = PatientCache(max_size=10, ttl=30)
+    patient = _patient(1)
+    cache.put(patient)
+    patient["tags"].append("changed after put")
+
+    first = cache.get("uhid", "U1")
+    assert first == _patient(1) and cache.get("id", "PAT_1") == _patient(1)
+    first["tags"].append("changed by a reader")
+    first["name"] = "Renamed"
+    assert cache.get("id", "PAT_1") == _patient(1)
+
+    assert cache.get("id", "PAT_2") is None
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_ttl_expiry(clock):
+    cache = PatientCache(max_size=10, ttl=30)
+    cache.put(_patient(1))
+    clock[0] += 30
+    assert cache.get("id", "PAT_1") is not None
+    clock[0] += 1
+    assert cache.get("id", "PAT_1") is None
+    assert cache.expirations == 1
+
+    # The other key expires on its own; the reverse map goes with the last one
+    assert cache.get("uhid", "U1") is None
+    assert cache.stats()["size"] == 0 and cache._keys_by_patient == {}
+
+
+def test_lru_eviction(clock):
+    cache = PatientCache(max_size=4, ttl=30)  # Two patients, two keys each
+    cache.put(_patient(1))
+    cache.put(_patient(2))
+    assert cache.get("id", "PAT_1") is not None  # PAT_1's id key is now the most recent
+
+    cache.put(_patient(3))
+    assert cache.evictions == 2
+    assert cache.get("uhid", "U1") is None and cache.get("id", "PAT_2") is None
+    assert cache.get("id", "PAT_1") is not None and cache.get("uhid", "U3") is not None
+    assert cache._keys_by_patient == {"PAT_1": {("id", "PAT_1")}, "PAT_2": {("uhid", "U2")}, "PAT_3": {("id", "PAT_3"), ("uhid", "U3")}}
+
+
+def test_invalidation_drops_every_key_of_the_patient(clock):
+    cache = PatientCache(max_size=10, ttl=30)
+    cache.put(_patient(1))
+    cache.put(_patient(1, uhid="U1-NEW"))  # UHID changed: the old key still points at the patient
+    cache.put(_patient(2))
+
+    cache.invalidate("PAT_1")
+    assert cache.get("uhid", "U1") is None and cache.get("uhid", "U1-NEW") is None and cache.get("id", "PAT_1") is None
+    assert cache.get("id", "PAT_2") is not None
+    assert cache.invalidations == 3 and "PAT_1" not in cache._keys_by_patient
+
+    cache.invalidate(uhid="U2")
+    assert cache.get("uhid", "U2") is None and cache.get("id", "PAT_2") is not None
+
+
+def test_put_is_skipped_after_a_concurrent_invalidation(clock):
+    cache = PatientCache(max_size=10, ttl=30)
+    generation = cache.generation      # A read starts...
+    cache.invalidate("PAT_1")          # ...a write lands...
+    cache.put(_patient(1), generation)  # ...and the read's now-stale copy is not cached
+    assert cache.get("id", "PAT_1") is None
+
+    cache.put(_patient(1), cache.generation)
+    assert cache.get("id", "PAT_1") is not None
+
+    cache.clear()
+    assert cache.get("uhid", "U1") is None and cache.generation == generation + 2
+    assert cache._keys_by_patient == {}
@@ -0,0 +1,124 @@
+"""
+Tests for the streaming bulk patient import (app/services/patient_import.py)
+
+Input is fed as byte chunks cut at awkward places (inside lines, quoted
+fields and multi-byte characters) into the in-memory backend.
+"""
+
+import asyncio
+import os
+
+os.environ.setdefault('GEMINI_API_KEY', 'test_key')
+os.environ.setdefault('GROQ_API_KEY', 'test_key')
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routes import patients
+from app.services.memory_storage import MemoryStorage
+from app.services.patient_import import ImportFormatError, import_patients, iter_lines, iter_records
+from app.services.storage_backend import get_storage
+
+
+async def _chunks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def _records(data: bytes, fmt: str = "csv", size: int = 3):
+    async def collect():
+        return [record async for record in iter_records(iter_lines(_chunks(data, size)), fmt)]
+    return asyncio.run(collect())
+
+
+def _import(storage, data: bytes, fmt: str = "csv", **options):
+    return asyncio.run(import_patients(_chunks(data, 5), fmt, storage=storage, **options))
+
+
+@pytest.fixture
+def storage():
+    storage = MemoryStorage()
+    asyncio.run(storage.connect())
+    return storage
+
+
+# ==================== PARSING ====================
+
+def test_csv_bom_quotes_and_multiline_fields():
+    data = ('﻿UHID,Name,Phone\r\n'
+            'U1,"Devi, Sita","9876543210"\r\n'
+            'U2,"Ram ""Raju""\nKumar",9876543211\n'
+            '\n'
+            'U3,सीता\n').encode("utf-8")
+    for size in (1, 2, 7, len(data)):  # Chunk boundaries inside the BOM, quotes and UTF-8 sequences
+        assert _records(data, size=size) == [
+            (1, {"uhid": "U1", "name": "Devi, Sita", "phone": "9876543210"}),
+            (2, {"uhid": "U2", "name": 'Ram "Raju"\nKumar', "phone": "9876543211"}),
+            (3, {"uhid": "U3", "name": "सीता", "phone": None})
+        ]
+
+
+def test_csv_row_errors():
+    data = b'uhid,name\nU1,Sita,extra\nU2,"Ram\n'
+    assert _records(data) == [(1, "Expected 2 columns, got 3"), (2, "Unterminated quoted field")]
+
+    with pytest.raises(ImportFormatError):
+        _records(b"\n\n")
+    with pytest.raises(ImportFormatError):
+        _records(b"{}", fmt="xml")
+
+
+def test_ndjson_rows():
+    data = b'{"uhid": "U1"}\n\n[1]\n{oops\n{"uhid": "U2"}'
+    assert _records(data, fmt="ndjson") == [
+        (1, {"uhid": "U1"}), (2, "Expected a JSON object"), (3, "Invalid JSON: Expecting property name enclosed in double quotes"),
+        (4, {"uhid": "U2"})
+    ]
+
+
+# ==================== IMPORT ====================
+
+CSV = (b"uhid,name,phone,age,gender\n"
+       b"U1,Sita,9876543210,34,female\n"
+       b"U2,Ram,9876543211,,male\n"
+       b"U1,Sita again,9876543212,,\n"
+       b"U3,Gita,12345,,\n"
+       b"U4,Hari,9876543213,200,\n"
+       b"U5,Mohan,9876543214,,\n")
+
+
+def test_import_reports_rows_and_duplicates(storage):
+    asyncio.run(storage.create_patient("PAT_OLD", {"uhid": "U5", "name": "Mohan", "phone": "9876543214"}))
+
+    report = _import(storage, CSV, chunk_size=2)  # U5 (already registered) lands in the last chunk
+    assert (report["total_rows"], report["imported"], report["failed"]) == (6, 2, 4)
+    assert [(error["row"], error["uhid"]) for error in report["errors"]] == [(3, "U1"), (4, "U3"), (5, "U4"), (6, "U5")]
+    assert report["errors"][0]["errors"] == ["uhid: duplicate UHID earlier in this file"]
+
+    imported = asyncio.run(storage.get_patient_by_uhid("U2"))
+    assert imported["source"] == "import" and imported["visit_count"] == 0 and imported["age"] is None
+    assert asyncio.run(storage.get_queue()) == []
+
+
+def test_dry_run_writes_nothing(storage):
+    asyncio.run(storage.create_patient("PAT_OLD", {"uhid": "U5", "name": "Mohan", "phone": "9876543214"}))
+
+    report = _import(storage, CSV, dry_run=True, chunk_size=4)
+    assert report["dry_run"] and (report["imported"], report["failed"]) == (2, 4)
+    assert report["errors"][-1]["errors"] == ["uhid: UHID already registered"]
+    assert asyncio.run(storage.get_patient_by_uhid("U1")) is None
+
+
+def test_route_uses_the_injected_storage(storage):
+    app = FastAPI()
+    app.include_router(patients.router)
+    app.dependency_overrides[get_storage] = lambda: storage
+    client = TestClient(app)
+
+    response = client.post("/patients/import?chunk_size=1", content=CSV, headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200 and response.json()["imported"] == 3
+    assert asyncio.run(storage.get_patient_by_uhid("U5"))["source"] == "import"
+
+    assert client.post("/patients/import?format=xml", content=b"").status_code == 400
+    assert client.post("/patients/import", content=b"", headers={"Content-Type": "text/csv"}).status_code == 400
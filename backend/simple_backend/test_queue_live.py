@@ -0,0 +1,89 @@
+"""
+Tests for live queue push (app/routes/queue_live.py, app/services/queue_events.py)
+
+Storage writes run on the app's event loop (client.portal) so the in-process
+bus delivers them to the connected WebSocket subscriber as in production.
+"""
+
+import asyncio
+import os
+
+os.environ.setdefault('GEMINI_API_KEY', 'test_key')
+os.environ.setdefault('GROQ_API_KEY', 'test_key')
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routes import queue_live
+from app.services import queue_events as queue_events_module
+from app.services.memory_storage import MemoryStorage
+from app.services.queue_events import queue_events, sse_message
+from app.services.storage_backend import get_storage
+
+
+def _queue_entry(i: int, status: str = "waiting") -> dict:
+    return {"queue_id": f"Q_{i}", "patient_id": f"PAT_{i}", "patient_name": f"Patient {i}", "token_number": i,
+            "priority": "normal", "status": status, "added_at": "2024-01-01T09:00:00+00:00"}
+
+
+@pytest.fixture
+def client():
+    storage = MemoryStorage()
+    asyncio.run(storage.connect())
+    asyncio.run(storage.add_to_queue(_queue_entry(1)))
+    app = FastAPI()
+    app.include_router(queue_live.router)
+    app.dependency_overrides[get_storage] = lambda: storage
+    with TestClient(app) as test_client:
+        yield test_client, storage
+
+
+def test_websocket_snapshot_then_deltas(client):
+    client, storage = client
+    with client.websocket_connect("/queue/ws") as websocket:
+        snapshot = websocket.receive_json()
+        assert snapshot["type"] == "snapshot" and snapshot["source"] == "local"
+        assert [entry["queue_id"] for entry in snapshot["queue"]] == ["Q_1"]
+        assert snapshot["stats"]["waiting"] == 1
+
+        client.portal.call(storage.add_to_queue, _queue_entry(2))
+        added = websocket.receive_json()
+        assert added["type"] == "added" and added["queue_id"] == "Q_2" and added["token_number"] == 2
+
+        client.portal.call(storage.update_queue_status, "Q_2", "completed")
+        status = websocket.receive_json()
+        assert (status["type"], status["queue_id"], status["status"]) == ("status", "Q_2", "completed")
+
+        assert client.portal.call(storage.archive_finished_queue) == 1
+        removed = websocket.receive_json()
+        assert (removed["type"], removed["queue_id"]) == ("removed", "Q_2")
+
+    # Reconnecting with the last id seen replays only what was missed
+    with client.websocket_connect(f"/queue/ws?resume={added['id']}") as websocket:
+        assert [websocket.receive_json()["id"] for _ in range(2)] == [status["id"], removed["id"]]
+    with client.websocket_connect("/queue/ws?resume=other-epoch-1") as websocket:
+        assert websocket.receive_json()["type"] == "snapshot"
+
+
+def test_lagging_subscriber_gets_a_fresh_snapshot(monkeypatch):
+    monkeypatch.setattr(queue_events_module, "SUBSCRIBER_QUEUE_SIZE", 1)
+
+    async def main():
+        storage = MemoryStorage()
+        await storage.connect()
+        stream = queue_live.queue_event_stream(storage)
+        assert (await stream.__anext__())["queue"] == []
+
+        await storage.add_to_queue(_queue_entry(1))
+        await storage.add_to_queue(_queue_entry(2))  # Overflows the subscriber's queue
+        snapshot = await stream.__anext__()
+        assert snapshot["type"] == "snapshot" and [e["queue_id"] for e in snapshot["queue"]] == ["Q_1", "Q_2"]
+        await stream.aclose()
+        assert queue_events.subscribers == []
+    asyncio.run(main())
+
+
+def test_sse_message_format():
+    message = sse_message({"id": "abc-3", "type": "removed", "queue_id": "Q_1"})
+    assert message == 'id: abc-3\nevent: removed\ndata: {"id": "abc-3", "type": "removed", "queue_id": "Q_1"}\n\n'
@@ -0,0 +1,813 @@
+"""
+Storage conformance suite
+
+Every backend behind the PatientStorage / DocumentStorage protocols must
+pass the same checks: identical results, ordering, paging cursors,
+duplicate handling and stats shapes. Backends under test:
+
+- mongodb: in-process MongoDB (mongomock-motor), or a real mongod when
+           MONGODB_TEST_URL is set (a throwaway database is dropped afterwards)
+- sqlite:  a fresh database file per test
+- json:    the journaled store in a fresh directory per test
+- memory:  nothing persisted
+"""
+
+import asyncio
+import os
+import uuid
+
+os.environ.setdefault('GEMINI_API_KEY', 'test_key')
+os.environ.setdefault('GROQ_API_KEY', 'test_key')
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from app.services import text_compression
+from app.services.database import CODEC_OPTIONS, database
+from app.services.memory_storage import MemoryStorage
+from app.services.mongo_service import MongoService
+from app.services.mongodb_storage import MongoDBStorage
+from app.services.patient_cache import patient_cache
+from app.services.report_state import REPORT_NOTE_PROJECTION, build_state, load_report_state, state_drift
+from app.services.sqlite_storage import SQLiteStorage
+from app.services.storage_protocol import PatientStorage, DocumentStorage, DuplicateQueueEntry
+from app.services.storage_service import StorageService
+from app.services.timestamps import parse_timestamp
+
+
+BACKENDS = ["mongodb", "sqlite", "json", "memory"]
+MONGODB_TEST_URL = os.environ.get('MONGODB_TEST_URL')
+
+
+async def open_backend(name: str, tmp_path):
+    """Connect a fresh, empty instance of a backend -> (storage, document_storage)"""
+    if name == "mongodb":
+        if MONGODB_TEST_URL:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            database.client = AsyncIOMotorClient(MONGODB_TEST_URL, **CODEC_OPTIONS)
+            database.db = database.client[f"phc_conformance_{uuid.uuid4().hex[:8]}"]
+        else:
+            database.client = AsyncMongoMockClient(**CODEC_OPTIONS)
+            database.db = database.client.phc
+        patient_cache.clear()
+        storage, document_storage = MongoDBStorage(), MongoService()
+        await storage.connect()
+        await document_storage.connect()
+        await database.wait_for_indexes()
+        return storage, document_storage
+    if name == "sqlite":
+        backend = SQLiteStorage(path=str(tmp_path / "phc.db"))
+        await backend.connect()
+        return backend, backend
+    if name == "json":
+        backend = MemoryStorage(StorageService(base_dir=str(tmp_path / "data")))
+        await backend.connect()
+        return backend, backend
+    backend = MemoryStorage()
+    await backend.connect()
+    return backend, backend
+
+
+async def close_backend(name: str, storage, document_storage):
+    if name == "mongodb":
+        if MONGODB_TEST_URL:
+            await database.client.drop_database(database.db.name)
+        await document_storage.disconnect()
+        await storage.disconnect()
+        patient_cache.clear()
+        return
+    await storage.disconnect()
+
+
+@pytest.fixture(params=BACKENDS)
+def run(request, tmp_path):
+    """Run `check(storage, document_storage)` against a fresh backend"""
+    name = request.param
+
+    def runner(check):
+        async def main():
+            storage, document_storage = await open_backend(name, tmp_path)
+            try:
+                await check(storage, document_storage)
+            finally:
+                await close_backend(name, storage, document_storage)
+        asyncio.run(main())
+
+    return runner
+
+
+def _patient(i: int, **fields) -> dict:
+    patient = {
+        "patient_id": f"PAT_{i:04d}",
+        "uhid": f"UHID{i:06d}",
+        "name": f"Patient {i}",
+        "phone": "9876543210",
+        "age": 30 + i,
+        "gender": "female" if i % 2 else "male",
+        "status": "active",
+        "created_at": f"2024-01-{1 + i:02d}T09:00:00"
+    }
+    patient.update(fields)
+    return patient
+
+
+def _queue_entry(i: int, status: str = "waiting", added_at: str = None) -> dict:
+    return {
+        "queue_id": f"Q_{i:04d}",
+        "patient_id": f"PAT_{i:04d}",
+        "token_number": i,
+        "status": status,
+        "added_at": added_at or f"2024-01-01T09:{i:02d}:00"
+    }
+
+
+# ==================== PROTOCOLS ====================
+
+def test_backends_implement_protocols(run):
+    async def check(storage, document_storage):
+        assert isinstance(storage, PatientStorage)
+        assert isinstance(document_storage, DocumentStorage)
+    run(check)
+
+
+# ==================== PATIENTS ====================
+
+def test_patient_round_trip(run):
+    async def check(storage, document_storage):
+        created = await storage.create_patient("PAT_0001", _patient(1))
+        assert created["patient_id"] == "PAT_0001"
+        assert "updated_at" in created
+
+        patient = await storage.get_patient("PAT_0001")
+        assert patient["name"] == "Patient 1"
+        assert "_id" not in patient
+        assert (await storage.get_patient_by_uhid("UHID000001"))["patient_id"] == "PAT_0001"
+        assert await storage.get_patient("PAT_9999") is None
+        assert await storage.get_patient_by_uhid("UHID999999") is None
+
+        updated = await storage.update_patient("PAT_0001", {"phone": "9000000000"})
+        assert updated["phone"] == "9000000000"
+        assert "_id" not in updated
+        assert (await storage.get_patient("PAT_0001"))["phone"] == "9000000000"
+        assert await storage.update_patient("PAT_9999", {"phone": "1"}) is None
+    run(check)
+
+
+def test_reads_and_nested_updates_do_not_alias_stored_records(run):
+    async def check(storage, document_storage):
+        await storage.create_patient("PAT_0001", _patient(1, contact={"email": "a@x.org", "tags": ["sms"]}))
+        read = await storage.get_patient("PAT_0001")
+        read["contact"]["tags"].append("changed by a reader")
+        await storage.update_patient("PAT_0001", {"contact.email": "b@x.org"})
+        assert read["contact"]["email"] == "a@x.org"  # An earlier read is not updated in place
+        assert (await storage.get_patient("PAT_0001"))["contact"] == {"email": "b@x.org", "tags": ["sms"]}
+
+        document_id = await document_storage.save_document({"document_id": "DOC_1", "patient_id": "PAT_0001", "extracted_data": {"fields": {"a": 1}}})
+        document = await document_storage.get_document(document_id)
+        document["extracted_data"]["fields"]["a"] = 2
+        await document_storage.update_document(document_id, {"extracted_data.fields.b": 3})
+        assert document["extracted_data"]["fields"] == {"a": 2}
+        assert (await document_storage.get_document(document_id))["extracted_data"]["fields"] == {"a": 1, "b": 3}
+    run(check)
+
+
+def test_insert_patients_reports_duplicate_uhids(run):
+    async def check(storage, document_storage):
+        await storage.create_patient("PAT_0001", _patient(1))
+        failures = await storage.insert_patients([_patient(2), _patient(3, uhid="UHID000001"), _patient(4)])
+
+        assert list(failures) == [1]
+        assert failures[1].startswith("uhid")
+        assert await storage.get_patient("PAT_0002") is not None
+        assert await storage.get_patient("PAT_0003") is None
+        assert await storage.get_patient("PAT_0004") is not None
+        assert await storage.get_existing_uhids(["UHID000001", "UHID000004", "UHID000005"]) == {"UHID000001", "UHID000004"}
+    run(check)
+
+
+def test_patients_newest_first_with_stable_cursor(run):
+    async def check(storage, document_storage):
+        for i in range(1, 6):
+            await storage.create_patient(f"PAT_{i:04d}", _patient(i))
+        # Same created_at: ties break on patient_id
+        await storage.create_patient("PAT_0006", _patient(6, created_at=_patient(5)["created_at"]))
+
+        expected = ["PAT_0006", "PAT_0005", "PAT_0004", "PAT_0003", "PAT_0002", "PAT_0001"]
+        assert list(await storage.get_all_patients()) == expected
+
+        seen, after = [], None
+        while True:
+            page, after = await storage.get_patients_page(limit=4, after=after)
+            seen += [patient["patient_id"] for patient in page]
+            if after is None:
+                break
+        assert seen == expected
+    run(check)
+
+
+def test_patient_search(run):
+    async def check(storage, document_storage):
+        await storage.create_patient("PAT_0001", _patient(1, name="Ram Kumar Sharma", phone="+91 98765 43210", uhid="MH12345"))
+        await storage.create_patient("PAT_0002", _patient(2, name="दीपक वर्मा", phone="9123456789", uhid="DL55555"))
+        await storage.create_patient("PAT_0003", _patient(3, name="Mohammad Irfan", phone="9000011111", uhid="UP77777"))
+        await storage.insert_patients([_patient(4, name="Priya Ramesh", phone="9888800000", uhid="MH12399")])
+
+        async def ids(query):
+            return [patient["patient_id"] for patient in await storage.search_patients(query)]
+
+        assert await ids("ram ku") == ["PAT_0001"]
+        assert await ids("Ram") == ["PAT_0001", "PAT_0004"]
+        assert await ids("sharmaa") == ["PAT_0001"]
+        assert await ids("शर्मा") == ["PAT_0001"]
+        assert await ids("Deepak") == ["PAT_0002"]
+        assert await ids("Dipak Verma") == ["PAT_0002"]
+        assert await ids("Muhammad") == ["PAT_0003"]
+        assert await ids("43210") == ["PAT_0001"]
+        assert await ids("MH123") == ["PAT_0004", "PAT_0001"]  # equal scores: by name
+        assert await ids("mh12399") == ["PAT_0004"]
+        assert await ids("zzzz") == []
+
+        best = (await storage.search_patients("MH12345"))[0]
+        assert best["match"] == "uhid"
+        assert best["score"] == 100
+        assert "keys" not in best and "_id" not in best
+        assert (await storage.search_patients("Muhammad"))[0]["match"] == "fuzzy"
+
+        # Updates re-index the patient
+        await storage.update_patient("PAT_0003", {"name": "Irfan Khan", "phone": "9555566666"})
+        assert await ids("Mohammad") == []
+        assert await ids("khan") == ["PAT_0003"]
+        assert await ids("66666") == ["PAT_0003"]
+
+        assert await storage.rebuild_search_index() == 4
+        assert await ids("ram ku") == ["PAT_0001"]
+    run(check)
+
+
+# ==================== QUEUE ====================
+
+def test_queue_arrival_order_and_paging(run):
+    async def check(storage, document_storage):
+        for i in (3, 1, 2, 5, 4):
+            await storage.add_to_queue(_queue_entry(i))
+
+        expected = ["Q_0001", "Q_0002", "Q_0003", "Q_0004", "Q_0005"]
+        queue = await storage.get_queue()
+        assert [entry["queue_id"] for entry in queue] == expected
+        assert all("_id" not in entry for entry in queue)
+
+        page, after = await storage.get_queue_page(limit=3)
+        assert [entry["queue_id"] for entry in page] == expected[:3]
+        page, after = await storage.get_queue_page(limit=3, after=after)
+        assert [entry["queue_id"] for entry in page] == expected[3:]
+        assert after is None
+    run(check)
+
+
+def test_one_active_queue_entry_per_patient(run):
+    async def check(storage, document_storage):
+        await storage.add_to_queue(_queue_entry(1))
+
+        duplicate = _queue_entry(1)
+        duplicate["queue_id"] = "Q_DUP"
+        with pytest.raises(DuplicateQueueEntry) as error:
+            await storage.add_to_queue(duplicate)
+        assert error.value.existing["queue_id"] == "Q_0001"
+        assert len(await storage.get_queue()) == 1
+
+        # A finished visit does not block the next one
+        await storage.update_queue_status("Q_0001", "completed")
+        await storage.add_to_queue(duplicate)
+        assert (await storage.get_active_queue_entry("PAT_0001"))["queue_id"] == "Q_DUP"
+    run(check)
+
+
+def test_queue_status_updates(run):
+    async def check(storage, document_storage):
+        for i in range(1, 4):
+            await storage.add_to_queue(_queue_entry(i))
+
+        updated = await storage.update_queue_status("Q_0002", "in_consultation", doctor="Dr. Rao")
+        assert updated["status"] == "in_consultation"
+        assert updated["doctor"] == "Dr. Rao"
+        assert "_id" not in updated
+        assert await storage.update_queue_status("Q_9999", "completed") is None
+
+        assert [e["queue_id"] for e in await storage.get_queue_by_status("waiting")] == ["Q_0001", "Q_0003"]
+        assert (await storage.get_patient_queue_entry("PAT_0002"))["status"] == "in_consultation"
+        assert await storage.get_active_queue_entry("PAT_9999") is None
+
+        stats = await storage.get_queue_stats()
+        assert stats["waiting"] == 2
+        assert stats["in_consultation"] == 1
+        assert stats["completed"] == 0
+        assert stats["total"] == 3
+        assert stats["active"] == 3
+    run(check)
+
+
+def test_token_numbers_are_sequential_per_day(run):
+    async def check(storage, document_storage):
+        tokens = [await storage.next_token_number(day="2024-01-01") for _ in range(3)]
+        assert tokens == [1, 2, 3]
+        assert await storage.next_token_number(day="2024-01-02") == 1
+        assert await storage.next_token_number(facility_id="PHC_OTHER", day="2024-01-01") == 1
+        assert await storage.next_token_number(day="2024-01-01") == 4
+    run(check)
+
+
+def test_archive_finished_queue(run):
+    async def check(storage, document_storage):
+        await storage.add_to_queue(_queue_entry(1, added_at="2024-01-01T09:00:00"))
+        await storage.add_to_queue(_queue_entry(2, added_at="2024-01-01T10:00:00"))
+        await storage.add_to_queue(_queue_entry(3, added_at="2024-01-02T09:00:00"))
+        await storage.add_to_queue(_queue_entry(4, added_at="2024-01-02T10:00:00"))
+        await storage.update_queue_status("Q_0001", "completed")
+        await storage.update_queue_status("Q_0002", "cancelled")
+        await storage.update_queue_status("Q_0003", "completed")
+
+        assert await storage.archive_finished_queue(before="2024-01-02T00:00:00") == 2
+        assert [e["queue_id"] for e in await storage.get_queue()] == ["Q_0003", "Q_0004"]
+        assert await storage.archive_finished_queue() == 1
+        assert [e["queue_id"] for e in await storage.get_queue()] == ["Q_0004"]
+        assert await storage.archive_finished_queue() == 0
+
+        assert await storage.get_visit_stats() == [
+            {"date": "2024-01-02", "completed": 1, "cancelled": 0, "total": 1},
+            {"date": "2024-01-01", "completed": 1, "cancelled": 1, "total": 2}
+        ]
+        assert await storage.get_visit_stats(since="2024-01-02") == [
+            {"date": "2024-01-02", "completed": 1, "cancelled": 0, "total": 1}
+        ]
+        # Entries from previous days are finished, so rollover has nothing left
+        assert await storage.rollover_queue() == 0
+    run(check)
+
+
+# ==================== NOTES & HISTORY ====================
+
+def test_notes_newest_first(run):
+    async def check(storage, document_storage):
+        for i, created_at in enumerate(["2024-01-01T09:00:00", "2024-01-03T09:00:00", "2024-01-02T09:00:00"]):
+            await storage.add_note("PAT_0001", {
+                "note_id": f"NOTE_{i}",
+                "created_at": created_at,
+                "soap_note": {"subjective": f"complaint {i}", "plan": "rest"}
+            })
+        await storage.add_note("PAT_0002", {"note_id": "NOTE_OTHER", "created_at": "2024-01-05T09:00:00"})
+
+        notes = await storage.get_patient_notes("PAT_0001")
+        assert [note["note_id"] for note in notes] == ["NOTE_1", "NOTE_2", "NOTE_0"]
+        assert all(note["patient_id"] == "PAT_0001" and "_id" not in note for note in notes)
+
+        page, after = await storage.get_patient_notes_page("PAT_0001", limit=2)
+        assert [note["note_id"] for note in page] == ["NOTE_1", "NOTE_2"]
+        page, after = await storage.get_patient_notes_page("PAT_0001", limit=2, after=after)
+        assert [note["note_id"] for note in page] == ["NOTE_0"]
+        assert after is None
+
+        note = await storage.get_note("PAT_0001", "NOTE_2", {"_id": 0, "note_id": 1, "soap_note.subjective": 1})
+        assert note == {"note_id": "NOTE_2", "soap_note": {"subjective": "complaint 2"}}
+        assert await storage.get_note("PAT_0002", "NOTE_2") is None
+
+        summary = await storage.get_patient_notes("PAT_0001", {"_id": 0, "soap_note": 0, "updated_at": 0})
+        assert summary[0] == {"note_id": "NOTE_1", "patient_id": "PAT_0001", "created_at": parse_timestamp("2024-01-03T09:00:00")}
+
+        all_notes = await storage.get_all_notes()
+        assert sorted(all_notes) == ["PAT_0001", "PAT_0002"]
+        assert len(all_notes["PAT_0001"]) == 3
+    run(check)
+
+
+def test_note_transcripts_are_compressed_and_lazy(run):
+    async def check(storage, document_storage):
+        transcript = "मरीज़ को तीन दिन से बुखार है, patient has fever and cough since three days. " * 200
+        added = await storage.add_note("PAT_0001", {"note_id": "NOTE_1", "transcript": transcript, "soap_note": {}})
+        assert added["transcript"] == transcript
+
+        note = await storage.get_note("PAT_0001", "NOTE_1")
+        assert "transcript" not in note
+        assert note["text_sizes"] == {"transcript": len(transcript.encode())}
+        [page_note], _ = await storage.get_patient_notes_page("PAT_0001")
+        assert "transcript" not in page_note
+        assert await storage.get_note_texts(["NOTE_1", "NOTE_9"]) == {"NOTE_1": {"transcript": transcript}}
+
+        # Notes written inline (before compression existed) are moved by the backfill
+        text_compression.COMPRESSED_NOTE_FIELDS = ()
+        try:
+            await storage.add_note("PAT_0002", {"note_id": "NOTE_2", "transcript": "old transcript " * 100})
+        finally:
+            text_compression.COMPRESSED_NOTE_FIELDS = ("transcript",)
+        assert (await storage.get_note("PAT_0002", "NOTE_2"))["transcript"].startswith("old transcript")
+
+        report = await storage.compress_note_texts(batch_size=1)
+        assert report["notes"] == 1
+        assert 0 < report["stored_bytes"] < report["raw_bytes"]
+        assert "transcript" not in await storage.get_note("PAT_0002", "NOTE_2")
+        assert (await storage.get_note_texts(["NOTE_2"]))["NOTE_2"]["transcript"] == "old transcript " * 100
+        assert (await storage.compress_note_texts())["notes"] == 0
+
+        stats = await storage.get_note_text_stats()
+        assert stats["texts"] == 2
+        assert stats["stored_bytes"] * 10 < stats["raw_bytes"]
+    run(check)
+
+
+def test_history_newest_first(run):
+    async def check(storage, document_storage):
+        added = await storage.add_history("PAT_0001", {"medications": [{"name": "Paracetamol"}]})
+        assert added["history_id"].startswith("HIST_")
+        assert "_id" not in added
+        await storage.add_history("PAT_0001", {"history_id": "HIST_OLD", "created_at": "2020-01-01T09:00:00"})
+        await storage.add_history("PAT_0001", {"history_id": "HIST_NEW", "created_at": "2099-01-01T09:00:00"})
+
+        history = await storage.get_patient_history("PAT_0001")
+        assert [entry["history_id"] for entry in history] == ["HIST_NEW", added["history_id"], "HIST_OLD"]
+
+        page, after = await storage.get_patient_history_page("PAT_0001", limit=1, projection={"_id": 0, "history_id": 1})
+        assert page == [{"history_id": "HIST_NEW"}]
+        assert after is not None
+        assert list(await storage.get_all_history()) == ["PAT_0001"]
+    run(check)
+
+
+def test_patient_activity_follows_notes_and_history(run):
+    async def check(storage, document_storage):
+        await storage.create_patient("PAT_0001", _patient(1))
+        await storage.add_note("PAT_0001", {"note_id": "NOTE_NEW", "created_at": "2024-01-02T09:00:00",
+                                            "soap_note": {"chief_complaint": "Fever"}})
+        await storage.add_note("PAT_0001", {"note_id": "NOTE_OLD", "created_at": "2024-01-01T09:00:00",
+                                            "soap_note": {"chief_complaint": "Cough"}})
+        await storage.add_history("PAT_0001", {"prescription_data": {"medications": []}})
+        await storage.add_note("PAT_MISSING", {"note_id": "NOTE_ORPHAN"})
+
+        expected = {
+            "visit_count": 2, "last_visit": parse_timestamp("2024-01-02T09:00:00"), "last_note_id": "NOTE_NEW",
+            "last_complaint": "Fever", "prescription_count": 1
+        }
+        patient = await storage.get_patient("PAT_0001")
+        assert {field: patient.get(field) for field in expected} == expected
+
+        await storage.update_patient("PAT_0001", {"visit_count": 9, "last_visit": None, "last_note_id": None, "prescription_count": 0})
+        await storage.create_patient("PAT_0002", _patient(2))
+        assert await storage.rebuild_patient_activity() == 2
+        patient = await storage.get_patient("PAT_0001")
+        assert {field: patient.get(field) for field in expected} == expected
+        assert (await storage.get_patient("PAT_0002"))["visit_count"] == 0
+    run(check)
+
+
+def test_report_state_is_maintained_incrementally(run):
+    async def check(storage, document_storage):
+        async def rebuilt():
+            return build_state(
+                "PAT_0001",
+                await storage.get_patient_notes("PAT_0001", REPORT_NOTE_PROJECTION),
+                await storage.get_patient_history("PAT_0001"),
+                await storage.get_patient_queue_entry("PAT_0001")
+            )
+
+        await storage.create_patient("PAT_0001", _patient(1))
+        await storage.add_note("PAT_0001", {"note_id": "NOTE_0", "created_at": "2024-01-05T09:00:00",
+                                            "soap_note": {"chief_complaint": "Fever", "language": "hi"}})
+        assert await storage.get_report_state("PAT_0001") is None
+        state = await load_report_state(storage, "PAT_0001")
+        assert state["visits"] == 1 and await storage.get_report_state("PAT_0001") == state
+
+        await storage.add_to_queue(_queue_entry(1))
+        for day in (3, 9, 1, 7, 8, 2):
+            await storage.add_note("PAT_0001", {"note_id": f"NOTE_{day}", "created_at": f"2024-01-0{day}T09:00:00", "soap_note": {
+                "chief_complaint": "Fever" if day % 2 else "Cough", "assessment": "Viral fever",
+                "medications": [{"name": "Paracetamol"}, "ORS"], "subjective": "x" * 150
+            }})
+            await storage.add_history("PAT_0001", {"history_id": f"HIST_{day}", "created_at": f"2024-01-0{day}T10:00:00",
+                                                   "prescription_data": {"doctor_name": "Dr. Rao", "medications": [{"name": "Paracetamol"}]}})
+        await storage.update_queue_status("Q_0001", "completed")
+
+        state = await storage.get_report_state("PAT_0001")
+        assert state_drift(state, await rebuilt()) == {}
+        assert state["visits"] == 7 and state["prescriptions"] == 6
+        assert state["latest"]["note_id"] == "NOTE_9" and state["queue"]["status"] == "completed"
+        assert [v["id"] for v in state["recent_visits"]] == ["NOTE_9", "NOTE_8", "NOTE_7", "NOTE_0", "NOTE_3"]
+        assert sorted((t["item"], t["count"]) for t in state["complaints"].values()) == [("Cough", 2), ("Fever", 5)]
+
+        assert await storage.archive_finished_queue() == 1
+        state = await storage.get_report_state("PAT_0001")
+        assert state["queue"] is None and state_drift(state, await rebuilt()) == {}
+    run(check)
+
+
+def test_report_state_build_survives_concurrent_writes(run):
+    async def check(storage, document_storage):
+        await storage.create_patient("PAT_0001", _patient(1))
+        await storage.add_note("PAT_0001", {"note_id": "NOTE_1", "created_at": "2024-01-01T09:00:00"})
+
+        # A note lands after the first build read the records but before it stored the state
+        read_queue_entry = storage.get_patient_queue_entry
+        async def get_patient_queue_entry_then_write(patient_id):
+            entry = await read_queue_entry(patient_id)
+            if await storage.get_report_state(patient_id) is None and len(await storage.get_patient_notes(patient_id)) == 1:
+                await storage.add_note(patient_id, {"note_id": "NOTE_2", "created_at": "2024-01-02T09:00:00"})
+            return entry
+        storage.get_patient_queue_entry = get_patient_queue_entry_then_write
+
+        state = await load_report_state(storage, "PAT_0001")
+        assert state["visits"] == 2 and state["latest"]["note_id"] == "NOTE_2"
+        assert await storage.get_report_state("PAT_0001") == state
+
+        # Creation never overwrites; a replace loses to any update since the state was read
+        await storage.create_report_state(build_state("PAT_0001", [], [], None))
+        assert (await storage.get_report_state("PAT_0001"))["visits"] == 2
+        await storage.add_history("PAT_0001", {"history_id": "HIST_1", "created_at": "2024-01-03T09:00:00"})
+        assert not await storage.replace_report_state(build_state("PAT_0001", [], [], None), state["version"])
+        stored = await storage.get_report_state("PAT_0001")
+        assert (stored["visits"], stored["prescriptions"]) == (2, 1) and stored["version"] > state["version"]
+    run(check)
+
+
+def test_timestamps_are_typed_and_ranged(run):
+    async def check(storage, document_storage):
+        await storage.create_patient("PAT_0001", _patient(1))
+        await storage.add_to_queue(_queue_entry(1, added_at="2024-01-01T09:00:00"))
+        for day in (1, 2, 3):
+            await storage.add_note(f"PAT_000{day % 2 + 1}", {"note_id": f"NOTE_{day}", "created_at": f"2024-01-0{day}T09:00:00"})
+            await storage.add_history("PAT_0001", {"history_id": f"HIST_{day}", "created_at": f"2024-01-0{day}T09:00:00"})
+
+        patient = await storage.get_patient("PAT_0001")
+        entry = (await storage.get_queue())[0]
+        note = await storage.get_note("PAT_0002", "NOTE_1")
+        for value in (patient["created_at"], patient["updated_at"], entry["added_at"], note["created_at"]):
+            assert value.tzinfo is not None and value.utcoffset().total_seconds() == 0
+        assert entry["added_at"] == parse_timestamp("2024-01-01T09:00:00")
+
+        start, end = parse_timestamp("2024-01-02T00:00:00"), parse_timestamp("2024-01-03T00:00:00")
+        page, _ = await storage.get_patient_notes_page("PAT_0001", limit=10, start=start, end=end)
+        assert [n["note_id"] for n in page] == ["NOTE_2"]
+        page, _ = await storage.get_patient_history_page("PAT_0001", limit=10, start=start)
+        assert [h["history_id"] for h in page] == ["HIST_3", "HIST_2"]
+
+        clinic, after = await storage.get_notes_page(limit=2)
+        assert [n["note_id"] for n in clinic] == ["NOTE_3", "NOTE_2"]
+        clinic, after = await storage.get_notes_page(limit=2, after=after)
+        assert [n["note_id"] for n in clinic] == ["NOTE_1"] and after is None
+        clinic, _ = await storage.get_notes_page(limit=10, end=start)
+        assert [n["note_id"] for n in clinic] == ["NOTE_1"]
+    run(check)
+
+
+# ==================== STATS ====================
+
+def test_stats_shape(run):
+    async def check(storage, document_storage):
+        for i in range(1, 4):
+            await storage.create_patient(f"PAT_{i:04d}", _patient(i))
+        await storage.add_to_queue(_queue_entry(1))
+        await storage.add_to_queue(_queue_entry(2))
+        await storage.update_queue_status("Q_0002", "completed")
+        await storage.add_note("PAT_0001", {"note_id": "NOTE_A"})
+        await storage.add_note("PAT_0001", {"note_id": "NOTE_B"})
+        await storage.add_history("PAT_0002", {"history_id": "HIST_A"})
+
+        stats = await storage.get_stats()
+        assert stats["patients"]["total"] == 3
+        assert stats["patients"]["active"] == 3
+        assert stats["patients"]["by_gender"] == {"female": 2, "male": 1}
+        assert stats["queue"]["total"] == 2
+        assert stats["queue"]["waiting"] == 1
+        assert stats["queue"]["completed"] == 1
+        assert stats["archive"]["total"] == 0
+        assert stats["notes"] == {"total": 2, "patients": 1}
+        assert stats["history"] == {"total": 1, "patients": 1}
+    run(check)
+
+
+def test_stats_counters_follow_every_write_path(run):
+    async def check(storage, document_storage):
+        await storage.create_patient("PAT_0001", _patient(1))
+        assert (await storage.get_stats())["patients"]["total"] == 1
+
+        await storage.create_patient("PAT_0002", _patient(2))
+        await storage.insert_patients([_patient(3), _patient(4, uhid="UHID000001"), _patient(5, gender=None)])
+        await storage.update_patient("PAT_0002", {"gender": "female", "status": "inactive"})
+        await storage.update_patient("PAT_0003", {"phone": "9000000000"})
+        for i in (1, 2, 3):
+            await storage.add_to_queue(_queue_entry(i))
+        await storage.update_queue_status("Q_0001", "in_consultation")
+        await storage.update_queue_status("Q_0001", "completed")
+        await storage.update_queue_status("Q_0002", "cancelled")
+        await storage.update_queue_status("Q_9999", "completed")
+        await storage.archive_finished_queue()
+        await storage.add_note("PAT_0001", {"note_id": "NOTE_A"})
+        await storage.add_note("PAT_0001", {"note_id": "NOTE_B"})
+        await storage.add_note("PAT_0003", {"note_id": "NOTE_C"})
+        await storage.add_history("PAT_0001", {"history_id": "HIST_A"})
+
+        stats = await storage.get_stats()
+        assert stats["patients"] == {"total": 4, "active": 3, "by_gender": {"female": 3, "unknown": 1}}
+        assert stats["queue"]["waiting"] == 1
+        assert stats["queue"]["total"] == 1
+        assert stats["archive"]["completed"] == 1
+        assert stats["archive"]["cancelled"] == 1
+        assert stats["archive"]["total"] == 2
+        assert stats["notes"] == {"total": 3, "patients": 2}
+        assert stats["history"] == {"total": 1, "patients": 1}
+
+        reconciled = await storage.reconcile_stats()
+        assert reconciled["drift"] == {}
+        assert reconciled["stats"] == stats
+        assert await storage.get_stats() == stats
+    run(check)
+
+
+def test_concurrent_first_notes_count_the_patient_once(run):
+    async def check(storage, document_storage):
+        await storage.create_patient("PAT_0001", _patient(1))
+        await storage.get_stats()  # Counters are maintained from here on
+        # MongoDB awaits each step of a write: yield inside them so the inserts interleave
+        update_report_state = storage._update_report_state
+        if asyncio.iscoroutinefunction(update_report_state):
+            async def interleaved(*args):
+                await asyncio.sleep(0)
+                await update_report_state(*args)
+            storage._update_report_state = interleaved
+
+        await asyncio.gather(*(storage.add_note("PAT_0001", {"note_id": f"NOTE_{i}"}) for i in range(3)))
+        await asyncio.gather(*(storage.add_history("PAT_0001", {"history_id": f"HIST_{i}"}) for i in range(3)))
+
+        stats = await storage.get_stats()
+        assert stats["notes"] == {"total": 3, "patients": 1}
+        assert stats["history"] == {"total": 3, "patients": 1}
+    run(check)
+
+
+# ==================== CHANGE FEEDS ====================
+
+def test_change_feeds(run):
+    async def check(storage, document_storage):
+        async def drain(collection, since=None, until=None):
+            records, after = [], None
+            while True:
+                if collection == "documents":
+                    page, after = await document_storage.get_document_changes_page(since, until, limit=2, after=after)
+                else:
+                    page, after = await storage.get_changes_page(collection, since, until, limit=2, after=after)
+                records += page
+                if after is None:
+                    return records
+
+        for i in range(5):
+            await storage.create_patient(f"PAT_{i:04d}", _patient(i))
+        await storage.add_note("PAT_0001", {"note_id": "NOTE_1", "soap_note": {}})
+        await storage.add_history("PAT_0001", {"history_id": "HIST_1", "prescription_data": {}})
+        await document_storage.save_document({
+            "document_id": "DOC_1", "patient_id": "PAT_0001", "status": "processing", "uploaded_at": "2024-01-01T09:00:00"
+        })
+        await storage.add_to_queue(_queue_entry(1))
+        await storage.update_queue_status("Q_0001", "completed")
+        await storage.archive_finished_queue()
+
+        patients = await drain("patients")
+        assert sorted(p["patient_id"] for p in patients) == [f"PAT_{i:04d}" for i in range(5)]
+        assert patients == sorted(patients, key=lambda p: (p["updated_at"], p["patient_id"]))
+        assert all("_id" not in p for p in patients)
+        assert [n["note_id"] for n in await drain("notes")] == ["NOTE_1"]
+        assert [h["history_id"] for h in await drain("history")] == ["HIST_1"]
+        archived = await drain("queue_archive")
+        assert [e["queue_id"] for e in archived] == ["Q_0001"]
+        assert await drain("queue_archive", since=archived[0]["archived_at"]) == []
+
+        # Writes after the mark (patient update, document status) show up in the next window only
+        mark = max(p["updated_at"] for p in patients + await drain("documents"))
+        await asyncio.sleep(0.01)
+        await storage.update_patient("PAT_0002", {"name": "Renamed"})
+        await document_storage.update_document_status("DOC_1", "completed", {"medications": []})
+
+        assert [p["patient_id"] for p in await drain("patients", since=mark)] == ["PAT_0002"]
+        assert len(await drain("patients", until=mark)) == 4
+        changed = await drain("documents", since=mark)
+        assert [d["document_id"] for d in changed] == ["DOC_1"]
+        assert changed[0]["status"] == "completed"
+        assert await drain("notes", since=mark) == []
+    run(check)
+
+
+# ==================== DOCUMENTS ====================
+
+def test_paging_continues_through_missing_sort_values(run):
+    async def check(storage, document_storage):
+        for i, uploaded_at in enumerate(["2024-01-01T09:02:00", None, "2024-01-01T09:01:00", None, None]):
+            await document_storage.save_document({"document_id": f"DOC_{i}", "patient_id": "PAT_0001", "uploaded_at": uploaded_at})
+
+        # Missing values sort lowest: last when newest first, with cursors both before and inside them
+        for limit in (1, 2, 3):
+            ids, after = [], None
+            while True:
+                page, after = await document_storage.get_patient_documents_page("PAT_0001", limit=limit, after=after)
+                ids += [d["document_id"] for d in page]
+                if after is None:
+                    break
+            assert ids == ["DOC_0", "DOC_2", "DOC_4", "DOC_3", "DOC_1"]
+    run(check)
+
+
+def test_documents_and_batches(run):
+    async def check(storage, document_storage):
+        await document_storage.create_batch({
+            "batch_id": "BATCH_1", "patient_id": "PAT_0001", "status": "pending",
+            "document_ids": [], "created_at": "2024-01-01T09:00:00"
+        })
+        for i, uploaded_at in enumerate(["2024-01-01T09:02:00", "2024-01-01T09:01:00", "2024-01-01T09:03:00"]):
+            document_id = await document_storage.save_document({
+                "document_id": f"DOC_{i}", "patient_id": "PAT_0001", "batch_id": "BATCH_1",
+                "status": "pending", "uploaded_at": uploaded_at
+            })
+            assert document_id == f"DOC_{i}"
+            await document_storage.add_document_to_batch("BATCH_1", document_id)
+
+        documents = await document_storage.get_patient_documents("PAT_0001")
+        assert [d["document_id"] for d in documents] == ["DOC_2", "DOC_0", "DOC_1"]
+        assert all("_id" not in d for d in documents)
+        assert [d["document_id"] for d in await document_storage.get_batch_documents("BATCH_1")] == ["DOC_1", "DOC_0", "DOC_2"]
+
+        page, after = await document_storage.get_patient_documents_page("PAT_0001", limit=2, projection={"_id": 0, "document_id": 1})
+        assert page == [{"document_id": "DOC_2"}, {"document_id": "DOC_0"}]
+        page, after = await document_storage.get_patient_documents_page("PAT_0001", limit=2, after=after)
+        assert [d["document_id"] for d in page] == ["DOC_1"]
+        assert after is None
+
+        await document_storage.update_document_status("DOC_0", "completed", {"medications": []})
+        await document_storage.update_document("DOC_0", {"thumbnail_key": "thumbs/DOC_0.jpg"})
+        document = await document_storage.get_document("DOC_0")
+        assert document["status"] == "completed"
+        assert document["extracted_data"] == {"medications": []}
+        assert document["thumbnail_key"] == "thumbs/DOC_0.jpg"
+        assert await document_storage.get_document("DOC_9") is None
+
+        assert (await document_storage.get_batch("BATCH_1"))["document_ids"] == ["DOC_0", "DOC_1", "DOC_2"]
+        assert (await document_storage.get_active_batch("PAT_0001"))["batch_id"] == "BATCH_1"
+        await document_storage.update_batch_status("BATCH_1", "completed")
+        assert await document_storage.get_active_batch("PAT_0001") is None
+        assert "completed_at" in await document_storage.get_batch("BATCH_1")
+
+        await document_storage.create_batch({
+            "batch_id": "BATCH_2", "patient_id": "PAT_0001", "status": "pending",
+            "document_ids": [], "created_at": "2024-01-02T09:00:00"
+        })
+        batches = await document_storage.get_patient_batches("PAT_0001")
+        assert [b["batch_id"] for b in batches] == ["BATCH_2", "BATCH_1"]
+        assert all("_id" not in b for b in batches)
+    run(check)
+
+
+def test_upload_session_is_claimed_once(run):
+    async def check(storage, document_storage):
+        upload_id = await document_storage.create_upload_session({
+            "upload_id": "UP_1", "patient_id": "PAT_0001", "status": "pending"
+        })
+        assert upload_id == "UP_1"
+
+        claimed = await document_storage.claim_upload_session("UP_1")
+        assert claimed["status"] == "queued"
+        assert "completed_at" in claimed
+        assert await document_storage.claim_upload_session("UP_1") is None
+        assert await document_storage.claim_upload_session("UP_9") is None
+
+        await document_storage.update_upload_session("UP_1", {"status": "processing"})
+        session = await document_storage.get_upload_session("UP_1")
+        assert session["status"] == "processing"
+        assert "_id" not in session
+    run(check)
+
+
+def test_export_jobs(run):
+    async def check(storage, document_storage):
+        job_id = await document_storage.create_export_job({
+            "job_id": "EXP_1", "status": "accepted", "types": ["Patient"], "since": None
+        })
+        assert job_id == "EXP_1"
+
+        await document_storage.update_export_job("EXP_1", {"status": "completed", "output": [{"type": "Patient", "count": 2}]})
+        job = await document_storage.get_export_job("EXP_1")
+        assert (job["status"], job["types"], job["output"]) == ("completed", ["Patient"], [{"type": "Patient", "count": 2}])
+        assert "_id" not in job
+        assert await document_storage.get_export_job("EXP_9") is None
+    run(check)
+
+
+def test_timelines_keep_latest_per_patient(run):
+    async def check(storage, document_storage):
+        await document_storage.save_timeline({"patient_id": "PAT_0001", "generated_at": "2024-01-01T09:00:00", "events": [1]})
+        await document_storage.save_timeline({"patient_id": "PAT_0002", "generated_at": "2024-01-02T09:00:00", "events": []})
+        await document_storage.save_timeline({"patient_id": "PAT_0001", "generated_at": "2024-01-03T09:00:00", "events": [2]})
+
+        timeline = await document_storage.get_patient_timeline("PAT_0001")
+        assert timeline["events"] == [2]
+        assert "_id" not in timeline
+        assert [t["patient_id"] for t in await document_storage.get_all_timelines()] == ["PAT_0001", "PAT_0002"]
+
+        page, after = await document_storage.get_timelines_page(limit=1)
+        assert [t["patient_id"] for t in page] == ["PAT_0001"]
+        page, after = await document_storage.get_timelines_page(limit=1, after=after)
+        assert [t["patient_id"] for t in page] == ["PAT_0002"]
+        assert after is None
+    run(check)
@@ -0,0 +1,115 @@
+"""
+Tests for the journaled in-memory store (app/services/storage_service.py)
+
+Crashes are simulated by opening a second StorageService on the same
+directory without closing the first, or by editing the files in between.
+"""
+
+import os
+
+os.environ.setdefault('GEMINI_API_KEY', 'test_key')
+os.environ.setdefault('GROQ_API_KEY', 'test_key')
+
+from app.services.storage_service import StorageService
+
+
+def _open(tmp_path, **options) -> StorageService:
+    return StorageService(base_dir=str(tmp_path / "data"), fsync=False, **options)
+
+
+def _journal_lines(store: StorageService) -> list:
+    with open(store.journal_file, encoding="utf-8") as f:
+        return f.readlines()
+
+
+def test_journal_replays_after_restart(tmp_path):
+    store = _open(tmp_path)
+    store.create_patient("PAT_1", {"uhid": "U1", "name": "Sita"})
+    store.add_note("PAT_1", {"note_id": "NOTE_1"})
+    store.update_patient("PAT_1", {"name": "Sita Devi"})
+    store.add_to_queue({"queue_id": "Q_1", "patient_id": "PAT_1", "status": "waiting"})
+    store.update_queue_status("Q_1", "completed")
+
+    restarted = _open(tmp_path)  # No close(): nothing but the journal on disk
+    assert not os.path.exists(restarted.snapshot_file)
+    assert restarted.get_patient_by_uhid("U1")["name"] == "Sita Devi"
+    assert [n["note_id"] for n in restarted.get_patient_notes("PAT_1")] == ["NOTE_1"]
+    assert [e["queue_id"] for e in restarted.get_queue_by_status("completed")] == ["Q_1"]
+    assert restarted.seq == store.seq == 5
+
+
+def test_torn_last_line_is_discarded(tmp_path):
+    store = _open(tmp_path)
+    store.create_patient("PAT_1", {"uhid": "U1"})
+    store.create_patient("PAT_2", {"uhid": "U2"})
+    intact = os.path.getsize(store.journal_file)
+    with open(store.journal_file, "a", encoding="utf-8") as f:
+        f.write('{"op": "patient", "doc": {"patient_id": "PAT_3"')
+
+    restarted = _open(tmp_path)
+    assert sorted(restarted.get_all_patients()) == ["PAT_1", "PAT_2"]
+    assert os.path.getsize(restarted.journal_file) == intact
+
+    restarted.create_patient("PAT_3", {"uhid": "U3"})
+    assert sorted(_open(tmp_path).get_all_patients()) == ["PAT_1", "PAT_2", "PAT_3"]
+
+
+def test_records_in_the_snapshot_are_not_replayed(tmp_path):
+    store = _open(tmp_path)
+    store.create_patient("PAT_1", {"uhid": "U1"})
+    store.add_note("PAT_1", {"note_id": "NOTE_1"})
+    old_journal = _journal_lines(store)
+    store.compact()
+    assert _journal_lines(store) == []
+
+    # Crash after the snapshot was replaced but before the journal was swapped
+    with open(store.journal_file, "w", encoding="utf-8") as f:
+        f.writelines(old_journal)
+
+    restarted = _open(tmp_path)
+    assert [n["note_id"] for n in restarted.get_patient_notes("PAT_1")] == ["NOTE_1"]
+    assert restarted.seq == 2
+    restarted.add_note("PAT_1", {"note_id": "NOTE_2"})
+    assert [n["note_id"] for n in _open(tmp_path).get_patient_notes("PAT_1")] == ["NOTE_1", "NOTE_2"]
+
+
+def test_compaction_runs_in_background_at_threshold(tmp_path):
+    store = _open(tmp_path, compact_every=3)
+    store.create_patient("PAT_1", {"uhid": "U1"})
+    store.add_note("PAT_1", {"note_id": "NOTE_1"})
+    assert store._compaction is None and not os.path.exists(store.snapshot_file)
+
+    # A write that lands while the snapshot is being serialized stays in the new journal
+    save_json = store.save_json
+    def save_json_with_concurrent_write(file_path, data):
+        store.add_note("PAT_1", {"note_id": "NOTE_3"})
+        save_json(file_path, data)
+    store.save_json = save_json_with_concurrent_write
+
+    store.add_note("PAT_1", {"note_id": "NOTE_2"})
+    store.wait_for_compaction()
+    store.save_json = save_json
+
+    assert store.load_json(store.snapshot_file)["seq"] == 3
+    assert [line for line in _journal_lines(store) if '"NOTE_3"' in line] and len(_journal_lines(store)) == 1
+    assert store.journal_entries == 1 and store._compaction is None
+
+    restarted = _open(tmp_path)
+    assert [n["note_id"] for n in restarted.get_patient_notes("PAT_1")] == ["NOTE_1", "NOTE_2", "NOTE_3"]
+    assert restarted.seq == 4
+
+
+def test_close_compacts(tmp_path):
+    store = _open(tmp_path)
+    store.create_patient("PAT_1", {"uhid": "U1"})
+    store.close()
+    assert _journal_lines(store) == []
+    assert _open(tmp_path).get_patient("PAT_1")["uhid"] == "U1"
+
+
+def test_in_memory_store_writes_nothing(tmp_path):
+    store = StorageService(base_dir=None, compact_every=1)
+    store.create_patient("PAT_1", {"uhid": "U1"})
+    store.add_note("PAT_1", {"note_id": "NOTE_1"})
+    assert store._compaction is None and store.get_patient_by_uhid("U1")["patient_id"] == "PAT_1"
+    store.close()
@@ -0,0 +1,69 @@
+"""
+Tests for compressed note transcripts (app/services/text_compression.py)
+
+The notes routes run on a bare FastAPI app over the in-memory backend.
+"""
+
+import asyncio
+import os
+
+os.environ.setdefault('GEMINI_API_KEY', 'test_key')
+os.environ.setdefault('GROQ_API_KEY', 'test_key')
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.models.schemas import ProjectionView
+from app.routes import notes
+from app.services.memory_storage import MemoryStorage
+from app.services.projections import build_projection
+from app.services.storage_backend import storage_backend
+from app.services.text_compression import pack_note_texts, unpack_note_texts, texts_requested
+
+
+def test_pack_and_requested_fields():
+    note = {"note_id": "NOTE_1", "patient_id": "PAT_1", "transcript": "खांसी " * 500, "soap_note": {}}
+    record = pack_note_texts(note)
+    assert "transcript" not in note
+    assert note["text_sizes"] == {"transcript": len(("खांसी " * 500).encode())}
+    assert record["codec"] == "zstd"
+    assert record["stored_size"] == len(record["data"]) < record["raw_size"] // 10
+    assert unpack_note_texts(record) == {"transcript": "खांसी " * 500}
+    assert pack_note_texts({"note_id": "NOTE_2", "patient_id": "PAT_1", "soap_note": {}}) is None
+
+    assert texts_requested(build_projection("notes", ProjectionView.FULL)) == ["transcript"]
+    assert texts_requested(build_projection("notes", ProjectionView.CLINICAL)) == []
+    assert texts_requested(build_projection("notes", ProjectionView.SUMMARY)) == []
+    assert texts_requested(build_projection("notes", fields="created_at,transcript")) == ["transcript"]
+    assert texts_requested({"_id": 0, "transcript": 0}) == []
+    assert texts_requested(None) == []
+
+
+@pytest.fixture
+def client():
+    storage = MemoryStorage()
+    asyncio.run(storage.connect())
+    previous = (storage_backend.name, storage_backend._storage, storage_backend._document_storage)
+    storage_backend.use(storage, name="memory")
+    app = FastAPI()
+    app.include_router(notes.router)
+    with TestClient(app) as test_client:
+        yield test_client, storage
+    storage_backend.name, storage_backend._storage, storage_backend._document_storage = previous
+
+
+def test_notes_routes_load_transcripts_on_request(client):
+    client, storage = client
+    asyncio.run(storage.create_patient("PAT_1", {"uhid": "U1", "name": "Sita"}))
+    asyncio.run(storage.add_note("PAT_1", {"note_id": "NOTE_1", "transcript": "fever since two days", "soap_note": {"plan": "rest"}}))
+
+    listed = client.get("/notes/PAT_1").json()["notes"]
+    assert "transcript" not in listed[0]
+    full = client.get("/notes/PAT_1?view=full").json()["notes"]
+    assert full[0]["transcript"] == "fever since two days"
+    assert client.get("/notes/PAT_1?fields=transcript").json()["notes"][0]["transcript"] == "fever since two days"
+
+    note = client.get("/notes/PAT_1/NOTE_1").json()["note"]
+    assert note["transcript"] == "fever since two days"
+    assert "transcript" not in client.get("/notes/PAT_1/NOTE_1?view=clinical").json()["note"]
@@ -0,0 +1,200 @@
+"""
+Tests for typed timestamps (app/services/timestamps.py)
+
+Legacy records (naive ISO strings) are planted directly in each backend's
+store, then read back typed and rewritten by backfill_timestamps.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+os.environ.setdefault('GEMINI_API_KEY', 'test_key')
+os.environ.setdefault('GROQ_API_KEY', 'test_key')
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+from app.routes import notes
+from app.services import timestamps
+from app.services.database import CODEC_OPTIONS, database
+from app.services.memory_storage import MemoryStorage
+from app.services.mongodb_storage import MongoDBStorage
+from app.services.patient_cache import patient_cache
+from app.services.sqlite_storage import SQLiteStorage
+from app.services.storage_backend import storage_backend
+from app.services.storage_service import StorageService
+from app.services.timestamps import parse_timestamp, to_iso, clinic_date, upgrade_timestamps, decode_timestamps
+
+
+LEGACY = "2024-01-01T09:00:00.123456"
+
+
+@pytest.fixture
+def kolkata(monkeypatch):
+    monkeypatch.setattr(timestamps, "CLINIC_TZ", ZoneInfo("Asia/Kolkata"))
+
+
+def test_parse_and_canonical_text(kolkata):
+    parsed = parse_timestamp(LEGACY)
+    assert parsed == datetime(2024, 1, 1, 3, 30, 0, 123000, tzinfo=timezone.utc)
+    assert parse_timestamp("2024-01-01T09:00:00+00:00") == datetime(2024, 1, 1, 9, tzinfo=timezone.utc)
+    assert parse_timestamp(None) is None and parse_timestamp("") is None
+    with pytest.raises(ValueError):
+        parse_timestamp("yesterday")
+
+    assert to_iso(LEGACY) == "2024-01-01T03:30:00.123+00:00"
+    assert clinic_date("2024-01-01T20:00:00+00:00") == "2024-01-02"
+
+
+def test_upgrade_and_decode(kolkata):
+    entry = {"added_at": LEGACY, "completed_at": None, "notes": "not a timestamp"}
+    assert upgrade_timestamps(entry) == {"added_at": parse_timestamp(LEGACY), "visit_date": "2024-01-01"}
+    assert upgrade_timestamps(entry) == {}
+    assert upgrade_timestamps({"created_at": "garbage"}) == {}
+
+    assert decode_timestamps({"created_at": LEGACY}) is True
+    assert decode_timestamps({"created_at": to_iso(LEGACY)}) is False
+
+
+def test_mongodb_upgrades_on_read_and_backfills():
+    async def main():
+        database.client = AsyncMongoMockClient(**CODEC_OPTIONS)
+        database.db = database.client.phc
+        patient_cache.clear()
+        storage = MongoDBStorage()
+        await storage.connect()
+        try:
+            await storage.db.notes.insert_one({"note_id": "NOTE_1", "patient_id": "PAT_1", "created_at": LEGACY})
+            await storage.db.history.insert_one({"history_id": "HIST_1", "patient_id": "PAT_1", "created_at": LEGACY})
+
+            notes = await storage.get_patient_notes("PAT_1")
+            assert notes[0]["created_at"] == parse_timestamp(LEGACY)
+            stored = await storage.db.notes.find_one({"note_id": "NOTE_1"})
+            assert isinstance(stored["created_at"], datetime)
+
+            counts = await storage.backfill_timestamps(batch_size=1)
+            assert counts["history"] == 1 and counts["notes"] == 0
+            stored = await storage.db.history.find_one({"history_id": "HIST_1"})
+            assert stored["created_at"] == parse_timestamp(LEGACY)
+            assert sum((await storage.backfill_timestamps()).values()) == 0
+        finally:
+            await storage.disconnect()
+            patient_cache.clear()
+
+    asyncio.run(main())
+
+
+def test_mongodb_notes_advance_legacy_last_visit():
+    async def main():
+        database.client = AsyncMongoMockClient(**CODEC_OPTIONS)
+        database.db = database.client.phc
+        patient_cache.clear()
+        storage = MongoDBStorage()
+        await storage.connect()
+        try:
+            for patient_id in ("PAT_1", "PAT_2"):
+                await storage.db.patients.insert_one({"patient_id": patient_id, "uhid": patient_id, "visit_count": 1,
+                                                      "last_visit": LEGACY, "last_note_id": "NOTE_LEGACY"})
+
+            await storage.add_note("PAT_1", {"note_id": "NOTE_NEW", "created_at": "2024-02-01T09:00:00+00:00"})
+            await storage.add_note("PAT_2", {"note_id": "NOTE_OLD", "created_at": "2023-12-01T09:00:00+00:00"})
+
+            newer = await storage.db.patients.find_one({"patient_id": "PAT_1"})
+            assert (newer["visit_count"], newer["last_note_id"]) == (2, "NOTE_NEW")
+            assert newer["last_visit"] == parse_timestamp("2024-02-01T09:00:00+00:00")
+            older = await storage.db.patients.find_one({"patient_id": "PAT_2"})
+            assert (older["visit_count"], older["last_note_id"]) == (2, "NOTE_LEGACY")
+            assert older["last_visit"] == parse_timestamp(LEGACY)
+        finally:
+            await storage.disconnect()
+            patient_cache.clear()
+
+    asyncio.run(main())
+
+
+def test_sqlite_decodes_and_backfills(tmp_path):
+    async def main():
+        storage = SQLiteStorage(path=str(tmp_path / "phc.db"))
+        await storage.connect()
+        try:
+            await storage.add_note("PAT_1", {"note_id": "NOTE_1", "created_at": "2024-02-01T09:00:00"})
+            await storage.add_note("PAT_1", {"note_id": "NOTE_2", "created_at": "2024-03-01T09:00:00"})
+            legacy = sqlite3.connect(str(tmp_path / "phc.db"))
+            legacy.execute(
+                "UPDATE notes SET created_at = ?, data = json_set(data, '$.created_at', ?) WHERE note_id = 'NOTE_1'",
+                (LEGACY, LEGACY)
+            )
+            legacy.commit()
+            legacy.close()
+
+            note = await storage.get_note("PAT_1", "NOTE_1")
+            assert note["created_at"] == parse_timestamp(LEGACY)
+
+            counts = await storage.backfill_timestamps(batch_size=1)
+            assert counts["notes"] == 1 and sum(counts.values()) == 1
+            assert sum((await storage.backfill_timestamps()).values()) == 0
+            page, _ = await storage.get_patient_notes_page("PAT_1", limit=10, end=parse_timestamp("2024-02-01T00:00:00"))
+            assert [n["note_id"] for n in page] == ["NOTE_1"]
+        finally:
+            await storage.disconnect()
+
+    asyncio.run(main())
+
+
+def test_json_store_rewrites_legacy_files(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "patients.json").write_text(json.dumps({"PAT_1": {"uhid": "U1", "name": "Sita", "created_at": LEGACY}}))
+
+    async def open_store():
+        storage = MemoryStorage(StorageService(base_dir=str(data_dir)))
+        await storage.connect()
+        return storage
+
+    async def main():
+        storage = await open_store()
+        assert (await storage.get_patient("PAT_1"))["created_at"] == parse_timestamp(LEGACY)
+        assert await storage.backfill_timestamps() == {"patients": 1}
+        await storage.disconnect()
+
+        storage = await open_store()
+        assert (await storage.get_patient("PAT_1"))["created_at"] == parse_timestamp(LEGACY)
+        assert await storage.backfill_timestamps() == {}
+        await storage.disconnect()
+
+    asyncio.run(main())
+
+
+@pytest.fixture
+def client():
+    storage = MemoryStorage()
+    asyncio.run(storage.connect())
+    previous = (storage_backend.name, storage_backend._storage, storage_backend._document_storage)
+    storage_backend.use(storage, name="memory")
+    app = FastAPI()
+    app.include_router(notes.router)
+    with TestClient(app) as test_client:
+        yield test_client, storage
+    storage_backend.name, storage_backend._storage, storage_backend._document_storage = previous
+
+
+def test_notes_date_range_routes(client):
+    client, storage = client
+    for i in (0, 1):
+        asyncio.run(storage.create_patient(f"PAT_{i}", {"uhid": f"U{i}", "name": "Sita"}))
+    for day in (1, 2, 3):
+        asyncio.run(storage.add_note(f"PAT_{day % 2}", {"note_id": f"NOTE_{day}", "created_at": f"2024-01-0{day}T09:00:00+00:00"}))
+
+    body = client.get("/notes?start=2024-01-02T00:00:00Z&end=2024-01-04").json()
+    assert [n["note_id"] for n in body["notes"]] == ["NOTE_3", "NOTE_2"]
+    assert body["notes"][0]["created_at"] == "2024-01-03T09:00:00Z"
+
+    body = client.get("/notes/PAT_1?end=2024-01-02T00:00:00%2B00:00").json()
+    assert [n["note_id"] for n in body["notes"]] == ["NOTE_1"]
+    assert client.get("/notes?start=someday").status_code == 400
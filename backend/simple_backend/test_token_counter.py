@@ -0,0 +1,167 @@
+"""
+Concurrency tests for token number allocation
+
+Fires hundreds of simultaneous registrations and queue additions against an
+in-process MongoDB (mongomock-motor) and checks that every token is unique,
+that numbering is gap-free, and that allocation cost does not grow with the
+size of the queue.
+"""
+
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault('GEMINI_API_KEY', 'test_key')
+os.environ.setdefault('GROQ_API_KEY', 'test_key')
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from app.services.database import CODEC_OPTIONS, database
+from app.services.mongodb_storage import mongodb_storage
+from app.services.patient_cache import patient_cache
+from main import app
+
+
+CONCURRENT_REGISTRATIONS = 300
+
+
+@pytest.fixture(autouse=True)
+def mock_database():
+    """Point the shared client at a fresh in-memory MongoDB for every test"""
+    database.client = AsyncMongoMockClient(**CODEC_OPTIONS)
+    database.db = database.client.phc
+    mongodb_storage.client = None
+    patient_cache.clear()
+    yield
+    mongodb_storage.client = None
+    mongodb_storage.db = None
+    database.client = None
+    database.db = None
+
+
+async def _register(client: httpx.AsyncClient, i: int) -> dict:
+    response = await client.post("/patients", json={
+        "uhid": f"UHID{i:06d}",
+        "name": f"Patient {i}",
+        "phone": "9876543210",
+        "age": 30,
+        "gender": "female"
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_concurrent_registrations_get_unique_tokens():
+    """Hundreds of simultaneous registrations never share a token"""
+
+    async def run():
+        await mongodb_storage.connect()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await asyncio.gather(*(_register(client, i) for i in range(CONCURRENT_REGISTRATIONS)))
+        return await mongodb_storage.get_queue()
+
+    queue = asyncio.run(run())
+    tokens = sorted(q['token_number'] for q in queue)
+
+    assert len(queue) == CONCURRENT_REGISTRATIONS
+    assert tokens == list(range(1, CONCURRENT_REGISTRATIONS + 1))
+
+
+def test_concurrent_allocations_across_endpoints():
+    """register_patient and add_to_queue draw from the same counter"""
+
+    async def run():
+        await mongodb_storage.connect()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            registered = await asyncio.gather(*(_register(client, i) for i in range(100)))
+
+            # Complete half of them, then re-queue those patients concurrently with new registrations
+            for entry in registered[:50]:
+                await mongodb_storage.update_queue_status(entry['queue_id'], "completed")
+
+            requeue = [
+                client.post("/queue", json={"patient_id": entry['patient_id'], "priority": "normal"})
+                for entry in registered[:50]
+            ]
+            register = [_register(client, i) for i in range(100, 200)]
+            results = await asyncio.gather(*requeue, *register)
+
+        for response in results[:50]:
+            assert response.status_code == 200, response.text
+        return await mongodb_storage.get_queue()
+
+    queue = asyncio.run(run())
+    tokens = [q['token_number'] for q in queue]
+
+    assert len(tokens) == 250
+    assert len(set(tokens)) == len(tokens)
+    assert max(tokens) == 250
+
+
+def test_cancellations_do_not_reuse_tokens():
+    """A cancelled entry's number is never handed out again"""
+
+    async def run():
+        await mongodb_storage.connect()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await _register(client, 1)
+            second = await _register(client, 2)
+            cancelled = await client.post(f"/queue/{second['queue_id']}/cancel")
+            assert cancelled.status_code == 200
+            await _register(client, 3)
+        return await mongodb_storage.get_queue()
+
+    queue = asyncio.run(run())
+
+    assert [q['token_number'] for q in queue] == [1, 2, 3]
+
+
+def test_tokens_restart_per_facility_and_day():
+    """Each (facility, day) pair has its own sequence"""
+
+    async def run():
+        await mongodb_storage.connect()
+        return await asyncio.gather(
+            mongodb_storage.next_token_number("PHC_A", "2025-01-01"),
+            mongodb_storage.next_token_number("PHC_A", "2025-01-01"),
+            mongodb_storage.next_token_number("PHC_A", "2025-01-02"),
+            mongodb_storage.next_token_number("PHC_B", "2025-01-01")
+        )
+
+    tokens = asyncio.run(run())
+
+    assert sorted(tokens[:2]) == [1, 2]
+    assert tokens[2:] == [1, 1]
+
+
+def test_allocation_latency_independent_of_queue_size():
+    """Allocating a token costs the same with an empty or a 20k-entry queue"""
+
+    async def timed_allocations(count: int):
+        timings = []
+        for _ in range(count):
+            start = time.perf_counter()
+            await mongodb_storage.next_token_number()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
+
+    async def run():
+        await mongodb_storage.connect()
+        empty = await timed_allocations(200)
+        await database.db.queue.insert_many([
+            {"queue_id": f"Q_{i:08X}", "patient_id": f"PAT_{i:08X}", "status": "waiting"}
+            for i in range(20000)
+        ])
+        full = await timed_allocations(200)
+        return empty, full
+
+    empty, full = asyncio.run(run())
+
+    # The old len(active_queue) + 1 was linear in queue size (>100x slower here)
+    assert full < empty * 5